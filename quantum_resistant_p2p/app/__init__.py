@@ -4,7 +4,10 @@ Application layer for post-quantum secure P2P messaging.
 This package provides the application logic, messaging, and logging functionality.
 """
 
-from .messaging import SecureMessaging, Message, MessageStore
+from .messaging import SecureMessaging, Message
+from .blob_store import BlobStore
+from .message_store import MessageStore
 from .logging import SecureLogger
+from .log_archive import LogRetention
 
-__all__ = ['SecureMessaging', 'Message', 'SecureLogger', 'MessageStore']
+__all__ = ['SecureMessaging', 'Message', 'SecureLogger', 'LogRetention', 'MessageStore', 'BlobStore']
@@ -0,0 +1,389 @@
+"""
+Content-addressed encrypted storage for file contents.
+"""
+
+import hmac
+import hashlib
+import logging
+import os
+import sqlite3
+import stat
+import struct
+import threading
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Tuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from ..crypto.symmetric import AES256GCM
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """Encrypted, deduplicating store for file contents.
+
+    Every blob is identified by a keyed hash of its contents, so identical
+    files share one copy on disk no matter how often they are sent or
+    received. A blob is written as a sequence of chunks, each encrypted on its
+    own with AES-256-GCM and bound to the blob ID, its position and whether it
+    is the last chunk, so chunks can't be reordered, swapped between blobs or
+    cut off. Blobs are reference counted and deleted when the last reference
+    is released.
+
+    Reading and writing go chunk by chunk, so saving or storing a file never
+    needs more than one chunk in memory.
+    """
+
+    CHUNK_SIZE = 1024 * 1024  # 1 MiB of plaintext per chunk
+    INDEX_FILENAME = "index.db"
+
+    def __init__(self, base_dir: Optional[str] = None, encryption_key: Optional[bytes] = None):
+        """Initialize the blob store.
+
+        Args:
+            base_dir: Directory to keep the blobs in. If None, uses
+                      ~/.quantum_resistant_p2p/blobs.
+            encryption_key: Encryption key to use. Must be provided for proper operation.
+
+        Raises:
+            ValueError: If no encryption key is provided
+        """
+        if encryption_key is None:
+            raise ValueError("Encryption key must be provided to BlobStore")
+
+        if base_dir is None:
+            self.base_dir = Path.home() / ".quantum_resistant_p2p" / "blobs"
+        else:
+            self.base_dir = Path(base_dir)
+        self.base_dir.mkdir(exist_ok=True, parents=True)
+
+        # Separate subkeys for chunk encryption and for content addressing
+        key_material = HKDF(
+            algorithm=hashes.SHA256(),
+            length=64,
+            salt=None,
+            info=b"blob_store",
+        ).derive(encryption_key)
+        self._chunk_key = key_material[:32]
+        self._id_key = key_material[32:]
+
+        self.cipher = AES256GCM()
+
+        # Reference counts are updated from the UI and from message handlers
+        self.lock = threading.RLock()
+
+        index_path = self.base_dir / self.INDEX_FILENAME
+        self._conn = sqlite3.connect(str(index_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                " blob_id TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " chunk_count INTEGER NOT NULL,"
+                " refcount INTEGER NOT NULL)"
+            )
+
+        try:
+            if os.name == 'posix':
+                os.chmod(self.base_dir, stat.S_IRWXU)  # 0o700 permissions
+                os.chmod(index_path, stat.S_IRUSR | stat.S_IWUSR)  # 0o600 permissions
+        except Exception as e:
+            logger.warning(f"Failed to set blob store permissions: {e}")
+
+        logger.info(f"Blob store initialized at {self.base_dir}")
+
+    def _blob_path(self, blob_id: str) -> Path:
+        """Get the path of a blob file, fanned out over subdirectories."""
+        return self.base_dir / blob_id[:2] / blob_id
+
+    @staticmethod
+    def _associated_data(blob_id: str, index: int, is_last: bool) -> bytes:
+        """Build the associated data binding a chunk to its blob and position."""
+        return f"{blob_id}|{index}|{int(is_last)}".encode()
+
+    def _chunk_count(self, size: int) -> int:
+        """Get the number of chunks a blob of the given size is written as."""
+        # An empty blob is still written as one (empty) chunk
+        return max(1, -(-size // self.CHUNK_SIZE))
+
+    def _add_existing_ref(self, blob_id: str) -> bool:
+        """Take another reference to a blob if it's already stored.
+
+        Returns:
+            True if the blob exists and its reference count was increased
+        """
+        with self.lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE blobs SET refcount = refcount + 1 WHERE blob_id = ?", (blob_id,)
+            )
+            return cursor.rowcount > 0
+
+    def _write_blob(self, blob_id: str, size: int,
+                    read_chunks: Callable[[], Iterator[bytes]]) -> None:
+        """Encrypt a blob's chunks to disk and add it to the index.
+
+        The blob is written to a temporary file and moved into place, so a
+        crash never leaves a partial blob under its ID.
+
+        Args:
+            blob_id: The ID of the blob
+            size: Size of the contents in bytes
+            read_chunks: Returns an iterator over the plaintext chunks
+        """
+        chunk_count = self._chunk_count(size)
+        path = self._blob_path(blob_id)
+        path.parent.mkdir(exist_ok=True)
+        temp_path = path.with_name(path.name + ".tmp")
+
+        with open(temp_path, "wb") as f:
+            written = 0
+            for index, chunk in enumerate(read_chunks()):
+                ciphertext = self.cipher.encrypt(
+                    self._chunk_key, chunk,
+                    self._associated_data(blob_id, index, index == chunk_count - 1)
+                )
+                f.write(struct.pack(">I", len(ciphertext)))
+                f.write(ciphertext)
+                written += 1
+            if written != chunk_count:
+                raise IOError(f"Blob {blob_id[:8]}... changed while it was being stored")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+        with self.lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO blobs (blob_id, size, chunk_count, refcount) VALUES (?, ?, ?, 1)"
+                " ON CONFLICT(blob_id) DO UPDATE SET refcount = refcount + 1",
+                (blob_id, size, chunk_count)
+            )
+
+    def put(self, data: bytes) -> Optional[str]:
+        """Store contents held in memory and take a reference to them.
+
+        Args:
+            data: The contents to store
+
+        Returns:
+            The blob ID, or None if storing failed
+        """
+        blob_id = hmac.new(self._id_key, data, hashlib.sha256).hexdigest()
+
+        try:
+            with self.lock:
+                if self._add_existing_ref(blob_id):
+                    logger.debug(f"Blob {blob_id[:8]}... already stored, deduplicated")
+                    return blob_id
+
+                def read_chunks() -> Iterator[bytes]:
+                    view = memoryview(data)
+                    for offset in range(0, self._chunk_count(len(data)) * self.CHUNK_SIZE, self.CHUNK_SIZE):
+                        yield bytes(view[offset:offset + self.CHUNK_SIZE])
+
+                self._write_blob(blob_id, len(data), read_chunks)
+            return blob_id
+
+        except Exception as e:
+            logger.error(f"Failed to store blob: {e}")
+            return None
+
+    def put_file(self, file_path: str) -> Optional[Tuple[str, int]]:
+        """Store the contents of a file and take a reference to them.
+
+        The file is read twice, once to address it and once to encrypt it,
+        and only one chunk is held in memory at a time.
+
+        Args:
+            file_path: The path to the file
+
+        Returns:
+            Tuple of (blob ID, size in bytes), or None if storing failed
+        """
+        def read_chunks() -> Iterator[bytes]:
+            with open(file_path, "rb") as f:
+                chunk = f.read(self.CHUNK_SIZE)
+                yield chunk
+                while True:
+                    chunk = f.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        try:
+            digest = hmac.new(self._id_key, digestmod=hashlib.sha256)
+            size = 0
+            for chunk in read_chunks():
+                digest.update(chunk)
+                size += len(chunk)
+            blob_id = digest.hexdigest()
+
+            with self.lock:
+                if self._add_existing_ref(blob_id):
+                    logger.debug(f"Blob {blob_id[:8]}... already stored, deduplicated")
+                    return blob_id, size
+
+                self._write_blob(blob_id, size, read_chunks)
+            return blob_id, size
+
+        except Exception as e:
+            logger.error(f"Failed to store file {file_path}: {e}")
+            return None
+
+    def add_ref(self, blob_id: str) -> bool:
+        """Take another reference to a stored blob.
+
+        Args:
+            blob_id: The ID of the blob
+
+        Returns:
+            True if the blob exists, False otherwise
+        """
+        return self._add_existing_ref(blob_id)
+
+    def release(self, blob_id: str) -> None:
+        """Drop a reference to a blob, deleting it once nothing refers to it.
+
+        Args:
+            blob_id: The ID of the blob
+        """
+        try:
+            with self.lock, self._conn:
+                self._conn.execute(
+                    "UPDATE blobs SET refcount = refcount - 1 WHERE blob_id = ?", (blob_id,)
+                )
+                row = self._conn.execute(
+                    "SELECT refcount FROM blobs WHERE blob_id = ?", (blob_id,)
+                ).fetchone()
+                if row is None or row[0] > 0:
+                    return
+                self._conn.execute("DELETE FROM blobs WHERE blob_id = ?", (blob_id,))
+
+            path = self._blob_path(blob_id)
+            if path.exists():
+                os.remove(path)
+            logger.debug(f"Deleted blob {blob_id[:8]}...")
+
+        except Exception as e:
+            logger.error(f"Failed to release blob {blob_id[:8]}...: {e}")
+
+    def get_size(self, blob_id: str) -> Optional[int]:
+        """Get the size of a blob's contents.
+
+        Args:
+            blob_id: The ID of the blob
+
+        Returns:
+            The size in bytes, or None if the blob isn't stored
+        """
+        with self.lock:
+            row = self._conn.execute(
+                "SELECT size FROM blobs WHERE blob_id = ?", (blob_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def exists(self, blob_id: str) -> bool:
+        """Check if a blob is stored.
+
+        Args:
+            blob_id: The ID of the blob
+
+        Returns:
+            True if the blob is stored, False otherwise
+        """
+        return self.get_size(blob_id) is not None
+
+    def iter_chunks(self, blob_id: str) -> Iterator[bytes]:
+        """Decrypt a blob chunk by chunk.
+
+        Args:
+            blob_id: The ID of the blob
+
+        Yields:
+            The plaintext chunks in order
+
+        Raises:
+            KeyError: If the blob isn't stored
+            IOError: If the blob file is truncated or corrupted
+        """
+        with self.lock:
+            row = self._conn.execute(
+                "SELECT chunk_count FROM blobs WHERE blob_id = ?", (blob_id,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"Blob {blob_id[:8]}... not found")
+        chunk_count = row[0]
+
+        with open(self._blob_path(blob_id), "rb") as f:
+            for index in range(chunk_count):
+                header = f.read(4)
+                if len(header) != 4:
+                    raise IOError(f"Blob {blob_id[:8]}... is truncated")
+                length = struct.unpack(">I", header)[0]
+                ciphertext = f.read(length)
+                if len(ciphertext) != length:
+                    raise IOError(f"Blob {blob_id[:8]}... is truncated")
+                yield self.cipher.decrypt(
+                    self._chunk_key, ciphertext,
+                    self._associated_data(blob_id, index, index == chunk_count - 1)
+                )
+
+    def read(self, blob_id: str) -> Optional[bytes]:
+        """Read a whole blob into memory.
+
+        Prefer save_to for files that may be large.
+
+        Args:
+            blob_id: The ID of the blob
+
+        Returns:
+            The contents, or None if the blob could not be read
+        """
+        try:
+            return b"".join(self.iter_chunks(blob_id))
+        except Exception as e:
+            logger.error(f"Failed to read blob {blob_id[:8]}...: {e}")
+            return None
+
+    def save_to(self, blob_id: str, file_path: str) -> bool:
+        """Decrypt a blob into a file, one chunk at a time.
+
+        Args:
+            blob_id: The ID of the blob
+            file_path: Where to write the contents
+
+        Returns:
+            True if the file was written, False otherwise
+        """
+        try:
+            with open(file_path, "wb") as f:
+                for chunk in self.iter_chunks(blob_id):
+                    f.write(chunk)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save blob {blob_id[:8]}... to {file_path}: {e}")
+            return False
+
+    def get_stats(self) -> dict:
+        """Get the number of blobs and the space they take up.
+
+        Returns:
+            Dict with blob count, total stored size and total references
+        """
+        with self.lock:
+            count, size, refs = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount), 0) FROM blobs"
+            ).fetchone()
+        return {"blobs": count, "size": size, "references": refs}
+
+    def close(self) -> None:
+        """Close the blob index."""
+        with self.lock:
+            try:
+                self._conn.close()
+                logger.info("Blob store closed")
+            except Exception as e:
+                logger.error(f"Error closing blob store: {e}")
@@ -0,0 +1,268 @@
+"""
+Retention policy and manifest of the secure logger's daily log files.
+"""
+
+import datetime
+import logging
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LogRetention:
+    """Limits on how long logs are kept live and how much log is kept at all.
+
+    A limit of None means no limit. Days are archived and deleted oldest
+    first, and the current day is never archived or deleted.
+    """
+
+    archive_after_days: Optional[float] = 7    # Age after which days are archived
+    max_age_days: Optional[float] = None       # Age after which days are deleted
+    max_total_bytes: Optional[int] = None      # Disk space kept for all days
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the policy to a dictionary for storage.
+
+        Returns:
+            Dictionary representation of the policy
+        """
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'LogRetention':
+        """Create a policy from a dictionary.
+
+        Args:
+            data: Dictionary representation of the policy
+
+        Returns:
+            The policy
+        """
+        return cls(
+            archive_after_days=data.get('archive_after_days'),
+            max_age_days=data.get('max_age_days'),
+            max_total_bytes=data.get('max_total_bytes')
+        )
+
+
+class LogDay:
+    """What the manifest knows about one day of logs."""
+
+    __slots__ = ('date', 'first_event_time', 'last_event_time', 'events',
+                 'size', 'live', 'archived')
+
+    def __init__(self, date: str):
+        """Initialize an empty day.
+
+        Args:
+            date: The day, as YYYY-MM-DD
+        """
+        self.date = date
+        self.first_event_time: Optional[float] = None
+        self.last_event_time: Optional[float] = None
+        self.events = 0
+        # Bytes on disk of the day's log and index files
+        self.size = 0
+        # Whether the day has a live log file, which is still appended to
+        self.live = False
+        # Whether the day has an archive bundle
+        self.archived = False
+
+    @property
+    def end_time(self) -> float:
+        """The end of the day, local time."""
+        day = datetime.datetime.strptime(self.date, "%Y-%m-%d") + datetime.timedelta(days=1)
+        return day.timestamp()
+
+    def add(self, first_event_time: float, last_event_time: float, events: int, size: int) -> None:
+        """Count events written to the day's log file.
+
+        Args:
+            first_event_time: Timestamp of the oldest event written
+            last_event_time: Timestamp of the newest event written
+            events: The number of events written
+            size: The number of bytes written
+        """
+        if self.first_event_time is None or first_event_time < self.first_event_time:
+            self.first_event_time = first_event_time
+        if self.last_event_time is None or last_event_time > self.last_event_time:
+            self.last_event_time = last_event_time
+        self.events += events
+        self.size += size
+
+    def overlaps(self, start_time: Optional[float], end_time: Optional[float]) -> bool:
+        """Check whether the day may hold events in a time range.
+
+        Args:
+            start_time: Start of the range, unbounded if None
+            end_time: End of the range, unbounded if None
+
+        Returns:
+            True if the day overlaps the range
+        """
+        start_date = end_date = None
+        if start_time is not None:
+            start_date = datetime.datetime.fromtimestamp(start_time).strftime("%Y-%m-%d")
+        if end_time is not None:
+            end_date = datetime.datetime.fromtimestamp(end_time).strftime("%Y-%m-%d")
+        if not ((start_date is None or self.date >= start_date)
+                and (end_date is None or self.date <= end_date)):
+            return False
+        if self.live or self.first_event_time is None:
+            # The times of a live day may lag behind its log after a crash
+            return True
+        return ((start_time is None or self.last_event_time >= start_time)
+                and (end_time is None or self.first_event_time <= end_time))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the day to a dictionary for storage.
+
+        Returns:
+            Dictionary representation of the day
+        """
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'LogDay':
+        """Create a day from a dictionary.
+
+        Args:
+            data: Dictionary representation of the day
+
+        Returns:
+            The day
+        """
+        day = cls(data['date'])
+        for slot in cls.__slots__:
+            if slot in data:
+                setattr(day, slot, data[slot])
+        return day
+
+
+class LogManifest:
+    """The days that have logs, with their time ranges and sizes.
+
+    The secure logger keeps the manifest up to date as it writes, archives
+    and deletes logs, so queries find their files without listing the log
+    directory and retention is applied without measuring every file.
+    """
+
+    def __init__(self, retention: Optional[LogRetention] = None):
+        """Initialize an empty manifest.
+
+        Args:
+            retention: The retention policy, LogRetention() if None
+        """
+        self.days: Dict[str, LogDay] = {}
+        self.retention = retention if retention is not None else LogRetention()
+        # Whether the manifest has changed since it was saved
+        self.dirty = False
+
+    def day(self, date: str) -> LogDay:
+        """Get a day, adding it if it isn't in the manifest.
+
+        Args:
+            date: The day, as YYYY-MM-DD
+
+        Returns:
+            The day
+        """
+        day = self.days.get(date)
+        if day is None:
+            day = self.days[date] = LogDay(date)
+            self.dirty = True
+        return day
+
+    def select(self, start_time: Optional[float] = None,
+               end_time: Optional[float] = None) -> List[LogDay]:
+        """Get the days that may hold events in a time range.
+
+        Args:
+            start_time: Start of the range, unbounded if None
+            end_time: End of the range, unbounded if None
+
+        Returns:
+            The days, oldest first
+        """
+        return [self.days[date] for date in sorted(self.days)
+                if self.days[date].overlaps(start_time, end_time)]
+
+    def total_size(self) -> int:
+        """Get the bytes on disk of all days.
+
+        Returns:
+            The total size
+        """
+        return sum(day.size for day in self.days.values())
+
+    def expired(self, now: Optional[float] = None) -> Tuple[List[str], List[str]]:
+        """Find the days the retention policy archives or deletes.
+
+        Args:
+            now: The current time, time.time() if None
+
+        Returns:
+            Tuple of (to_archive, to_delete), lists of dates, oldest first
+        """
+        if now is None:
+            now = time.time()
+        today = datetime.datetime.fromtimestamp(now).strftime("%Y-%m-%d")
+        retention = self.retention
+        dates = [date for date in sorted(self.days) if date < today]
+
+        to_delete = set()
+        if retention.max_age_days is not None:
+            cutoff = now - retention.max_age_days * 86400
+            to_delete.update(date for date in dates if self.days[date].end_time <= cutoff)
+
+        if retention.max_total_bytes is not None:
+            excess = self.total_size() - sum(self.days[date].size for date in to_delete)
+            excess -= max(retention.max_total_bytes, 0)
+            for date in dates:
+                if excess <= 0:
+                    break
+                if date not in to_delete:
+                    to_delete.add(date)
+                    excess -= self.days[date].size
+
+        to_archive = []
+        if retention.archive_after_days is not None:
+            cutoff = now - retention.archive_after_days * 86400
+            to_archive = [date for date in dates
+                          if date not in to_delete and self.days[date].live
+                          and self.days[date].end_time <= cutoff]
+
+        return to_archive, [date for date in dates if date in to_delete]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the manifest to a dictionary for storage.
+
+        Returns:
+            Dictionary representation of the manifest
+        """
+        return {
+            "retention": self.retention.to_dict(),
+            "days": [day.to_dict() for _, day in sorted(self.days.items())]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'LogManifest':
+        """Create a manifest from a dictionary.
+
+        Args:
+            data: Dictionary representation of the manifest
+
+        Returns:
+            The manifest
+        """
+        retention = None
+        if "retention" in data:
+            retention = LogRetention.from_dict(data["retention"])
+        manifest = cls(retention)
+        for day_data in data.get("days", []):
+            day = LogDay.from_dict(day_data)
+            manifest.days[day.date] = day
+        return manifest
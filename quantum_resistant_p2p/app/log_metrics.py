@@ -0,0 +1,211 @@
+"""
+Incrementally maintained security metrics for the secure logger.
+"""
+
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Event fields that name an algorithm
+ALGORITHM_FIELDS = ("encryption_algorithm", "signature_algorithm", "algorithm")
+
+
+class MetricCounters:
+    """Counters and histograms over a set of log events.
+
+    Counters are updated one event at a time and can be merged, so metrics
+    for any set of hours or days are the sum of their rollups.
+    """
+
+    __slots__ = ('events', 'handshakes', 'algorithms', 'files_transferred',
+                 'bytes_transferred', 'first_event_time', 'last_event_time')
+
+    def __init__(self):
+        """Initialize empty counters."""
+        self.events: Dict[str, int] = {}        # Events by type
+        self.handshakes: Dict[str, int] = {}    # Key exchange events by state
+        self.algorithms: Dict[str, int] = {}    # Events by algorithm used
+        self.files_transferred = 0
+        self.bytes_transferred = 0
+        self.first_event_time: Optional[float] = None
+        self.last_event_time: Optional[float] = None
+
+    def add(self, event: Dict[str, Any]) -> None:
+        """Count an event.
+
+        Args:
+            event: The log entry
+        """
+        event_type = event["type"]
+        timestamp = event["timestamp"]
+
+        self.events[event_type] = self.events.get(event_type, 0) + 1
+
+        if self.first_event_time is None or timestamp < self.first_event_time:
+            self.first_event_time = timestamp
+        if self.last_event_time is None or timestamp > self.last_event_time:
+            self.last_event_time = timestamp
+
+        if event_type == "key_exchange":
+            state = str(event.get("state", "unknown"))
+            self.handshakes[state] = self.handshakes.get(state, 0) + 1
+        elif event_type in ("message_sent", "message_received"):
+            if event.get("is_file", False):
+                self.files_transferred += 1
+            size = event.get("size", 0)
+            if isinstance(size, (int, float)):
+                self.bytes_transferred += size
+
+        for key in ALGORITHM_FIELDS:
+            if key in event:
+                algorithm = str(event[key])
+                self.algorithms[algorithm] = self.algorithms.get(algorithm, 0) + 1
+
+    def merge(self, other: 'MetricCounters') -> None:
+        """Add another set of counters to these.
+
+        Args:
+            other: The counters to add
+        """
+        for mine, theirs in ((self.events, other.events),
+                             (self.handshakes, other.handshakes),
+                             (self.algorithms, other.algorithms)):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        self.files_transferred += other.files_transferred
+        self.bytes_transferred += other.bytes_transferred
+        if other.first_event_time is not None and (
+                self.first_event_time is None or other.first_event_time < self.first_event_time):
+            self.first_event_time = other.first_event_time
+        if other.last_event_time is not None and (
+                self.last_event_time is None or other.last_event_time > self.last_event_time):
+            self.last_event_time = other.last_event_time
+
+    def to_metrics(self) -> Dict[str, Any]:
+        """Get the metrics in the form SecureLogger.get_security_metrics returns.
+
+        Returns:
+            Dictionary of security metrics
+        """
+        return {
+            "total_events": sum(self.events.values()),
+            "key_exchanges": self.events.get("key_exchange", 0),
+            "messages_sent": self.events.get("message_sent", 0),
+            "messages_received": self.events.get("message_received", 0),
+            "files_transferred": self.files_transferred,
+            "total_bytes_transferred": self.bytes_transferred,
+            "algorithms_used": dict(self.algorithms),
+            "handshakes": dict(self.handshakes),
+            "events_by_type": dict(self.events),
+            "first_event_time": self.first_event_time,
+            "last_event_time": self.last_event_time
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the counters to a dictionary for storage.
+
+        Returns:
+            Dictionary representation of the counters
+        """
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'MetricCounters':
+        """Create counters from a dictionary.
+
+        Args:
+            data: Dictionary representation of the counters
+
+        Returns:
+            The counters
+        """
+        counters = cls()
+        for slot in cls.__slots__:
+            if slot in data:
+                setattr(counters, slot, data[slot])
+        return counters
+
+
+class DayRollup:
+    """Metrics of one day's log file, in total and by hour.
+
+    log_end is the offset in the log file up to which records have been
+    counted, so a rollup saved before a crash can catch up with the records
+    written after it.
+    """
+
+    __slots__ = ('total', 'hours', 'log_end', 'dirty')
+
+    def __init__(self):
+        """Initialize an empty rollup."""
+        self.total = MetricCounters()
+        # Counters by hour, keyed by the hour's start time divided by 3600
+        self.hours: Dict[int, MetricCounters] = {}
+        self.log_end = 0
+        # Whether the rollup has changed since it was saved
+        self.dirty = False
+
+    def add(self, event: Dict[str, Any]) -> None:
+        """Count an event.
+
+        Args:
+            event: The log entry
+        """
+        self.total.add(event)
+        hour = int(event["timestamp"] // 3600)
+        counters = self.hours.get(hour)
+        if counters is None:
+            counters = self.hours[hour] = MetricCounters()
+        counters.add(event)
+        self.dirty = True
+
+    def window(self, start_time: Optional[float], end_time: Optional[float]) -> MetricCounters:
+        """Get the metrics of the hours overlapping a time range.
+
+        Args:
+            start_time: Start of the range, unbounded if None
+            end_time: End of the range, unbounded if None
+
+        Returns:
+            The merged counters, to a resolution of one hour
+        """
+        if start_time is None and end_time is None:
+            return self.total
+        counters = MetricCounters()
+        for hour, hour_counters in self.hours.items():
+            if start_time is not None and (hour + 1) * 3600 <= start_time:
+                continue
+            if end_time is not None and hour * 3600 > end_time:
+                continue
+            counters.merge(hour_counters)
+        return counters
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the rollup to a dictionary for storage.
+
+        Returns:
+            Dictionary representation of the rollup
+        """
+        return {
+            "total": self.total.to_dict(),
+            "hours": {str(hour): counters.to_dict() for hour, counters in self.hours.items()},
+            "log_end": self.log_end
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DayRollup':
+        """Create a rollup from a dictionary.
+
+        Args:
+            data: Dictionary representation of the rollup
+
+        Returns:
+            The rollup
+        """
+        rollup = cls()
+        rollup.total = MetricCounters.from_dict(data.get("total", {}))
+        rollup.hours = {int(hour): MetricCounters.from_dict(counters)
+                        for hour, counters in data.get("hours", {}).items()}
+        rollup.log_end = data.get("log_end", 0)
+        return rollup
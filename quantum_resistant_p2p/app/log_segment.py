@@ -0,0 +1,197 @@
+"""
+Block format of the secure logger's log files.
+
+A log file starts with a header holding a magic string and a random sync
+marker. Events follow in blocks; each block is the sync marker, the length of
+the encrypted payload and the payload, which is a compressed run of events
+encrypted with AES-256-GCM:
+
+    header:  MAGIC (8 bytes) | sync marker (16 bytes)
+    block:   sync marker (16 bytes) | length (4 bytes) | encrypted payload
+
+Grouping events into blocks pays for a nonce, a tag and a cipher call once per
+block instead of once per event, and lets similar events compress together.
+After corruption, a reader skips to the next sync marker, so at most one
+block is lost.
+"""
+
+import os
+import json
+import zlib
+import struct
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LogSegment:
+    """Encoder and decoder for the blocks of one log file."""
+
+    MAGIC = b"QRPSLOG2"
+    SYNC_SIZE = 16
+    HEADER_SIZE = len(MAGIC) + SYNC_SIZE
+
+    # Sync marker and payload length in front of each block's payload
+    BLOCK_PREFIX_SIZE = SYNC_SIZE + 4
+
+    # Sanity limit for the size of a block's payload
+    MAX_BLOCK_SIZE = 16 * 1024 * 1024
+
+    # zlib compression level of block payloads
+    COMPRESSION_LEVEL = 6
+
+    _LENGTH = struct.Struct(">I")
+
+    # Associated data of block payloads, bound to the file's sync marker
+    _BLOCK_AD = b"secure_logger_block_v2"
+
+    def __init__(self, cipher, key: bytes, sync: bytes):
+        """Initialize the codec for a log file.
+
+        Args:
+            cipher: The symmetric algorithm encrypting the blocks
+            key: The encryption key
+            sync: The sync marker of the file
+        """
+        self.cipher = cipher
+        self.key = key
+        self.sync = sync
+        self._associated_data = self._BLOCK_AD + sync
+
+    @classmethod
+    def create(cls, cipher, key: bytes) -> 'LogSegment':
+        """Create the codec for a new log file, with a random sync marker.
+
+        Args:
+            cipher: The symmetric algorithm encrypting the blocks
+            key: The encryption key
+
+        Returns:
+            The codec
+        """
+        return cls(cipher, key, os.urandom(cls.SYNC_SIZE))
+
+    @classmethod
+    def open(cls, cipher, key: bytes, file_path: Path) -> Optional['LogSegment']:
+        """Get the codec for an existing log file.
+
+        Args:
+            cipher: The symmetric algorithm encrypting the blocks
+            key: The encryption key
+            file_path: The log file
+
+        Returns:
+            The codec, or None if the file is empty, missing, or written in
+            the older format of one encrypted record per event
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                header = f.read(cls.HEADER_SIZE)
+        except FileNotFoundError:
+            return None
+        if len(header) < cls.HEADER_SIZE or not header.startswith(cls.MAGIC):
+            return None
+        return cls(cipher, key, header[len(cls.MAGIC):])
+
+    def header(self) -> bytes:
+        """Get the header that starts the log file.
+
+        Returns:
+            The header bytes
+        """
+        return self.MAGIC + self.sync
+
+    def encode_block(self, records: List[bytes], level: Optional[int] = None) -> bytes:
+        """Compress and encrypt events into a block.
+
+        Args:
+            records: The JSON-encoded events, in the order they were logged
+            level: The zlib compression level, COMPRESSION_LEVEL if None
+
+        Returns:
+            The block, ready to append to the file
+        """
+        parts = []
+        for record in records:
+            parts.append(self._LENGTH.pack(len(record)))
+            parts.append(record)
+        if level is None:
+            level = self.COMPRESSION_LEVEL
+        compressed = zlib.compress(b"".join(parts), level)
+        payload = self.cipher.encrypt(self.key, compressed, self._associated_data)
+        return self.sync + self._LENGTH.pack(len(payload)) + payload
+
+    def decode_block(self, payload) -> List[Dict[str, Any]]:
+        """Decrypt and decompress the payload of a block.
+
+        Args:
+            payload: The encrypted payload, without the sync marker and length
+
+        Returns:
+            The events in the block
+
+        Raises:
+            Exception: If the payload is corrupted or was tampered with
+        """
+        data = zlib.decompress(self.cipher.decrypt(self.key, bytes(payload), self._associated_data))
+        events = []
+        position = 0
+        while position < len(data):
+            length = self._LENGTH.unpack_from(data, position)[0]
+            position += self._LENGTH.size
+            events.append(json.loads(data[position:position + length].decode()))
+            position += length
+        return events
+
+    def scan(self, data: bytes, base: int) -> Tuple[List[Tuple[int, int, List[Dict[str, Any]]]], int]:
+        """Read the blocks in a range of the file, skipping corrupted ones.
+
+        Args:
+            data: The file contents from offset base on
+            base: Offset in the file of the start of data
+
+        Returns:
+            Tuple of (blocks, consumed): (offset, payload length, events) of
+            each readable block, and the number of bytes read. A partial block
+            at the end, possibly still being written, isn't consumed.
+        """
+        blocks = []
+        position = 0
+        while position + self.BLOCK_PREFIX_SIZE <= len(data):
+            if data[position:position + self.SYNC_SIZE] != self.sync:
+                next_block = data.find(self.sync, position + 1)
+                if next_block < 0:
+                    logger.warning(f"No block found after offset {base + position}")
+                    break
+                logger.warning(f"Skipped {next_block - position} corrupted bytes "
+                               f"at offset {base + position}")
+                position = next_block
+                continue
+
+            length = self._LENGTH.unpack_from(data, position + self.SYNC_SIZE)[0]
+            end = position + self.BLOCK_PREFIX_SIZE + length
+            if length > self.MAX_BLOCK_SIZE or end > len(data):
+                # A torn block followed by newer ones, or the last block
+                # still being written
+                next_block = data.find(self.sync, position + 1)
+                if next_block < 0:
+                    break
+                logger.warning(f"Skipped incomplete block at offset {base + position}")
+                position = next_block
+                continue
+
+            try:
+                events = self.decode_block(data[position + self.BLOCK_PREFIX_SIZE:end])
+            except Exception as e:
+                logger.warning(f"Skipped corrupted block at offset {base + position}: {e}")
+                # The length may be what is corrupted, so don't trust it to
+                # find the next block
+                next_block = data.find(self.sync, position + 1)
+                position = next_block if next_block >= 0 else end
+                continue
+
+            blocks.append((base + position, length, events))
+            position = end
+        return blocks, position
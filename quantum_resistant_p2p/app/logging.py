@@ -4,21 +4,51 @@ Secure logging for cryptographic operations using unified file protection.
 
 import json
 import os
+import base64
 import time
 import logging
 import datetime
 import threading
 import io
+import mmap
+import queue
 import struct
+import zlib
 import re
-from typing import Dict, List, Any, Optional
+import itertools
+from typing import Dict, List, Any, Optional, Iterator, Tuple
 from pathlib import Path
 
 from ..crypto.symmetric import AES256GCM
 from ..utils.secure_file import SecureFile
+from .log_metrics import MetricCounters, DayRollup
+from .log_segment import LogSegment
+from .log_archive import LogRetention, LogManifest
 
 logger = logging.getLogger(__name__)
 
+# An index entry: (timestamp, offset, length, event type, slot) of one event.
+# Offset and length locate the block holding the event and slot is its
+# position in the block, or -1 for a file with one record per event.
+IndexEntry = Tuple[float, int, int, str, int]
+
+
+class _LogFileIndex:
+    """The decrypted index of one log file, as far as it has been read."""
+    
+    __slots__ = ('index_size', 'end', 'entries', 'segment')
+    
+    def __init__(self, segment: Optional[LogSegment] = None):
+        # Bytes of the index file read so far
+        self.index_size = 0
+        # Bytes of the log file covered by the index
+        self.end = segment.HEADER_SIZE if segment is not None else 0
+        # Index entries in the order the events were written
+        self.entries: List[IndexEntry] = []
+        # Block codec of the file, None for an empty file or one in the
+        # older format of one encrypted record per event
+        self.segment = segment
+
 
 class SecureLogger:
     """Secure logging for cryptographic operations with improved reliability.
@@ -26,8 +56,85 @@ class SecureLogger:
     This class provides functionality to securely log cryptographic operations
     including key exchanges, message transfers, and security-related events,
     with enhanced safeguards against file corruption.
+    
+    Events are written by a background thread so logging doesn't cost the
+    caller (usually the event loop) any file I/O. log_event only queues the
+    event; the writer appends queued events in batches, one locked append
+    per log file for up to BATCH_SIZE events or FLUSH_INTERVAL seconds. Each
+    batch is stored as one compressed, encrypted block (see LogSegment).
+    Call flush() to wait for queued events to be written, and close() on
+    shutdown. If the writer falls QUEUE_SIZE events behind, log_event waits
+    up to QUEUE_TIMEOUT seconds for room and then drops the event; the
+    writer logs how many were dropped.
+    
+    Every log file has an encrypted sidecar index (YYYY-MM-DD.idx) with the
+    block, timestamp and type of each event. Queries filter the index and
+    decrypt only the blocks holding matching events, read through mmap, so
+    they don't read or decrypt whole log files. Log files without an index,
+    or with blocks the index doesn't cover yet, are indexed on first query.
+    
+    Log files written before blocks were introduced hold one encrypted
+    record per event; they are still read, and appended to in that format.
+    
+    Security metrics are counted as events are written, into hourly and daily
+    rollups saved encrypted next to each log file (YYYY-MM-DD.metrics), so
+    metrics cover every event without reading the logs.
     """
     
+    # Maximum number of events waiting to be written
+    QUEUE_SIZE = 10000
+    
+    # Seconds log_event waits for room in a full queue before dropping the event
+    QUEUE_TIMEOUT = 0.05
+    
+    # Maximum number of events written in one batch
+    BATCH_SIZE = 256
+    
+    # Seconds the writer waits for more events before writing a batch
+    FLUSH_INTERVAL = 0.5
+    
+    # Queue markers asking the writer to write immediately or to stop
+    _FLUSH = object()
+    _STOP = object()
+    
+    # Associated data of index frames, so they can't pass for log records
+    _INDEX_AD = b"secure_logger_index_v2"
+    _INDEX_AD_V1 = b"secure_logger_index_v1"
+    
+    # Index frame header: start and end of the log range the frame covers
+    _INDEX_RANGE = struct.Struct(">QQ")
+    
+    # Index entry: offset, length, timestamp, slot, length of the event type
+    _INDEX_ENTRY = struct.Struct(">QIdhB")
+    
+    # Index entry of version 1 indexes, which had no slot
+    _INDEX_ENTRY_V1 = struct.Struct(">QIdB")
+    
+    # Set in the length of version 2 index frames, whose payload is compressed
+    _INDEX_V2_FLAG = 0x80000000
+    
+    # Seconds between saves of changed metric rollups
+    ROLLUP_SAVE_INTERVAL = 5.0
+    
+    # Associated data of the encrypted metric rollups
+    _METRICS_AD = b"secure_logger_metrics_v1"
+    
+    # File of the manifest of days with logs, in the log directory
+    MANIFEST_FILENAME = "manifest.json"
+    
+    # Associated data of the encrypted manifest
+    _MANIFEST_AD = b"secure_logger_manifest_v1"
+    
+    # Directory of the archive bundles, in the log directory
+    ARCHIVE_DIRNAME = "archive"
+    
+    # Events per block of archive bundles, and their zlib compression level
+    ARCHIVE_BLOCK_EVENTS = 4096
+    ARCHIVE_COMPRESSION_LEVEL = 9
+    
+    # Seconds between applications of the retention policy by the writer
+    RETENTION_INTERVAL = 3600.0
+    
     def __init__(self, log_path: Optional[str] = None, encryption_key: Optional[bytes] = None):
         """Initialize a new secure logger.
         
@@ -61,6 +168,8 @@ class SecureLogger:
         
         # Create a lock for thread safety
         self.lock = threading.RLock()
+        # Held while applying the retention policy, taken before self.lock
+        self._retention_lock = threading.Lock()
         
         # Compile regex for valid log filenames (YYYY-MM-DD.log)
         self.log_filename_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}\.log$')
@@ -68,6 +177,30 @@ class SecureLogger:
         # Track if we're already inside an error handler to prevent recursion
         self._in_error_handler = False
         
+        # Events waiting for the writer thread
+        self._queue: queue.Queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._writer: Optional[threading.Thread] = None
+        
+        # Sequence numbers of the last queued and last written events
+        self._queued = 0
+        self._written = 0
+        # Events dropped because the queue was full, in total and not yet logged
+        self.dropped_events = 0
+        self._dropped_unlogged = 0
+        self._progress = threading.Condition()
+        
+        # Decrypted indexes of the log files, by log file path
+        self._indexes: Dict[Path, _LogFileIndex] = {}
+        
+        # Metric rollups of the log files, by log file path
+        self._rollups: Dict[Path, DayRollup] = {}
+        self._rollups_saved = time.monotonic()
+        
+        # Manifest of the days with logs, loaded on first use
+        self._manifest: Optional[LogManifest] = None
+        # When the writer next applies the retention policy
+        self._retention_due = 0.0
+        
         logger.info(f"Secure logger initialized at {self.log_path}")
     
     def _load_or_generate_key(self) -> bytes:
@@ -102,45 +235,986 @@ class SecureLogger:
     def log_event(self, event_type: str, **kwargs) -> None:
         """Log a security-related event.
         
+        The event is queued and written by the writer thread; use flush() to
+        wait until it's on disk. The caller never writes to disk itself: if
+        the queue stays full for QUEUE_TIMEOUT seconds, the event is dropped
+        and counted in dropped_events.
+        
         Args:
             event_type: The type of event
             **kwargs: Additional event data
         """
-        # Use a lock to ensure thread safety
-        with self.lock:
+        try:
+            # Create the log entry
+            entry = {
+                "timestamp": time.time(),
+                "type": event_type,
+                **kwargs
+            }
+            
+            with self._progress:
+                self._ensure_writer()
+            
             try:
-                # Create the log entry
-                entry = {
-                    "timestamp": time.time(),
-                    "type": event_type,
-                    **kwargs
-                }
-                
-                # Get the current date for the log file name
-                date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-                log_file_path = self.log_path / f"{date_str}.log"
-                
-                # Create a SecureFile instance for this log file
-                log_file = SecureFile(log_file_path)
+                self._queue.put(entry, timeout=self.QUEUE_TIMEOUT)
+            except queue.Full:
+                # The writer is far behind; writing here would block the caller
+                # and put the event ahead of the queued ones
+                with self._progress:
+                    self.dropped_events += 1
+                    self._dropped_unlogged += 1
+                    first = self._dropped_unlogged == 1
+                if first:
+                    self._safe_error("Log queue is full, dropping events")
+                return
+            
+            with self._progress:
+                self._queued += 1
+        except Exception as e:
+            self._safe_error(f"Failed to log event: {e}")
+    
+    def _ensure_writer(self) -> None:
+        """Start the writer thread if it isn't running.
+        
+        Must be called with self._progress held.
+        """
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(
+                target=self._run_writer, name="SecureLoggerWriter", daemon=True
+            )
+            self._writer.start()
+    
+    def _run_writer(self) -> None:
+        """Write queued events in batches until asked to stop."""
+        while True:
+            item = self._queue.get()
+            batch = []
+            stop = False
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            
+            # Collect events until the batch is full, the interval has passed
+            # or someone asks for the events to be written now
+            while True:
+                if item is self._STOP:
+                    stop = True
+                    break
+                if item is not self._FLUSH:
+                    batch.append(item)
+                    if len(batch) < self.BATCH_SIZE:
+                        remaining = deadline - time.monotonic()
+                        if remaining > 0:
+                            try:
+                                item = self._queue.get(timeout=remaining)
+                                continue
+                            except queue.Empty:
+                                pass
+                break
+            
+            with self._progress:
+                dropped, self._dropped_unlogged = self._dropped_unlogged, 0
+            
+            try:
+                if dropped:
+                    # Record the gap in the log itself
+                    self._write_batch(batch + [{
+                        "timestamp": time.time(),
+                        "type": "log_events_dropped",
+                        "count": dropped
+                    }])
+                elif batch:
+                    self._write_batch(batch)
                 
-                # Encrypt the log entry
+                with self.lock:
+                    self._save_rollups()
+                if time.monotonic() >= self._retention_due:
+                    self._retention_due = time.monotonic() + self.RETENTION_INTERVAL
+                    self.apply_retention()
+            except Exception as e:
+                self._safe_error(f"Log writer failed: {e}")
+            finally:
+                # Count the batch as handled even if it failed, so flush()
+                # doesn't wait for it forever
+                with self._progress:
+                    self._written += len(batch)
+                    self._progress.notify_all()
+            
+            if stop:
+                return
+    
+    def _write_batch(self, entries: List[Dict[str, Any]]) -> bool:
+        """Append events to their daily log files.
+        
+        Args:
+            entries: The events to write, oldest first
+            
+        Returns:
+            True if every event was written, False otherwise
+        """
+        success = True
+        
+        # Group the encoded events by the day of the event
+        records: Dict[str, List[Tuple[Dict[str, Any], bytes]]] = {}
+        for entry in entries:
+            try:
+                date_str = datetime.datetime.fromtimestamp(entry["timestamp"]).strftime("%Y-%m-%d")
                 entry_json = json.dumps(entry).encode()
-                encrypted_entry = self.cipher.encrypt(self.encryption_key, entry_json)
-                
-                # Create the complete record (length + encrypted data)
-                length = len(encrypted_entry).to_bytes(4, byteorder="big")
-                record = length + encrypted_entry
-                
-                # Write to the log file
-                success = log_file.append_bytes(record)
-                
-                if success:
-                    logger.debug(f"Logged {event_type} event")
+                records.setdefault(date_str, []).append((entry, entry_json))
+            except Exception as e:
+                self._safe_error(f"Failed to log {entry.get('type')} event: {e}")
+                success = False
+        
+        with self.lock:
+            for date_str, day_records in records.items():
+                try:
+                    written = self._append_records(self.log_path / f"{date_str}.log", day_records)
+                except Exception as e:
+                    self._safe_error(f"Failed to write {len(day_records)} events to log: {e}")
+                    success = False
+                    continue
+                if written:
+                    logger.debug(f"Logged {len(day_records)} events")
                 else:
-                    self._safe_error(f"Failed to write {event_type} event to log")
+                    self._safe_error(f"Failed to write {len(day_records)} events to log")
+                    success = False
+        return success
+    
+    def _append_records(self, log_file_path: Path,
+                        day_records: List[Tuple[Dict[str, Any], bytes]]) -> bool:
+        """Append events to a log file, its index and its metrics.
+        
+        Must be called with self.lock held.
+        
+        Args:
+            log_file_path: The log file
+            day_records: (entry, JSON-encoded entry) of each event
+            
+        Returns:
+            True if the events were written, False otherwise
+        """
+        manifest = self._load_manifest()
+        day = manifest.day(log_file_path.stem)
+        if not day.live:
+            # Remove what an interrupted archival may have left, and record
+            # the day before its file exists so the file is never missing
+            # from the manifest
+            self._remove_log_files(log_file_path)
+            day.live = True
+            manifest.dirty = True
+            self._save_manifest()
+        
+        # Bring the index and metrics up to date first, so they stay contiguous
+        rollup = self._load_rollup(log_file_path)
+        index = self._load_index(log_file_path)
+        
+        def append(f) -> Tuple[int, Optional[LogSegment], List[IndexEntry]]:
+            # One locked append for all the day's events in the batch
+            f.seek(0, os.SEEK_END)
+            start = f.tell()
+            segment = index.segment
+            header = b""
+            if start == 0:
+                segment = LogSegment.create(self.cipher, self.encryption_key)
+                header = segment.header()
+            
+            offset = start + len(header)
+            entries = []
+            if segment is not None:
+                data = segment.encode_block([entry_json for _, entry_json in day_records])
+                length = len(data) - segment.BLOCK_PREFIX_SIZE
+                for slot, (entry, _) in enumerate(day_records):
+                    entries.append((entry["timestamp"], offset, length, entry["type"], slot))
+            else:
+                # Keep the format of a file written before blocks were introduced
+                parts = []
+                for entry, entry_json in day_records:
+                    encrypted = self.cipher.encrypt(self.encryption_key, entry_json)
+                    entries.append((entry["timestamp"], offset, len(encrypted), entry["type"], -1))
+                    parts.append(len(encrypted).to_bytes(4, byteorder="big") + encrypted)
+                    offset += 4 + len(encrypted)
+                data = b"".join(parts)
+            
+            f.write(header + data)
+            f.flush()
+            return start, segment, entries
+        
+        result = SecureFile(log_file_path).with_file_lock(append)
+        if result is None:
+            return False
+        start, segment, entries = result
+        written = -start
+        
+        if start == 0:
+            # A new file, its header isn't part of any block
+            index.segment = segment
+            start = index.end = max(index.end, segment.HEADER_SIZE)
+            rollup.log_end = max(rollup.log_end, segment.HEADER_SIZE)
+        if segment is not None:
+            end = entries[-1][1] + segment.BLOCK_PREFIX_SIZE + entries[-1][2]
+        else:
+            end = entries[-1][1] + 4 + entries[-1][2]
+        
+        if rollup.log_end == start:
+            for entry, _ in day_records:
+                rollup.add(entry)
+            rollup.log_end = end
+        
+        written += end
+        if index.end == start:
+            frame = self._encode_index_frame(start, end, entries)
+            if SecureFile(self._index_path(log_file_path)).append_bytes(frame):
+                written += len(frame)
+                index.index_size += len(frame)
+                index.end = end
+                index.entries.extend(entries)
+        # Otherwise the events are indexed and counted on the next query
+        
+        timestamps = [entry["timestamp"] for entry, _ in day_records]
+        day.add(min(timestamps), max(timestamps), len(day_records), written)
+        manifest.dirty = True
+        return True
+    
+    @staticmethod
+    def _metrics_path(log_file_path: Path) -> Path:
+        """Get the path of the metric rollup of a log file."""
+        return log_file_path.with_suffix(".metrics")
+    
+    def _load_rollup(self, log_file_path: Path) -> DayRollup:
+        """Get the metric rollup of a log file, counting records it's missing.
+        
+        Must be called with self.lock held.
+        
+        Args:
+            log_file_path: The log file
+            
+        Returns:
+            The rollup
+        """
+        rollup = self._rollups.get(log_file_path)
+        if rollup is None:
+            rollup = DayRollup()
+            stored = SecureFile(self._metrics_path(log_file_path)).read_json()
+            if stored is not None:
+                try:
+                    rollup_json = self.cipher.decrypt(
+                        self.encryption_key, base64.b64decode(stored["data"]), self._METRICS_AD
+                    )
+                    rollup = DayRollup.from_dict(json.loads(rollup_json.decode()))
+                except Exception as e:
+                    self._safe_error(f"Failed to read metrics of {log_file_path.name}, recounting: {e}")
+            self._rollups[log_file_path] = rollup
+        
+        index = self._load_index(log_file_path)
+        if index.end < rollup.log_end:
+            # The log is shorter than what was counted, count it again
+            rollup = self._rollups[log_file_path] = DayRollup()
+        
+        if index.end > rollup.log_end:
+            # Count the records written after the rollup was saved
+            missing = []
+            for item in reversed(index.entries):
+                if item[1] < rollup.log_end:
+                    break
+                missing.append(item)
+            if missing:
+                missing.reverse()
+                for entry in self._read_entries(log_file_path, index.segment, missing):
+                    rollup.add(entry)
+            rollup.log_end = index.end
+            rollup.dirty = True
+        
+        return rollup
+    
+    def _save_rollups(self, force: bool = False) -> None:
+        """Save the metric rollups and the manifest if they changed.
+        
+        Must be called with self.lock held.
+        
+        Args:
+            force: Save now instead of at most every ROLLUP_SAVE_INTERVAL seconds
+        """
+        if not force and time.monotonic() - self._rollups_saved < self.ROLLUP_SAVE_INTERVAL:
+            return
+        self._rollups_saved = time.monotonic()
+        
+        for log_file_path, rollup in self._rollups.items():
+            if not rollup.dirty:
+                continue
+            try:
+                rollup_json = json.dumps(rollup.to_dict()).encode()
+                encrypted = self.cipher.encrypt(self.encryption_key, rollup_json, self._METRICS_AD)
+                if SecureFile(self._metrics_path(log_file_path)).write_json(
+                        {"data": base64.b64encode(encrypted).decode()}):
+                    rollup.dirty = False
+            except Exception as e:
+                self._safe_error(f"Failed to save metrics of {log_file_path.name}: {e}")
+        
+        self._save_manifest()
+    
+    def get_metric_counters(self, start_time: Optional[float] = None,
+                            end_time: Optional[float] = None) -> MetricCounters:
+        """Get the metric counters of the events in a time range.
+        
+        Args:
+            start_time: Only count events after this timestamp
+            end_time: Only count events before this timestamp
+            
+        Returns:
+            The counters; with a time range they are accurate to the hour
+        """
+        # Make sure events that are still queued are counted
+        self.flush()
+        
+        counters = MetricCounters()
+        for log_file_path in self._log_files(start_time, end_time):
+            try:
+                with self.lock:
+                    counters.merge(self._load_rollup(log_file_path).window(start_time, end_time))
+            except Exception as e:
+                self._safe_error(f"Error reading metrics of {log_file_path}: {e}")
+        return counters
+    
+    def _load_manifest(self) -> LogManifest:
+        """Get the manifest of the days with logs, building it if it's missing.
+        
+        Must be called with self.lock held.
+        
+        Returns:
+            The manifest
+        """
+        if self._manifest is not None:
+            return self._manifest
+        
+        stored = SecureFile(self.log_path / self.MANIFEST_FILENAME).read_json()
+        if stored is not None:
+            try:
+                manifest_json = self.cipher.decrypt(
+                    self.encryption_key, base64.b64decode(stored["data"]), self._MANIFEST_AD
+                )
+                self._manifest = LogManifest.from_dict(json.loads(manifest_json.decode()))
+                return self._manifest
+            except Exception as e:
+                self._safe_error(f"Failed to read the log manifest, rebuilding it: {e}")
+        
+        self._manifest = self._rebuild_manifest()
+        self._save_manifest()
+        return self._manifest
+    
+    def _rebuild_manifest(self) -> LogManifest:
+        """Build the manifest from the files in the log directory.
+        
+        Used for log directories written before the manifest was introduced
+        and when the manifest is lost.
+        
+        Must be called with self.lock held.
+        
+        Returns:
+            The manifest, with the default retention policy
+        """
+        manifest = LogManifest()
+        manifest.dirty = True
+        
+        day_files = []
+        for log_file_path in self.log_path.glob("*.log"):
+            if self.log_filename_pattern.match(log_file_path.name):
+                day_files.append((log_file_path, False))
+        for bundle_path in (self.log_path / self.ARCHIVE_DIRNAME).glob("*.bundle"):
+            if self.log_filename_pattern.match(bundle_path.with_suffix(".log").name):
+                day_files.append((bundle_path, True))
+        
+        for file_path, archived in sorted(day_files):
+            day = manifest.day(file_path.stem)
+            try:
+                counters = self._load_rollup(file_path).total
+                size = sum(path.stat().st_size for path in (file_path, self._index_path(file_path))
+                           if path.exists())
+            except Exception as e:
+                self._safe_error(f"Error reading log file {file_path}: {e}")
+                continue
+            if counters.first_event_time is not None:
+                day.add(counters.first_event_time, counters.last_event_time,
+                        sum(counters.events.values()), size)
+            else:
+                day.size += size
+            if archived:
+                day.archived = True
+            else:
+                day.live = True
+        
+        logger.info(f"Built log manifest of {len(manifest.days)} days")
+        return manifest
+    
+    def _save_manifest(self) -> None:
+        """Save the manifest if it changed.
+        
+        Must be called with self.lock held.
+        """
+        manifest = self._manifest
+        if manifest is None or not manifest.dirty:
+            return
+        try:
+            manifest_json = json.dumps(manifest.to_dict()).encode()
+            encrypted = self.cipher.encrypt(self.encryption_key, manifest_json, self._MANIFEST_AD)
+            if SecureFile(self.log_path / self.MANIFEST_FILENAME).write_json(
+                    {"data": base64.b64encode(encrypted).decode()}):
+                manifest.dirty = False
+        except Exception as e:
+            self._safe_error(f"Failed to save the log manifest: {e}")
+    
+    def _bundle_path(self, date: str) -> Path:
+        """Get the path of the archive bundle of a day."""
+        return self.log_path / self.ARCHIVE_DIRNAME / f"{date}.bundle"
+    
+    def _remove_log_files(self, log_file_path: Path) -> None:
+        """Delete a log file or bundle with its index and metrics.
+        
+        Must be called with self.lock held.
+        
+        Args:
+            log_file_path: The log file or bundle
+        """
+        log_file_path.unlink(missing_ok=True)
+        self._index_path(log_file_path).unlink(missing_ok=True)
+        SecureFile(self._metrics_path(log_file_path)).remove()
+        self._indexes.pop(log_file_path, None)
+        self._rollups.pop(log_file_path, None)
+    
+    def get_retention(self) -> LogRetention:
+        """Get the retention policy of the logs.
+        
+        Returns:
+            The retention policy
+        """
+        with self.lock:
+            return self._load_manifest().retention
+    
+    def set_retention(self, retention: LogRetention) -> bool:
+        """Set the retention policy of the logs and apply it.
+        
+        Args:
+            retention: The retention policy
+            
+        Returns:
+            True if the policy was saved, False otherwise
+        """
+        with self.lock:
+            manifest = self._load_manifest()
+            manifest.retention = retention
+            manifest.dirty = True
+            self._save_manifest()
+            if manifest.dirty:
+                return False
+        self.apply_retention()
+        return True
+    
+    def apply_retention(self, now: Optional[float] = None) -> Tuple[int, int]:
+        """Archive and delete the days the retention policy doesn't keep live.
+        
+        The writer thread does this every RETENTION_INTERVAL seconds. Days
+        are archived without holding self.lock, so events can be logged and
+        queried meanwhile.
+        
+        Args:
+            now: The current time, time.time() if None
+            
+        Returns:
+            Tuple of (archived, deleted), the number of days archived and deleted
+        """
+        archived = deleted = 0
+        with self._retention_lock:
+            to_archive: List[str] = []
+            with self.lock:
+                try:
+                    manifest = self._load_manifest()
+                    to_archive, to_delete = manifest.expired(now)
+                    
+                    for date in to_delete:
+                        day = manifest.days[date]
+                        try:
+                            if day.live:
+                                self._remove_log_files(self.log_path / f"{date}.log")
+                            if day.archived:
+                                self._remove_log_files(self._bundle_path(date))
+                        except Exception as e:
+                            self._safe_error(f"Failed to delete logs of {date}: {e}")
+                            continue
+                        # Drop the day once its files are gone, so a day whose
+                        # deletion was interrupted is deleted again
+                        del manifest.days[date]
+                        manifest.dirty = True
+                        deleted += 1
+                    
+                    self._save_manifest()
+                except Exception as e:
+                    self._safe_error(f"Failed to apply log retention: {e}")
+            
+            for date in to_archive:
+                try:
+                    if self._archive_day(date):
+                        archived += 1
+                except Exception as e:
+                    self._safe_error(f"Failed to archive logs of {date}: {e}")
+        
+        if archived or deleted:
+            logger.info(f"Archived {archived} and deleted {deleted} days of logs")
+        return archived, deleted
+    
+    def _archive_day(self, date: str) -> bool:
+        """Move the events of a day's log file into its archive bundle.
+        
+        The bundle is a log file of large blocks compressed at a higher
+        level, holding the events of the day's earlier bundle, if any, and
+        of its log file.
+        
+        Must be called with self._retention_lock held and self.lock not held.
+        The bundle is built from the indexes as they are when archiving starts
+        and written block by block to a temporary file; self.lock is only
+        taken to read the indexes and to swap the bundle in. If events were
+        written to the day meanwhile, the bundle is dropped and the day is
+        archived on a later pass.
+        
+        Args:
+            date: The day, as YYYY-MM-DD
+            
+        Returns:
+            True if the day was archived, False otherwise
+        """
+        log_file_path = self.log_path / f"{date}.log"
+        bundle_path = self._bundle_path(date)
+        bundle_index_path = self._index_path(bundle_path)
+        
+        with self.lock:
+            manifest = self._load_manifest()
+            day = manifest.days.get(date)
+            if day is None:
+                return False
+            if not log_file_path.exists():
+                # A manifest restored from its backup may not know the day was
+                # archived since
+                day.live = False
+                day.archived = bundle_path.exists()
+                manifest.dirty = True
+                self._save_manifest()
+                return day.archived
+            
+            sources = []
+            for source in ([bundle_path] if day.archived else []) + [log_file_path]:
+                index = self._load_index(source)
+                sources.append((source, index.segment, list(index.entries)))
+            log_end = self._indexes[log_file_path].end
+        
+        segment = LogSegment.create(self.cipher, self.encryption_key)
+        rollup = DayRollup()
+        entries: List[IndexEntry] = []
+        offset = segment.HEADER_SIZE
+        temp_path = bundle_path.with_suffix(".tmp")
+        index_temp_path = bundle_index_path.with_name(bundle_index_path.name + ".tmp")
+        
+        def remove_temp_files() -> None:
+            temp_path.unlink(missing_ok=True)
+            index_temp_path.unlink(missing_ok=True)
+        
+        try:
+            bundle_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(segment.header())
+                for source, source_segment, items in sources:
+                    events = self._read_entries(source, source_segment, items)
+                    while True:
+                        batch = list(itertools.islice(events, self.ARCHIVE_BLOCK_EVENTS))
+                        if not batch:
+                            break
+                        block = segment.encode_block([json.dumps(event).encode() for event in batch],
+                                                     self.ARCHIVE_COMPRESSION_LEVEL)
+                        length = len(block) - segment.BLOCK_PREFIX_SIZE
+                        for slot, event in enumerate(batch):
+                            entries.append((event["timestamp"], offset, length, event["type"], slot))
+                            rollup.add(event)
+                        f.write(block)
+                        offset += len(block)
+                f.flush()
+                os.fsync(f.fileno())
+            
+            frame = self._encode_index_frame(segment.HEADER_SIZE, offset, entries)
+            with open(index_temp_path, 'wb') as f:
+                f.write(frame)
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception as e:
+            self._safe_error(f"Failed to archive logs of {date}: {e}")
+            remove_temp_files()
+            return False
+        
+        with self.lock:
+            manifest = self._load_manifest()
+            if (manifest.days.get(date) is not day or not log_file_path.exists()
+                    or self._load_index(log_file_path).end != log_end):
+                logger.debug(f"Logs of {date} changed while archiving, archiving them later")
+                remove_temp_files()
+                return False
+            
+            try:
+                # Drop the old index first, so an interruption leaves a bundle
+                # that is indexed again rather than one with a stale index
+                bundle_index_path.unlink(missing_ok=True)
+                self._indexes.pop(bundle_path, None)
+                self._rollups.pop(bundle_path, None)
+                os.replace(temp_path, bundle_path)
+                os.replace(index_temp_path, bundle_index_path)
+            except Exception as e:
+                self._safe_error(f"Failed to archive logs of {date}: {e}")
+                remove_temp_files()
+                return False
+            
+            index = self._indexes[bundle_path] = _LogFileIndex(segment)
+            index.index_size = len(frame)
+            index.end = offset
+            index.entries = entries
+            rollup.log_end = offset
+            self._rollups[bundle_path] = rollup
+            
+            # Point the manifest at the bundle before removing the log file, so an
+            # interruption leaves a stray file rather than missing events
+            counters = rollup.total
+            day.events = sum(counters.events.values())
+            day.first_event_time = counters.first_event_time
+            day.last_event_time = counters.last_event_time
+            day.size = offset + len(frame)
+            day.live = False
+            day.archived = True
+            manifest.dirty = True
+            self._save_manifest()
+            self._save_rollups(force=True)
+            
+            try:
+                self._remove_log_files(log_file_path)
+            except Exception as e:
+                self._safe_error(f"Failed to remove archived log file {log_file_path}: {e}")
+        
+        logger.debug(f"Archived {len(entries)} log entries of {date}")
+        return True
+    
+    def get_log_days(self) -> List[Dict[str, Any]]:
+        """Get the days that have logs.
+        
+        Returns:
+            List of days, oldest first, with their date, first and last event
+            times, number of events, size in bytes and whether they're live
+            and archived
+        """
+        self.flush()
+        with self.lock:
+            return [day.to_dict() for day in self._load_manifest().select()]
+    
+    @staticmethod
+    def _index_path(log_file_path: Path) -> Path:
+        """Get the path of the index of a log file."""
+        return log_file_path.with_suffix(".idx")
+    
+    def _encode_index_frame(self, start: int, end: int, entries: List[IndexEntry]) -> bytes:
+        """Encrypt index entries covering a range of a log file.
+        
+        Args:
+            start: Offset of the first byte of the log range
+            end: Offset just past the log range
+            entries: Index entries of the records in the range
+            
+        Returns:
+            The frame (length + encrypted data) to append to the index file
+        """
+        parts = [self._INDEX_RANGE.pack(start, end)]
+        for timestamp, offset, length, event_type, slot in entries:
+            type_bytes = event_type.encode()[:255]
+            parts.append(self._INDEX_ENTRY.pack(offset, length, timestamp, slot, len(type_bytes)))
+            parts.append(type_bytes)
+        compressed = zlib.compress(b"".join(parts), LogSegment.COMPRESSION_LEVEL)
+        encrypted = self.cipher.encrypt(self.encryption_key, compressed, self._INDEX_AD)
+        return (len(encrypted) | self._INDEX_V2_FLAG).to_bytes(4, byteorder="big") + encrypted
+    
+    def _decode_index_frame(self, encrypted: bytes, version: int) -> Tuple[int, int, List[IndexEntry]]:
+        """Decrypt an index frame.
+        
+        Args:
+            encrypted: The encrypted frame, without its length
+            version: The frame's format, 1 for indexes written before blocks
+                were introduced
+            
+        Returns:
+            Tuple of (start, end, entries)
+        """
+        if version == 2:
+            payload = zlib.decompress(self.cipher.decrypt(self.encryption_key, encrypted, self._INDEX_AD))
+        else:
+            payload = self.cipher.decrypt(self.encryption_key, encrypted, self._INDEX_AD_V1)
+        
+        start, end = self._INDEX_RANGE.unpack_from(payload, 0)
+        position = self._INDEX_RANGE.size
+        entries = []
+        while position < len(payload):
+            if version == 2:
+                offset, length, timestamp, slot, type_length = self._INDEX_ENTRY.unpack_from(payload, position)
+                position += self._INDEX_ENTRY.size
+            else:
+                offset, length, timestamp, type_length = self._INDEX_ENTRY_V1.unpack_from(payload, position)
+                position += self._INDEX_ENTRY_V1.size
+                slot = -1
+            event_type = payload[position:position + type_length].decode()
+            position += type_length
+            entries.append((timestamp, offset, length, event_type, slot))
+        return start, end, entries
+    
+    def _load_index(self, log_file_path: Path) -> _LogFileIndex:
+        """Get the index of a log file, reading or building what's missing.
+        
+        Only index frames appended since the last call are decrypted. Records
+        the index doesn't cover (written by an older version, or before a
+        crash) are decrypted once and added to it.
+        
+        Must be called with self.lock held.
+        
+        Args:
+            log_file_path: The log file
+            
+        Returns:
+            The index
+        """
+        index_path = self._index_path(log_file_path)
+        log_size = log_file_path.stat().st_size if log_file_path.exists() else 0
+        
+        index = self._indexes.get(log_file_path)
+        if index is None or log_size < index.end:
+            segment = LogSegment.open(self.cipher, self.encryption_key, log_file_path)
+            index = self._indexes[log_file_path] = _LogFileIndex(segment)
+        
+        # Read the frames appended since the last call
+        try:
+            with open(index_path, 'rb') as f:
+                f.seek(index.index_size)
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        
+        position = 0
+        while position + 4 <= len(data):
+            length = int.from_bytes(data[position:position + 4], byteorder="big")
+            version = 2 if length & self._INDEX_V2_FLAG else 1
+            length &= ~self._INDEX_V2_FLAG
+            if position + 4 + length > len(data):
+                break
+            try:
+                start, end, entries = self._decode_index_frame(data[position + 4:position + 4 + length], version)
+            except Exception as e:
+                self._safe_error(f"Corrupted index {index_path.name}, rebuilding it: {e}")
+                return self._rebuild_index(log_file_path)
+            if start != index.end or end > log_size:
+                self._safe_error(f"Index {index_path.name} doesn't match its log, rebuilding it")
+                return self._rebuild_index(log_file_path)
+            index.entries.extend(entries)
+            index.end = end
+            position += 4 + length
+            index.index_size += 4 + length
+        
+        if position != len(data):
+            # A torn frame at the end, left by a crash
+            self._safe_error(f"Incomplete frame in index {index_path.name}, rebuilding it")
+            return self._rebuild_index(log_file_path)
+        
+        if index.end < log_size:
+            self._index_tail(log_file_path, index, log_size)
+        
+        return index
+    
+    def _rebuild_index(self, log_file_path: Path) -> _LogFileIndex:
+        """Delete the index of a log file and index the whole file again.
+        
+        Args:
+            log_file_path: The log file
+            
+        Returns:
+            The new index
+        """
+        try:
+            self._index_path(log_file_path).unlink(missing_ok=True)
+        except Exception as e:
+            self._safe_error(f"Failed to remove index of {log_file_path.name}: {e}")
+        self._indexes.pop(log_file_path, None)
+        return self._load_index(log_file_path)
+    
+    def _index_tail(self, log_file_path: Path, index: _LogFileIndex, log_size: int) -> None:
+        """Index the events at the end of a log file that the index doesn't cover.
+        
+        Args:
+            log_file_path: The log file
+            index: The index, covering the file up to index.end
+            log_size: The size of the log file
+        """
+        with open(log_file_path, 'rb') as f:
+            f.seek(index.end)
+            file_data = f.read(log_size - index.end)
+        
+        if index.segment is not None:
+            # Corrupted blocks are skipped up to the next sync marker
+            blocks, position = index.segment.scan(file_data, index.end)
+            entries = [(entry["timestamp"], offset, length, entry["type"], slot)
+                       for offset, length, events in blocks
+                       for slot, entry in enumerate(events)]
+        else:
+            entries, position = self._scan_records(log_file_path, file_data, index.end)
+        
+        if position == 0:
+            return
+        
+        start, end = index.end, index.end + position
+        frame = self._encode_index_frame(start, end, entries)
+        if SecureFile(self._index_path(log_file_path)).append_bytes(frame):
+            index.index_size += len(frame)
+        else:
+            # Keep the entries in memory, the index is rebuilt on the next load
+            self._indexes.pop(log_file_path, None)
+        index.entries.extend(entries)
+        index.end = end
+        logger.debug(f"Indexed {len(entries)} log entries in {log_file_path.name}")
+    
+    def _scan_records(self, log_file_path: Path, file_data: bytes,
+                      base: int) -> Tuple[List[IndexEntry], int]:
+        """Read the records of a log file in the older one record per event format.
+        
+        Args:
+            log_file_path: The log file
+            file_data: The file contents from offset base on
+            base: Offset in the file of the start of file_data
+            
+        Returns:
+            Tuple of (index entries of the readable records, bytes consumed)
+        """
+        ENTRY_SIZE_LIMIT = 100_000  # Reasonable max size for an entry (100KB)
+        
+        entries = []
+        position = 0
+        while position + 4 <= len(file_data):
+            length = int.from_bytes(file_data[position:position + 4], byteorder="big")
+            
+            try:
+                # Sanity check - make sure length is reasonable
+                if length <= 0 or length > ENTRY_SIZE_LIMIT:
+                    raise ValueError(f"invalid entry length {length}")
+                if position + 4 + length > len(file_data):
+                    # Either a torn entry followed by newer ones, or the last
+                    # entry still being written
+                    success, new_position = self._recover_from_corruption(file_data, position)
+                    if not success:
+                        break
+                    position = new_position
+                    continue
                 
+                entry_json = self.cipher.decrypt(self.encryption_key, file_data[position + 4:position + 4 + length])
+                entry = json.loads(entry_json.decode())
+                entries.append((entry["timestamp"], base + position, length, entry["type"], -1))
+                position += 4 + length
             except Exception as e:
-                self._safe_error(f"Failed to log event: {e}")
+                self._safe_error(f"Failed to index log entry in {log_file_path.name} "
+                                 f"at position {base + position}: {e}")
+                
+                # Try to recover from corruption
+                success, new_position = self._recover_from_corruption(file_data, position)
+                if not success:
+                    # Nothing readable follows, leave the rest unindexed
+                    position = len(file_data)
+                    break
+                position = new_position
+        
+        return entries, position
+    
+    def _read_entries(self, log_file_path: Path, segment: Optional[LogSegment],
+                      items: List[IndexEntry]) -> Iterator[Dict[str, Any]]:
+        """Decrypt the events that index entries point to.
+        
+        Each block is decrypted once for consecutive events it holds.
+        
+        Args:
+            log_file_path: The log file
+            segment: The block codec of the file, None for the older format
+            items: Index entries of the events to read
+            
+        Yields:
+            The events, in the order of items; unreadable ones are skipped
+        """
+        block_offset = None
+        block: List[Dict[str, Any]] = []
+        
+        with open(log_file_path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for _, offset, length, _, slot in items:
+                try:
+                    if slot < 0:
+                        entry_json = self.cipher.decrypt(
+                            self.encryption_key, data[offset + 4:offset + 4 + length]
+                        )
+                        entry = json.loads(entry_json.decode())
+                    else:
+                        if offset != block_offset:
+                            start = offset + segment.BLOCK_PREFIX_SIZE
+                            block_offset = None
+                            block = segment.decode_block(data[start:start + length])
+                            block_offset = offset
+                        entry = block[slot]
+                except Exception as e:
+                    self._safe_error(f"Failed to process log entry in {log_file_path.name} "
+                                     f"at position {offset}: {e}")
+                    continue
+                yield entry
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every event logged so far has been written.
+        
+        Args:
+            timeout: Maximum number of seconds to wait, no limit if None
+            
+        Returns:
+            True if the events were written, False if the timeout expired
+        """
+        with self._progress:
+            target = self._queued
+            if self._written >= target:
+                return True
+            self._ensure_writer()
+        
+        # Wake the writer so it doesn't wait out the flush interval
+        try:
+            self._queue.put(self._FLUSH, timeout=timeout)
+        except queue.Full:
+            pass
+        
+        with self._progress:
+            return self._progress.wait_for(lambda: self._written >= target, timeout)
+    
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """Write all queued events and stop the writer thread.
+        
+        Events logged after closing start a new writer thread.
+        
+        Args:
+            timeout: Maximum number of seconds to wait, no limit if None
+            
+        Returns:
+            True if all events were written, False if the timeout expired
+        """
+        with self._progress:
+            writer = self._writer
+            self._writer = None
+        if writer is None or not writer.is_alive():
+            with self.lock:
+                self._save_rollups(force=True)
+            return True
+        
+        self._queue.put(self._STOP)
+        writer.join(timeout)
+        if writer.is_alive():
+            self._safe_error("Timed out waiting for the log writer to finish")
+            return False
+        
+        with self.lock:
+            self._save_rollups(force=True)
+        return True
     
     def _safe_error(self, message: str, exc_info: bool = False) -> None:
         """Safely log an error message, avoiding recursive errors.
@@ -206,152 +1280,102 @@ class SecureLogger:
         # No valid entry found within scan limit
         return False, position
     
-    def get_events(self, start_time: Optional[float] = None, 
-                   end_time: Optional[float] = None,
-                   event_type: Optional[str] = None,
-                   limit: Optional[int] = None) -> List[Dict[str, Any]]:
-        """Get events from the log.
+    def _log_files(self, start_time: Optional[float] = None,
+                   end_time: Optional[float] = None) -> List[Path]:
+        """Get the log files that may hold events in a time range.
         
         Args:
-            start_time: Only include events after this timestamp
-            end_time: Only include events before this timestamp
-            event_type: Only include events of this type
-            limit: Maximum number of events to return
+            start_time: Only include files with events after this timestamp
+            end_time: Only include files with events before this timestamp
             
         Returns:
-            List of log entries
+            The log files and archive bundles, oldest first
         """
-        events = []
-        error_count = 0
-        MAX_ERRORS = 5  # Stop after this many consecutive errors per file
-        ENTRY_SIZE_LIMIT = 100_000  # Reasonable max size for an entry (100KB)
-        
-        # Get all log files that match our date pattern
+        log_files = []
         try:
-            # Filter to only include correctly formatted log files (YYYY-MM-DD.log)
-            log_files = []
-            for file in self.log_path.glob("*.log"):
-                if self.log_filename_pattern.match(file.name):
-                    log_files.append(file)
-            log_files.sort()  # Sort by date
+            with self.lock:
+                days = self._load_manifest().select(start_time, end_time)
         except Exception as e:
-            self._safe_error(f"Error listing log files: {e}")
+            self._safe_error(f"Error reading the log manifest: {e}")
             return []
         
-        # Determine date range if timestamps are provided
-        if start_time is not None:
-            start_date = datetime.datetime.fromtimestamp(start_time).strftime("%Y-%m-%d")
-            log_files = [f for f in log_files if f.name >= f"{start_date}.log"]
+        for day in days:
+            if day.archived:
+                log_files.append(self._bundle_path(day.date))
+            if day.live:
+                log_files.append(self.log_path / f"{day.date}.log")
+        return log_files
+    
+    def iter_events(self, start_time: Optional[float] = None,
+                    end_time: Optional[float] = None,
+                    event_type: Optional[str] = None,
+                    newest_first: bool = False) -> Iterator[Dict[str, Any]]:
+        """Stream events from the log in time order.
+        
+        Matching events are found through the log indexes, and only the
+        blocks holding them are decrypted, as the caller consumes them.
+        
+        Args:
+            start_time: Only include events after this timestamp
+            end_time: Only include events before this timestamp
+            event_type: Only include events of this type
+            newest_first: Yield the newest events first instead of the oldest
+            
+        Yields:
+            Log entries
+        """
+        # Make sure events that are still queued are included
+        self.flush()
         
-        if end_time is not None:
-            end_date = datetime.datetime.fromtimestamp(end_time).strftime("%Y-%m-%d")
-            log_files = [f for f in log_files if f.name <= f"{end_date}.log"]
+        log_files = self._log_files(start_time, end_time)
+        if newest_first:
+            log_files.reverse()
         
-        # Process each log file
         for log_file_path in log_files:
             try:
-                if not log_file_path.exists() or not log_file_path.is_file():
-                    continue
-                
-                # Skip empty files
-                if log_file_path.stat().st_size == 0:
-                    continue
-                
-                # Use SecureFile to read the entire file at once
-                log_file = SecureFile(log_file_path)
-                file_data = log_file.read_bytes()
-                
-                if not file_data:
-                    continue
-                
-                # Reset error count for each file
-                error_count = 0
-                position = 0
-                
-                while position < len(file_data):
-                    # Check if we've reached the limit
-                    if limit is not None and len(events) >= limit:
-                        break
-                    
-                    # Try to read length of encrypted entry
-                    if position + 4 > len(file_data):
-                        break  # End of file
-                    
-                    try:
-                        length = int.from_bytes(file_data[position:position + 4], byteorder="big")
-                        
-                        # Sanity check - make sure length is reasonable
-                        if length <= 0 or length > ENTRY_SIZE_LIMIT:
-                            self._safe_error(f"Invalid entry length in {log_file_path.name}: {length}")
-                            
-                            # Try to recover from corruption
-                            success, new_position = self._recover_from_corruption(file_data, position)
-                            if success:
-                                # Recovery found a valid entry, continue processing
-                                position = new_position
-                                continue
-                            else:
-                                # Could not recover, skip this file
-                                break
-                        
-                        # Ensure we have enough data
-                        if position + 4 + length > len(file_data):
-                            self._safe_error(f"Incomplete entry in {log_file_path.name}")
-                            break
-                        
-                        # Read the encrypted entry
-                        encrypted_entry = file_data[position + 4:position + 4 + length]
-                        
-                        # Reset error count on successful read
-                        error_count = 0
-                        
-                        # Decrypt the entry
-                        entry_json = self.cipher.decrypt(self.encryption_key, encrypted_entry)
-                        entry = json.loads(entry_json.decode())
-                        
-                        # Filter by timestamp and event type
-                        if start_time is not None and entry["timestamp"] < start_time:
-                            position += 4 + length
-                            continue
-                        if end_time is not None and entry["timestamp"] > end_time:
-                            position += 4 + length
-                            continue
-                        if event_type is not None and entry["type"] != event_type:
-                            position += 4 + length
-                            continue
-                        
-                        events.append(entry)
-                        
-                        # Move to next entry
-                        position += 4 + length
-                        
-                    except Exception as e:
-                        error_count += 1
-                        self._safe_error(f"Failed to process log entry in {log_file_path.name} at position {position}: {e}")
-                        
-                        # Try to recover from corruption
-                        success, new_position = self._recover_from_corruption(file_data, position)
-                        if success:
-                            # Recovery worked, reset error count
-                            error_count = 0
-                            position = new_position
-                            continue
-                        else:
-                            # Move ahead a byte and try again
-                            position += 1
-                        
-                        # Stop trying if we hit too many errors in a row
-                        if error_count >= MAX_ERRORS:
-                            self._safe_error(f"Too many consecutive errors ({MAX_ERRORS}) in {log_file_path.name}, stopping log processing")
-                            break
-                            
+                with self.lock:
+                    index = self._load_index(log_file_path)
+                    segment = index.segment
+                    entries = list(index.entries)
             except Exception as e:
                 self._safe_error(f"Error reading log file {log_file_path}: {e}")
+                continue
+            
+            # Filter by timestamp and event type before decrypting anything
+            matches = [
+                item for item in entries
+                if (start_time is None or item[0] >= start_time)
+                and (end_time is None or item[0] <= end_time)
+                and (event_type is None or item[3] == event_type)
+            ]
+            if not matches:
+                continue
+            matches.sort(key=lambda item: item[0], reverse=newest_first)
+            
+            try:
+                yield from self._read_entries(log_file_path, segment, matches)
+            except Exception as e:
+                self._safe_error(f"Error reading log file {log_file_path}: {e}")
+    
+    def get_events(self, start_time: Optional[float] = None, 
+                   end_time: Optional[float] = None,
+                   event_type: Optional[str] = None,
+                   limit: Optional[int] = None,
+                   newest_first: bool = False) -> List[Dict[str, Any]]:
+        """Get events from the log.
         
-        # Sort events by timestamp
-        events.sort(key=lambda e: e["timestamp"])
-        
-        return events
+        Args:
+            start_time: Only include events after this timestamp
+            end_time: Only include events before this timestamp
+            event_type: Only include events of this type
+            limit: Maximum number of events to return
+            newest_first: Return the newest events, newest first, instead of the oldest
+            
+        Returns:
+            List of log entries
+        """
+        events = self.iter_events(start_time, end_time, event_type, newest_first)
+        return list(itertools.islice(events, limit))
     
     def get_event_summary(self, start_time: Optional[float] = None,
                           end_time: Optional[float] = None) -> Dict[str, int]:
@@ -364,87 +1388,47 @@ class SecureLogger:
         Returns:
             Dictionary mapping event types to counts
         """
-        # Get events with a reasonable limit to avoid issues with corrupted files
-        events = self.get_events(start_time, end_time, limit=1000)
-        
-        summary = {}
-        for event in events:
-            event_type = event["type"]
-            if event_type not in summary:
-                summary[event_type] = 0
-            summary[event_type] += 1
-        
-        return summary
+        return dict(self.get_metric_counters(start_time, end_time).events)
     
-    def get_security_metrics(self) -> Dict[str, Any]:
+    def get_security_metrics(self, start_time: Optional[float] = None,
+                             end_time: Optional[float] = None) -> Dict[str, Any]:
         """Get security metrics based on the logs.
         
+        Args:
+            start_time: Only include events after this timestamp
+            end_time: Only include events before this timestamp
+            
         Returns:
             Dictionary of security metrics
         """
-        # Get events with a reasonable limit to avoid issues with corrupted files
-        events = self.get_events(limit=1000)
-        
-        # Calculate metrics
-        metrics = {
-            "total_events": len(events),
-            "key_exchanges": 0,
-            "messages_sent": 0,
-            "messages_received": 0,
-            "files_transferred": 0,
-            "total_bytes_transferred": 0,
-            "algorithms_used": {},
-            "first_event_time": None,
-            "last_event_time": None
-        }
-        
-        for event in events:
-            event_type = event["type"]
-            
-            # Update time range
-            if metrics["first_event_time"] is None or event["timestamp"] < metrics["first_event_time"]:
-                metrics["first_event_time"] = event["timestamp"]
-            if metrics["last_event_time"] is None or event["timestamp"] > metrics["last_event_time"]:
-                metrics["last_event_time"] = event["timestamp"]
-            
-            # Update event counts
-            if event_type == "key_exchange":
-                metrics["key_exchanges"] += 1
-            elif event_type == "message_sent":
-                metrics["messages_sent"] += 1
-                if event.get("is_file", False):
-                    metrics["files_transferred"] += 1
-                metrics["total_bytes_transferred"] += event.get("size", 0)
-            elif event_type == "message_received":
-                metrics["messages_received"] += 1
-                if event.get("is_file", False):
-                    metrics["files_transferred"] += 1
-                metrics["total_bytes_transferred"] += event.get("size", 0)
-            
-            # Track algorithms used
-            for key in ["encryption_algorithm", "signature_algorithm", "algorithm"]:
-                if key in event:
-                    algorithm = event[key]
-                    if algorithm not in metrics["algorithms_used"]:
-                        metrics["algorithms_used"][algorithm] = 0
-                    metrics["algorithms_used"][algorithm] += 1
-        
-        return metrics
+        return self.get_metric_counters(start_time, end_time).to_metrics()
     
     def clear_logs(self) -> None:
         """Clear all logs.
         
         This is a destructive operation and should be used with caution.
         """
+        # Write queued events first so they are cleared too
+        self.flush()
+        
         # Use a lock to ensure thread safety
         with self.lock:
             # Only clear files that match our date pattern
-            for log_file_path in self.log_path.glob("*.log"):
-                if self.log_filename_pattern.match(log_file_path.name):
+            log_files = list(self.log_path.glob("*.log"))
+            log_files.extend((self.log_path / self.ARCHIVE_DIRNAME).glob("*.bundle"))
+            for log_file_path in log_files:
+                if self.log_filename_pattern.match(log_file_path.with_suffix(".log").name):
                     try:
-                        os.remove(log_file_path)
+                        self._remove_log_files(log_file_path)
                         logger.debug(f"Removed log file {log_file_path}")
                     except Exception as e:
                         self._safe_error(f"Failed to remove log file {log_file_path}: {e}")
+            self._indexes.clear()
+            self._rollups.clear()
+            
+            # Keep the retention policy
+            manifest = self._manifest = LogManifest(self._load_manifest().retention)
+            manifest.dirty = True
+            self._save_manifest()
             
             logger.info("Cleared all logs")
\ No newline at end of file
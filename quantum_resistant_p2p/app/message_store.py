@@ -0,0 +1,532 @@
+"""
+Persistent encrypted storage for conversation history.
+"""
+
+import hmac
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import stat
+import threading
+from dataclasses import replace
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from ..crypto.symmetric import AES256GCM
+from .blob_store import BlobStore
+from .messaging import Message
+from .search_index import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+
+class MessageStore:
+    """Encrypted, disk-backed store for messages with unread count tracking.
+
+    Messages are kept in an SQLite database. Every row is encrypted on its own
+    with AES-256-GCM; the row's conversation, message ID and timestamp are bound
+    in as associated data so rows can't be moved between conversations. Peer
+    IDs are only stored as keyed hashes. Rows are indexed by (peer, timestamp),
+    pages are read with a keyset cursor, and unread counts are kept per
+    conversation in the database, so memory use doesn't grow with the history
+    and nothing has to be replayed on startup.
+
+    With a BlobStore, file contents are kept there instead of in the rows and
+    stored messages only carry the blob handle.
+
+    Text messages and file names are indexed for search as they're added (see
+    SearchIndex), so a search only decrypts the messages it returns.
+    """
+
+    SCHEMA_VERSION = 3
+    DB_FILENAME = "messages.db"
+
+    def __init__(self, db_path: Optional[str] = None, encryption_key: Optional[bytes] = None,
+                 blob_store: Optional[BlobStore] = None):
+        """Initialize the message store.
+
+        Args:
+            db_path: Path to the database file. If None, uses
+                     ~/.quantum_resistant_p2p/messages.db. ":memory:" keeps the
+                     store in memory only.
+            encryption_key: Encryption key to use. Must be provided for proper operation.
+            blob_store: Store for file contents (optional). Without one, file
+                        contents are kept in the message rows.
+
+        Raises:
+            ValueError: If no encryption key is provided
+        """
+        if encryption_key is None:
+            raise ValueError("Encryption key must be provided to MessageStore")
+
+        if db_path is None:
+            app_dir = Path.home() / ".quantum_resistant_p2p"
+            app_dir.mkdir(exist_ok=True, parents=True)
+            self.db_path = str(app_dir / self.DB_FILENAME)
+        else:
+            self.db_path = str(db_path)
+
+        # Separate subkeys for row encryption, hashing peer IDs and hashing search terms
+        key_material = HKDF(
+            algorithm=hashes.SHA256(),
+            length=96,
+            salt=None,
+            info=b"message_store",
+        ).derive(encryption_key)
+        self._row_key = key_material[:32]
+        self._index_key = key_material[32:64]
+        self._search_key = key_material[64:]
+
+        self.cipher = AES256GCM()
+        self.blob_store = blob_store
+
+        # Current node ID to identify local messages
+        self.current_node_id = None
+
+        # The connection is shared, so serialize access to it
+        self.lock = threading.RLock()
+
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.search_index = SearchIndex(self._conn, self._search_key)
+        self._init_schema()
+
+        logger.info(f"Message store initialized at {self.db_path}")
+
+    def _init_schema(self) -> None:
+        """Create the tables and indexes if they don't exist yet."""
+        with self.lock:
+            if self.db_path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                try:
+                    if os.name == 'posix':
+                        os.chmod(self.db_path, stat.S_IRUSR | stat.S_IWUSR)  # 0o600 permissions
+                except Exception as e:
+                    logger.warning(f"Failed to set message store permissions: {e}")
+
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS messages ("
+                    " id INTEGER PRIMARY KEY,"
+                    " peer TEXT NOT NULL,"
+                    " message_id TEXT NOT NULL UNIQUE,"
+                    " timestamp REAL NOT NULL,"
+                    " is_read INTEGER NOT NULL,"
+                    " payload BLOB NOT NULL,"
+                    " blob_id TEXT)"
+                )
+                # Version 1 databases predate the blob store
+                columns = [row[1] for row in self._conn.execute("PRAGMA table_info(messages)")]
+                if "blob_id" not in columns:
+                    self._conn.execute("ALTER TABLE messages ADD COLUMN blob_id TEXT")
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_messages_peer_time"
+                    " ON messages (peer, timestamp, id)"
+                )
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS conversations ("
+                    " peer TEXT PRIMARY KEY,"
+                    " unread_count INTEGER NOT NULL DEFAULT 0,"
+                    " last_activity REAL)"
+                )
+                # Version 2 databases predate the search index
+                if self.search_index.create_schema():
+                    self._rebuild_search_index()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)",
+                    (str(self.SCHEMA_VERSION),)
+                )
+
+    def _peer_key(self, peer_id: str) -> str:
+        """Get the keyed hash a peer ID is stored under.
+
+        Args:
+            peer_id: The ID of the peer
+
+        Returns:
+            Hex digest identifying the conversation
+        """
+        return hmac.new(self._index_key, peer_id.encode(), hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def _associated_data(peer: str, message_id: str, timestamp: float) -> bytes:
+        """Build the associated data binding a row's payload to its columns."""
+        return f"{peer}|{message_id}|{timestamp!r}".encode()
+
+    def conversation_peer(self, message: Message) -> Optional[str]:
+        """Determine which conversation a message belongs to.
+
+        Args:
+            message: The message
+
+        Returns:
+            The peer ID of the conversation, or None if the message should not be stored
+        """
+        if message.recipient_id:
+            if message.sender_id == self.current_node_id:
+                # Outgoing message - use recipient_id as the conversation key
+                return message.recipient_id
+            elif message.recipient_id == self.current_node_id:
+                # Incoming direct message - use sender_id as the conversation key
+                return message.sender_id
+
+        # Skip system messages that aren't part of a conversation
+        if message.is_system:
+            return None
+
+        # Fallback to sender_id if direction can't be determined
+        return message.sender_id
+
+    @staticmethod
+    def _searchable_text(message: Message) -> str:
+        """Get the text of a message that should be found by search."""
+        if message.is_file:
+            return message.filename or ""
+        try:
+            return message.content.decode("utf-8")
+        except UnicodeDecodeError:
+            # Binary data has nothing to search
+            return ""
+
+    def _rebuild_search_index(self) -> None:
+        """Index all stored messages, for databases created before search existed."""
+        count = 0
+        for row_id, peer, message_id, timestamp, payload in self._conn.execute(
+            "SELECT id, peer, message_id, timestamp, payload FROM messages"
+        ).fetchall():
+            message = self._decrypt_row(peer, message_id, timestamp, payload)
+            if message is not None:
+                self.search_index.add(row_id, self._searchable_text(message))
+                count += 1
+        if count:
+            logger.info(f"Indexed {count} stored messages for search")
+
+    def add_message(self, message: Message, mark_as_read: bool = False) -> bool:
+        """Add a message to the store.
+
+        With a blob store, the contents of a file message are moved into it and
+        the message is updated in place to hold only the blob handle, so no
+        one keeps the file contents in memory after this returns. A message
+        that already holds a blob handle hands its reference over to the store.
+
+        Args:
+            message: The message to store
+            mark_as_read: Whether to mark the message as read immediately
+
+        Returns:
+            True if the message was stored, False if it was skipped or failed
+        """
+        peer_id = self.conversation_peer(message)
+        if peer_id is None:
+            return False
+
+        peer = self._peer_key(peer_id)
+        timestamp = float(message.timestamp)
+
+        # Move file contents into the blob store and keep only the handle
+        blob_id = message.blob_id
+        file_size = message.file_size
+        if message.is_file and blob_id is None and self.blob_store is not None:
+            blob_id = self.blob_store.put(message.content)
+            if blob_id is None:
+                logger.warning(f"Keeping file of message {message.message_id} inline")
+            else:
+                file_size = len(message.content)
+
+        try:
+            stored = message
+            if blob_id is not None:
+                stored = replace(message, content=b"", blob_id=blob_id, file_size=file_size)
+            plaintext = json.dumps(stored.to_dict()).encode()
+            payload = self.cipher.encrypt(
+                self._row_key, plaintext,
+                self._associated_data(peer, message.message_id, timestamp)
+            )
+
+            with self.lock, self._conn:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO messages (peer, message_id, timestamp, is_read, payload, blob_id)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (peer, message.message_id, timestamp, 1 if mark_as_read else 0, payload, blob_id)
+                )
+                if cursor.rowcount == 0:
+                    logger.debug(f"Message {message.message_id} already stored")
+                    if blob_id is not None and self.blob_store is not None:
+                        self.blob_store.release(blob_id)
+                    return False
+
+                self.search_index.add(cursor.lastrowid, self._searchable_text(message))
+
+                self._conn.execute(
+                    "INSERT INTO conversations (peer, unread_count, last_activity) VALUES (?, ?, ?)"
+                    " ON CONFLICT(peer) DO UPDATE SET"
+                    " unread_count = unread_count + excluded.unread_count,"
+                    " last_activity = MAX(COALESCE(last_activity, 0), excluded.last_activity)",
+                    (peer, 0 if mark_as_read else 1, timestamp)
+                )
+
+            if blob_id is not None:
+                message.content = b""
+                message.blob_id = blob_id
+                message.file_size = file_size
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to store message {message.message_id}: {e}")
+            if blob_id is not None and self.blob_store is not None:
+                self.blob_store.release(blob_id)
+            return False
+
+    def _decrypt_row(self, peer: str, message_id: str, timestamp: float,
+                     payload: bytes) -> Optional[Message]:
+        """Decrypt a stored row back into a Message.
+
+        Returns:
+            The Message, or None if the row could not be decrypted
+        """
+        try:
+            plaintext = self.cipher.decrypt(
+                self._row_key, payload, self._associated_data(peer, message_id, timestamp)
+            )
+            return Message.from_dict(json.loads(plaintext.decode()))
+        except Exception as e:
+            logger.error(f"Failed to decrypt stored message {message_id}: {e}")
+            return None
+
+    def get_message_page(self, peer_id: str, before: Optional[Tuple[float, int]] = None,
+                         limit: int = 100) -> Tuple[List[Message], Optional[Tuple[float, int]]]:
+        """Get a page of messages for a peer, newest page first.
+
+        Args:
+            peer_id: The ID of the peer
+            before: Cursor returned by a previous call to continue with older
+                    messages, or None to start from the newest message
+            limit: Maximum number of messages to return
+
+        Returns:
+            Tuple of (messages in chronological order, cursor for the next older
+            page or None if there are no older messages)
+        """
+        peer = self._peer_key(peer_id)
+
+        with self.lock:
+            if before is None:
+                rows = self._conn.execute(
+                    "SELECT id, message_id, timestamp, payload FROM messages"
+                    " WHERE peer = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+                    (peer, limit + 1)
+                ).fetchall()
+            else:
+                before_timestamp, before_id = before
+                rows = self._conn.execute(
+                    "SELECT id, message_id, timestamp, payload FROM messages"
+                    " WHERE peer = ? AND (timestamp < ? OR (timestamp = ? AND id < ?))"
+                    " ORDER BY timestamp DESC, id DESC LIMIT ?",
+                    (peer, before_timestamp, before_timestamp, before_id, limit + 1)
+                ).fetchall()
+
+        # The extra row only tells us whether there is an older page
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        cursor = (rows[-1][2], rows[-1][0]) if has_more else None
+
+        messages = []
+        for row_id, message_id, timestamp, payload in reversed(rows):
+            message = self._decrypt_row(peer, message_id, timestamp, payload)
+            if message is not None:
+                messages.append(message)
+
+        return messages, cursor
+
+    def get_messages(self, peer_id: str) -> List[Message]:
+        """Get all messages for a peer.
+
+        This loads the whole conversation; prefer get_message_page for display.
+
+        Args:
+            peer_id: The ID of the peer
+
+        Returns:
+            List of Message objects in chronological order
+        """
+        pages = []
+        messages, cursor = self.get_message_page(peer_id)
+        pages.append(messages)
+        while cursor is not None:
+            messages, cursor = self.get_message_page(peer_id, before=cursor)
+            pages.append(messages)
+        return [message for page in reversed(pages) for message in page]
+
+    def search(self, query: str, peer_id: Optional[str] = None, limit: int = 50) -> List[Message]:
+        """Find messages containing all words of a query.
+
+        Matches whole words in text messages and file names, ignoring case.
+        Only the returned messages are decrypted.
+
+        Args:
+            query: The words to search for
+            peer_id: Only search the conversation with this peer (optional)
+            limit: Maximum number of messages to return
+
+        Returns:
+            List of matching messages, newest first
+        """
+        if not self.search_index.available:
+            return []
+
+        expression = self.search_index.match_expression(query)
+        if expression is None:
+            return []
+
+        sql = (f"SELECT m.peer, m.message_id, m.timestamp, m.payload"
+               f" FROM {SearchIndex.TABLE} f JOIN messages m ON m.id = f.rowid"
+               f" WHERE {SearchIndex.TABLE} MATCH ?")
+        params = [expression]
+        if peer_id is not None:
+            sql += " AND m.peer = ?"
+            params.append(self._peer_key(peer_id))
+        sql += " ORDER BY m.timestamp DESC, m.id DESC LIMIT ?"
+        params.append(limit)
+
+        try:
+            with self.lock:
+                rows = self._conn.execute(sql, params).fetchall()
+        except Exception as e:
+            logger.error(f"Search failed: {e}")
+            return []
+
+        messages = []
+        for peer, message_id, timestamp, payload in rows:
+            message = self._decrypt_row(peer, message_id, timestamp, payload)
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def count_messages(self, peer_id: str) -> int:
+        """Get the number of stored messages for a peer.
+
+        Args:
+            peer_id: The ID of the peer
+
+        Returns:
+            The number of messages
+        """
+        with self.lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE peer = ?", (self._peer_key(peer_id),)
+            ).fetchone()
+        return row[0]
+
+    def delete_conversation(self, peer_id: str) -> int:
+        """Delete all messages with a peer, releasing the files they refer to.
+
+        Args:
+            peer_id: The ID of the peer
+
+        Returns:
+            The number of messages deleted
+        """
+        peer = self._peer_key(peer_id)
+        try:
+            with self.lock, self._conn:
+                rows = self._conn.execute(
+                    "SELECT id, blob_id FROM messages WHERE peer = ?", (peer,)
+                ).fetchall()
+                blob_ids = [blob_id for _, blob_id in rows if blob_id is not None]
+                self.search_index.remove([row_id for row_id, _ in rows])
+                cursor = self._conn.execute("DELETE FROM messages WHERE peer = ?", (peer,))
+                self._conn.execute("DELETE FROM conversations WHERE peer = ?", (peer,))
+                deleted = cursor.rowcount
+
+            if self.blob_store is not None:
+                for blob_id in blob_ids:
+                    self.blob_store.release(blob_id)
+            return deleted
+
+        except Exception as e:
+            logger.error(f"Failed to delete conversation with {peer_id}: {e}")
+            return 0
+
+    def mark_all_read(self, peer_id: str) -> None:
+        """Mark all messages from a peer as read.
+
+        Args:
+            peer_id: The ID of the peer
+        """
+        peer = self._peer_key(peer_id)
+        try:
+            with self.lock, self._conn:
+                self._conn.execute(
+                    "UPDATE messages SET is_read = 1 WHERE peer = ? AND is_read = 0", (peer,)
+                )
+                self._conn.execute(
+                    "UPDATE conversations SET unread_count = 0 WHERE peer = ?", (peer,)
+                )
+        except Exception as e:
+            logger.error(f"Failed to mark messages from {peer_id} as read: {e}")
+
+    def get_unread_count(self, peer_id: str) -> int:
+        """Get the number of unread messages from a peer.
+
+        Args:
+            peer_id: The ID of the peer
+
+        Returns:
+            The number of unread messages
+        """
+        with self.lock:
+            row = self._conn.execute(
+                "SELECT unread_count FROM conversations WHERE peer = ?", (self._peer_key(peer_id),)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def has_unread_messages(self, peer_id: str) -> bool:
+        """Check if a peer has any unread messages.
+
+        Args:
+            peer_id: The ID of the peer
+
+        Returns:
+            True if there are unread messages, False otherwise
+        """
+        return self.get_unread_count(peer_id) > 0
+
+    def get_last_activity(self, peer_id: str) -> Optional[float]:
+        """Get the timestamp of the latest message with a peer.
+
+        Args:
+            peer_id: The ID of the peer
+
+        Returns:
+            The timestamp, or None if there are no messages
+        """
+        with self.lock:
+            row = self._conn.execute(
+                "SELECT last_activity FROM conversations WHERE peer = ?", (self._peer_key(peer_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_current_node_id(self, node_id: str) -> None:
+        """Set the current node ID for determining message direction.
+
+        Args:
+            node_id: The ID of the current node
+        """
+        self.current_node_id = node_id
+
+    def close(self) -> None:
+        """Close the database."""
+        with self.lock:
+            try:
+                self._conn.close()
+                logger.info("Message store closed")
+            except Exception as e:
+                logger.error(f"Error closing message store: {e}")
@@ -23,6 +23,7 @@ from ..crypto import (
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from .logging import SecureLogger
+from ..utils.secure_buffer import secret_view
 
 logger = logging.getLogger(__name__)
 
@@ -45,10 +46,24 @@ class Message:
     signature_algo: Optional[str] = None
     # Special field for system messages
     is_system: bool = False
+    # Handle of file contents moved into a BlobStore, content is then empty
+    blob_id: Optional[str] = None
+    file_size: Optional[int] = None
+    
+    @property
+    def size(self) -> int:
+        """Size of the content in bytes, including file contents kept in a BlobStore."""
+        if self.blob_id is not None and self.file_size is not None:
+            return self.file_size
+        return len(self.content)
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert the message to a dictionary."""
         result = asdict(self)
+        # Blob handles only exist on stored copies, keep them out of what's sent
+        if result['blob_id'] is None:
+            del result['blob_id']
+            del result['file_size']
         # Convert bytes to base64
         if isinstance(result['content'], bytes):
             import base64
@@ -127,14 +142,22 @@ class SecureMessaging:
         self.symmetric = symmetric_algorithm or AES256GCM()
         self.signature = signature_algorithm or MLDSASignature()
 
-        # Dictionary mapping peer IDs to shared symmetric keys
-        self.shared_keys: Dict[str, bytes] = {}
+        # Per-peer crypto state lives in each peer's PeerSession; these are
+        # dict-like views of the session fields keyed by peer ID, so the whole
+        # session is released at once when the peer goes away
+        sessions = self.node.peer_registry
+
+        # Shared symmetric keys
+        self.shared_keys = sessions.field_view('shared_key')
+
+        # Original shared secrets (before derivation)
+        self.key_exchange_originals = sessions.field_view('key_exchange_original')
 
-        # Dictionary mapping peer IDs to original shared secrets (before derivation)
-        self.key_exchange_originals: Dict[str, bytes] = {}
+        # Key exchange states
+        self.key_exchange_states = sessions.field_view('key_exchange_state')
 
-        # Dictionary mapping peer IDs to key exchange states
-        self.key_exchange_states: Dict[str, int] = {}
+        # Ephemeral private keys of key exchanges we initiated, cleared once complete
+        self.ephemeral_private_keys = sessions.field_view('ephemeral_private_key')
 
         # Dictionary mapping message IDs to callbacks for received messages
         self.message_callbacks: Dict[str, Callable[[Any], None]] = {}
@@ -145,8 +168,8 @@ class SecureMessaging:
         # List of settings change listeners
         self.settings_change_listeners: List[Callable[[], None]] = []
 
-        # Store peer crypto settings
-        self.peer_crypto_settings: Dict[str, Dict[str, str]] = {}
+        # Peer crypto settings
+        self.peer_crypto_settings = sessions.field_view('crypto_settings')
 
         # Track processed message IDs to prevent duplicates
         self.processed_message_ids = set()
@@ -292,7 +315,9 @@ class SecureMessaging:
         key_data = {
             "peer_id": peer_id,
             "our_node_id": self.node.node_id,  # Store our node ID with the key
-            "shared_key": shared_key,
+            # The session's buffers are wiped when the session ends, so the
+            # stored record gets its own copies
+            "shared_key": bytes(shared_key),
             "algorithm": self.key_exchange.name,
             "symmetric_algorithm": self.symmetric.name,
             "created_at": timestamp
@@ -300,7 +325,7 @@ class SecureMessaging:
     
         # Store the original secret if available
         if original_secret:
-            key_data["original_shared_secret"] = original_secret
+            key_data["original_shared_secret"] = bytes(original_secret)
     
         success = self.key_storage.store_key(key_id, key_data)
         if success:
@@ -374,7 +399,7 @@ class SecureMessaging:
             length=required_key_size,
             salt=None,
             info=info,
-        ).derive(shared_secret)
+        ).derive(secret_view(shared_secret))
 
         logger.debug(f"Derived {required_key_size}-byte key for {self.symmetric.name} from "
                     f"{len(shared_secret)}-byte shared secret")
@@ -590,10 +615,7 @@ class SecureMessaging:
             public_key, private_key = self._generate_ephemeral_keypair()
 
             # Store the private key in memory temporarily (only for this exchange)
-            # We'll use a dictionary to map peer_id to ephemeral private keys
             # This is cleared once the exchange is complete
-            if not hasattr(self, 'ephemeral_private_keys'):
-                self.ephemeral_private_keys = {}
             self.ephemeral_private_keys[peer_id] = private_key
 
             # Get our signature keypair for authentication
@@ -684,7 +706,7 @@ class SecureMessaging:
             logger.error(f"Error initiating key exchange with {peer_id}: {e}")
             self.key_exchange_states[peer_id] = KeyExchangeState.NONE
             # Clean up ephemeral private key
-            if hasattr(self, 'ephemeral_private_keys') and peer_id in self.ephemeral_private_keys:
+            if peer_id in self.ephemeral_private_keys:
                 del self.ephemeral_private_keys[peer_id]
             # Check if we have a shared key despite the error
             if peer_id in self.shared_keys:
@@ -1019,7 +1041,7 @@ class SecureMessaging:
                 return
 
             # Get the ephemeral private key for this exchange
-            if not hasattr(self, 'ephemeral_private_keys') or peer_id not in self.ephemeral_private_keys:
+            if peer_id not in self.ephemeral_private_keys:
                 logger.error(f"No ephemeral private key found for exchange with {peer_id}")
 
                 # Call any registered callbacks with an error
@@ -1137,7 +1159,7 @@ class SecureMessaging:
             logger.error(f"Error handling key exchange response from {peer_id}: {e}")
 
             # Clean up ephemeral private key
-            if hasattr(self, 'ephemeral_private_keys') and peer_id in self.ephemeral_private_keys:
+            if peer_id in self.ephemeral_private_keys:
                 del self.ephemeral_private_keys[peer_id]
 
             # Call any registered callbacks with the error
@@ -1755,8 +1777,8 @@ class SecureMessaging:
             # Clear all shared keys and key exchange states
             # This is important - we need to renegotiate with all peers
             old_peer_ids = list(self.shared_keys.keys())
-            self.shared_keys = {}
-            self.key_exchange_states = {}
+            self.shared_keys.clear()
+            self.key_exchange_states.clear()
             
             # Log the change
             logger.info(f"Changed key exchange algorithm from {old_algorithm} to {self.key_exchange.name}")
@@ -2041,107 +2063,3 @@ class SecureMessaging:
 
         # All checks passed, key exchange is valid
         return True
-
-class MessageStore:
-    """Store for secure messages to provide persistence and unread count tracking."""
-    
-    def __init__(self):
-        """Initialize a new message store."""
-        # Maps peer_id -> list of Message objects
-        self.messages = {}
-        # Maps peer_id -> count of unread messages
-        self.unread_counts = {}
-        # Maps peer_id -> timestamp of last message
-        self.last_activity = {}
-        # Current node ID to identify local messages
-        self.current_node_id = None
-    
-    def add_message(self, message, mark_as_read=False):
-        """Add a message to the store.
-        
-        Args:
-            message: The message to store
-            mark_as_read: Whether to mark the message as read immediately
-        """
-        # Determine the conversation peer_id based on message direction
-        store_peer_id = None
-        
-        if hasattr(message, 'recipient_id') and message.recipient_id:
-            if message.sender_id == self.current_node_id:
-                # Outgoing message - use recipient_id as the conversation key
-                store_peer_id = message.recipient_id
-            elif message.recipient_id == self.current_node_id:
-                # Incoming direct message - use sender_id as the conversation key
-                store_peer_id = message.sender_id
-        
-        if store_peer_id is None:
-            # Fallback to sender_id if direction can't be determined
-            store_peer_id = message.sender_id
-            
-            # Skip system messages that aren't part of a conversation
-            if message.is_system:
-                return
-        
-        # Initialize data structures for this peer if needed
-        if store_peer_id not in self.messages:
-            self.messages[store_peer_id] = []
-            self.unread_counts[store_peer_id] = 0
-        
-        # Add the message
-        self.messages[store_peer_id].append(message)
-        
-        # Update last activity timestamp
-        self.last_activity[store_peer_id] = message.timestamp
-        
-        # Increment unread count if not marked as read
-        if not mark_as_read:
-            self.unread_counts[store_peer_id] = self.unread_counts.get(store_peer_id, 0) + 1
-    
-    def get_messages(self, peer_id):
-        """Get all messages for a peer.
-        
-        Args:
-            peer_id: The ID of the peer
-            
-        Returns:
-            List of Message objects
-        """
-        return self.messages.get(peer_id, [])
-    
-    def mark_all_read(self, peer_id):
-        """Mark all messages from a peer as read.
-        
-        Args:
-            peer_id: The ID of the peer
-        """
-        self.unread_counts[peer_id] = 0
-    
-    def get_unread_count(self, peer_id):
-        """Get the number of unread messages from a peer.
-        
-        Args:
-            peer_id: The ID of the peer
-            
-        Returns:
-            The number of unread messages
-        """
-        return self.unread_counts.get(peer_id, 0)
-    
-    def has_unread_messages(self, peer_id):
-        """Check if a peer has any unread messages.
-        
-        Args:
-            peer_id: The ID of the peer
-            
-        Returns:
-            True if there are unread messages, False otherwise
-        """
-        return self.get_unread_count(peer_id) > 0
-        
-    def set_current_node_id(self, node_id):
-        """Set the current node ID for determining message direction.
-        
-        Args:
-            node_id: The ID of the current node
-        """
-        self.current_node_id = node_id
\ No newline at end of file
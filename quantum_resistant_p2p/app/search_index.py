@@ -0,0 +1,131 @@
+"""
+Blinded full-text search index for the message store.
+"""
+
+import hmac
+import hashlib
+import logging
+import re
+import sqlite3
+import unicodedata
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SearchIndex:
+    """Full-text index over the message store that never stores plaintext words.
+
+    Text is split into words, and each word is replaced by a truncated keyed
+    hash (a blind token) before it goes into an SQLite FTS5 table whose rowids
+    are the message rows. Searching hashes the query words the same way, so
+    FTS5 finds the matching rows through its own index and only those rows
+    have to be decrypted. Without the key, the index shows which messages
+    share words but not what the words are.
+
+    Because words are hashed, only whole words match, ignoring case.
+
+    The index lives in the message store's database and uses its connection,
+    so a message and its index entry are committed together.
+    """
+
+    TABLE = "messages_fts"
+    TOKEN_LENGTH = 16  # Hex characters (64 bits) kept from each keyed hash
+
+    _WORD_RE = re.compile(r"\w+")
+
+    def __init__(self, conn: sqlite3.Connection, index_key: bytes):
+        """Initialize the search index.
+
+        Args:
+            conn: Connection to the message store database
+            index_key: Key for hashing words into blind tokens
+        """
+        self._conn = conn
+        self._key = index_key
+        self.available = True
+
+    def create_schema(self) -> bool:
+        """Create the index table if it doesn't exist yet.
+
+        Returns:
+            True if the table was created now and existing messages need to
+            be indexed, False otherwise
+        """
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.TABLE,)
+        ).fetchone() is not None
+        if exists:
+            return False
+
+        try:
+            self._conn.execute(f"CREATE VIRTUAL TABLE {self.TABLE} USING fts5(terms)")
+            return True
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5, keep the store working without search
+            logger.warning(f"Full-text search unavailable: {e}")
+            self.available = False
+            return False
+
+    @classmethod
+    def words(cls, text: str) -> List[str]:
+        """Split text into normalized words.
+
+        Args:
+            text: The text to split
+
+        Returns:
+            List of lowercase words in the order they appear
+        """
+        return cls._WORD_RE.findall(unicodedata.normalize("NFKC", text).casefold())
+
+    def _token(self, word: str) -> str:
+        """Get the blind token for a normalized word."""
+        digest = hmac.new(self._key, word.encode(), hashlib.sha256).hexdigest()
+        # Tokens must start with a letter so FTS5 doesn't read them as numbers or syntax
+        return "t" + digest[:self.TOKEN_LENGTH]
+
+    def add(self, rowid: int, text: str) -> None:
+        """Index the text of a message.
+
+        Must be called inside the transaction that inserts the message row.
+
+        Args:
+            rowid: The row ID of the message
+            text: The searchable text of the message
+        """
+        if not self.available:
+            return
+        tokens = {self._token(word) for word in self.words(text)}
+        if tokens:
+            self._conn.execute(
+                f"INSERT INTO {self.TABLE} (rowid, terms) VALUES (?, ?)", (rowid, " ".join(tokens))
+            )
+
+    def remove(self, rowids: List[int]) -> None:
+        """Remove messages from the index.
+
+        Args:
+            rowids: The row IDs of the messages
+        """
+        if not self.available:
+            return
+        self._conn.executemany(
+            f"DELETE FROM {self.TABLE} WHERE rowid = ?", [(rowid,) for rowid in rowids]
+        )
+
+    def match_expression(self, query: str) -> Optional[str]:
+        """Build the FTS5 MATCH expression for a search query.
+
+        All words of the query must appear in a message for it to match.
+
+        Args:
+            query: The search query
+
+        Returns:
+            The MATCH expression, or None if the query has no words
+        """
+        tokens = dict.fromkeys(self._token(word) for word in self.words(query))
+        if not tokens:
+            return None
+        return " AND ".join(tokens)
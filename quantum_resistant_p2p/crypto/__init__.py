@@ -12,6 +12,7 @@ from .key_exchange import (
 from .symmetric import SymmetricAlgorithm, AES256GCM, ChaCha20Poly1305
 from .signatures import SignatureAlgorithm, MLDSASignature, SPHINCSSignature
 from .key_storage import KeyStorage
+from .key_history import KeyHistoryRetention, KeyHistoryIndex
 from .algorithm_base import CryptoAlgorithm
 
 # For backward compatibility (will be deprecated in future)
@@ -30,6 +31,6 @@ __all__ = [
     'KyberKeyExchange',  # Backward compatibility
     'SymmetricAlgorithm', 'AES256GCM', 'ChaCha20Poly1305',
     'SignatureAlgorithm', 'MLDSASignature', 'SPHINCSSignature', 'DilithiumSignature',
-    'KeyStorage', 'CryptoAlgorithm',
+    'KeyStorage', 'KeyHistoryRetention', 'KeyHistoryIndex', 'CryptoAlgorithm',
     'LIBOQS_AVAILABLE', 'LIBOQS_VERSION'
 ]
\ No newline at end of file
@@ -175,7 +175,8 @@ class MLKEMKeyExchange(KeyExchangeAlgorithm):
         """
         try:
             # Create a new KEM instance with the private key for decapsulation
-            decap_kem = oqs.KeyEncapsulation(self.variant, private_key)
+            # liboqs copies the key from bytes, so a SecureBuffer is converted here
+            decap_kem = oqs.KeyEncapsulation(self.variant, bytes(private_key))
             shared_secret = decap_kem.decap_secret(ciphertext)
             
             logger.debug(f"ML-KEM decapsulation: shared secret {len(shared_secret)} bytes")
@@ -298,7 +299,8 @@ class HQCKeyExchange(KeyExchangeAlgorithm):
         """
         try:
             # Create a new KEM instance with the private key for decapsulation
-            decap_kem = oqs.KeyEncapsulation(self.variant, private_key)
+            # liboqs copies the key from bytes, so a SecureBuffer is converted here
+            decap_kem = oqs.KeyEncapsulation(self.variant, bytes(private_key))
             shared_secret = decap_kem.decap_secret(ciphertext)
             
             logger.debug(f"HQC decapsulation: shared secret {len(shared_secret)} bytes")
@@ -438,7 +440,8 @@ class FrodoKEMKeyExchange(KeyExchangeAlgorithm):
         """
         try:
             # Create a new KEM instance with the private key for decapsulation
-            decap_kem = oqs.KeyEncapsulation(self.variant, private_key)
+            # liboqs copies the key from bytes, so a SecureBuffer is converted here
+            decap_kem = oqs.KeyEncapsulation(self.variant, bytes(private_key))
             shared_secret = decap_kem.decap_secret(ciphertext)
             
             logger.debug(f"FrodoKEM decapsulation: shared secret {len(shared_secret)} bytes")
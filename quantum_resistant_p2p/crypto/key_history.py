@@ -0,0 +1,201 @@
+"""
+Index and retention policy for the key exchange history.
+"""
+
+import bisect
+import logging
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple, Any
+
+logger = logging.getLogger(__name__)
+
+# Key IDs of history entries are f"{HISTORY_KEY_PREFIX}{peer_id}_{timestamp}"
+HISTORY_KEY_PREFIX = "peer_shared_key_"
+
+
+@dataclass
+class KeyHistoryRetention:
+    """Limits on how much key exchange history is kept.
+
+    A limit of None means no limit. The newest entries are kept.
+    """
+
+    max_per_peer: Optional[int] = None     # Entries kept for each peer
+    max_age_days: Optional[float] = None   # Age after which entries are deleted
+    max_total: Optional[int] = None        # Entries kept across all peers
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the policy to a dictionary for storage.
+
+        Returns:
+            Dictionary representation of the policy
+        """
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'KeyHistoryRetention':
+        """Create a policy from a dictionary.
+
+        Args:
+            data: Dictionary representation of the policy
+
+        Returns:
+            The policy
+        """
+        return cls(
+            max_per_peer=data.get('max_per_peer'),
+            max_age_days=data.get('max_age_days'),
+            max_total=data.get('max_total')
+        )
+
+
+class KeyHistoryIndex:
+    """In-memory index of key history entries by peer and creation time.
+
+    The index only holds key IDs, peer IDs and timestamps, which are all
+    part of the key IDs, so it can be built without decrypting any entry.
+    Entries are kept sorted by creation time, overall and per peer, so pages
+    of history and the entries to prune are found without scanning or
+    sorting every key.
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        self._all: List[Tuple[float, str]] = []
+        self._by_peer: Dict[str, List[Tuple[float, str]]] = {}
+
+    @staticmethod
+    def parse_key_id(key_id: str) -> Optional[Tuple[str, float]]:
+        """Get the peer ID and creation time encoded in a history key ID.
+
+        Args:
+            key_id: The key ID
+
+        Returns:
+            Tuple of (peer_id, created_at), or None if the key ID doesn't encode them
+        """
+        if not key_id.startswith(HISTORY_KEY_PREFIX):
+            return None
+        peer_id, _, timestamp = key_id[len(HISTORY_KEY_PREFIX):].rpartition("_")
+        if not peer_id:
+            return None
+        try:
+            return peer_id, float(timestamp)
+        except ValueError:
+            return None
+
+    def add(self, key_id: str, peer_id: str, created_at: float) -> None:
+        """Add an entry, replacing any entry with the same key ID.
+
+        Args:
+            key_id: The key ID
+            peer_id: The ID of the peer the key was exchanged with
+            created_at: The creation time of the key
+        """
+        self.remove(key_id)
+        self._entries[key_id] = (peer_id, created_at)
+        bisect.insort(self._all, (created_at, key_id))
+        bisect.insort(self._by_peer.setdefault(peer_id, []), (created_at, key_id))
+
+    def remove(self, key_id: str) -> None:
+        """Remove an entry if it's in the index.
+
+        Args:
+            key_id: The key ID
+        """
+        entry = self._entries.pop(key_id, None)
+        if entry is None:
+            return
+        peer_id, created_at = entry
+        self._remove_sorted(self._all, (created_at, key_id))
+        peer_entries = self._by_peer[peer_id]
+        self._remove_sorted(peer_entries, (created_at, key_id))
+        if not peer_entries:
+            del self._by_peer[peer_id]
+
+    @staticmethod
+    def _remove_sorted(entries: List[Tuple[float, str]], item: Tuple[float, str]) -> None:
+        """Remove an item from a sorted list."""
+        position = bisect.bisect_left(entries, item)
+        if position < len(entries) and entries[position] == item:
+            del entries[position]
+
+    def __contains__(self, key_id: object) -> bool:
+        return key_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peers(self) -> List[str]:
+        """Get the peers that have history entries.
+
+        Returns:
+            List of peer IDs, most recently used first
+        """
+        return sorted(self._by_peer, key=lambda peer_id: self._by_peer[peer_id][-1], reverse=True)
+
+    def count(self, peer_id: Optional[str] = None) -> int:
+        """Count history entries.
+
+        Args:
+            peer_id: Only count entries of this peer (optional)
+
+        Returns:
+            The number of entries
+        """
+        if peer_id is None:
+            return len(self._all)
+        return len(self._by_peer.get(peer_id, []))
+
+    def page(self, peer_id: Optional[str] = None, offset: int = 0,
+             limit: Optional[int] = None) -> List[str]:
+        """Get a page of key IDs, newest first.
+
+        Args:
+            peer_id: Only include entries of this peer (optional)
+            offset: Number of newer entries to skip
+            limit: Maximum number of key IDs to return, all if None
+
+        Returns:
+            List of key IDs
+        """
+        entries = self._all if peer_id is None else self._by_peer.get(peer_id, [])
+        end = len(entries) - offset
+        start = 0 if limit is None else max(0, end - limit)
+        return [key_id for _, key_id in reversed(entries[start:max(end, 0)])]
+
+    def expired(self, retention: KeyHistoryRetention, now: Optional[float] = None) -> List[str]:
+        """Find the entries a retention policy doesn't keep.
+
+        Args:
+            retention: The retention policy
+            now: The current time, time.time() if None
+
+        Returns:
+            List of key IDs to delete, oldest first
+        """
+        expired = set()
+
+        if retention.max_age_days is not None:
+            cutoff = (time.time() if now is None else now) - retention.max_age_days * 86400
+            position = bisect.bisect_left(self._all, (cutoff, ""))
+            expired.update(key_id for _, key_id in self._all[:position])
+
+        if retention.max_per_peer is not None:
+            keep = max(retention.max_per_peer, 0)
+            for peer_entries in self._by_peer.values():
+                if len(peer_entries) > keep:
+                    expired.update(key_id for _, key_id in peer_entries[:len(peer_entries) - keep])
+
+        if retention.max_total is not None:
+            excess = len(self._all) - len(expired) - max(retention.max_total, 0)
+            for _, key_id in self._all:
+                if excess <= 0:
+                    break
+                if key_id not in expired:
+                    expired.add(key_id)
+                    excess -= 1
+
+        return [key_id for _, key_id in self._all if key_id in expired]
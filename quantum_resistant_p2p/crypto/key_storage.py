@@ -5,33 +5,225 @@ Secure storage for cryptographic keys with full metadata encryption.
 import os
 import logging
 import base64
-import hmac
-import hashlib
 import json
+import re
 import time
-from typing import Dict, Any, Optional, Tuple, List
+import threading
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Tuple, List, Callable, Iterator, Iterable, Mapping
 from pathlib import Path
 
 # Use cryptography library for security primitives
 from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives import hashes, hmac as crypto_hmac
 
 # Import our secure file utilities
 from ..utils.secure_file import SecureFile
+from ..utils.journal import Journal
+from ..utils.secure_buffer import SecureBuffer, secret_view
+from .key_history import KeyHistoryIndex, KeyHistoryRetention, HISTORY_KEY_PREFIX
 
 logger = logging.getLogger(__name__)
 
 
+# Key records are handed out as read-only views of the cached data
+KeyRecord = Mapping[str, Any]
+
+
+class _KeyEntry:
+    """A key entry as stored in the snapshot and, once accessed, decrypted."""
+    
+    __slots__ = ('stored', 'data')
+    
+    def __init__(self, stored: Optional[Dict[str, str]] = None, data: Optional[KeyRecord] = None):
+        self.stored = stored  # Encrypted entry from the snapshot, None once changed
+        self.data = data      # Decrypted key record, None until first accessed
+
+
+class _KeyEntries(MutableMapping):
+    """Key entries of an unlocked storage, mapping key IDs to key data.
+    
+    Entries loaded from the snapshot stay encrypted until they're first
+    accessed, so unlocking doesn't depend on the number of stored keys and
+    keys that are never used are never decrypted. An entry keeps its stored
+    ciphertext until it's changed, so the next snapshot can copy it without
+    encrypting it again.
+    
+    Records are kept decoded, with binary values as bytes, and wrapped in
+    read-only views so they can be returned without copying.
+    """
+    
+    # Decrypt in a thread pool when at least this many entries are needed at once
+    PARALLEL_THRESHOLD = 256
+    PARALLEL_BATCH_SIZE = 64
+    
+    def __init__(self, decrypt: Optional[Callable[[Dict[str, str]], Optional[Dict[str, Any]]]] = None):
+        """Initialize an empty set of entries.
+        
+        Args:
+            decrypt: Decrypts a stored entry, returning None if it can't be decrypted
+        """
+        self._decrypt = decrypt
+        self._entries: Dict[str, _KeyEntry] = {}
+    
+    def add_stored(self, key_id: str, stored: Dict[str, str]) -> None:
+        """Add an encrypted entry from the snapshot.
+        
+        Args:
+            key_id: The key ID
+            stored: The encrypted entry
+        """
+        self._entries[key_id] = _KeyEntry(stored=stored)
+    
+    def stored_entry(self, key_id: str) -> Optional[Dict[str, str]]:
+        """Get the unchanged encrypted entry of a key, if there is one."""
+        entry = self._entries.get(key_id)
+        return entry.stored if entry is not None else None
+    
+    def get_entry(self, key_id: str) -> Optional[_KeyEntry]:
+        """Get the entry of a key, None if there is none."""
+        return self._entries.get(key_id)
+    
+    def set_entry(self, key_id: str, entry: Optional[_KeyEntry]) -> None:
+        """Put back an entry returned by get_entry, removing the key if it's None."""
+        if entry is None:
+            self._entries.pop(key_id, None)
+        else:
+            self._entries[key_id] = entry
+    
+    def copy(self) -> '_KeyEntries':
+        """Get the entries as they are now.
+        
+        Entries are replaced rather than changed, so the copy doesn't follow
+        later changes and costs one dictionary copy.
+        """
+        entries = _KeyEntries(self._decrypt)
+        entries._entries = dict(self._entries)
+        return entries
+    
+    @property
+    def decrypted_count(self) -> int:
+        """Number of entries currently held decrypted."""
+        return sum(1 for entry in self._entries.values() if entry.data is not None)
+    
+    def __getitem__(self, key_id: str) -> KeyRecord:
+        entry = self._entries[key_id]
+        if entry.data is None:
+            data = self._decrypt(entry.stored)
+            if data is None:
+                # Undecryptable entries are dropped, as they were when loaded eagerly
+                self._entries.pop(key_id, None)
+                raise KeyError(key_id)
+            entry.data = MappingProxyType(data)
+        return entry.data
+    
+    def __setitem__(self, key_id: str, data: Dict[str, Any]) -> None:
+        self._entries[key_id] = _KeyEntry(data=MappingProxyType(dict(data)))
+    
+    def __delitem__(self, key_id: str) -> None:
+        del self._entries[key_id]
+    
+    def __contains__(self, key_id: object) -> bool:
+        return key_id in self._entries
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def decrypt_all(self, key_ids: Optional[Iterable[str]] = None) -> None:
+        """Decrypt every entry that hasn't been accessed yet.
+        
+        Large batches are spread over a thread pool.
+        
+        Args:
+            key_ids: Only decrypt these entries (optional)
+        """
+        if key_ids is None:
+            candidates = self._entries.items()
+        else:
+            candidates = [(key_id, self._entries[key_id]) for key_id in key_ids if key_id in self._entries]
+        pending = [(key_id, entry) for key_id, entry in candidates if entry.data is None]
+        if not pending:
+            return
+        
+        def decrypt_batch(batch):
+            return [self._decrypt(entry.stored) for _, entry in batch]
+        
+        workers = min(8, os.cpu_count() or 1)
+        if workers > 1 and len(pending) >= self.PARALLEL_THRESHOLD:
+            batches = [pending[i:i + self.PARALLEL_BATCH_SIZE]
+                       for i in range(0, len(pending), self.PARALLEL_BATCH_SIZE)]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = [data for batch in executor.map(decrypt_batch, batches) for data in batch]
+        else:
+            results = decrypt_batch(pending)
+        
+        for (key_id, entry), data in zip(pending, results):
+            if data is None:
+                self._entries.pop(key_id, None)
+            else:
+                entry.data = MappingProxyType(data)
+
+
 class KeyStorage:
     """Secure storage for cryptographic keys with full metadata encryption.
     
     This class provides complete encryption of all data and metadata, with no
     information leakage in the stored file. It uses Argon2id for key derivation
     and AES-GCM for encryption.
+    
+    Keys are encrypted under a random master key. The master key itself is
+    stored in a small header file, encrypted under a key derived from the
+    password, so changing the password only re-encrypts those 32 bytes and
+    keys derived from the master key stay the same.
+    
+    The storage file is a snapshot of all keys. Changes made after it was
+    written are appended to an encrypted journal next to it, so storing or
+    deleting a key costs one small record instead of rewriting every key.
+    Once the journal grows larger than the snapshot, it's folded into a new
+    snapshot in a background thread.
+    
+    Unlocking only decrypts an index of the key IDs in the snapshot; each
+    key is decrypted the first time it's used.
+    
+    The Argon2id cost is calibrated to take about KDF_TARGET_SECONDS on the
+    machine that sets the password, and recorded in the header.
     """
     
     # Storage format version (for future extensions)
-    FORMAT_VERSION = 1
+    # 1: keys encrypted directly under the password key
+    # 2: keys encrypted under a random master key wrapped by the password key
+    # 3: the header records the calibrated Argon2id parameters
+    FORMAT_VERSION = 3
+    
+    # Argon2id parameters used before calibration, and the least calibration picks
+    KDF_BASELINE_PARAMS = {
+        'iterations': 3,         # Iterations (time cost)
+        'lanes': 4,              # Parallelism parameter
+        'memory_cost': 102400,   # Memory cost in KiB (100 MiB)
+    }
+    KDF_MAX_MEMORY_COST = 512 * 1024  # KiB (512 MiB)
+    KDF_TARGET_SECONDS = 1.0
+    
+    # Calibrated parameters, measured once per process
+    _calibrated_kdf_params: Optional[Dict[str, int]] = None
+    
+    # Key history kept unless the user sets a different retention policy
+    DEFAULT_HISTORY_RETENTION = KeyHistoryRetention(max_per_peer=100, max_total=10000)
+    HISTORY_RETENTION_KEY_ID = "system_key_history_retention"
+    
+    # Compact the journal once it's larger than the snapshot and at least this big
+    JOURNAL_COMPACT_MIN_BYTES = 256 * 1024
+    
+    # Fields always treated as binary in entries that don't record their binary fields
+    _LEGACY_BINARY_FIELDS = frozenset(['key', 'public_key', 'private_key', 'shared_key',
+                                       'ciphertext', 'signature', 'original_shared_secret'])
+    _BASE64_RE = re.compile(r'[A-Za-z0-9+/=]+')
     
     def __init__(self, storage_path: Optional[str] = None):
         """Initialize a new key storage instance.
@@ -51,45 +243,153 @@ class KeyStorage:
             # Make sure parent directory exists
             self.storage_path.parent.mkdir(exist_ok=True, parents=True)
         
-        # In-memory key storage
-        self.keys: Dict[str, Dict[str, Any]] = {}
+        # In-memory key storage, decrypted on first access
+        self.keys = _KeyEntries(self._decrypt_entry)
+        
+        # Index of the key history by peer and time, built on first use
+        self._history: Optional[KeyHistoryIndex] = None
         
         # Cryptographic keys - all None until unlocked
-        self.master_key: Optional[bytes] = None
+        self.master_key: Optional[SecureBuffer] = None
         self.salt: Optional[bytes] = None
-        self.hmac_key: Optional[bytes] = None
+        self.hmac_key: Optional[SecureBuffer] = None
         
-        # Create the secure file handler
+        # Create the secure file handlers for the keys and for the header
+        # holding the wrapped master key
         self.secure_file = SecureFile(self.storage_path)
+        self.header_path = self.storage_path.with_suffix(self.storage_path.suffix + '.header')
+        self.header_file = SecureFile(self.header_path)
+        
+        # Journal of changes since the snapshot, opened on unlock
+        self.journal: Optional[Journal] = None
+        self.journal_id: Optional[bytes] = None
+        self._journal_sequence = 0
+        # Earlier journals the snapshot on disk still needs, after a compaction
+        # continued the journal in a new one
+        self._chained_journals: List[Journal] = []
+        self._snapshot_size = 0
+        self._compaction_thread: Optional[threading.Thread] = None
+        
+        # Guards the keys and the journal against the compaction thread
+        self._lock = threading.RLock()
+        # Held while writing a snapshot, taken before self._lock
+        self._snapshot_lock = threading.Lock()
         
         logger.info(f"Key storage initialized at {self.storage_path}")
     
-    def _derive_key(self, password: str, salt: Optional[bytes] = None) -> Tuple[bytes, bytes]:
+    def _derive_key(self, password: str, salt: Optional[bytes] = None,
+                    params: Optional[Dict[str, int]] = None) -> Tuple[bytes, bytes]:
         """Derive a key from a password using Argon2id.
         
         Args:
             password: The user's password
             salt: Optional salt, generated randomly if None
+            params: Argon2id parameters, KDF_BASELINE_PARAMS if None
             
         Returns:
             Tuple of (derived_key, salt)
         """
         if salt is None:
             salt = os.urandom(16)
+        if params is None:
+            params = self.KDF_BASELINE_PARAMS
         
-        # Use Argon2id with OWASP-recommended parameters
         kdf = Argon2id(
             salt=salt,               # Salt value
             length=32,               # Output key length (256 bits)
-            iterations=3,            # Iterations (time cost)
-            lanes=4,                 # Parallelism parameter 
-            memory_cost=102400,      # Memory cost (100 MiB)
+            iterations=params['iterations'],
+            lanes=params['lanes'],
+            memory_cost=params['memory_cost'],
         )
         
         derived_key = kdf.derive(password.encode())
         
         return derived_key, salt
     
+    @classmethod
+    def calibrate_kdf(cls, target_seconds: Optional[float] = None) -> Dict[str, int]:
+        """Find Argon2id parameters that take about the target time on this machine.
+        
+        Starting from KDF_BASELINE_PARAMS, memory is raised first (up to
+        KDF_MAX_MEMORY_COST) and then iterations. The parameters are never
+        weaker than the baseline, so slow machines just take longer.
+        
+        Args:
+            target_seconds: The derivation time to aim for, KDF_TARGET_SECONDS if None
+            
+        Returns:
+            The Argon2id parameters
+        """
+        if target_seconds is None:
+            if cls._calibrated_kdf_params is not None:
+                return dict(cls._calibrated_kdf_params)
+            target = cls.KDF_TARGET_SECONDS
+        else:
+            target = target_seconds
+        
+        params = dict(cls.KDF_BASELINE_PARAMS)
+        
+        start = time.perf_counter()
+        Argon2id(salt=os.urandom(16), length=32, **params).derive(b"calibration")
+        elapsed = time.perf_counter() - start
+        
+        # Argon2 time grows about linearly with memory and with iterations
+        scale = target / max(elapsed, 1e-3)
+        if scale > 1:
+            memory_cost = min(cls.KDF_MAX_MEMORY_COST, int(params['memory_cost'] * scale))
+            memory_cost -= memory_cost % 1024  # Whole MiB
+            memory_cost = max(memory_cost, params['memory_cost'])
+            scale *= params['memory_cost'] / memory_cost
+            params['memory_cost'] = memory_cost
+            params['iterations'] = max(params['iterations'], int(params['iterations'] * scale))
+        
+        logger.info(f"Calibrated Argon2id to {params['iterations']} iterations and "
+                    f"{params['memory_cost'] // 1024} MiB (baseline took {elapsed:.2f} s)")
+        
+        if target_seconds is None:
+            cls._calibrated_kdf_params = dict(params)
+        return params
+    
+    @classmethod
+    def _kdf_params(cls, header: Dict[str, Any]) -> Dict[str, int]:
+        """Get the Argon2id parameters of a storage header.
+        
+        Headers written before calibration use the baseline parameters.
+        """
+        params = header.get('kdf_params')
+        if params is None:
+            return dict(cls.KDF_BASELINE_PARAMS)
+        return {name: int(params[name]) for name in ('iterations', 'lanes', 'memory_cost')}
+    
+    @staticmethod
+    def _hmac_sha256(key: SecureBuffer, message: bytes) -> bytes:
+        """Compute HMAC-SHA256 with a key kept in a secure buffer.
+        
+        The standard library's hmac only takes bytes keys, which would mean
+        copying the key out of its buffer.
+        """
+        mac = crypto_hmac.HMAC(key.view(), hashes.SHA256())
+        mac.update(message)
+        return mac.finalize()
+    
+    def _set_master_key(self, master_key) -> None:
+        """Replace the master key, wiping the previous one.
+        
+        Args:
+            master_key: The new master key as bytes or a SecureBuffer, or None to lock
+        """
+        for old_key in (self.master_key, self.hmac_key):
+            if old_key is not None and old_key is not master_key:
+                old_key.wipe()
+        self.master_key = None
+        self.hmac_key = None
+        
+        if master_key is not None:
+            if not isinstance(master_key, SecureBuffer):
+                master_key = SecureBuffer(master_key)
+            self.master_key = master_key
+            self._derive_encryption_keys()
+    
     def _derive_encryption_keys(self) -> None:
         """Derive all encryption keys from the master key.
         
@@ -100,11 +400,7 @@ class KeyStorage:
             raise ValueError("Cannot derive keys, storage not unlocked")
         
         # HMAC key for entry IDs
-        self.hmac_key = hmac.new(
-            key=self.master_key,
-            msg=b"key_storage_hmac_key_v1",
-            digestmod=hashlib.sha256
-        ).digest()
+        self.hmac_key = SecureBuffer(self._hmac_sha256(self.master_key, b"key_storage_hmac_key_v1"))
     
     def _compute_entry_id(self, key_id: str) -> str:
         """Compute a deterministic but opaque entry ID for a key.
@@ -120,111 +416,234 @@ class KeyStorage:
         
         # Create a keyed hash of the key ID using HMAC
         # This ensures the mapping is deterministic but only known to those with the key
-        digest = hmac.new(
-            key=self.hmac_key,
-            msg=key_id.encode(),
-            digestmod=hashlib.sha256
-        ).hexdigest()
+        return self._hmac_sha256(self.hmac_key, key_id.encode()).hex()
+    
+    def _wrap_master_key(self, password: str, params: Dict[str, int]) -> Dict[str, Any]:
+        """Encrypt the master key under a key derived from a password.
         
-        return digest
+        Args:
+            password: The password to protect the master key with
+            params: The Argon2id parameters
+            
+        Returns:
+            The storage header holding the salt and the wrapped master key
+        """
+        password_key, salt = self._derive_key(password, params=params)
+        nonce = os.urandom(12)
+        wrapped_key = AESGCM(password_key).encrypt(nonce, self.master_key.view(), b"key_storage_master_key")
+        
+        return {
+            'format_version': self.FORMAT_VERSION,
+            'kdf': 'argon2id',
+            'kdf_params': params,
+            'salt': base64.b64encode(salt).decode(),
+            'wrapped_key': {
+                'nonce': base64.b64encode(nonce).decode(),
+                'ciphertext': base64.b64encode(wrapped_key).decode()
+            },
+            'created_at': time.time()
+        }
+    
+    def _unwrap_master_key(self, password: str, header: Dict[str, Any]) -> Optional[SecureBuffer]:
+        """Decrypt the master key from the storage header.
+        
+        Args:
+            password: The user's password
+            header: The storage header
+            
+        Returns:
+            The master key, or None if the password is wrong or the header is invalid
+        """
+        try:
+            salt = base64.b64decode(header['salt'])
+            nonce = base64.b64decode(header['wrapped_key']['nonce'])
+            ciphertext = base64.b64decode(header['wrapped_key']['ciphertext'])
+        except Exception as e:
+            logger.error(f"Invalid key storage header: {e}")
+            return None
+        
+        password_key, _ = self._derive_key(password, salt, self._kdf_params(header))
+        try:
+            return SecureBuffer(AESGCM(password_key).decrypt(nonce, ciphertext, b"key_storage_master_key"))
+        except Exception as e:
+            logger.error(f"Failed to unwrap master key, wrong password? {e}")
+            return None
     
-    def _secure_zero(self, data: bytes) -> None:
-        """Securely overwrite data in memory.
+    def _write_header(self, password: str,
+                      progress: Optional[Callable[[str], None]] = None) -> bool:
+        """Wrap the master key under a password and write the storage header.
+        
+        The Argon2id parameters are calibrated for this machine.
         
         Args:
-            data: The data to overwrite
+            password: The password to protect the master key with
+            progress: Called with a description of each step (optional)
+            
+        Returns:
+            True if the header was written, False otherwise
         """
-        if isinstance(data, bytes) and hasattr(data, '__len__'):
-            # Create a writable view of the bytes
-            view = memoryview(data).cast('B')
-            # Overwrite with zeroes
-            for i in range(len(view)):
-                view[i] = 0
+        if progress:
+            progress("Calibrating password hashing...")
+        params = self.calibrate_kdf()
+        
+        if progress:
+            progress("Protecting the master key...")
+        header = self._wrap_master_key(password, params)
+        self.salt = base64.b64decode(header['salt'])
+        if not self.header_file.write_json(header):
+            logger.error("Failed to write key storage header")
+            return False
+        return True
     
-    def unlock(self, password: str) -> bool:
+    def _verify_check_value(self, key: bytes, data: Dict[str, Any]) -> bool:
+        """Check that a snapshot was written with the given key.
+        
+        Args:
+            key: The key to check
+            data: The snapshot data
+            
+        Returns:
+            True if the snapshot's check value decrypts under the key
+        """
+        if 'test_nonce' not in data or 'test_ciphertext' not in data:
+            logger.error("Invalid key storage file, missing verification data")
+            return False
+        
+        try:
+            nonce = base64.b64decode(data['test_nonce'])
+            ciphertext = base64.b64decode(data['test_ciphertext'])
+            
+            plaintext = AESGCM(secret_view(key)).decrypt(nonce, ciphertext, None)
+            
+            if plaintext.decode() != "test_value":
+                logger.error("Password verification failed")
+                return False
+            return True
+        except Exception as e:
+            logger.error(f"Failed to decrypt test value, wrong password? {e}")
+            return False
+    
+    def _reset_keys(self) -> None:
+        """Drop the keys held in memory and the key history index."""
+        self.keys = _KeyEntries(self._decrypt_entry)
+        self._history = None
+    
+    def _load_snapshot(self, data: Dict[str, Any]) -> None:
+        """Decrypt the keys of a snapshot and apply its journal.
+        
+        The master key must be set.
+        
+        Args:
+            data: The snapshot data
+        """
+        self._reset_keys()
+        if 'keys' not in data:
+            logger.warning("No keys found in storage")
+        
+        stored_entries = data.get('keys', {})
+        index = self._decrypt_index(data['index']) if 'index' in data else None
+        
+        if index is not None:
+            # Keep the entries encrypted until they're used
+            for entry_id, key_id in index.items():
+                if entry_id in stored_entries:
+                    self.keys.add_stored(key_id, stored_entries[entry_id])
+        else:
+            # Snapshots without an index only name keys inside the entries
+            for entry_id, stored in stored_entries.items():
+                key_data = self._decrypt_entry(stored, with_key_id=True)
+                if key_data is None:
+                    continue
+                if '__key_id' not in key_data:
+                    logger.error(f"Missing key_id in entry {entry_id}, skipping")
+                    continue
+                    
+                key_id = key_data.pop('__key_id')  # Remove the special marker
+                self.keys[key_id] = key_data
+        
+        if 'journal_id' in data:
+            # Apply the changes made since the snapshot was written
+            self._snapshot_size = self.storage_path.stat().st_size
+            self._open_journal(base64.b64decode(data['journal_id']), remove_stale=False)
+            self._replay_journal()
+            self._remove_stale_journals()
+    
+    def unlock(self, password: str, progress: Optional[Callable[[str], None]] = None) -> bool:
         """Unlock the key storage with the given password.
         
+        The password only unlocks the random master key kept in the storage
+        header; the keys themselves are encrypted under the master key.
+        
+        Unlocking takes about KDF_TARGET_SECONDS, or a few times that when the
+        storage is created, so UIs should call it from a worker thread.
+        
         Args:
             password: The user's password
+            progress: Called with a description of each step (optional)
             
         Returns:
             True if unlock successful, False otherwise
         """
         try:
-            # Read the storage file using SecureFile
+            # Read the header and the storage file using SecureFile
+            header = self.header_file.read_json()
             data = self.secure_file.read_json()
             
-            if data is None:
-                # First time use, create a new storage file
-                self.salt = os.urandom(16)
-                self.master_key, _ = self._derive_key(password, self.salt)
-                self._derive_encryption_keys()
+            if header is None and data is None:
+                # First time use, create a new master key and storage file
+                self._set_master_key(os.urandom(32))
+                self._reset_keys()
+                if not self._write_header(password, progress):
+                    return False
                 return self._save_storage()
             
-            # Check format version
-            format_version = data.get('format_version', 0)
-            if format_version != self.FORMAT_VERSION:
+            # Check format version, versions 2 and 3 only differ in the header
+            format_version = data.get('format_version', 0) if data is not None else self.FORMAT_VERSION
+            if format_version == 1:
+                # Keys are encrypted directly under the password key
+                return self._migrate_storage_v1(password, data, header, progress)
+            if format_version not in (2, self.FORMAT_VERSION):
                 logger.error(f"Unsupported storage format version: {format_version}")
                 return False
             
-            if 'salt' not in data:
-                logger.error("Invalid key storage file, missing salt")
+            if header is None:
+                logger.error("Invalid key storage, missing header")
                 return False
             
-            # Derive the master key from the password
-            salt = base64.b64decode(data['salt'])
-            derived_key, _ = self._derive_key(password, salt)
+            # Unwrapping the master key verifies the password
+            if progress:
+                progress("Checking password...")
+            master_key = self._unwrap_master_key(password, header)
+            if master_key is None:
+                return False
             
-            # Verify the password using the test value
-            if 'test_nonce' in data and 'test_ciphertext' in data:
-                try:
-                    nonce = base64.b64decode(data['test_nonce'])
-                    ciphertext = base64.b64decode(data['test_ciphertext'])
-                    
-                    aesgcm = AESGCM(derived_key)
-                    plaintext = aesgcm.decrypt(nonce, ciphertext, None)
-                    
-                    if plaintext.decode() != "test_value":
-                        logger.error("Password verification failed")
-                        return False
-                except Exception as e:
-                    logger.error(f"Failed to decrypt test value, wrong password? {e}")
-                    return False
-            else:
-                logger.error("Invalid key storage file, missing verification data")
+            if data is not None and not self._verify_check_value(master_key, data):
+                logger.error("Key storage file doesn't belong to the header")
+                master_key.wipe()
                 return False
             
             # Password verified, set the keys
-            self.master_key = derived_key
-            self.salt = salt
-            self._derive_encryption_keys()
+            self._set_master_key(master_key)
+            self.salt = base64.b64decode(header['salt'])
             
-            # Load the encrypted keys
-            if 'keys' not in data:
-                logger.warning("No keys found in storage")
-                return True
-                
-            aesgcm = AESGCM(self.master_key)
+            if 'kdf_params' not in header:
+                # Written with the baseline parameters, rewrap with calibrated ones
+                if not self._write_header(password, progress):
+                    return False
             
-            for entry_id, encrypted_key_data in data['keys'].items():
-                try:
-                    # Decrypt the key data
-                    nonce = base64.b64decode(encrypted_key_data['nonce'])
-                    ciphertext = base64.b64decode(encrypted_key_data['ciphertext'])
-                    
-                    key_data_json = aesgcm.decrypt(nonce, ciphertext, None)
-                    key_data = json.loads(key_data_json.decode())
-                    
-                    # Extract the original key_id from the decrypted data
-                    if '__key_id' not in key_data:
-                        logger.error(f"Missing key_id in entry {entry_id}, skipping")
-                        continue
-                        
-                    key_id = key_data.pop('__key_id')  # Remove the special marker
-                    self.keys[key_id] = key_data
-                        
-                except Exception as e:
-                    logger.error(f"Failed to decrypt key {entry_id}: {e}")
+            if data is None:
+                # Interrupted while creating the storage, the header has no keys yet
+                self._reset_keys()
+                return self._save_storage()
+            
+            if progress:
+                progress("Loading keys...")
+            self._load_snapshot(data)
+            
+            if 'journal_id' not in data:
+                # Written before the journal existed, start one with a fresh snapshot
+                if not self._save_storage():
+                    return False
             
             logger.info(f"Unlocked key storage with {len(self.keys)} keys")
             return True
@@ -233,9 +652,60 @@ class KeyStorage:
             logger.error(f"Failed to unlock key storage: {e}")
             return False
     
+    def _migrate_storage_v1(self, password: str, data: Dict[str, Any],
+                            header: Optional[Dict[str, Any]],
+                            progress: Optional[Callable[[str], None]] = None) -> bool:
+        """Unlock a version 1 storage and move it to a wrapped master key.
+        
+        Version 1 encrypted every key directly under the password key. The
+        keys are re-encrypted once under a new random master key.
+        
+        Args:
+            password: The user's password
+            data: The version 1 snapshot data
+            header: The storage header, if an earlier migration got as far as writing it
+            progress: Called with a description of each step (optional)
+            
+        Returns:
+            True if unlock and migration successful, False otherwise
+        """
+        if 'salt' not in data:
+            logger.error("Invalid key storage file, missing salt")
+            return False
+        
+        # Derive the old key from the password
+        if progress:
+            progress("Checking password...")
+        legacy_key, _ = self._derive_key(password, base64.b64decode(data['salt']))
+        if not self._verify_check_value(legacy_key, data):
+            return False
+        
+        # Load the keys and journal written under the old key
+        if progress:
+            progress("Migrating keys...")
+        self._set_master_key(legacy_key)
+        self._load_snapshot(data)
+        
+        # Reuse the master key of an interrupted migration, nothing uses it yet otherwise
+        master_key = self._unwrap_master_key(password, header) if header is not None else None
+        if master_key is None:
+            master_key = os.urandom(32)
+        
+        self._set_master_key(master_key)
+        if not self._write_header(password, progress):
+            return False
+        if not self._save_storage():
+            return False
+        
+        logger.info(f"Migrated key storage with {len(self.keys)} keys to a wrapped master key")
+        return True
+    
     def derive_purpose_key(self, purpose: str) -> bytes:
         """Derive a special-purpose key from the master key.
         
+        The master key doesn't change with the password, so neither do the
+        derived keys.
+        
         Args:
             purpose: A string identifier for the key's purpose
             
@@ -247,11 +717,7 @@ class KeyStorage:
             return None
         
         # Derive a purpose-specific key using HMAC
-        purpose_key = hmac.new(
-            key=self.master_key,
-            msg=purpose.encode(),
-            digestmod=hashlib.sha256
-        ).digest()
+        purpose_key = self._hmac_sha256(self.master_key, purpose.encode())
         
         logger.debug(f"Derived purpose key for: {purpose}")
         return purpose_key
@@ -259,9 +725,9 @@ class KeyStorage:
     def get_or_create_persistent_key(self, purpose: str, key_size: int = 32) -> Optional[bytes]:
         """Get or create a persistent purpose-specific key that survives password changes.
 
-        Unlike `derive_purpose_key` which derives a key from the master key (and thus
-        changes when the password changes), this method creates a persistent random key
-        that is stored in the key storage and survives password changes.
+        Unlike `derive_purpose_key` which derives a key from the master key, this
+        method creates a random key that is stored in the key storage, so it is
+        independent of every other key and can be replaced on its own.
 
         Args:
             purpose: A string identifier for the key's purpose (used as key_id)
@@ -346,58 +812,38 @@ class KeyStorage:
         Returns:
             True if save successful, False otherwise
         """
-        if self.master_key is None or self.salt is None or self.hmac_key is None:
+        if self.master_key is None or self.hmac_key is None:
             logger.error("Cannot save storage, not unlocked")
             return False
         
+        with self._snapshot_lock, self._lock:
+            return self._write_snapshot()
+    
+    def _write_snapshot(self) -> bool:
+        """Write all keys to a new snapshot and start a new, empty journal.
+        
+        Must be called with the lock held.
+        
+        Returns:
+            True if save successful, False otherwise
+        """
         try:
-            # Create a test value to verify the password
-            aesgcm = AESGCM(self.master_key)
-            nonce = os.urandom(12)
-            ciphertext = aesgcm.encrypt(nonce, b"test_value", None)
-            
-            # Prepare the data to save
-            data = {
-                'format_version': self.FORMAT_VERSION,
-                'salt': base64.b64encode(self.salt).decode(),
-                'kdf': 'argon2id',
-                'test_nonce': base64.b64encode(nonce).decode(),
-                'test_ciphertext': base64.b64encode(ciphertext).decode(),
-                'created_at': time.time(),
-                'keys': {}
-            }
-            
-            # Encrypt each key with its metadata
-            for key_id, key_data in self.keys.items():
-                # Include the key_id inside the encrypted data
-                key_data_with_meta = key_data.copy()
-                key_data_with_meta['__key_id'] = key_id  # Special marker
-                
-                # Convert binary data to base64 strings for JSON serialization
-                serialized_data = {}
-                for k, v in key_data_with_meta.items():
-                    if isinstance(v, bytes):
-                        serialized_data[k] = base64.b64encode(v).decode('utf-8')
-                    else:
-                        serialized_data[k] = v
-                
-                # Serialize, encrypt and store with HMAC-based entry ID
-                key_data_json = json.dumps(serialized_data).encode()
-                nonce = os.urandom(12)
-                ciphertext = aesgcm.encrypt(nonce, key_data_json, None)
-                
-                # Create an opaque but deterministic entry ID
-                entry_id = self._compute_entry_id(key_id)
-                
-                data['keys'][entry_id] = {
-                    'nonce': base64.b64encode(nonce).decode(),
-                    'ciphertext': base64.b64encode(ciphertext).decode()
-                }
+            # The snapshot names the journal that continues it, so journals
+            # from earlier snapshots are never replayed on top of it
+            journal_id = os.urandom(8)
             
             # Write using our secure file handler
-            success = self.secure_file.write_json(data)
+            success = self.secure_file.write_json(self._encode_snapshot(self.keys, journal_id))
             
             if success:
+                # Everything in the old journals is in the snapshot now
+                old_journals = self._chained_journals + [self.journal]
+                self._chained_journals = []
+                self._open_journal(journal_id)
+                for old_journal in old_journals:
+                    if old_journal is not None:
+                        old_journal.remove()
+                self._snapshot_size = self.storage_path.stat().st_size
                 logger.info(f"Saved key storage with {len(self.keys)} keys")
             else:
                 logger.error("Failed to save key storage")
@@ -408,27 +854,418 @@ class KeyStorage:
             logger.error(f"Failed to save key storage: {e}")
             return False
     
-    def change_password(self, old_password: str, new_password: str) -> bool:
+    def _encode_snapshot(self, keys: _KeyEntries, journal_id: bytes) -> Dict[str, Any]:
+        """Encrypt keys into the data of a snapshot.
+        
+        Args:
+            keys: The keys to include
+            journal_id: The ID of the journal continuing the snapshot
+            
+        Returns:
+            The snapshot data
+        """
+        # Create a test value to verify the snapshot belongs to the master key
+        aesgcm = AESGCM(self.master_key.view())
+        nonce = os.urandom(12)
+        ciphertext = aesgcm.encrypt(nonce, b"test_value", None)
+        
+        # Prepare the data to save
+        data = {
+            'format_version': self.FORMAT_VERSION,
+            'test_nonce': base64.b64encode(nonce).decode(),
+            'test_ciphertext': base64.b64encode(ciphertext).decode(),
+            'created_at': time.time(),
+            'journal_id': base64.b64encode(journal_id).decode(),
+            'keys': {}
+        }
+        
+        # Maps entry IDs to key IDs so unlock doesn't have to decrypt every entry
+        index = {}
+        
+        # Encrypt each key with its metadata
+        for key_id in keys:
+            # Create an opaque but deterministic entry ID
+            entry_id = self._compute_entry_id(key_id)
+            index[entry_id] = key_id
+            
+            # Unchanged entries are copied as they are
+            stored = keys.stored_entry(key_id)
+            if stored is not None:
+                data['keys'][entry_id] = stored
+                continue
+            
+            # Include the key_id inside the encrypted data
+            serialized_data = self._serialize_entry(keys[key_id])
+            serialized_data['__key_id'] = key_id  # Special marker
+            
+            # Serialize, encrypt and store with HMAC-based entry ID
+            key_data_json = json.dumps(serialized_data).encode()
+            nonce = os.urandom(12)
+            ciphertext = aesgcm.encrypt(nonce, key_data_json, None)
+            
+            data['keys'][entry_id] = {
+                'nonce': base64.b64encode(nonce).decode(),
+                'ciphertext': base64.b64encode(ciphertext).decode()
+            }
+        
+        nonce = os.urandom(12)
+        ciphertext = aesgcm.encrypt(nonce, json.dumps(index).encode(), b"key_storage_index")
+        data['index'] = {
+            'nonce': base64.b64encode(nonce).decode(),
+            'ciphertext': base64.b64encode(ciphertext).decode()
+        }
+        
+        return data
+    
+    def _decrypt_entry(self, stored: Dict[str, str], with_key_id: bool = False) -> Optional[Dict[str, Any]]:
+        """Decrypt a key entry of the snapshot.
+        
+        Args:
+            stored: The encrypted entry
+            with_key_id: Whether to keep the key ID marker in the result
+            
+        Returns:
+            The key data, or None if the entry can't be decrypted
+        """
+        try:
+            nonce = base64.b64decode(stored['nonce'])
+            ciphertext = base64.b64decode(stored['ciphertext'])
+            
+            key_data = json.loads(AESGCM(self.master_key.view()).decrypt(nonce, ciphertext, None).decode())
+            key_id = key_data.pop('__key_id', None)
+            key_data = self._deserialize_entry(key_data)
+            if with_key_id and key_id is not None:
+                key_data['__key_id'] = key_id
+            return key_data
+        except Exception as e:
+            logger.error(f"Failed to decrypt key entry: {e}")
+            return None
+    
+    def _decrypt_index(self, stored: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """Decrypt the snapshot index mapping entry IDs to key IDs.
+        
+        Args:
+            stored: The encrypted index
+            
+        Returns:
+            The index, or None if it can't be decrypted
+        """
+        try:
+            nonce = base64.b64decode(stored['nonce'])
+            ciphertext = base64.b64decode(stored['ciphertext'])
+            return json.loads(AESGCM(self.master_key.view()).decrypt(nonce, ciphertext, b"key_storage_index").decode())
+        except Exception as e:
+            logger.error(f"Failed to decrypt key storage index: {e}")
+            return None
+    
+    @staticmethod
+    def _serialize_entry(key_data: KeyRecord) -> Dict[str, Any]:
+        """Convert binary values of a key entry to base64 strings for JSON.
+        
+        The names of the converted fields are recorded under '__bytes', so
+        they can be turned back into bytes without guessing.
+        
+        Args:
+            key_data: The key data
+            
+        Returns:
+            A copy of the key data that can be serialized as JSON
+        """
+        serialized_data = {}
+        binary_fields = []
+        for k, v in key_data.items():
+            if isinstance(v, bytes):
+                serialized_data[k] = base64.b64encode(v).decode('utf-8')
+                binary_fields.append(k)
+            else:
+                serialized_data[k] = v
+        serialized_data['__bytes'] = binary_fields
+        return serialized_data
+    
+    @staticmethod
+    def _deserialize_entry(serialized_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Restore the binary values of a key entry read from JSON.
+        
+        Entries written before binary fields were recorded fall back to
+        recognizing base64 strings.
+        
+        Args:
+            serialized_data: The key data as serialized by _serialize_entry
+            
+        Returns:
+            The key data with binary values as bytes
+        """
+        key_data = dict(serialized_data)
+        binary_fields = key_data.pop('__bytes', None)
+        if binary_fields is not None:
+            for k in binary_fields:
+                key_data[k] = base64.b64decode(key_data[k])
+            return key_data
+        
+        for k, v in key_data.items():
+            if isinstance(v, str):
+                # For known binary fields, always try to decode
+                if k in KeyStorage._LEGACY_BINARY_FIELDS:
+                    try:
+                        key_data[k] = base64.b64decode(v)
+                        continue
+                    except Exception:
+                        # Not base64 encoded, will use as is below
+                        pass
+                    
+                # For other fields, check if it looks like base64 (length multiple of 4,
+                # only contains valid base64 characters)
+                if len(v) > 0 and len(v) % 4 == 0 and KeyStorage._BASE64_RE.fullmatch(v):
+                    try:
+                        decoded = base64.b64decode(v)
+                        # Only use the decoded value if it looks like binary data
+                        # (contains bytes that aren't printable ASCII)
+                        if any(b < 32 or b > 126 for b in decoded):
+                            key_data[k] = decoded
+                    except Exception:
+                        # If decoding fails, use the original string
+                        pass
+        return key_data
+    
+    def _journal_path(self, journal_id: bytes) -> Path:
+        """Get the path of the journal continuing a snapshot."""
+        return self.storage_path.with_name(f"{self.storage_path.name}.{journal_id.hex()}.journal")
+    
+    def _open_journal(self, journal_id: bytes, remove_stale: bool = True) -> None:
+        """Open the journal continuing the current snapshot.
+        
+        Journals left over from older snapshots (after a crash during
+        compaction) are deleted.
+        
+        Args:
+            journal_id: The journal ID recorded in the snapshot, or in the
+                        record ending the previous journal
+            remove_stale: Whether to delete the journals that aren't needed
+        """
+        if self.journal is not None and self.journal_id != journal_id:
+            self.journal.close()
+        
+        self.journal_id = journal_id
+        self.journal = Journal(self._journal_path(journal_id))
+        self._journal_sequence = 0
+        
+        if remove_stale:
+            self._remove_stale_journals()
+    
+    def _remove_stale_journals(self) -> None:
+        """Delete the journals that neither the snapshot nor the current journal need."""
+        needed = {journal.file_path for journal in self._chained_journals}
+        needed.add(self.journal.file_path)
+        for path in self.storage_path.parent.glob(f"{self.storage_path.name}.*.journal"):
+            if path not in needed:
+                try:
+                    os.remove(path)
+                    logger.info(f"Deleted stale journal: {path}")
+                except Exception as e:
+                    logger.warning(f"Failed to delete stale journal {path}: {e}")
+    
+    def _journal_associated_data(self, sequence: int) -> bytes:
+        """Bind a journal record to its journal and position.
+        
+        This keeps records from being reordered, dropped from the middle or
+        replayed into another journal.
+        """
+        return b"key_storage_journal" + self.journal_id + sequence.to_bytes(8, 'big')
+    
+    def _replay_journal(self) -> None:
+        """Apply the records of the journal to the keys loaded from the snapshot.
+        
+        A journal ending in a 'next' record was continued in another journal
+        by a compaction whose snapshot wasn't written, so that journal is
+        replayed after it.
+        """
+        aesgcm = AESGCM(self.master_key.view())
+        
+        while True:
+            records = self.journal.read_records()
+            next_journal_id = None
+            
+            for sequence, record in enumerate(records):
+                try:
+                    plaintext = aesgcm.decrypt(
+                        record[:12], record[12:], self._journal_associated_data(sequence)
+                    )
+                    change = json.loads(plaintext.decode())
+                except Exception as e:
+                    logger.error(f"Failed to decrypt journal record {sequence}: {e}")
+                    continue
+                
+                if change['op'] == 'put':
+                    self.keys[change['key_id']] = self._deserialize_entry(change['data'])
+                elif change['op'] == 'delete' and change['key_id'] in self.keys:
+                    del self.keys[change['key_id']]
+                elif change['op'] == 'next':
+                    next_journal_id = base64.b64decode(change['journal_id'])
+            
+            self._journal_sequence = len(records)
+            if records:
+                logger.debug(f"Replayed {len(records)} journal records")
+            
+            if next_journal_id is None:
+                break
+            self._chained_journals.append(self.journal)
+            self._open_journal(next_journal_id, remove_stale=False)
+    
+    def _append_change(self, change: Dict[str, Any]) -> Optional[Journal]:
+        """Append an encrypted change record to the journal.
+        
+        Must be called with the lock held. The record isn't synced yet, pass
+        the returned journal to _commit_change once the lock is released.
+        
+        Args:
+            change: The change, with 'op', 'key_id' and, for puts, 'data'
+            
+        Returns:
+            The journal the record was appended to, or None if appending failed
+        """
+        aesgcm = AESGCM(self.master_key.view())
+        nonce = os.urandom(12)
+        ciphertext = aesgcm.encrypt(
+            nonce, json.dumps(change).encode(),
+            self._journal_associated_data(self._journal_sequence)
+        )
+        if not self.journal.append(nonce + ciphertext, sync=False):
+            return None
+        self._journal_sequence += 1
+        return self.journal
+    
+    def _commit_change(self, journal: Optional[Journal]) -> bool:
+        """Wait until an appended change is on disk.
+        
+        Called without the lock held, so changes from other threads that were
+        appended in the meantime share the same fsync.
+        
+        Args:
+            journal: The journal returned by _append_change
+            
+        Returns:
+            True if the change is on disk, False otherwise
+        """
+        if journal is None or not journal.sync():
+            return False
+        
+        self._maybe_compact()
+        return True
+    
+    def _maybe_compact(self) -> None:
+        """Start a background compaction if the journal has grown too large."""
+        journal = self.journal
+        if journal is None or journal.size < max(self.JOURNAL_COMPACT_MIN_BYTES, self._snapshot_size):
+            return
+        
+        with self._lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(
+                target=self._compact, name="KeyStorageCompaction", daemon=True
+            )
+            self._compaction_thread.start()
+    
+    def _compact(self) -> None:
+        """Fold the journal into a new snapshot.
+        
+        The lock is only held to copy the keys and continue the journal in a
+        new one, so keys can be changed while the snapshot is encrypted and
+        written. The new snapshot names the new journal.
+        """
+        with self._snapshot_lock:
+            with self._lock:
+                if self.master_key is None or self.journal is None:
+                    return
+                journal_size = self.journal.size
+                keys = self.keys.copy()
+                journal_id = os.urandom(8)
+                if not self._chain_journal(journal_id):
+                    logger.error("Failed to compact key storage journal")
+                    return
+            
+            try:
+                success = self.secure_file.write_json(self._encode_snapshot(keys, journal_id))
+            except Exception as e:
+                logger.error(f"Failed to save key storage: {e}")
+                success = False
+            
+            with self._lock:
+                if not success:
+                    # The old snapshot and its chain of journals still hold every change
+                    logger.error("Failed to compact key storage journal")
+                    return
+                
+                # The earlier journals are in the snapshot now
+                for old_journal in self._chained_journals:
+                    old_journal.remove()
+                self._chained_journals = []
+                self._snapshot_size = self.storage_path.stat().st_size
+                logger.info(f"Compacted key storage journal ({journal_size} bytes)")
+    
+    def _chain_journal(self, journal_id: bytes) -> bool:
+        """Continue the journal in a new one.
+        
+        The current journal ends with a record naming the new one, so the
+        snapshot on disk is still complete when replayed through both.
+        
+        Must be called with the lock held.
+        
+        Args:
+            journal_id: The ID of the new journal
+            
+        Returns:
+            True if the journal was continued, False otherwise
+        """
+        journal = self._append_change({
+            'op': 'next',
+            'journal_id': base64.b64encode(journal_id).decode()
+        })
+        # Changes in the new journal are only reachable through this record
+        if journal is None or not journal.sync():
+            return False
+        self._chained_journals.append(journal)
+        self._open_journal(journal_id, remove_stale=False)
+        return True
+    
+    def change_password(self, old_password: str, new_password: str,
+                        progress: Optional[Callable[[str], None]] = None) -> bool:
         """Change the password for the key storage.
         
+        Like unlock, this runs Argon2id and should be called from a worker thread.
+        
         Args:
             old_password: The current password
             new_password: The new password
+            progress: Called with a description of each step (optional)
             
         Returns:
             True if password change successful, False otherwise
         """
-        # First unlock with the old password
-        if not self.unlock(old_password):
-            logger.error("Failed to unlock storage with old password")
-            return False
+        if self.master_key is None:
+            # First unlock with the old password
+            if not self.unlock(old_password, progress):
+                logger.error("Failed to unlock storage with old password")
+                return False
+        else:
+            # Already unlocked, check the old password against the header
+            if progress:
+                progress("Checking current password...")
+            header = self.header_file.read_json()
+            master_key = self._unwrap_master_key(old_password, header) if header is not None else None
+            verified = master_key is not None and master_key == self.master_key
+            if master_key is not None:
+                master_key.wipe()
+            if not verified:
+                logger.error("Failed to verify old password")
+                return False
         
-        # Generate a new master key with the new password
-        self.master_key, self.salt = self._derive_key(new_password)
-        self._derive_encryption_keys()
+        # Only the wrapped master key changes, the keys stay encrypted as they are
+        if not self._write_header(new_password, progress):
+            return False
         
-        # Save the storage with the new master key
-        return self._save_storage()
+        logger.info("Changed key storage password")
+        return True
 
     def reset_storage(self, new_password: str, create_backup: bool = False) -> bool:
         """Reset the key storage with a new password, deleting all existing keys and logs.
@@ -447,36 +1284,54 @@ class KeyStorage:
         try:
             # Create backup of existing key storage if requested
             if create_backup and self.storage_path.exists():
-                backup_path = self.storage_path.with_suffix(self.storage_path.suffix + '.old')
                 try:
                     import shutil
-                    shutil.copy2(self.storage_path, backup_path)
-                    logger.info(f"Created backup of key storage at {backup_path}")
+                    # The keys can't be read without the header, back up both
+                    for path in (self.storage_path, self.header_path):
+                        if path.exists():
+                            backup_path = path.with_suffix(path.suffix + '.old')
+                            shutil.copy2(path, backup_path)
+                            logger.info(f"Created backup of {path.name} at {backup_path}")
                 except Exception as e:
                     logger.error(f"Failed to create backup: {e}")
 
             # Delete the existing key storage files
             try:
-                if self.storage_path.exists():
-                    os.remove(self.storage_path)
-                    logger.info(f"Deleted key storage file: {self.storage_path}")
-
-                # Also check for lock and backup files
-                lock_path = self.storage_path.with_suffix(self.storage_path.suffix + '.lock')
-                if lock_path.exists():
-                    os.remove(lock_path)
-                    logger.info(f"Deleted lock file: {lock_path}")
-
-                regular_backup = self.storage_path.with_suffix(self.storage_path.suffix + '.bak')
-                if regular_backup.exists():
-                    os.remove(regular_backup)
-                    logger.info(f"Deleted regular backup file: {regular_backup}")
-
-                # Delete any other backups
-                old_backup = self.storage_path.with_suffix(self.storage_path.suffix + '.old')
-                if old_backup.exists():
-                    os.remove(old_backup)
-                    logger.info(f"Deleted old backup file: {old_backup}")
+                # A running compaction would write the old keys back
+                if self._compaction_thread is not None:
+                    self._compaction_thread.join()
+                    self._compaction_thread = None
+                for journal in self._chained_journals:
+                    journal.close()
+                self._chained_journals = []
+                if self.journal is not None:
+                    self.journal.close()
+                    self.journal = None
+                for journal_path in self.storage_path.parent.glob(f"{self.storage_path.name}.*.journal"):
+                    os.remove(journal_path)
+                    logger.info(f"Deleted journal file: {journal_path}")
+                
+                for path in (self.storage_path, self.header_path):
+                    if path.exists():
+                        os.remove(path)
+                        logger.info(f"Deleted key storage file: {path}")
+
+                    # Also check for lock and backup files
+                    lock_path = path.with_suffix(path.suffix + '.lock')
+                    if lock_path.exists():
+                        os.remove(lock_path)
+                        logger.info(f"Deleted lock file: {lock_path}")
+
+                    regular_backup = path.with_suffix(path.suffix + '.bak')
+                    if regular_backup.exists():
+                        os.remove(regular_backup)
+                        logger.info(f"Deleted regular backup file: {regular_backup}")
+
+                    # Delete any other backups
+                    old_backup = path.with_suffix(path.suffix + '.old')
+                    if old_backup.exists():
+                        os.remove(old_backup)
+                        logger.info(f"Deleted old backup file: {old_backup}")
 
             except Exception as e:
                 logger.error(f"Error removing old storage files: {e}")
@@ -490,14 +1345,14 @@ class KeyStorage:
                     import glob
                     import shutil
 
-                    # Delete all log files first
-                    log_files = glob.glob(str(logs_dir / "*.log"))
-                    for log_file in log_files:
-                        try:
-                            os.remove(log_file)
-                            logger.info(f"Deleted log file: {log_file}")
-                        except Exception as e:
-                            logger.warning(f"Failed to delete log file {log_file}: {e}")
+                    # Delete the whole directory: besides the log files it holds
+                    # their indexes, metrics, manifest and archive bundles, all
+                    # encrypted under the log key deleted below
+                    try:
+                        shutil.rmtree(logs_dir)
+                        logger.info(f"Deleted log directory: {logs_dir}")
+                    except Exception as e:
+                        logger.warning(f"Failed to delete log directory {logs_dir}: {e}")
 
                     # Delete any encryption keys for logs
                     key_files = glob.glob(str(logs_dir.parent / "log_encryption_key*"))
@@ -513,11 +1368,30 @@ class KeyStorage:
                 logger.error(f"Error deleting secure logs: {e}")
                 # Continue with reset even if log deletion fails
 
+            # Delete the message history, it's encrypted under a key that no longer exists
+            try:
+                messages_db = self.storage_path.parent / "messages.db"
+                for path in (messages_db,
+                             messages_db.with_name(messages_db.name + "-wal"),
+                             messages_db.with_name(messages_db.name + "-shm")):
+                    if path.exists():
+                        os.remove(path)
+                        logger.info(f"Deleted message history file: {path}")
+
+                # Sent and received files are encrypted under a key from this storage too
+                blobs_dir = self.storage_path.parent / "blobs"
+                if blobs_dir.exists() and blobs_dir.is_dir():
+                    import shutil
+                    shutil.rmtree(blobs_dir)
+                    logger.info(f"Deleted blob store: {blobs_dir}")
+            except Exception as e:
+                logger.error(f"Error deleting message history: {e}")
+                # Continue with reset even if message history deletion fails
+
             # Clear any existing keys from memory
-            self.keys = {}
-            self.master_key = None
+            self._reset_keys()
+            self._set_master_key(None)
             self.salt = None
-            self.hmac_key = None
 
             # Create a new key storage with the new password
             success = self.unlock(new_password)
@@ -552,73 +1426,54 @@ class KeyStorage:
             key_data_with_meta = key_data.copy()
             key_data_with_meta['created_at'] = time.time()
             
-            # Store the key in memory
-            self.keys[key_id] = key_data_with_meta
+            is_history = key_id.startswith(HISTORY_KEY_PREFIX)
+            
+            with self._lock:
+                # Record the change in the journal before making it in memory
+                journal = self._append_change({
+                    'op': 'put',
+                    'key_id': key_id,
+                    'data': self._serialize_entry(key_data_with_meta)
+                })
+                if journal is None:
+                    return False
+                
+                # Store the key in memory
+                previous = self.keys.get_entry(key_id)
+                self.keys[key_id] = key_data_with_meta
+                entry = self.keys.get_entry(key_id)
+                if is_history and self._history is not None:
+                    self._index_history_entry(self._history, key_id, key_data_with_meta)
             
-            # Save to disk
-            return self._save_storage()
+            if not self._commit_change(journal):
+                self._rollback_changes([(key_id, entry, previous)])
+                return False
+            
+            if is_history:
+                # Keep the history within the retention policy
+                self.prune_key_history()
+            return True
             
         except Exception as e:
             logger.error(f"Failed to store key {key_id}: {e}")
             return False
     
-    def get_key(self, key_id: str) -> Optional[Dict[str, Any]]:
+    def get_key(self, key_id: str) -> Optional[KeyRecord]:
         """Retrieve a key from the key storage.
         
         Args:
             key_id: The identifier of the key to retrieve
             
         Returns:
-            The key data, or None if not found
+            A read-only view of the key data with binary values as bytes,
+            or None if not found
         """
         if self.master_key is None:
             logger.error("Cannot get key, storage not unlocked")
             return None
         
-        if key_id not in self.keys:
-            return None
-        
-        # Get the key data
-        key_data = self.keys[key_id].copy()
-        
-        # Convert base64 strings back to binary data
-        decoded_data = {}
-        for k, v in key_data.items():
-            if isinstance(v, str):
-                # For known binary fields, always try to decode
-                common_binary_fields = ['key', 'public_key', 'private_key', 'shared_key', 
-                                        'ciphertext', 'signature', 'original_shared_secret']
-                
-                if k in common_binary_fields:
-                    try:
-                        decoded_data[k] = base64.b64decode(v)
-                        continue
-                    except Exception:
-                        # Not base64 encoded, will use as is below
-                        pass
-                    
-                # For other fields, check if it looks like base64 (length multiple of 4,
-                # only contains valid base64 characters)
-                if len(v) > 0 and len(v) % 4 == 0 and all(c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=' for c in v):
-                    try:
-                        # Try to decode it
-                        decoded = base64.b64decode(v)
-                        # Only use the decoded value if it looks like binary data
-                        # (contains bytes that aren't printable ASCII)
-                        if any(b < 32 or b > 126 for b in decoded):
-                            decoded_data[k] = decoded
-                            continue
-                    except:
-                        # If decoding fails, use the original string
-                        pass
-                    
-                # If we got here, use the string value as-is
-                decoded_data[k] = v
-            else:
-                # Non-string value (int, bool, etc)
-                decoded_data[k] = v
-        
-        return decoded_data
+        # Decrypts the entry on its first use, later calls return the cached record
+        return self.keys.get(key_id)
     
     def delete_key(self, key_id: str) -> bool:
         """Delete a key from the key storage.
@@ -638,48 +1493,177 @@ class KeyStorage:
             return False
         
         try:
-            # Remove the key from memory
-            del self.keys[key_id]
+            with self._lock:
+                # Record the deletion in the journal before making it in memory
+                journal = self._append_change({'op': 'delete', 'key_id': key_id})
+                if journal is None:
+                    return False
+                
+                # Remove the key from memory
+                previous = self.keys.get_entry(key_id)
+                self.keys.set_entry(key_id, None)
+                if self._history is not None:
+                    self._history.remove(key_id)
             
-            # Save to disk to remove it from storage
-            return self._save_storage()
+            if not self._commit_change(journal):
+                self._rollback_changes([(key_id, None, previous)])
+                return False
+            return True
             
         except Exception as e:
             logger.error(f"Failed to delete key {key_id}: {e}")
             return False
     
-    def list_keys(self) -> List[Tuple[str, Dict[str, Any]]]:
+    def delete_keys(self, key_ids: Iterable[str]) -> int:
+        """Delete several keys, waiting for the disk only once.
+        
+        Args:
+            key_ids: The identifiers of the keys to delete
+            
+        Returns:
+            The number of keys deleted
+        """
+        if self.master_key is None:
+            logger.error("Cannot delete keys, storage not unlocked")
+            return 0
+        
+        try:
+            journal = None
+            changes = []
+            with self._lock:
+                for key_id in key_ids:
+                    if key_id not in self.keys:
+                        continue
+                    
+                    journal = self._append_change({'op': 'delete', 'key_id': key_id})
+                    if journal is None:
+                        break
+                    
+                    changes.append((key_id, None, self.keys.get_entry(key_id)))
+                    self.keys.set_entry(key_id, None)
+                    if self._history is not None:
+                        self._history.remove(key_id)
+            
+            if changes and not self._commit_change(journal):
+                self._rollback_changes(changes)
+                return 0
+            return len(changes)
+            
+        except Exception as e:
+            logger.error(f"Failed to delete keys: {e}")
+            return 0
+    
+    def _rollback_changes(self, changes: List[Tuple[str, Optional[_KeyEntry], Optional[_KeyEntry]]]) -> None:
+        """Undo changes in memory whose journal records couldn't be synced.
+        
+        Keys changed again since are left alone. A record whose sync failed
+        may still reach the disk, as after any failed fsync.
+        
+        Args:
+            changes: (key ID, entry after the change, entry before it) of each
+                     change, oldest first
+        """
+        with self._lock:
+            for key_id, entry, previous in reversed(changes):
+                if self.keys.get_entry(key_id) is not entry:
+                    continue
+                self.keys.set_entry(key_id, previous)
+                if self._history is not None and key_id.startswith(HISTORY_KEY_PREFIX):
+                    self._history.remove(key_id)
+                    key_data = self.keys.get(key_id)
+                    if key_data is not None:
+                        self._index_history_entry(self._history, key_id, key_data)
+    
+    def list_keys(self) -> List[Tuple[str, KeyRecord]]:
         """List all keys in the key storage.
         
         Returns:
-            List of tuples (key_id, key_data)
+            List of tuples (key_id, key_data), with key data as returned by get_key
         """
         if self.master_key is None:
             logger.error("Cannot list keys, storage not unlocked")
             return []
         
-        # Create a list of (key_id, key_data) tuples
-        # Convert any base64 strings to bytes in the key data
-        result = []
-        for key_id, key_data in self.keys.items():
-            decoded_data = {}
-            for k, v in key_data.items():
-                if isinstance(v, str) and k in ['public_key', 'private_key', 'shared_key']:
-                    try:
-                        decoded_data[k] = base64.b64decode(v)
-                    except Exception:
-                        decoded_data[k] = v
+        with self._lock:
+            self.keys.decrypt_all()
+            return list(self.keys.items())
+    
+    def _index_history_entry(self, index: KeyHistoryIndex, key_id: str, key_data: KeyRecord) -> None:
+        """Add a history entry to the index.
+        
+        The peer and time come from the key ID when it encodes them, and from
+        the key data otherwise.
+        """
+        parsed = KeyHistoryIndex.parse_key_id(key_id)
+        if parsed is None:
+            parsed = (key_data.get("peer_id", "Unknown"), key_data.get("created_at", 0))
+        index.add(key_id, *parsed)
+    
+    def _history_index(self) -> KeyHistoryIndex:
+        """Get the key history index, building it on first use.
+        
+        Must be called with the lock held. Building the index only reads key
+        IDs, except for entries whose key IDs don't encode the peer and time.
+        """
+        if self._history is None:
+            index = KeyHistoryIndex()
+            unparsed = []
+            for key_id in self.keys:
+                if not key_id.startswith(HISTORY_KEY_PREFIX):
+                    continue
+                parsed = KeyHistoryIndex.parse_key_id(key_id)
+                if parsed is None:
+                    unparsed.append(key_id)
                 else:
-                    decoded_data[k] = v
-            result.append((key_id, decoded_data))
+                    index.add(key_id, *parsed)
+            
+            self.keys.decrypt_all(unparsed)
+            for key_id in unparsed:
+                key_data = self.keys.get(key_id)
+                if key_data is not None:
+                    self._index_history_entry(index, key_id, key_data)
+            
+            self._history = index
+        return self._history
+    
+    def count_key_history(self, peer_id: Optional[str] = None) -> int:
+        """Count the saved key history entries.
         
-        return result
+        Args:
+            peer_id: Only count entries of this peer (optional)
+            
+        Returns:
+            The number of entries
+        """
+        if self.master_key is None:
+            logger.error("Cannot count key history, storage not unlocked")
+            return 0
+        
+        with self._lock:
+            return self._history_index().count(peer_id)
+    
+    def get_key_history_peers(self) -> List[str]:
+        """Get the peers that have saved key history.
+        
+        Returns:
+            List of peer IDs, most recent key exchange first
+        """
+        if self.master_key is None:
+            logger.error("Cannot get key history peers, storage not unlocked")
+            return []
+        
+        with self._lock:
+            return self._history_index().peers()
     
-    def get_key_history(self, decrypt_keys=False) -> List[Dict[str, Any]]:
-        """Get a list of all saved key history.
+    def get_key_history(self, decrypt_keys=False, peer_id: Optional[str] = None,
+                        offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get a page of saved key history, newest first.
 
         Args:
             decrypt_keys: Whether to decrypt the key data (default: False)
+            peer_id: Only include entries of this peer (optional)
+            offset: Number of newer entries to skip (default: 0)
+            limit: Maximum number of entries to return, all if None
 
         Returns:
             List of dictionaries containing key history information
@@ -688,9 +1672,14 @@ class KeyStorage:
             logger.error("Cannot get key history, storage not unlocked")
             return []
 
+        with self._lock:
+            key_ids = self._history_index().page(peer_id, offset, limit)
+            self.keys.decrypt_all(key_ids)
+            entries = [(key_id, self.keys[key_id]) for key_id in key_ids if key_id in self.keys]
+        
         history = []
-        for key_id, key_data in self.keys.items():
-            if key_id.startswith("peer_shared_key_"):
+        for key_id, key_data in entries:
+            if key_id.startswith(HISTORY_KEY_PREFIX):
                 # Extract and convert relevant information
                 display_data = key_data.copy()
 
@@ -736,9 +1725,68 @@ class KeyStorage:
 
                 history.append(entry)
 
-        # Sort by creation time, newest first
-        history.sort(key=lambda x: x["created_at"], reverse=True)
         return history
+    
+    def clear_key_history(self, peer_id: Optional[str] = None) -> int:
+        """Delete saved key history.
+        
+        Args:
+            peer_id: Only delete entries of this peer (optional)
+            
+        Returns:
+            The number of entries deleted
+        """
+        if self.master_key is None:
+            logger.error("Cannot clear key history, storage not unlocked")
+            return 0
+        
+        with self._lock:
+            key_ids = self._history_index().page(peer_id)
+        return self.delete_keys(key_ids)
+    
+    def get_history_retention(self) -> KeyHistoryRetention:
+        """Get the retention policy of the key history.
+        
+        Returns:
+            The retention policy, DEFAULT_HISTORY_RETENTION if none was set
+        """
+        record = self.get_key(self.HISTORY_RETENTION_KEY_ID)
+        if record is None:
+            return self.DEFAULT_HISTORY_RETENTION
+        return KeyHistoryRetention.from_dict(record)
+    
+    def set_history_retention(self, retention: KeyHistoryRetention) -> bool:
+        """Set the retention policy of the key history and apply it.
+        
+        Args:
+            retention: The retention policy
+            
+        Returns:
+            True if the policy was saved, False otherwise
+        """
+        if not self.store_key(self.HISTORY_RETENTION_KEY_ID, retention.to_dict()):
+            return False
+        self.prune_key_history()
+        return True
+    
+    def prune_key_history(self) -> int:
+        """Delete the key history entries the retention policy doesn't keep.
+        
+        Returns:
+            The number of entries deleted
+        """
+        if self.master_key is None:
+            return 0
+        
+        retention = self.get_history_retention()
+        with self._lock:
+            expired = self._history_index().expired(retention)
+        if not expired:
+            return 0
+        
+        deleted = self.delete_keys(expired)
+        logger.info(f"Pruned {deleted} key history entries")
+        return deleted
 
     def decrypt_key(self, key_id: str) -> Optional[bytes]:
         """Decrypt a specific key by ID.
@@ -783,15 +1831,21 @@ class KeyStorage:
 
     def close(self) -> None:
         """Close the key storage and clear sensitive data from memory."""
-        if hasattr(self, 'master_key') and self.master_key:
-            self._secure_zero(self.master_key)
-            self.master_key = None
-            
-        if hasattr(self, 'hmac_key') and self.hmac_key:
-            self._secure_zero(self.hmac_key)
-            self.hmac_key = None
-            
-        self.keys = {}
+        # Let a running compaction finish before the keys go away
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+            self._compaction_thread = None
+        
+        for journal in self._chained_journals:
+            journal.close()
+        self._chained_journals = []
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        
+        # Wipe the master key and the keys derived from it
+        self._set_master_key(None)
+        self._reset_keys()
         self.salt = None
         
         logger.info("Key storage closed and sensitive data cleared")
\ No newline at end of file
@@ -9,6 +9,7 @@ from typing import Tuple, Optional
 
 # Import the base class
 from .algorithm_base import CryptoAlgorithm
+from ..utils.secure_buffer import secret_view
 
 # Standard cryptography lib
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305 as ChaCha20Poly1305Cipher
@@ -110,7 +111,7 @@ class AES256GCM(SymmetricAlgorithm):
         nonce = os.urandom(12)
         
         # Create the AES-GCM cipher
-        aesgcm = AESGCM(key)
+        aesgcm = AESGCM(secret_view(key))
         
         # Encrypt the data
         ciphertext = aesgcm.encrypt(nonce, plaintext, associated_data)
@@ -146,7 +147,7 @@ class AES256GCM(SymmetricAlgorithm):
         actual_ciphertext = ciphertext[12:]
         
         # Create the AES-GCM cipher
-        aesgcm = AESGCM(key)
+        aesgcm = AESGCM(secret_view(key))
         
         # Decrypt the data
         try:
@@ -208,7 +209,7 @@ class ChaCha20Poly1305(SymmetricAlgorithm):
         nonce = os.urandom(12)
         
         # Create the ChaCha20-Poly1305 cipher
-        chacha = ChaCha20Poly1305Cipher(key)
+        chacha = ChaCha20Poly1305Cipher(secret_view(key))
         
         # Encrypt the data
         ciphertext = chacha.encrypt(nonce, plaintext, associated_data)
@@ -244,7 +245,7 @@ class ChaCha20Poly1305(SymmetricAlgorithm):
         actual_ciphertext = ciphertext[12:]
         
         # Create the ChaCha20-Poly1305 cipher
-        chacha = ChaCha20Poly1305Cipher(key)
+        chacha = ChaCha20Poly1305Cipher(secret_view(key))
         
         # Decrypt the data
         try:
@@ -7,6 +7,10 @@ between nodes, and handling of network connections.
 
 from .p2p_node import P2PNode
 from .discovery import NodeDiscovery
+from .peer_registry import PeerRegistry, PeerEvent
+from .peer_session import PeerSession
+from .peer_link import PeerLink
+from .reassembly import ReassemblyLimits
 from .node_identity import load_or_generate_node_id, save_node_id, get_app_data_dir
 
-__all__ = ['P2PNode', 'NodeDiscovery', 'load_or_generate_node_id', 'save_node_id', 'get_app_data_dir']
+__all__ = ['P2PNode', 'NodeDiscovery', 'PeerRegistry', 'PeerEvent', 'PeerSession', 'PeerLink', 'ReassemblyLimits', 'load_or_generate_node_id', 'save_node_id', 'get_app_data_dir']
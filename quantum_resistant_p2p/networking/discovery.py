@@ -4,11 +4,15 @@ Node discovery implementation for P2P network.
 
 import asyncio
 import socket
+import struct
 import json
 import logging
+import random
 from typing import List, Dict, Set, Optional, Tuple, Any
 import time
 
+from .peer_registry import PeerRegistry
+
 logger = logging.getLogger(__name__)
 
 
@@ -16,12 +20,29 @@ class NodeDiscovery:
     """Discovery mechanism for P2P nodes on the local network.
     
     This class provides functionality for discovering other nodes in the network
-    using UDP broadcast messages. It implements both automatic discovery through
-    broadcast messages and manual peer addition.
+    using UDP broadcast (or multicast) messages. It implements automatic discovery
+    through announcements, active discovery through queries that peers answer
+    with a unicast announcement, and manual peer addition.
+    
+    Announcements are sent on an adaptive schedule: quickly after startup or a
+    network change, then backing off exponentially to a slow steady-state
+    interval. Every interval is jittered so nodes started together don't
+    announce in lockstep.
     """
     
+    # Adaptive announcement schedule (seconds)
+    MIN_ANNOUNCE_INTERVAL = 2.0
+    MAX_ANNOUNCE_INTERVAL = 60.0
+    ANNOUNCE_BACKOFF_FACTOR = 2.0
+    ANNOUNCE_JITTER = 0.2  # +/- 20% of the interval
+    
+    # Minimum time between unicast replies to the same querying host
+    QUERY_REPLY_INTERVAL = 1.0
+    
     def __init__(self, node_id: str, host: str = '0.0.0.0', 
-                port: int = 8000, discovery_port: int = 8001):
+                port: int = 8000, discovery_port: int = 8001,
+                multicast_group: Optional[str] = None, multicast_ttl: int = 1,
+                registry: Optional[PeerRegistry] = None):
         """Initialize a new node discovery service.
         
         Args:
@@ -29,16 +50,30 @@ class NodeDiscovery:
             host: The host IP address the node is listening on
             port: The port number the node is listening on
             discovery_port: The port to use for discovery broadcasts
+            multicast_group: Optional IPv4 multicast group (e.g. '239.255.80.1') to use
+                            instead of the 255.255.255.255 broadcast address
+            multicast_ttl: Time-to-live for multicast datagrams (1 keeps them on the local link)
+            registry: Optional shared PeerRegistry to record discovered nodes in.
+                      A private one is created if not given.
         """
         self.node_id = node_id
         self.host = host
         self.port = port
         self.discovery_port = discovery_port
-        self.discovered_nodes: Dict[str, Tuple[str, int, float]] = {}  # node_id -> (host, port, last_seen)
+        self.multicast_group = multicast_group
+        self.multicast_ttl = multicast_ttl
+        self.registry = registry if registry is not None else PeerRegistry()
         self.running = False
         self.transport = None
         self.protocol = None
         
+        # Adaptive announcement state
+        self.announce_interval = self.MIN_ANNOUNCE_INTERVAL
+        self._announce_wakeup: Optional[asyncio.Event] = None
+        
+        # host -> time of the last unicast reply we sent to a query from it
+        self._query_replies: Dict[str, float] = {}
+        
         # If host is 0.0.0.0, try to get the actual IP
         if host == '0.0.0.0':
             self.advertised_host = self._get_local_ip()
@@ -47,6 +82,11 @@ class NodeDiscovery:
             
         logger.info(f"Node Discovery initialized for node {node_id}, advertising as {self.advertised_host}:{port}")
     
+    @property
+    def discovered_nodes(self) -> Dict[str, Tuple[str, int, float]]:
+        """Discovered nodes as a mapping of node_id -> (host, port, last_seen)."""
+        return {node_id: self.registry.get(node_id) for node_id, _, _ in self.registry.get_nodes()}
+    
     def _get_local_ip(self) -> str:
         """Get the local IP address of this machine.
         
@@ -99,6 +139,16 @@ class NodeDiscovery:
             # Enable broadcasting (needed for broadcasting announcements)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
             
+            # Join the multicast group if one is configured
+            if self.multicast_group:
+                membership = struct.pack("4s4s", socket.inet_aton(self.multicast_group),
+                                         socket.inet_aton('0.0.0.0'))
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.multicast_ttl)
+                # We filter our own announcements by node ID anyway
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+                logger.info(f"Joined discovery multicast group {self.multicast_group}")
+            
             # Create the transport and protocol
             loop = asyncio.get_running_loop()
             self.transport, self.protocol = await loop.create_datagram_endpoint(
@@ -107,11 +157,16 @@ class NodeDiscovery:
             )
             
             self.running = True
+            self._announce_wakeup = asyncio.Event()
             logger.info(f"Discovery service started on port {self.discovery_port}")
             
-            # Start the announcement and cleanup tasks
+            # Ask nodes already on the network to answer right away instead of
+            # waiting for their next periodic announcement
+            self.send_query()
+            
+            # Start the announcement and expiry tasks
             asyncio.create_task(self._periodic_announce())
-            asyncio.create_task(self._cleanup_old_nodes())
+            asyncio.create_task(self.registry.run_expiry())
             
         except Exception as e:
             logger.error(f"Failed to start discovery service: {e}")
@@ -122,6 +177,9 @@ class NodeDiscovery:
         if self.transport:
             self.transport.close()
             self.running = False
+            if self._announce_wakeup:
+                self._announce_wakeup.set()
+            self.registry.stop()
             logger.info("Discovery service stopped")
     
     def _handle_discovery_message(self, data: bytes, addr: Tuple[str, int]) -> None:
@@ -134,12 +192,13 @@ class NodeDiscovery:
         try:
             message = json.loads(data.decode())
             
-            if 'type' not in message or message['type'] != 'node_announcement':
-                logger.debug(f"Received non-announcement message from {addr}")
+            message_type = message.get('type')
+            if message_type not in ('node_announcement', 'discovery_query'):
+                logger.debug(f"Received unknown discovery message from {addr}")
                 return
                 
             if 'node_id' not in message or 'port' not in message:
-                logger.warning(f"Received invalid announcement from {addr}")
+                logger.warning(f"Received invalid {message_type} from {addr}")
                 return
                 
             node_id = message['node_id']
@@ -151,44 +210,163 @@ class NodeDiscovery:
                 return
                 
             # Update the node in our discovered list
-            self.discovered_nodes[node_id] = (host, port, time.time())
-            logger.info(f"Discovered node {node_id} at {host}:{port}")
+            if self.registry.touch(node_id, host, port):
+                logger.info(f"Discovered node {node_id} at {host}:{port}")
+            else:
+                logger.debug(f"Refreshed node {node_id} at {host}:{port}")
+            
+            # Answer queries with a unicast announcement to the sender
+            if message_type == 'discovery_query':
+                self._reply_to_query(addr)
             
         except json.JSONDecodeError:
             logger.warning(f"Received invalid JSON from {addr}")
         except Exception as e:
             logger.error(f"Error handling discovery message: {e}")
     
+    def _reply_to_query(self, addr: Tuple[str, int]) -> None:
+        """Send a unicast announcement in response to a discovery query.
+        
+        Replies to the same host are rate limited so a misbehaving or
+        restarting node can't make us flood it.
+        
+        Args:
+            addr: The address (host, port) the query came from
+        """
+        now = time.time()
+        last_reply = self._query_replies.get(addr[0], 0.0)
+        if now - last_reply < self.QUERY_REPLY_INTERVAL:
+            logger.debug(f"Skipping query reply to {addr[0]}, replied recently")
+            return
+        
+        self._query_replies[addr[0]] = now
+        
+        # Drop stale entries so the table can't grow without bound
+        if len(self._query_replies) > 1024:
+            self._query_replies = {
+                h: t for h, t in self._query_replies.items()
+                if now - t < self.QUERY_REPLY_INTERVAL
+            }
+        
+        try:
+            self.transport.sendto(self._build_message('node_announcement'), addr)
+            logger.debug(f"Sent query reply to {addr[0]}:{addr[1]}")
+        except Exception as e:
+            logger.error(f"Failed to reply to discovery query from {addr}: {e}")
+    
     async def _periodic_announce(self) -> None:
-        """Periodically announce this node's presence to the network."""
+        """Announce this node's presence on an adaptive, jittered schedule.
+        
+        The interval starts at MIN_ANNOUNCE_INTERVAL and grows by
+        ANNOUNCE_BACKOFF_FACTOR after each announcement up to
+        MAX_ANNOUNCE_INTERVAL. A change of the local IP address (or an explicit
+        call to reset_announce_interval) drops it back to the minimum.
+        """
         while self.running:
             try:
+                self._check_network_change()
                 self._send_announcement()
-                await asyncio.sleep(60)  # Announce every minute
+                
+                delay = self._next_announce_delay()
+                self.announce_interval = min(self.announce_interval * self.ANNOUNCE_BACKOFF_FACTOR,
+                                             self.MAX_ANNOUNCE_INTERVAL)
+                
+                # Sleep until the next announcement, or until woken by a reset
+                self._announce_wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._announce_wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"Error in announcement task: {e}")
-                await asyncio.sleep(60)  # Still wait before trying again
+                await asyncio.sleep(self.MAX_ANNOUNCE_INTERVAL)  # Still wait before trying again
     
-    def _send_announcement(self) -> None:
-        """Send an announcement message to the network."""
-        announcement = {
-            'type': 'node_announcement',
+    def _next_announce_delay(self) -> float:
+        """Get the jittered delay before the next announcement.
+        
+        Returns:
+            The delay in seconds
+        """
+        jitter = self.announce_interval * self.ANNOUNCE_JITTER
+        return max(0.1, self.announce_interval + random.uniform(-jitter, jitter))
+    
+    def reset_announce_interval(self) -> None:
+        """Return to fast announcements, e.g. after a network change.
+        
+        The announcement task is woken so the next announcement goes out
+        immediately rather than after the current (possibly long) delay.
+        """
+        self.announce_interval = self.MIN_ANNOUNCE_INTERVAL
+        if self._announce_wakeup:
+            self._announce_wakeup.set()
+        logger.debug("Reset discovery announcement interval")
+    
+    def _check_network_change(self) -> None:
+        """Detect a change of the local IP address and re-announce quickly if so."""
+        if self.host != '0.0.0.0':
+            return
+        
+        current_ip = self._get_local_ip()
+        if current_ip != self.advertised_host:
+            logger.info(f"Local address changed from {self.advertised_host} to {current_ip}")
+            self.advertised_host = current_ip
+            self.announce_interval = self.MIN_ANNOUNCE_INTERVAL
+            self.send_query()
+    
+    def _build_message(self, message_type: str) -> bytes:
+        """Build an encoded discovery message describing this node.
+        
+        Args:
+            message_type: Either 'node_announcement' or 'discovery_query'
+            
+        Returns:
+            The encoded message
+        """
+        message = {
+            'type': message_type,
             'node_id': self.node_id,
             'host': self.advertised_host,
             'port': self.port
         }
+        return json.dumps(message).encode()
+    
+    def _group_address(self) -> Tuple[str, int]:
+        """Get the address that network-wide discovery messages are sent to.
         
-        data = json.dumps(announcement).encode()
+        Returns:
+            The multicast group if configured, otherwise the broadcast address
+        """
+        if self.multicast_group:
+            return (self.multicast_group, self.discovery_port)
+        return ('255.255.255.255', self.discovery_port)  # Standard broadcast address
+    
+    def send_query(self) -> None:
+        """Ask all nodes on the network to announce themselves to us directly.
+        
+        Receivers record us from the query itself and reply with a unicast
+        announcement, so both sides learn about each other within one round trip.
+        """
+        if not self.transport:
+            return
         
-        # Broadcast on the local network
         try:
-            broadcast_address = '255.255.255.255'  # Standard broadcast address
-            self.transport.sendto(data, (broadcast_address, self.discovery_port))
-            logger.debug("Sent node announcement via broadcast")
+            self.transport.sendto(self._build_message('discovery_query'), self._group_address())
+            logger.debug("Sent discovery query")
         except Exception as e:
-            logger.error(f"Failed to send broadcast: {e}")
+            logger.error(f"Failed to send discovery query: {e}")
+    
+    def _send_announcement(self) -> None:
+        """Send an announcement message to the network."""
+        data = self._build_message('node_announcement')
+        
+        # Broadcast (or multicast) on the local network
+        try:
+            self.transport.sendto(data, self._group_address())
+            logger.debug("Sent node announcement")
+        except Exception as e:
+            logger.error(f"Failed to send announcement: {e}")
 
     def _send_direct_announcement(self, host: str, port: int) -> None:
         """Send an announcement message directly to a specific peer.
@@ -197,14 +375,7 @@ class NodeDiscovery:
             host: The host address to send to
             port: The port to send to (should be discovery_port, not regular port)
         """
-        announcement = {
-            'type': 'node_announcement',
-            'node_id': self.node_id,
-            'host': self.advertised_host,
-            'port': self.port
-        }
-        
-        data = json.dumps(announcement).encode()
+        data = self._build_message('node_announcement')
         
         # Send directly to the peer's discovery port
         try:
@@ -213,37 +384,13 @@ class NodeDiscovery:
         except Exception as e:
             logger.error(f"Failed to send direct announcement to {host}:{self.discovery_port}: {e}")
 
-    async def _cleanup_old_nodes(self) -> None:
-        """Periodically clean up nodes that haven't been seen recently."""
-        while self.running:
-            try:
-                current_time = time.time()
-                expired_nodes = []
-                
-                for node_id, (host, port, last_seen) in self.discovered_nodes.items():
-                    # If we haven't seen this node in 5 minutes, remove it
-                    if current_time - last_seen > 300:
-                        expired_nodes.append(node_id)
-                
-                for node_id in expired_nodes:
-                    logger.info(f"Node {node_id} expired from discovery")
-                    del self.discovered_nodes[node_id]
-                
-                await asyncio.sleep(60)  # Check every minute
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                logger.error(f"Error in cleanup task: {e}")
-                await asyncio.sleep(60)  # Still wait before trying again
-    
     def get_discovered_nodes(self) -> List[Tuple[str, str, int]]:
         """Get a list of all discovered nodes.
         
         Returns:
             List of tuples (node_id, host, port)
         """
-        return [(node_id, host, port) 
-                for node_id, (host, port, _) in self.discovered_nodes.items()]
+        return self.registry.get_nodes()
     
     def add_known_node(self, node_id: str, host: str, port: int) -> None:
         """Manually add a known node to the discovery list.
@@ -253,5 +400,5 @@ class NodeDiscovery:
             host: The host IP address of the node
             port: The port number the node is listening on
         """
-        self.discovered_nodes[node_id] = (host, port, time.time())
+        self.registry.touch(node_id, host, port)
         logger.info(f"Manually added node {node_id} at {host}:{port}")
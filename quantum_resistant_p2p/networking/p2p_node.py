@@ -5,29 +5,50 @@ P2P Node implementation for quantum-resistant P2P communication.
 import asyncio
 import logging
 import json
-from typing import Dict, List, Optional, Callable, Any, Tuple, Set
+import mmap
+import time
+from typing import Dict, List, Optional, Callable, Any, Tuple, Set, Union
 import uuid
 import struct
 
 from .node_identity import load_or_generate_node_id
+from .peer_registry import PeerRegistry
+from .peer_link import PeerLink, FRAMING_V2, FRAMING_VERSION
+from .reassembly import Reassembly, ReassemblyBudget, ReassemblyLimits
 
 logger = logging.getLogger(__name__)
 
+# Frame types, given by the first byte of every frame
+FRAME_MESSAGE = 0x00   # A whole message
+FRAME_CHUNKED = 0x01   # The header of a chunked message
+FRAME_CHUNK = 0x02     # One chunk of a chunked message (framing version 2)
+
 
 class P2PNode:
     """A peer-to-peer network node supporting direct communication between peers."""
     
+    MAX_HELLO_SIZE = 64 * 1024  # Largest message accepted before the hello exchange
+    
     def __init__(self, host: str = '0.0.0.0', port: int = 8000, node_id: Optional[str] = None,
-                 max_chunk_size: int = 64*1024, node_discovery=None, key_storage=None):
+                 max_chunk_size: int = 1024*1024, node_discovery=None, key_storage=None,
+                 peer_registry: Optional[PeerRegistry] = None, adaptive_chunk_size: bool = True,
+                 reassembly_limits: Optional[ReassemblyLimits] = None):
         """Initialize a new P2P node.
         
         Args:
             host: The host IP address to bind to
             port: The port number to listen on
             node_id: Unique identifier for this node. If None, a persistent ID will be loaded or generated.
-            max_chunk_size: Maximum size of message chunks in bytes
+            max_chunk_size: Largest message chunk sent or accepted, in bytes. The chunk
+                            size of a connection is negotiated with the peer up to this.
             node_discovery: Optional reference to the NodeDiscovery instance
             key_storage: Optional reference to KeyStorage for secure node ID storage
+            peer_registry: Optional PeerRegistry holding the session of every peer.
+                           A new one is created if not given; share it with NodeDiscovery.
+            adaptive_chunk_size: Whether to tune the chunk size of each connection to
+                                 its throughput and round trip time
+            reassembly_limits: Limits on the size of incoming messages and on the bytes
+                               each peer may have in flight. Defaults to ReassemblyLimits().
         """
         self.host = host
         self.port = port
@@ -35,19 +56,38 @@ class P2PNode:
         # KeyStorage is passed for secure storage if available
         self.node_id = load_or_generate_node_id(key_storage, node_id)
         self.max_chunk_size = max_chunk_size
-        self.peers: Dict[str, Tuple[str, int]] = {}  # node_id -> (host, port)
-        self.connections: Dict[str, asyncio.StreamWriter] = {}  # node_id -> writer
+        self.adaptive_chunk_size = adaptive_chunk_size
+        self.reassembly_limits = reassembly_limits if reassembly_limits is not None else ReassemblyLimits()
+        # Reassembly budget of each peer, shared by its connections
+        self._reassembly_budgets: Dict[str, ReassemblyBudget] = {}
         self.server = None
         self.message_handlers: Dict[str, List[Callable]] = {}
         self.connection_handlers: Set[Callable[[str], None]] = set()
         self.running = False
         self.node_discovery = node_discovery  # Store reference to NodeDiscovery
+        self.peer_registry = peer_registry if peer_registry is not None else PeerRegistry()
+        
+        # Round trip measurements for tuning the chunk size
+        self.register_message_handler('ping', self._handle_ping)
+        self.register_message_handler('pong', self._handle_pong)
         
         if key_storage:
             logger.info(f"P2P Node initialized with secure persistent ID: {self.node_id[:8]}...")
         else:
             logger.info(f"P2P Node initialized with persistent ID: {self.node_id[:8]}...")
     
+    @property
+    def peers(self) -> Dict[str, Tuple[str, int]]:
+        """Connected peers as a mapping of node_id -> (host, port)."""
+        return {peer_id: self.peer_registry.get_session(peer_id).remote_address
+                for peer_id in self.peer_registry.get_connected()}
+    
+    @property
+    def connections(self) -> Dict[str, asyncio.StreamWriter]:
+        """Open connections as a mapping of node_id -> writer."""
+        return {peer_id: self.peer_registry.get_session(peer_id).writer
+                for peer_id in self.peer_registry.get_connected()}
+    
     async def start(self) -> None:
         """Start the P2P node server."""
         self.server = await asyncio.start_server(
@@ -68,14 +108,14 @@ class P2PNode:
             self.running = False
             
             # Close all connections
-            for writer in self.connections.values():
+            for peer_id, writer in self.connections.items():
+                self.peer_registry.disconnect(peer_id, writer)
                 writer.close()
                 try:
                     await writer.wait_closed()
                 except Exception as e:
                     logger.error(f"Error closing connection: {e}")
             
-            self.connections.clear()
             logger.info(f"P2P Node {self.node_id} stopped")
     
     def register_connection_handler(self, handler: Callable[[str], None]) -> None:
@@ -121,8 +161,8 @@ class P2PNode:
                 return
 
             try:
-                message = json.loads(data.decode())
-            except json.JSONDecodeError:
+                message = json.loads(str(data, 'utf-8'))
+            except (json.JSONDecodeError, UnicodeDecodeError):
                 logger.error(f"Invalid JSON received from {peer_address}, closing connection")
                 writer.close()
                 return
@@ -137,31 +177,42 @@ class P2PNode:
 
             # Send our own hello message if not already sent
             if message.get('type') == 'hello':
+                link = self._open_link(peer_id, message)
                 response = {
                     'node_id': self.node_id,
-                    'type': 'hello_response'
+                    'type': 'hello_response',
+                    **self._framing_parameters()
                 }
                 response_json = json.dumps(response).encode()
                 await self._send_chunked_message(writer, response_json)
                 logger.debug(f"Sent hello response to {peer_id}")
+            else:
+                link = self._open_link(peer_id)
 
             # Store peer information
-            self.peers[peer_id] = (peer_host, peer_port)
-            self.connections[peer_id] = writer
+            self.peer_registry.connect(peer_id, writer, (peer_host, peer_port), link)
 
-            logger.info(f"Registered peer {peer_id} at {peer_host}:{peer_port}")
+            logger.info(f"Registered peer {peer_id} at {peer_host}:{peer_port} "
+                        f"(framing version {link.version})")
 
             # Notify connection handlers about the new peer
             await self._notify_connection_handlers(peer_id)
 
+            if link.rtt_due():
+                asyncio.create_task(self._measure_rtt(peer_id))
+
             # Handle incoming messages
             while True:
-                data = await self._read_message(reader)
+                data = await self._read_message(reader, link)
                 if not data:
                     logger.info(f"Connection closed by peer {peer_id}")
                     break
                 
-                await self._process_message(peer_id, data)
+                try:
+                    await self._process_message(peer_id, data)
+                finally:
+                    # Unmap a spilled message and return it to the budget
+                    link.message_processed()
 
         except (asyncio.CancelledError, ConnectionError) as e:
             logger.error(f"Connection error with {peer_address}: {e}")
@@ -170,10 +221,9 @@ class P2PNode:
         finally:
             # Clean up
             if 'peer_id' in locals():
-                if peer_id in self.peers:
-                    del self.peers[peer_id]
-                if peer_id in self.connections:
-                    del self.connections[peer_id]
+                self.peer_registry.disconnect(peer_id, writer)
+            if 'link' in locals():
+                self._close_link(peer_id, link)
 
             writer.close()
             try:
@@ -195,22 +245,24 @@ class P2PNode:
         logger.info(f"Attempting to connect to peer at {host}:{port}")
     
         # First check if we're already connected to this peer by host and port
-        for peer_id, (peer_host, peer_port) in self.peers.items():
-            if peer_host == host and peer_port == port:
-                logger.info(f"Already connected to peer {peer_id} at {host}:{port}")
-                return True
+        session = self.peer_registry.find_by_address(host, port)
+        if session and session.is_connected:
+            logger.info(f"Already connected to peer {session.node_id} at {host}:{port}")
+            return True
     
         try:
             reader, writer = await asyncio.open_connection(host, port)
     
-            # Send initial message with our node ID
+            # Send initial message with our node ID and framing parameters
             initial_message = {
                 'node_id': self.node_id,
-                'type': 'hello'
+                'type': 'hello',
+                **self._framing_parameters()
             }
             initial_json = json.dumps(initial_message).encode()
     
             # Use chunked sending
+            hello_sent = time.monotonic()
             await self._send_chunked_message(writer, initial_json)
             logger.debug(f"Sent hello message to {host}:{port}")
     
@@ -227,8 +279,8 @@ class P2PNode:
                 return False
     
             try:
-                message = json.loads(data.decode())
-            except json.JSONDecodeError:
+                message = json.loads(str(data, 'utf-8'))
+            except (json.JSONDecodeError, UnicodeDecodeError):
                 logger.error(f"Invalid JSON response from peer at {host}:{port}")
                 writer.close()
                 return False
@@ -246,14 +298,18 @@ class P2PNode:
                 writer.close()
                 return False
     
+            # The hello exchange took one round trip
+            link = self._open_link(peer_id, message)
+            if link.adaptive:
+                link.record_rtt(time.monotonic() - hello_sent)
+    
             # Store peer information
-            self.peers[peer_id] = (host, port)
-            self.connections[peer_id] = writer
+            self.peer_registry.connect(peer_id, writer, (host, port), link)
     
-            logger.info(f"Connected to peer {peer_id} at {host}:{port}")
+            logger.info(f"Connected to peer {peer_id} at {host}:{port} (framing version {link.version})")
     
             # Start a task to handle messages from this peer
-            asyncio.create_task(self._handle_peer_messages(peer_id, reader))
+            asyncio.create_task(self._handle_peer_messages(peer_id, reader, link))
     
             # Notify connection handlers
             await self._notify_connection_handlers(peer_id)
@@ -274,62 +330,176 @@ class P2PNode:
             logger.error(f"Unexpected error connecting to peer at {host}:{port}: {e}")
             return False
 
-    async def _read_message(self, reader: asyncio.StreamReader) -> Optional[bytes]:
+    def _framing_parameters(self) -> Dict[str, int]:
+        """Get the framing parameters announced in hello messages.
+
+        Returns:
+            Dict with the framing version and the largest chunk this node accepts
+        """
+        return {
+            'framing': FRAMING_VERSION,
+            'max_chunk_size': self.max_chunk_size
+        }
+
+    def _open_link(self, peer_id: str, hello: Optional[Dict[str, Any]] = None) -> PeerLink:
+        """Create the framing state of a new connection to a peer.
+        
+        Args:
+            peer_id: The ID of the peer
+            hello: The peer's hello or hello_response, None if it sent neither
+            
+        Returns:
+            The link, drawing from the peer's reassembly budget
+        """
+        budget = self._reassembly_budgets.get(peer_id)
+        if budget is None:
+            budget = self._reassembly_budgets[peer_id] = ReassemblyBudget(self.reassembly_limits)
+        if hello is None:
+            return PeerLink(budget=budget)
+        return PeerLink.negotiate(hello, self.max_chunk_size, self.adaptive_chunk_size, budget)
+
+    def _close_link(self, peer_id: str, link: PeerLink) -> None:
+        """Drop the framing state of a closed connection.
+        
+        Args:
+            peer_id: The ID of the peer
+            link: The link of the connection
+        """
+        link.close()
+        if link.budget.links == 0 and self._reassembly_budgets.get(peer_id) is link.budget:
+            del self._reassembly_budgets[peer_id]
+
+    def _check_message_size(self, length: int, link: Optional[PeerLink]) -> None:
+        """Check the size of a message sent in a single frame.
+        
+        Args:
+            length: The size of the message
+            link: The framing state of the connection, None before the hello exchange
+            
+        Raises:
+            ValueError: If the message is too large
+        """
+        if link is None:
+            limit = self.MAX_HELLO_SIZE
+        elif link.version >= FRAMING_V2:
+            # Larger messages are sent in chunks
+            limit = link.max_chunk_size
+        else:
+            link.budget.check(length)
+            return
+        if length > limit:
+            raise ValueError(f"Message of {length} bytes exceeds the limit of {limit} bytes")
+
+    def _check_chunk_length(self, length: int, reassembly: Reassembly,
+                            link: Optional[PeerLink]) -> None:
+        """Check the length of a chunk before reading it.
+        
+        Args:
+            length: The length announced for the chunk
+            reassembly: The message the chunk belongs to
+            link: The framing state of the connection, None before the hello exchange
+            
+        Raises:
+            ValueError: If the chunk is larger than a chunk may be, or than
+                        the rest of the message
+        """
+        limit = self.MAX_HELLO_SIZE if link is None else link.max_chunk_size
+        if length > limit:
+            raise ValueError(f"Chunk of {length} bytes exceeds the limit of {limit} bytes")
+        remaining = reassembly.total_length - reassembly.received
+        if length > remaining:
+            raise ValueError(f"Chunk of {length} bytes overruns the message length "
+                             f"{reassembly.total_length} ({remaining} bytes left)")
+
+    async def _read_message(self, reader: asyncio.StreamReader, link: Optional[PeerLink] = None
+                            ) -> Optional[Union[bytes, bytearray, mmap.mmap]]:
         """Read a complete message that may be split into chunks.
         
+        On version 2 links, the chunks of several messages may be interleaved
+        with each other and with whole messages; frames are read until one of
+        the messages is complete.
+        
+        Message sizes are checked against the peer's reassembly budget before
+        anything is allocated, and large messages are reassembled on disk.
+        
         Args:
             reader: The stream reader to read from
+            link: The framing state of the connection, None before the hello exchange
             
         Returns:
-            The complete message as bytes, or None if connection closed
+            The complete message as a bytes-like object (a read-only memory map
+            if it was reassembled on disk), or None if connection closed.
+            A reassembled message holds its share of the peer's budget until
+            link.message_processed() is called.
         """
+        interleaved = link is not None and link.version >= FRAMING_V2
+        reassembly = None
         try:
-            # Read message header (1 byte for flags)
-            header = await reader.readexactly(1)
-            if not header:
-                return None
-                
-            flags = header[0]
-            is_chunked = (flags & 0x01) == 0x01
-            
-            if not is_chunked:
-                # Simple message - read length and then data
-                length_bytes = await reader.readexactly(4)
-                length = struct.unpack("!I", length_bytes)[0]
-                
-                # Read the entire message
-                data = await reader.readexactly(length)
-                return data
-            else:
-                # Chunked message - handle reassembly
-                message_id_bytes = await reader.readexactly(16)  # UUID as bytes
-                total_chunks_bytes = await reader.readexactly(4)
-                total_chunks = struct.unpack("!I", total_chunks_bytes)[0]
-                total_length_bytes = await reader.readexactly(4)
-                total_length = struct.unpack("!I", total_length_bytes)[0]
+            while True:
+                # Read the frame type (1 byte)
+                header = await reader.readexactly(1)
+                frame_type = header[0]
                 
-                # Prepare buffer for reassembly
-                message_buffer = bytearray(total_length)
-                chunks_received = 0
+                if frame_type == FRAME_MESSAGE:
+                    # Simple message - read length and then data
+                    length = struct.unpack("!I", await reader.readexactly(4))[0]
+                    self._check_message_size(length, link)
+                    if link is None or length <= link.max_chunk_size:
+                        return await reader.readexactly(length)
+                    
+                    # Version 1 peers may send large messages whole; read them
+                    # in pieces within the budget like a chunked message
+                    reassembly = link.budget.open(length)
+                    while not reassembly.complete:
+                        piece = min(link.max_chunk_size, length - reassembly.received)
+                        reassembly.add(reassembly.next_index, await reader.readexactly(piece))
+                    message, reassembly = link.deliver(reassembly), None
+                    return message
                 
-                # Read all chunks
-                while chunks_received < total_chunks:
-                    # Read chunk header
-                    chunk_index_bytes = await reader.readexactly(4)
-                    chunk_index = struct.unpack("!I", chunk_index_bytes)[0]
-                    chunk_length_bytes = await reader.readexactly(4)
-                    chunk_length = struct.unpack("!I", chunk_length_bytes)[0]
+                if frame_type == FRAME_CHUNKED:
+                    message_id = await reader.readexactly(16)  # UUID as bytes
+                    total_chunks, total_length = struct.unpack("!II", await reader.readexactly(8))
                     
-                    # Read chunk data
-                    chunk_data = await reader.readexactly(chunk_length)
+                    if link is None:
+                        self._check_message_size(total_length, link)
+                        reassembly = Reassembly(total_length, total_chunks)
+                    else:
+                        reassembly = link.budget.open(total_length,
+                                                      None if interleaved else total_chunks)
                     
-                    # Calculate offset in the buffer
-                    offset = chunk_index * self.max_chunk_size
-                    message_buffer[offset:offset+chunk_length] = chunk_data
+                    if interleaved:
+                        # The chunks follow in frames of their own
+                        if message_id in link.inflight:
+                            raise ValueError("Duplicate chunked message ID")
+                        link.inflight[message_id] = reassembly
+                        reassembly = None
+                        continue
                     
-                    chunks_received += 1
+                    # Version 1 - the chunks follow the header
+                    while not reassembly.complete:
+                        chunk_index, chunk_length = struct.unpack("!II", await reader.readexactly(8))
+                        self._check_chunk_length(chunk_length, reassembly, link)
+                        reassembly.add(chunk_index, await reader.readexactly(chunk_length))
+                    if link is None:
+                        message, reassembly = reassembly.result(), None
+                    else:
+                        message, reassembly = link.deliver(reassembly), None
+                    return message
                 
-                return bytes(message_buffer)
+                if frame_type == FRAME_CHUNK and interleaved:
+                    message_id = await reader.readexactly(16)
+                    chunk_index, chunk_length = struct.unpack("!II", await reader.readexactly(8))
+                    inflight = link.inflight.get(message_id)
+                    if inflight is None:
+                        raise ValueError("Chunk of an unknown message")
+                    self._check_chunk_length(chunk_length, inflight, link)
+                    
+                    if inflight.add(chunk_index, await reader.readexactly(chunk_length)):
+                        del link.inflight[message_id]
+                        return link.deliver(inflight)
+                    continue
+                
+                raise ValueError(f"Unknown frame type {frame_type}")
                 
         except asyncio.IncompleteReadError:
             logger.error("Connection closed while reading message")
@@ -337,80 +507,172 @@ class P2PNode:
         except Exception as e:
             logger.error(f"Error reading message: {e}")
             return None
+        finally:
+            if reassembly is not None:
+                reassembly.discard()
 
-    async def _send_chunked_message(self, writer: asyncio.StreamWriter, data: bytes) -> bool:
+    async def _send_chunked_message(self, writer: asyncio.StreamWriter, data: bytes,
+                                    link: Optional[PeerLink] = None) -> bool:
         """Send a potentially large message by splitting it into chunks.
         
         Args:
             writer: The stream writer to write to
             data: The message data to send
+            link: The framing state of the connection. Before the hello exchange
+                  it is None, and version 1 framing with max_chunk_size is used.
             
         Returns:
             True if successfully sent, False otherwise
         """
         try:
-            total_length = len(data)
-            
-            # Determine if we need chunking
-            if total_length <= self.max_chunk_size:
-                # Simple message - no chunking needed
-                header = bytes([0x00])  # Flag byte - no chunking
-                length_bytes = struct.pack("!I", total_length)
-                
-                # Write header, length, and data
-                writer.write(header + length_bytes + data)
-                await writer.drain()
+            if link is None:
+                await self._write_message(writer, data, self.max_chunk_size)
+            elif link.version < FRAMING_V2:
+                # The chunks must follow the header, so the message is sent in one turn
+                async with link.turn():
+                    await self._write_message(writer, data, link.chunk_size)
             else:
-                # Chunked message
-                header = bytes([0x01])  # Flag byte - chunked
-                message_id = uuid.uuid4().bytes  # 16 bytes
-                
-                # Calculate number of chunks
-                total_chunks = (total_length + self.max_chunk_size - 1) // self.max_chunk_size
-                
-                # Write message header
-                writer.write(header)
-                writer.write(message_id)
-                writer.write(struct.pack("!I", total_chunks))
-                writer.write(struct.pack("!I", total_length))
-                await writer.drain()
-                
-                # Send chunks
-                for i in range(total_chunks):
-                    start = i * self.max_chunk_size
-                    end = min(start + self.max_chunk_size, total_length)
-                    chunk_data = data[start:end]
-                    chunk_length = len(chunk_data)
-                    
-                    # Write chunk header
-                    writer.write(struct.pack("!I", i))  # Chunk index
-                    writer.write(struct.pack("!I", chunk_length))
-                    
-                    # Write chunk data
-                    writer.write(chunk_data)
-                    await writer.drain()
+                await self._write_interleaved_message(writer, data, link)
             
             return True
             
         except Exception as e:
             logger.error(f"Error sending chunked message: {e}")
             return False
+
+    async def _write_message(self, writer: asyncio.StreamWriter, data: bytes, chunk_size: int) -> None:
+        """Write a message in version 1 framing, with the chunks after the header.
+        
+        Args:
+            writer: The stream writer to write to
+            data: The message data to send
+            chunk_size: The size of the chunks
+        """
+        total_length = len(data)
+        
+        # Determine if we need chunking
+        if total_length <= chunk_size:
+            # Simple message - no chunking needed
+            writer.write(struct.pack("!BI", FRAME_MESSAGE, total_length) + data)
+            await writer.drain()
+            return
+        
+        # Chunked message
+        message_id = uuid.uuid4().bytes  # 16 bytes
+        total_chunks = (total_length + chunk_size - 1) // chunk_size
+        
+        # Write message header
+        writer.write(struct.pack("!B16sII", FRAME_CHUNKED, message_id, total_chunks, total_length))
+        await writer.drain()
+        
+        # Send chunks, as views so the data isn't copied
+        view = memoryview(data)
+        for i in range(total_chunks):
+            chunk_data = view[i * chunk_size:(i + 1) * chunk_size]
+            
+            # Write chunk header (index and length) and data
+            writer.write(struct.pack("!II", i, len(chunk_data)))
+            writer.write(chunk_data)
+            await writer.drain()
+
+    async def _write_interleaved_message(self, writer: asyncio.StreamWriter, data: bytes,
+                                         link: PeerLink) -> None:
+        """Write a message in version 2 framing, taking a turn per chunk.
+        
+        The chunk size is taken from the link before every chunk, and other
+        messages may be sent between the chunks. The header announces no
+        chunk count, since it isn't known in advance.
+        
+        Args:
+            writer: The stream writer to write to
+            data: The message data to send
+            link: The framing state of the connection
+        """
+        total_length = len(data)
+        message_id = uuid.uuid4().bytes
+        
+        async with link.turn():
+            if total_length <= link.next_chunk_size():
+                writer.write(struct.pack("!BI", FRAME_MESSAGE, total_length) + data)
+                await writer.drain()
+                return
+            writer.write(struct.pack("!B16sII", FRAME_CHUNKED, message_id, 0, total_length))
+        
+        view = memoryview(data)
+        offset = index = 0
+        busy = 0.0
+        while offset < total_length:
+            async with link.turn():
+                started = time.perf_counter()
+                end = min(offset + link.next_chunk_size(), total_length)
+                writer.write(struct.pack("!B16sII", FRAME_CHUNK, message_id, index, end - offset))
+                writer.write(view[offset:end])
+                await writer.drain()
+                busy += time.perf_counter() - started
+            offset = end
+            index += 1
+        
+        link.record_transfer(total_length, busy)
+
+    async def _measure_rtt(self, peer_id: str) -> None:
+        """Send a ping to measure the round trip time to a peer, if it's due.
+        
+        Args:
+            peer_id: The ID of the peer
+        """
+        session = self.peer_registry.get_session(peer_id)
+        link = session.link if session else None
+        if link is None or not link.rtt_due():
+            return
+        link.rtt_probed_at = time.monotonic()
+        await self.send_message(peer_id, 'ping', sent=time.monotonic())
+
+    async def _handle_ping(self, peer_id: str, message: Dict[str, Any]) -> None:
+        """Answer a round trip measurement of a peer.
+        
+        Args:
+            peer_id: The ID of the peer
+            message: The ping message
+        """
+        await self.send_message(peer_id, 'pong', sent=message.get('sent'))
+
+    async def _handle_pong(self, peer_id: str, message: Dict[str, Any]) -> None:
+        """Record the round trip time measured by a ping.
+        
+        Args:
+            peer_id: The ID of the peer
+            message: The pong message, echoing the time the ping was sent
+        """
+        session = self.peer_registry.get_session(peer_id)
+        sent = message.get('sent')
+        if session and session.link and isinstance(sent, (int, float)):
+            session.link.record_rtt(time.monotonic() - sent)
                     
-    async def _handle_peer_messages(self, peer_id: str, reader: asyncio.StreamReader) -> None:
+    async def _handle_peer_messages(self, peer_id: str, reader: asyncio.StreamReader,
+                                    link: Optional[PeerLink] = None) -> None:
         """Handle messages from a connected peer.
     
         Args:
             peer_id: The ID of the peer
             reader: The stream reader for the connection
+            link: The framing state of the connection
         """
+        session = self.peer_registry.get_session(peer_id)
+        writer = session.writer if session else None
+        
         try:
             while True:
-                data = await self._read_message(reader)
+                data = await self._read_message(reader, link)
                 if not data:
                     logger.info(f"Connection closed by peer {peer_id}")
                     break
                 
-                await self._process_message(peer_id, data)
+                try:
+                    await self._process_message(peer_id, data)
+                finally:
+                    # Unmap a spilled message and return it to the budget
+                    if link is not None:
+                        link.message_processed()
     
         except (asyncio.CancelledError, ConnectionError) as e:
             logger.error(f"Error reading from peer {peer_id}: {e}")
@@ -427,24 +689,24 @@ class P2PNode:
                 except Exception as e:
                     logger.error(f"Error in connection handler for disconnect of peer {peer_id}: {e}")
             
-            # Now remove the peer from our collections
-            if peer_id in self.peers:
-                del self.peers[peer_id]
-            if peer_id in self.connections:
-                self.connections[peer_id].close()
-                del self.connections[peer_id]
+            # Now drop the connection from the peer's session
+            if writer:
+                writer.close()
+            self.peer_registry.disconnect(peer_id, writer)
+            if link is not None:
+                self._close_link(peer_id, link)
     
             logger.info(f"Connection with peer {peer_id} closed")
     
-    async def _process_message(self, peer_id: str, data: bytes) -> None:
+    async def _process_message(self, peer_id: str, data: Union[bytes, bytearray, mmap.mmap]) -> None:
         """Process a message received from a peer.
         
         Args:
             peer_id: The ID of the peer who sent the message
-            data: The raw message data
+            data: The raw message data, as returned by _read_message
         """
         try:
-            message = json.loads(data.decode())
+            message = json.loads(str(data, 'utf-8'))
             
             if 'type' not in message:
                 logger.warning(f"Received message without type from {peer_id}")
@@ -453,6 +715,10 @@ class P2PNode:
             message_type = message['type']
             logger.debug(f"Received message of type {message_type} from {peer_id}")
             
+            session = self.peer_registry.get_session(peer_id)
+            if session:
+                session.record_received(len(data))
+            
             # Call registered handlers for this message type
             if message_type in self.message_handlers:
                 for handler in self.message_handlers[message_type]:
@@ -463,7 +729,7 @@ class P2PNode:
             else:
                 logger.debug(f"No handler for message type {message_type} from {peer_id}")
                 
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, UnicodeDecodeError):
             logger.warning(f"Received invalid JSON from {peer_id}")
         except Exception as e:
             logger.error(f"Error processing message from {peer_id}: {e}")
@@ -479,9 +745,11 @@ class P2PNode:
         Returns:
             bool: True if message was sent, False otherwise
         """
-        if peer_id not in self.connections:
+        session = self.peer_registry.get_session(peer_id)
+        if session is None or not session.is_connected:
             logger.error(f"Cannot send message to unknown peer {peer_id}")
             return False
+        writer = session.writer
 
         try:
             message = {
@@ -490,14 +758,17 @@ class P2PNode:
                 **kwargs
             }
 
-            writer = self.connections[peer_id]
             message_json = json.dumps(message).encode()
 
             # Use chunked sending
-            success = await self._send_chunked_message(writer, message_json)
+            link = session.link
+            success = await self._send_chunked_message(writer, message_json, link)
 
             if success:
+                session.record_sent(len(message_json))
                 logger.debug(f"Sent {message_type} message to {peer_id}")
+                if link is not None and link.rtt_due():
+                    asyncio.create_task(self._measure_rtt(peer_id))
                 return True
             else:
                 logger.error(f"Failed to send message to {peer_id}")
@@ -507,15 +778,12 @@ class P2PNode:
         except Exception as e:
             logger.error(f"Unexpected error sending message to {peer_id}: {e}")
 
-        # Remove the peer if we can't send to them
-        if peer_id in self.peers:
-            del self.peers[peer_id]
-        if peer_id in self.connections:
-            try:
-                self.connections[peer_id].close()
-            except Exception:
-                pass
-            del self.connections[peer_id]
+        # Drop the connection if we can't send to them
+        try:
+            writer.close()
+        except Exception:
+            pass
+        self.peer_registry.disconnect(peer_id, writer)
 
         return False
 
@@ -539,7 +807,7 @@ class P2PNode:
         Returns:
             List of peer IDs
         """
-        return list(self.peers.keys())
+        return self.peer_registry.get_connected()
 
     def get_peer_info(self, peer_id: str) -> Optional[Tuple[str, int]]:
         """Get the host and port for a specific peer.
@@ -550,4 +818,7 @@ class P2PNode:
         Returns:
             Tuple of (host, port) if the peer exists, None otherwise
         """
-        return self.peers.get(peer_id)
\ No newline at end of file
+        session = self.peer_registry.get_session(peer_id)
+        if session is None or not session.is_connected:
+            return None
+        return session.remote_address
\ No newline at end of file
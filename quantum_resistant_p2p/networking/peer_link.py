@@ -0,0 +1,239 @@
+"""
+Framing state of a single connection between two P2P nodes.
+"""
+
+import asyncio
+import contextlib
+import logging
+import mmap
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Union
+
+from .reassembly import Reassembly, ReassemblyBudget
+
+logger = logging.getLogger(__name__)
+
+# Framing versions. Version 1 sends the chunks of a message right after its
+# header, and receivers place them at index * their own chunk size. Version 2
+# sends every chunk as a frame of its own, tagged with the message ID, so
+# other messages can be sent between the chunks of a large one, and chunk
+# sizes may change within a message.
+FRAMING_V1 = 1
+FRAMING_V2 = 2
+FRAMING_VERSION = FRAMING_V2
+
+# Version 1 receivers assume the sender uses their chunk size, which is the
+# default of nodes that don't negotiate it
+LEGACY_CHUNK_SIZE = 64 * 1024
+
+
+class PeerLink:
+    """Framing state of one connection: how messages are split and sent.
+
+    The framing version and the largest chunk either side accepts are agreed
+    in the hello exchange. On version 2 links, the chunk size then follows
+    the measured throughput and round trip time of the connection: a chunk
+    should take about TARGET_CHUNK_TIME or one round trip to send, whichever
+    is longer, so fast links use fewer, larger chunks. Senders take turns
+    per chunk, and while another message is waiting for its turn, chunks are
+    cut down to MIN_CHUNK_SIZE so it isn't held up behind a large one.
+
+    Version 1 links keep the fixed chunk size of the peer and send each
+    message in one turn.
+
+    Incoming messages are reassembled within the ReassemblyBudget of the
+    peer, which all of its connections share, and stay charged to it until
+    message_processed() is called.
+    """
+
+    MIN_CHUNK_SIZE = 16 * 1024
+    INITIAL_CHUNK_SIZE = 64 * 1024
+    TARGET_CHUNK_TIME = 0.005  # Seconds a chunk should take to send
+    SMOOTHING = 0.25           # Weight of a new sample in the moving averages
+    RTT_INTERVAL = 30.0        # Seconds between round trip measurements
+
+    def __init__(self, version: int = FRAMING_V1, max_chunk_size: int = LEGACY_CHUNK_SIZE,
+                 adaptive: bool = True, budget: Optional[ReassemblyBudget] = None):
+        """Initialize the state of a new connection.
+
+        Args:
+            version: The framing version agreed with the peer
+            max_chunk_size: The largest chunk both sides accept
+            adaptive: Whether to tune the chunk size on version 2 links. If not,
+                      max_chunk_size is always used.
+            budget: The reassembly budget of the peer, a new one with the
+                    default limits if None
+        """
+        self.version = version
+        self.max_chunk_size = max_chunk_size
+        self.adaptive = adaptive and version >= FRAMING_V2
+        if self.adaptive:
+            self.chunk_size = min(self.INITIAL_CHUNK_SIZE, max_chunk_size)
+        else:
+            self.chunk_size = max_chunk_size
+        self.throughput: Optional[float] = None   # Bytes per second
+        self.rtt: Optional[float] = None          # Seconds
+        # When the round trip time was last measured or a ping sent
+        self.rtt_probed_at: Optional[float] = None
+        # Chunked messages being received, by message ID (version 2)
+        self.inflight: Dict[bytes, Reassembly] = {}
+        # The reassembled message being processed, holding its share of the budget
+        self.delivered: Optional[Reassembly] = None
+        self.budget = budget if budget is not None else ReassemblyBudget()
+        self.budget.links += 1
+        self.closed = False
+        # Senders waiting for their turn
+        self.waiting = 0
+        self._send_lock = asyncio.Lock()
+
+    @classmethod
+    def negotiate(cls, hello: Dict[str, Any], max_chunk_size: int, adaptive: bool = True,
+                  budget: Optional[ReassemblyBudget] = None) -> 'PeerLink':
+        """Create the state of a connection from the peer's hello.
+
+        Args:
+            hello: The peer's hello or hello_response message
+            max_chunk_size: The largest chunk this node accepts
+            adaptive: Whether to tune the chunk size
+            budget: The reassembly budget of the peer
+
+        Returns:
+            The link
+        """
+        try:
+            version = min(int(hello.get('framing', FRAMING_V1)), FRAMING_VERSION)
+            peer_max_chunk_size = int(hello.get('max_chunk_size', LEGACY_CHUNK_SIZE))
+        except (TypeError, ValueError):
+            logger.warning("Invalid framing parameters in hello, using version 1")
+            version, peer_max_chunk_size = FRAMING_V1, LEGACY_CHUNK_SIZE
+
+        if version < FRAMING_V2:
+            # The peer reassembles chunks at index * its own chunk size
+            return cls(FRAMING_V1, LEGACY_CHUNK_SIZE, adaptive=False, budget=budget)
+        return cls(version, max(min(max_chunk_size, peer_max_chunk_size), cls.MIN_CHUNK_SIZE),
+                   adaptive=adaptive, budget=budget)
+
+    @contextlib.asynccontextmanager
+    async def turn(self) -> AsyncIterator[None]:
+        """Wait for the connection to be free and hold it while sending."""
+        self.waiting += 1
+        try:
+            await self._send_lock.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            yield
+        finally:
+            self._send_lock.release()
+
+    def next_chunk_size(self) -> int:
+        """Get the size of the next chunk to send.
+
+        Returns:
+            The chunk size in bytes
+        """
+        if self.version >= FRAMING_V2 and self.waiting:
+            # Let the waiting message go sooner
+            return min(self.MIN_CHUNK_SIZE, self.chunk_size)
+        return self.chunk_size
+
+    def record_transfer(self, size: int, seconds: float) -> None:
+        """Record how long it took to send a chunked message.
+
+        Args:
+            size: The bytes sent
+            seconds: The time spent writing them, without waiting for turns
+        """
+        if seconds <= 0:
+            return
+        sample = size / seconds
+        if self.throughput is None:
+            self.throughput = sample
+        else:
+            self.throughput += self.SMOOTHING * (sample - self.throughput)
+        self._retune()
+
+    def record_rtt(self, seconds: float) -> None:
+        """Record a measured round trip time.
+
+        Args:
+            seconds: The round trip time
+        """
+        if seconds < 0:
+            return
+        if self.rtt is None:
+            self.rtt = seconds
+        else:
+            self.rtt += self.SMOOTHING * (seconds - self.rtt)
+        self.rtt_probed_at = time.monotonic()
+        self._retune()
+
+    def rtt_due(self) -> bool:
+        """Check whether the round trip time should be measured again.
+
+        Returns:
+            True if the link is adaptive and the last measurement is stale
+        """
+        return self.adaptive and (self.rtt_probed_at is None or
+                                  time.monotonic() - self.rtt_probed_at >= self.RTT_INTERVAL)
+
+    def _retune(self) -> None:
+        """Set the chunk size from the measured throughput and round trip time."""
+        if not self.adaptive or self.throughput is None:
+            return
+        target_time = max(self.TARGET_CHUNK_TIME, self.rtt or 0.0)
+        target = int(self.throughput * target_time)
+        # Round down to a power of two so small variations don't change it
+        chunk_size = 1 << (max(target, 1).bit_length() - 1)
+        chunk_size = max(self.MIN_CHUNK_SIZE, min(chunk_size, self.max_chunk_size))
+        if chunk_size != self.chunk_size:
+            logger.debug(f"Chunk size changed from {self.chunk_size} to {chunk_size} bytes")
+            self.chunk_size = chunk_size
+
+    def deliver(self, reassembly: Reassembly) -> Union[bytearray, mmap.mmap]:
+        """Hand on a reassembled message for processing.
+
+        Args:
+            reassembly: The complete message
+
+        Returns:
+            The message, as a bytes-like object
+        """
+        self.message_processed()
+        self.delivered = reassembly
+        return reassembly.result()
+
+    def message_processed(self) -> None:
+        """Drop the delivered message and return its bytes to the peer's budget."""
+        if self.delivered is not None:
+            self.delivered.discard()
+            self.delivered = None
+
+    def close(self) -> None:
+        """Drop the messages still being received and leave the peer's budget."""
+        if self.closed:
+            return
+        self.closed = True
+        self.message_processed()
+        for reassembly in self.inflight.values():
+            reassembly.discard()
+        self.inflight.clear()
+        self.budget.links -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the framing parameters and measurements of the connection.
+
+        Returns:
+            Dict with the framing version, chunk sizes, throughput, round trip
+            time and the bytes being received
+        """
+        return {
+            "framing": self.version,
+            "chunk_size": self.chunk_size,
+            "max_chunk_size": self.max_chunk_size,
+            "adaptive": self.adaptive,
+            "throughput": self.throughput,
+            "rtt": self.rtt,
+            "inflight_messages": len(self.inflight),
+            **self.budget.get_stats(),
+        }
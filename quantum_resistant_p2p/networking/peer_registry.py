@@ -0,0 +1,475 @@
+"""
+Event-driven registry of known peers for the P2P network.
+"""
+
+import asyncio
+import heapq
+import logging
+import sys
+import time
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from .peer_session import PeerSession
+
+logger = logging.getLogger(__name__)
+
+
+class PeerEvent:
+    """Types of change reported to peer registry subscribers."""
+    ADDED = "added"
+    UPDATED = "updated"
+    REMOVED = "removed"
+
+
+class PeerRegistry:
+    """Registry of the PeerSession of every known peer.
+
+    Sessions are indexed by node ID and by address (both the discovered
+    listening address and the address of an open connection), so either
+    lookup is O(1).
+
+    Peers expire when they haven't been seen for ``ttl`` seconds and aren't
+    connected. Expiry deadlines are kept in a min-heap with one entry per peer:
+    refreshing a peer only moves its deadline in a dict, and the stale heap
+    entry is rescheduled lazily when it reaches the top. The expiry task sleeps
+    until the earliest deadline, so the work done is proportional to peer churn
+    rather than to the number of known peers.
+
+    Subscribers are called with ``(event, node_id)`` where event is one of the
+    PeerEvent values. ADDED and REMOVED refer to the list of discovered peers;
+    a changed address or connection state produces PeerEvent.UPDATED. A plain
+    refresh of a known peer does not produce an event.
+    """
+
+    DEFAULT_TTL = 300.0  # Forget peers not seen for 5 minutes
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        """Initialize an empty peer registry.
+
+        Args:
+            ttl: Seconds after the last sighting before a peer expires
+        """
+        self.ttl = ttl
+        self.sessions: Dict[str, PeerSession] = {}
+        self._by_address: Dict[Tuple[str, int], str] = {}  # (host, port) -> node_id
+        self._connected: Set[str] = set()
+        self._deadlines: Dict[str, float] = {}  # node_id -> monotonic expiry time
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._scheduled: Set[str] = set()  # node IDs that have an entry in the heap
+        self._subscribers: List[Callable[[str, str], None]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self.running = False
+
+    def subscribe(self, handler: Callable[[str, str], None]) -> None:
+        """Register a handler for peer changes.
+
+        Args:
+            handler: Callback taking (event, node_id)
+        """
+        # Avoid adding the same handler twice (bound methods compare equal, not identical)
+        if handler in self._subscribers:
+            logger.debug(f"Peer registry subscriber {handler} already registered, skipping")
+            return
+
+        self._subscribers.append(handler)
+        logger.debug(f"Registered peer registry subscriber {handler}")
+
+    def unsubscribe(self, handler: Callable[[str, str], None]) -> None:
+        """Remove a previously registered handler.
+
+        Args:
+            handler: The callback to remove
+        """
+        if handler in self._subscribers:
+            self._subscribers.remove(handler)
+
+    def _emit(self, event: str, node_id: str) -> None:
+        """Notify all subscribers about a change.
+
+        Args:
+            event: One of the PeerEvent values
+            node_id: The peer the event is about
+        """
+        for handler in list(self._subscribers):
+            try:
+                handler(event, node_id)
+            except Exception as e:
+                logger.error(f"Error in peer registry subscriber for {event} of {node_id}: {e}")
+
+    def _schedule(self, node_id: str) -> None:
+        """Move a peer's expiry deadline to ttl seconds from now.
+
+        Args:
+            node_id: The peer to reschedule
+        """
+        deadline = time.monotonic() + self.ttl
+        self._deadlines[node_id] = deadline
+
+        if node_id in self._scheduled:
+            # The existing heap entry is earlier and will be rescheduled when popped
+            return
+
+        self._scheduled.add(node_id)
+        heapq.heappush(self._expiry_heap, (deadline, node_id))
+
+        # Wake the expiry task if this is now the earliest deadline
+        if self._wakeup and self._expiry_heap[0][1] == node_id:
+            self._wakeup.set()
+
+    def _index_address(self, address: Optional[Tuple[str, int]], node_id: str) -> None:
+        """Point an address at a peer in the address index."""
+        if address is not None:
+            self._by_address[address] = node_id
+
+    def _unindex_address(self, address: Optional[Tuple[str, int]], node_id: str) -> None:
+        """Remove an address from the index if it still points at the peer."""
+        if address is not None and self._by_address.get(address) == node_id:
+            del self._by_address[address]
+
+    def get_session(self, node_id: str) -> Optional[PeerSession]:
+        """Get the session of a peer.
+
+        Args:
+            node_id: The ID of the peer
+
+        Returns:
+            The PeerSession if the peer is known, None otherwise
+        """
+        return self.sessions.get(node_id)
+
+    def ensure_session(self, node_id: str) -> PeerSession:
+        """Get the session of a peer, creating an empty one if needed.
+
+        A new session expires like any other unless the peer connects or is
+        discovered in the meantime.
+
+        Args:
+            node_id: The ID of the peer
+
+        Returns:
+            The PeerSession of the peer
+        """
+        session = self.sessions.get(node_id)
+        if session is None:
+            session = PeerSession(node_id)
+            self.sessions[node_id] = session
+            self._schedule(node_id)
+        return session
+
+    def find_by_address(self, host: str, port: int) -> Optional[PeerSession]:
+        """Find the peer listening on, or connected from, an address.
+
+        Args:
+            host: The host IP address
+            port: The port number
+
+        Returns:
+            The PeerSession if an address matches, None otherwise
+        """
+        node_id = self._by_address.get((host, port))
+        if node_id is None:
+            return None
+        return self.sessions.get(node_id)
+
+    def touch(self, node_id: str, host: str, port: int) -> bool:
+        """Record a sighting of a peer, adding it if it's unknown.
+
+        Args:
+            node_id: The ID of the peer
+            host: The host IP address of the peer
+            port: The port number the peer is listening on
+
+        Returns:
+            True if the peer was newly discovered, False if it was already known
+        """
+        session = self.ensure_session(node_id)
+        was_discovered = session.is_discovered
+        previous_address = session.address
+
+        session.host = host
+        session.port = port
+        session.last_seen = time.time()
+        self._schedule(node_id)
+
+        if previous_address != (host, port):
+            self._unindex_address(previous_address, node_id)
+            self._index_address((host, port), node_id)
+
+        if not was_discovered:
+            self._emit(PeerEvent.ADDED, node_id)
+            return True
+
+        if previous_address != (host, port):
+            self._emit(PeerEvent.UPDATED, node_id)
+        return False
+
+    def remove(self, node_id: str) -> bool:
+        """Forget a peer, dropping its whole session.
+
+        Args:
+            node_id: The ID of the peer
+
+        Returns:
+            True if the peer was known, False otherwise
+        """
+        session = self.sessions.pop(node_id, None)
+        if session is None:
+            return False
+
+        self._unindex_address(session.address, node_id)
+        self._unindex_address(session.remote_address, node_id)
+        self._connected.discard(node_id)
+        # The heap entry stays until it is popped and found to have no deadline
+        self._deadlines.pop(node_id, None)
+        self._emit(PeerEvent.REMOVED, node_id)
+        return True
+
+    def connect(self, node_id: str, writer, remote_address: Tuple[str, int],
+                link=None) -> PeerSession:
+        """Record an open connection to a peer.
+
+        Connected peers never expire.
+
+        Args:
+            node_id: The ID of the peer
+            writer: The stream writer of the connection
+            remote_address: The (host, port) the connection is with
+            link: The PeerLink holding the framing state of the connection
+
+        Returns:
+            The PeerSession of the peer
+        """
+        session = self.ensure_session(node_id)
+        self._unindex_address(session.remote_address, node_id)
+        session.mark_connected(writer, remote_address, link)
+        self._index_address(remote_address, node_id)
+        self._connected.add(node_id)
+        self._emit(PeerEvent.UPDATED, node_id)
+        return session
+
+    def disconnect(self, node_id: str, writer=None) -> bool:
+        """Record that the connection to a peer has closed.
+
+        The crypto session bound to the connection is dropped. Once
+        disconnected, a peer expires ttl seconds later unless it is seen again.
+
+        Args:
+            node_id: The ID of the peer
+            writer: If given, only disconnect if this is still the peer's
+                    current connection (a newer one may have replaced it)
+
+        Returns:
+            True if the peer was connected, False otherwise
+        """
+        session = self.sessions.get(node_id)
+        if session is None or not session.is_connected:
+            return False
+        if writer is not None and session.writer is not writer:
+            return False
+
+        self._unindex_address(session.remote_address, node_id)
+        session.mark_disconnected()
+        # Keep the discovered address indexed if the connection shared it
+        self._index_address(session.address, node_id)
+        self._connected.discard(node_id)
+        self._schedule(node_id)
+        self._emit(PeerEvent.UPDATED, node_id)
+        return True
+
+    def is_connected(self, node_id: str) -> bool:
+        """Check whether a peer is currently connected.
+
+        Args:
+            node_id: The ID of the peer
+
+        Returns:
+            True if connected, False otherwise
+        """
+        return node_id in self._connected
+
+    def get_connected(self) -> List[str]:
+        """Get the IDs of all connected peers.
+
+        Returns:
+            List of peer IDs
+        """
+        return list(self._connected)
+
+    def get(self, node_id: str) -> Optional[Tuple[str, int, float]]:
+        """Get the discovered address and last sighting of a peer.
+
+        Args:
+            node_id: The ID of the peer
+
+        Returns:
+            Tuple of (host, port, last_seen) if the peer was discovered, None otherwise
+        """
+        session = self.sessions.get(node_id)
+        if session is None or not session.is_discovered:
+            return None
+        return (session.host, session.port, session.last_seen)
+
+    def get_nodes(self) -> List[Tuple[str, str, int]]:
+        """Get a list of all discovered peers.
+
+        Returns:
+            List of tuples (node_id, host, port)
+        """
+        return [(node_id, session.host, session.port)
+                for node_id, session in self.sessions.items()
+                if session.is_discovered]
+
+    def field_view(self, field: str) -> 'SessionFieldView':
+        """Get a dict-like view of one PeerSession field keyed by node ID.
+
+        Args:
+            field: Name of a PeerSession slot or secret field
+
+        Returns:
+            A SessionFieldView over the field
+        """
+        if field not in PeerSession.__slots__ and field not in PeerSession.SECRET_FIELDS:
+            raise ValueError(f"Unknown peer session field: {field}")
+        return SessionFieldView(self, field)
+
+    def memory_footprint(self) -> Dict[str, int]:
+        """Estimate the memory used by the registry.
+
+        Returns:
+            Dict with the approximate size in bytes of the sessions, the
+            indexes and the expiry heap, and their total
+        """
+        sessions = sum(session.footprint() for session in self.sessions.values())
+        indexes = (sys.getsizeof(self.sessions) + sys.getsizeof(self._by_address)
+                   + sum(sys.getsizeof(address) for address in self._by_address)
+                   + sys.getsizeof(self._connected) + sys.getsizeof(self._deadlines)
+                   + sys.getsizeof(self._scheduled))
+        heap = sys.getsizeof(self._expiry_heap) + sum(sys.getsizeof(entry) for entry in self._expiry_heap)
+        return {
+            "peers": len(self.sessions),
+            "sessions": sessions,
+            "indexes": indexes,
+            "expiry_heap": heap,
+            "total": sessions + indexes + heap,
+        }
+
+    def next_expiry(self) -> Optional[float]:
+        """Get the number of seconds until the earliest heap entry is due.
+
+        Returns:
+            Seconds until the next expiry check, or None if nothing is scheduled
+        """
+        if not self._expiry_heap:
+            return None
+        return max(0.0, self._expiry_heap[0][0] - time.monotonic())
+
+    def expire(self) -> List[str]:
+        """Remove every peer whose deadline has passed.
+
+        Returns:
+            The IDs of the peers that expired
+        """
+        now = time.monotonic()
+        expired = []
+
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            _, node_id = heapq.heappop(self._expiry_heap)
+            self._scheduled.discard(node_id)
+
+            deadline = self._deadlines.get(node_id)
+            if deadline is None:
+                # Removed since this entry was pushed
+                continue
+
+            if node_id in self._connected:
+                deadline = now + self.ttl
+                self._deadlines[node_id] = deadline
+
+            if deadline > now:
+                # Refreshed since this entry was pushed
+                self._scheduled.add(node_id)
+                heapq.heappush(self._expiry_heap, (deadline, node_id))
+                continue
+
+            logger.info(f"Node {node_id} expired from discovery")
+            expired.append(node_id)
+            self.remove(node_id)
+
+        return expired
+
+    async def run_expiry(self) -> None:
+        """Expire peers as their deadlines pass until stop() is called."""
+        self.running = True
+        self._wakeup = asyncio.Event()
+
+        while self.running:
+            try:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.next_expiry())
+                except asyncio.TimeoutError:
+                    pass
+
+                self.expire()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error in peer expiry task: {e}")
+                await asyncio.sleep(60)  # Still wait before trying again
+
+    def stop(self) -> None:
+        """Stop the expiry task."""
+        self.running = False
+        if self._wakeup:
+            self._wakeup.set()
+
+
+class SessionFieldView(MutableMapping):
+    """Dict-like view of one PeerSession field, keyed by node ID.
+
+    Lets code that keeps per-peer values in a dictionary store them in the
+    peer's session instead. A value of None means the key is absent; setting a
+    key creates the session if the peer isn't known yet.
+    """
+
+    __slots__ = ('_registry', '_field')
+
+    def __init__(self, registry: PeerRegistry, field: str):
+        self._registry = registry
+        self._field = field
+
+    def __getitem__(self, node_id: str) -> Any:
+        session = self._registry.sessions.get(node_id)
+        value = None if session is None else getattr(session, self._field)
+        if value is None:
+            raise KeyError(node_id)
+        return value
+
+    def __setitem__(self, node_id: str, value: Any) -> None:
+        if value is None:
+            self.pop(node_id, None)
+            return
+        setattr(self._registry.ensure_session(node_id), self._field, value)
+
+    def __delitem__(self, node_id: str) -> None:
+        session = self._registry.sessions.get(node_id)
+        if session is None or getattr(session, self._field) is None:
+            raise KeyError(node_id)
+        setattr(session, self._field, None)
+
+    def __contains__(self, node_id: object) -> bool:
+        session = self._registry.sessions.get(node_id)
+        return session is not None and getattr(session, self._field) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([node_id for node_id, session in self._registry.sessions.items()
+                     if getattr(session, self._field) is not None])
+
+    def __len__(self) -> int:
+        return sum(1 for session in self._registry.sessions.values()
+                   if getattr(session, self._field) is not None)
+
+    def __repr__(self) -> str:
+        # Only show which peers have a value; the values may be key material
+        return f"SessionFieldView({self._field}, peers={list(self)!r})"
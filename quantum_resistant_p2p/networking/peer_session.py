@@ -0,0 +1,203 @@
+"""
+Per-peer session state for the P2P network.
+"""
+
+import sys
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+
+from ..utils.secure_buffer import SecureBuffer
+
+
+def _secret_field(slot: str, doc: str) -> property:
+    """Create a property that keeps a secret in a SecureBuffer.
+
+    Setting the property copies the value into a new buffer and wipes the
+    one it replaces, so overwriting or clearing the field erases the old key.
+
+    Args:
+        slot: Name of the slot holding the buffer
+        doc: Docstring of the property
+
+    Returns:
+        The property
+    """
+    def getter(session: 'PeerSession') -> Optional[SecureBuffer]:
+        return getattr(session, slot)
+
+    def setter(session: 'PeerSession', value: Optional[Union[bytes, SecureBuffer]]) -> None:
+        old = getattr(session, slot)
+        if value is not None and not isinstance(value, SecureBuffer):
+            value = SecureBuffer(value)
+        setattr(session, slot, value)
+        if old is not None and old is not value:
+            old.wipe()
+
+    return property(getter, setter, doc=doc)
+
+
+class PeerSession:
+    """All state kept about a single peer.
+
+    One record holds what used to be spread over several dictionaries keyed by
+    node ID: the discovered listening address, the open connection, the
+    cryptographic session negotiated by SecureMessaging and traffic counters.
+    ``__slots__`` keeps every record the same small, fixed size, so the memory
+    used for N known peers is predictable (see PeerSession.footprint and
+    PeerRegistry.memory_footprint).
+
+    Key material (SECRET_FIELDS) is kept in SecureBuffers that are wiped as
+    soon as the key is replaced or the session is reset.
+
+    Fields that don't apply are None; a peer that was discovered but never
+    connected has no writer, and a peer that connected to us but never
+    announced itself has no last_seen.
+    """
+
+    __slots__ = (
+        'node_id',
+        # Discovery
+        'host', 'port', 'last_seen',
+        # Connection
+        'remote_address', 'writer', 'connected_at', 'link',
+        # Crypto session
+        '_shared_key', '_key_exchange_original', 'key_exchange_state',
+        'crypto_settings', '_ephemeral_private_key',
+        # Traffic statistics
+        'messages_sent', 'messages_received', 'bytes_sent', 'bytes_received',
+    )
+
+    # Key material, stored in the matching underscore slots
+    SECRET_FIELDS = ('shared_key', 'key_exchange_original', 'ephemeral_private_key')
+
+    shared_key = _secret_field('_shared_key', "The symmetric key derived for the peer.")
+    key_exchange_original = _secret_field(
+        '_key_exchange_original', "The shared secret of the key exchange, before derivation.")
+    ephemeral_private_key = _secret_field(
+        '_ephemeral_private_key', "Our private key for a key exchange in progress.")
+
+    def __init__(self, node_id: str):
+        """Initialize an empty session for a peer.
+
+        Args:
+            node_id: The ID of the peer
+        """
+        self.node_id = node_id
+        self.host: Optional[str] = None
+        self.port: Optional[int] = None
+        self.last_seen: Optional[float] = None
+        self.remote_address: Optional[Tuple[str, int]] = None
+        self.writer = None
+        self.connected_at: Optional[float] = None
+        self.link = None
+        self._shared_key: Optional[SecureBuffer] = None
+        self._key_exchange_original: Optional[SecureBuffer] = None
+        self.key_exchange_state: Optional[int] = None
+        self.crypto_settings: Optional[Dict[str, str]] = None
+        self._ephemeral_private_key: Optional[SecureBuffer] = None
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def __repr__(self) -> str:
+        return (f"PeerSession({self.node_id[:8]}..., address={self.address}, "
+                f"connected={self.is_connected})")
+
+    @property
+    def address(self) -> Optional[Tuple[str, int]]:
+        """The discovered (listening) address of the peer, if known."""
+        if self.host is None or self.port is None:
+            return None
+        return (self.host, self.port)
+
+    @property
+    def is_discovered(self) -> bool:
+        """Whether the peer has been seen through discovery or a manual add."""
+        return self.last_seen is not None
+
+    @property
+    def is_connected(self) -> bool:
+        """Whether there is an open connection to the peer."""
+        return self.writer is not None
+
+    def mark_connected(self, writer, remote_address: Tuple[str, int], link=None) -> None:
+        """Attach an open connection to the session.
+
+        Args:
+            writer: The stream writer of the connection
+            remote_address: The (host, port) the connection is with
+            link: The PeerLink holding the framing state of the connection
+        """
+        self.writer = writer
+        self.remote_address = remote_address
+        self.link = link
+        self.connected_at = time.time()
+
+    def mark_disconnected(self) -> None:
+        """Detach the connection and drop the crypto session bound to it."""
+        self.writer = None
+        self.remote_address = None
+        self.connected_at = None
+        self.link = None
+        self.reset_key_exchange()
+
+    def reset_key_exchange(self) -> None:
+        """Wipe the shared key and any key exchange in progress."""
+        self.shared_key = None
+        self.key_exchange_original = None
+        self.key_exchange_state = None
+        self.ephemeral_private_key = None
+
+    def record_sent(self, size: int) -> None:
+        """Count an outgoing message.
+
+        Args:
+            size: Size of the encoded message in bytes
+        """
+        self.messages_sent += 1
+        self.bytes_sent += size
+
+    def record_received(self, size: int) -> None:
+        """Count an incoming message.
+
+        Args:
+            size: Size of the encoded message in bytes
+        """
+        self.messages_received += 1
+        self.bytes_received += size
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get traffic statistics for the peer.
+
+        Returns:
+            Dict with message and byte counters and the connection time
+        """
+        return {
+            "messages_sent": self.messages_sent,
+            "messages_received": self.messages_received,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "connected_at": self.connected_at,
+        }
+
+    def footprint(self) -> int:
+        """Estimate the memory used by this record and the values it owns.
+
+        Shared objects (the stream writer, interned strings and small ints)
+        are not counted.
+
+        Returns:
+            Approximate size in bytes
+        """
+        size = sys.getsizeof(self) + sys.getsizeof(self.node_id)
+        for value in (self.host, self.last_seen, self.remote_address, self.connected_at):
+            if value is not None:
+                size += sys.getsizeof(value)
+        for secret in (self._shared_key, self._key_exchange_original, self._ephemeral_private_key):
+            if secret is not None:
+                size += sys.getsizeof(secret) + len(secret)
+        if self.crypto_settings is not None:
+            size += sys.getsizeof(self.crypto_settings)
+            size += sum(sys.getsizeof(v) for v in self.crypto_settings.values())
+        return size
@@ -0,0 +1,256 @@
+"""
+Reassembly of chunked messages within per-peer size limits.
+"""
+
+import logging
+import mmap
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReassemblyLimits:
+    """Limits on the messages a node accepts from each peer.
+
+    Messages are announced with their size before their chunks arrive, so
+    the limits are checked before anything is allocated. Messages of at
+    least spill_threshold bytes, or that don't fit in the memory left to
+    the peer, are reassembled in a temporary file instead of in memory.
+
+    Messages are JSON and are decoded whole once received, so no message may
+    be larger than max_inflight_memory either, and a message stays charged
+    to the peer's memory until it has been processed.
+    """
+
+    max_message_size: int = 64 * 1024 ** 2       # Largest single message
+    max_inflight_bytes: int = 4 * 1024 ** 3      # All messages being received from a peer
+    max_inflight_memory: int = 64 * 1024 ** 2    # Of which held in memory
+    spill_threshold: int = 16 * 1024 ** 2        # Messages this large go to disk
+    spill_dir: Optional[str] = None              # Directory of the temporary files
+
+
+class Reassembly:
+    """A chunked message being received.
+
+    Chunks arrive in order on a connection, so each one is placed after the
+    previous one and the sender's chunk size doesn't need to be known.
+    """
+
+    __slots__ = ('total_length', 'total_chunks', 'received', 'next_index',
+                 'memory_bytes', '_buffer', '_file', '_map', '_budget')
+
+    def __init__(self, total_length: int, total_chunks: Optional[int] = None,
+                 spill_dir: Optional[str] = None, spill: bool = False):
+        """Initialize an empty reassembly.
+
+        Args:
+            total_length: The message size announced by the sender
+            total_chunks: The number of chunks announced by the sender, None
+                          if the chunk size may change within the message
+            spill_dir: Directory of the temporary file, the system default if None
+            spill: Whether to reassemble in a temporary file instead of in memory
+        """
+        self.total_length = total_length
+        self.total_chunks = total_chunks
+        self.received = 0
+        self.next_index = 0
+        self.memory_bytes = 0  # Charged to the budget's memory
+        self._buffer: Optional[bytearray] = None
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._budget: Optional['ReassemblyBudget'] = None
+        if spill:
+            # Anonymous file, removed by the system once closed
+            self._file = tempfile.TemporaryFile(prefix="qrp2p_message_", dir=spill_dir)
+        else:
+            self._buffer = bytearray(total_length)
+
+    @property
+    def complete(self) -> bool:
+        """Whether every chunk has been received."""
+        if self.total_chunks is None:
+            return self.received == self.total_length
+        return self.next_index == self.total_chunks
+
+    @property
+    def spilled(self) -> bool:
+        """Whether the message is reassembled in a temporary file."""
+        return self._file is not None
+
+    def add(self, index: int, data: bytes) -> bool:
+        """Add the next chunk of the message.
+
+        Args:
+            index: The index of the chunk
+            data: The chunk
+
+        Returns:
+            True if the message is complete
+
+        Raises:
+            ValueError: If the chunk is out of order, empty or overruns the message
+        """
+        if index != self.next_index:
+            raise ValueError(f"Expected chunk {self.next_index}, got chunk {index}")
+        if not data and self.total_chunks is None:
+            raise ValueError(f"Chunk {index} is empty")
+        end = self.received + len(data)
+        if end > self.total_length:
+            raise ValueError(f"Chunk {index} overruns the message length {self.total_length}")
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buffer[self.received:end] = data
+        self.received = end
+        self.next_index += 1
+        if self.complete and self.received != self.total_length:
+            raise ValueError(f"Message ended after {self.received} of {self.total_length} bytes")
+        return self.complete
+
+    def result(self) -> Union[bytearray, mmap.mmap]:
+        """Get the complete message.
+
+        A message reassembled in memory is returned without copying it. A
+        spilled message is returned as a read-only memory map of its file,
+        which the system can page out; the file is removed when the map is
+        closed. Decoding the message takes memory either way, so a spilled
+        message is charged to the peer's memory from here on.
+
+        The message keeps its share of the peer's budget until discard() is
+        called once it has been processed.
+
+        Returns:
+            The message, as a bytes-like object
+        """
+        if self._file is None:
+            return self._buffer
+        if self._budget is not None:
+            self._budget.charge_memory(self)
+        self._file.flush()
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map
+        finally:
+            self._file.close()
+            self._file = None
+
+    def discard(self) -> None:
+        """Drop the message, incomplete or processed, and return its bytes to the budget."""
+        self._release()
+        self._buffer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _release(self) -> None:
+        """Return the message's bytes to the peer's budget."""
+        if self._budget is not None:
+            self._budget.release(self)
+            self._budget = None
+
+
+class ReassemblyBudget:
+    """The bytes of messages being received from one peer.
+
+    Every connection of the peer draws from the same budget, so opening more
+    connections doesn't raise the limits.
+    """
+
+    def __init__(self, limits: Optional[ReassemblyLimits] = None):
+        """Initialize an empty budget.
+
+        Args:
+            limits: The limits of the peer, ReassemblyLimits() if None
+        """
+        self.limits = limits if limits is not None else ReassemblyLimits()
+        self.inflight_bytes = 0   # Announced bytes of all messages being received
+        self.memory_bytes = 0     # Of which held in memory
+        self.links = 0            # Open connections drawing from the budget
+
+    def check(self, length: int) -> None:
+        """Check that a message of the given size may be received.
+
+        Args:
+            length: The size of the message
+
+        Raises:
+            ValueError: If the message exceeds the limits
+        """
+        # Messages are decoded whole, so they must fit in memory
+        max_size = min(self.limits.max_message_size, self.limits.max_inflight_memory)
+        if length > max_size:
+            raise ValueError(f"Message of {length} bytes exceeds the limit of {max_size} bytes")
+        if self.inflight_bytes + length > self.limits.max_inflight_bytes:
+            raise ValueError(f"Message of {length} bytes exceeds the {self.limits.max_inflight_bytes} "
+                             f"bytes a peer may have in flight ({self.inflight_bytes} in use)")
+
+    def open(self, total_length: int, total_chunks: Optional[int] = None) -> Reassembly:
+        """Start reassembling a chunked message.
+
+        Args:
+            total_length: The message size announced by the sender
+            total_chunks: The number of chunks announced by the sender, None
+                          if the chunk size may change within the message
+
+        Returns:
+            The reassembly, which returns its bytes when completed or discarded
+
+        Raises:
+            ValueError: If the message is empty or exceeds the limits
+        """
+        if total_length <= 0:
+            raise ValueError("Chunked message is empty")
+        self.check(total_length)
+        limits = self.limits
+        spill = (total_length >= limits.spill_threshold or
+                 self.memory_bytes + total_length > limits.max_inflight_memory)
+        reassembly = Reassembly(total_length, total_chunks, limits.spill_dir, spill)
+        if not spill:
+            self.charge_memory(reassembly)
+        reassembly._budget = self
+        self.inflight_bytes += total_length
+        if spill:
+            logger.debug(f"Reassembling message of {total_length} bytes on disk")
+        return reassembly
+
+    def charge_memory(self, reassembly: Reassembly) -> None:
+        """Count a message in the memory of the peer.
+
+        Messages reassembled in memory are charged when opened, spilled ones
+        when they are decoded.
+
+        Args:
+            reassembly: The reassembly opened from this budget
+        """
+        if not reassembly.memory_bytes:
+            reassembly.memory_bytes = reassembly.total_length
+            self.memory_bytes += reassembly.total_length
+
+    def release(self, reassembly: Reassembly) -> None:
+        """Return the bytes of a processed or discarded message.
+
+        Args:
+            reassembly: The reassembly opened from this budget
+        """
+        self.inflight_bytes -= reassembly.total_length
+        self.memory_bytes -= reassembly.memory_bytes
+        reassembly.memory_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the bytes in flight and the limits.
+
+        Returns:
+            Dict with the bytes in flight, in memory, and the limits
+        """
+        return {
+            "inflight_bytes": self.inflight_bytes,
+            "memory_bytes": self.memory_bytes,
+            "max_inflight_bytes": self.limits.max_inflight_bytes,
+            "max_inflight_memory": self.limits.max_inflight_memory,
+        }
@@ -15,6 +15,7 @@ from .oqs_status_widget import OQSStatusWidget
 from .key_history_dialog import KeyHistoryDialog
 from .change_password_dialog import ChangePasswordDialog
 from .reset_password_dialog import ResetPasswordDialog
+from .search_dialog import SearchDialog
 
 __all__ = [
     'MainWindow', 
@@ -27,5 +28,6 @@ __all__ = [
     'OQSStatusWidget',
     'KeyHistoryDialog',
     'ChangePasswordDialog',
-    'ResetPasswordDialog'
+    'ResetPasswordDialog',
+    'SearchDialog'
 ]
\ No newline at end of file
@@ -5,11 +5,12 @@ Dialog for changing the key storage password.
 import logging
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, 
-    QPushButton, QMessageBox, QFormLayout
+    QPushButton, QMessageBox, QFormLayout, QProgressBar
 )
 from PyQt5.QtCore import Qt, pyqtSignal
 
 from ..crypto import KeyStorage
+from .storage_worker import StorageWorker
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +34,8 @@ class ChangePasswordDialog(QDialog):
         
         self.key_storage = key_storage
         self.require_old_password = require_old_password
+        self.worker = None
+        self.secure_logger = None
         
         self.setWindowTitle("Change Password")
         self.setMinimumWidth(400)
@@ -85,6 +88,18 @@ class ChangePasswordDialog(QDialog):
         strength_label.setStyleSheet("color: gray; font-size: 10px;")
         layout.addWidget(strength_label)
         
+        # Progress while the new password is being applied
+        self.progress_label = QLabel()
+        self.progress_label.setAlignment(Qt.AlignCenter)
+        self.progress_label.setVisible(False)
+        layout.addWidget(self.progress_label)
+        
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)  # Busy indicator, Argon2id doesn't report progress
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+        
         # Buttons
         button_layout = QHBoxLayout()
         self.change_button = QPushButton("Change Password")
@@ -145,73 +160,123 @@ class ChangePasswordDialog(QDialog):
                 return
 
         # Get a reference to the secure logger if available
-        secure_logger = None
         parent = self.parent()
         while parent is not None:
             if hasattr(parent, 'secure_logger') and parent.secure_logger is not None:
-                secure_logger = parent.secure_logger
+                self.secure_logger = parent.secure_logger
                 break
             parent = parent.parent()
 
-        # Change the password
-        try:
-            if self.require_old_password:
-                success = self.key_storage.change_password(old_password, new_password)
-            else:
-                # For the case where we've just verified the old password (e.g., in login dialog)
-                success = self.key_storage.change_password("", new_password)
-
-            if success:
-                # Log successful password change
-                if secure_logger:
-                    secure_logger.log_event(
-                        event_type="password_change",
-                        message="Password changed successfully",
-                        success=True
-                    )
-
-                QMessageBox.information(
-                    self, "Success", 
-                    "Password changed successfully. Please remember your new password."
+        # Change the password in a worker thread, key derivation takes a while
+        if not self.require_old_password:
+            # For the case where we've just verified the old password (e.g., in login dialog)
+            old_password = ""
+
+        self._set_busy(True)
+        self.worker = StorageWorker(
+            lambda progress: self.key_storage.change_password(old_password, new_password, progress=progress),
+            self
+        )
+        self.worker.progress.connect(self.progress_label.setText)
+        self.worker.completed.connect(self._on_change_finished)
+        self.worker.failed.connect(self._on_change_failed)
+        self.worker.start()
+
+    def _set_busy(self, busy: bool):
+        """Show or hide the progress of a password change and lock the inputs meanwhile.
+
+        Args:
+            busy: Whether a password change is running
+        """
+        if hasattr(self, 'old_password_input'):
+            self.old_password_input.setEnabled(not busy)
+        self.new_password_input.setEnabled(not busy)
+        self.confirm_password_input.setEnabled(not busy)
+        self.change_button.setEnabled(not busy)
+        self.cancel_button.setEnabled(not busy)
+        self.progress_label.setText("Changing password...")
+        self.progress_label.setVisible(busy)
+        self.progress_bar.setVisible(busy)
+
+    def reject(self):
+        """Close the dialog, unless a password change is still running."""
+        if self.worker is not None and self.worker.isRunning():
+            return
+        super().reject()
+
+    def _finish_worker(self):
+        """Clean up after the worker thread has finished."""
+        self.worker.wait()
+        self.worker = None
+        self._set_busy(False)
+
+    def _on_change_finished(self, success: bool):
+        """Handle the result of a password change.
+
+        Args:
+            success: Whether the password was changed
+        """
+        self._finish_worker()
+        secure_logger = self.secure_logger
+
+        if success:
+            # Log successful password change
+            if secure_logger:
+                secure_logger.log_event(
+                    event_type="password_change",
+                    message="Password changed successfully",
+                    success=True
                 )
-                logger.info("Password changed successfully")
-                self.password_changed.emit()
-                self.accept()
-            else:
-                # Log failed password change
-                if secure_logger:
-                    secure_logger.log_event(
-                        event_type="password_change",
-                        message="Password change failed - likely wrong current password",
-                        success=False
-                    )
-
-                if self.require_old_password:
-                    QMessageBox.warning(
-                        self, "Error", 
-                        "Failed to change password. Please check your current password."
-                    )
-                    self.old_password_input.clear()
-                    self.old_password_input.setFocus()
-                else:
-                    QMessageBox.warning(
-                        self, "Error", 
-                        "Failed to change password due to an internal error."
-                    )
-                logger.error("Password change failed")
-
-        except Exception as e:
-            # Log exception during password change
+
+            QMessageBox.information(
+                self, "Success", 
+                "Password changed successfully. Please remember your new password."
+            )
+            logger.info("Password changed successfully")
+            self.password_changed.emit()
+            self.accept()
+        else:
+            # Log failed password change
             if secure_logger:
                 secure_logger.log_event(
                     event_type="password_change",
-                    message=f"Exception during password change: {str(e)}",
-                    success=False,
-                    error=str(e)
+                    message="Password change failed - likely wrong current password",
+                    success=False
+                )
+
+            if self.require_old_password:
+                QMessageBox.warning(
+                    self, "Error", 
+                    "Failed to change password. Please check your current password."
+                )
+                self.old_password_input.clear()
+                self.old_password_input.setFocus()
+            else:
+                QMessageBox.warning(
+                    self, "Error", 
+                    "Failed to change password due to an internal error."
                 )
+            logger.error("Password change failed")
 
-            QMessageBox.critical(
-                self, "Error", 
-                f"An error occurred while changing the password: {str(e)}"
+    def _on_change_failed(self, error: str):
+        """Handle an exception raised while changing the password.
+
+        Args:
+            error: The error message
+        """
+        self._finish_worker()
+
+        # Log exception during password change
+        if self.secure_logger:
+            self.secure_logger.log_event(
+                event_type="password_change",
+                message=f"Exception during password change: {error}",
+                success=False,
+                error=error
             )
-            logger.error(f"Exception during password change: {e}", exc_info=True)
\ No newline at end of file
+
+        QMessageBox.critical(
+            self, "Error", 
+            f"An error occurred while changing the password: {error}"
+        )
+        logger.error(f"Exception during password change: {error}")
@@ -0,0 +1,187 @@
+"""
+List model for the chat history shown by the messaging widget.
+"""
+
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
+from PyQt5.QtGui import QColor, QFont
+
+logger = logging.getLogger(__name__)
+
+
+class ChatItem:
+    """A single rendered line of the chat history.
+
+    Only the display text is kept for text messages. File messages also keep
+    the Message they came from so the file can be saved from the context menu.
+    """
+
+    __slots__ = ('text', 'kind', 'message')
+
+    # Item kinds
+    INCOMING = "incoming"
+    OUTGOING = "outgoing"
+    SYSTEM = "system"
+    WARNING = "warning"
+
+    def __init__(self, text: str, kind: str, message=None):
+        """Initialize a chat item.
+
+        Args:
+            text: The text to display
+            kind: One of INCOMING, OUTGOING, SYSTEM or WARNING
+            message: The file Message this item stands for, if any
+        """
+        self.text = text
+        self.kind = kind
+        self.message = message
+
+
+class ChatHistoryModel(QAbstractListModel):
+    """Model of the chat history with the current peer.
+
+    The view only renders the visible rows, and older history is prepended a
+    page at a time as the user scrolls up, so the cost of opening a
+    conversation doesn't depend on how long it is.
+    """
+
+    # Role returning the file Message of an item (None for other items)
+    FileMessageRole = Qt.UserRole
+
+    SYSTEM_COLOR = QColor("#555555")  # Dark gray for info
+    WARNING_COLOR = QColor("#C62828")  # Dark red for warnings
+
+    def __init__(self, parent=None):
+        """Initialize an empty chat history model.
+
+        Args:
+            parent: The parent object
+        """
+        super().__init__(parent)
+        self._items: List[ChatItem] = []
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._items)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._items):
+            return None
+
+        item = self._items[index.row()]
+
+        if role == Qt.DisplayRole:
+            return item.text
+        if role == Qt.ForegroundRole:
+            if item.kind == ChatItem.WARNING:
+                return self.WARNING_COLOR
+            if item.kind == ChatItem.SYSTEM:
+                return self.SYSTEM_COLOR
+            return None
+        if role == Qt.FontRole and item.message is not None:
+            font = QFont()
+            font.setUnderline(True)
+            return font
+        if role == Qt.ToolTipRole and item.message is not None and item.kind == ChatItem.INCOMING:
+            return "Right-click to save"
+        if role == self.FileMessageRole:
+            return item.message
+        return None
+
+    @staticmethod
+    def format_message(message, is_outgoing: bool) -> ChatItem:
+        """Render a message as a chat item.
+
+        Args:
+            message: The message to render
+            is_outgoing: Whether the message was sent by us
+
+        Returns:
+            The ChatItem for the message
+        """
+        timestamp = datetime.fromtimestamp(message.timestamp).strftime("%H:%M:%S")
+        prefix = "You" if is_outgoing else f"{message.sender_id[:8]}..."
+        kind = ChatItem.OUTGOING if is_outgoing else ChatItem.INCOMING
+
+        if message.is_file:
+            filename = message.filename or "Unknown file"
+            file_size = message.size
+
+            # For file messages, include save instruction for received files
+            save_info = " (Right-click to save)" if not is_outgoing else ""
+            text = f"[{timestamp}] {prefix}: 📄 File: {filename} ({file_size:,} bytes){save_info}"
+            return ChatItem(text, kind, message)
+
+        try:
+            content = message.content.decode("utf-8")
+        except UnicodeDecodeError:
+            # Binary data, just show the size
+            content = f"Binary data ({len(message.content)} bytes)"
+
+        return ChatItem(f"[{timestamp}] {prefix}: {content}", kind)
+
+    def clear(self) -> None:
+        """Remove all items."""
+        self.beginResetModel()
+        self._items = []
+        self.endResetModel()
+
+    def _append(self, item: ChatItem) -> None:
+        """Append a single item at the bottom."""
+        row = len(self._items)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._items.append(item)
+        self.endInsertRows()
+
+    def append_message(self, message, is_outgoing: bool) -> None:
+        """Append a message at the bottom.
+
+        Args:
+            message: The message to add
+            is_outgoing: Whether the message was sent by us
+        """
+        self._append(self.format_message(message, is_outgoing))
+
+    def append_system(self, text: str, is_warning: bool = False) -> None:
+        """Append a system notice at the bottom.
+
+        Args:
+            text: The notice text
+            is_warning: Whether this is a warning
+        """
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        kind = ChatItem.WARNING if is_warning else ChatItem.SYSTEM
+        self._append(ChatItem(f"[{timestamp}] * {text} *", kind))
+
+    def prepend_messages(self, messages: List[Tuple[object, bool]]) -> int:
+        """Insert a page of older messages at the top.
+
+        Args:
+            messages: List of (message, is_outgoing) in chronological order
+
+        Returns:
+            The number of rows inserted
+        """
+        if not messages:
+            return 0
+
+        items = [self.format_message(message, is_outgoing) for message, is_outgoing in messages]
+        self.beginInsertRows(QModelIndex(), 0, len(items) - 1)
+        self._items[0:0] = items
+        self.endInsertRows()
+        return len(items)
+
+    def file_message_at(self, row: int) -> Optional[object]:
+        """Get the file message shown in a row.
+
+        Args:
+            row: The row index
+
+        Returns:
+            The Message if the row is a file message, None otherwise
+        """
+        if 0 <= row < len(self._items):
+            return self._items[row].message
+        return None
@@ -9,12 +9,12 @@ from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
     QTableWidget, QTableWidgetItem, QHeaderView, QMessageBox,
     QMenu, QAction, QTextEdit, QSplitter, QWidget, QApplication,
-    QRadioButton, QButtonGroup
+    QRadioButton, QButtonGroup, QComboBox, QSpinBox, QGroupBox
 )
 from PyQt5.QtCore import Qt, pyqtSlot
 from PyQt5.QtGui import QColor, QFont, QCursor, QPalette
 
-from ..crypto import KeyStorage
+from ..crypto import KeyStorage, KeyHistoryRetention
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +22,8 @@ logger = logging.getLogger(__name__)
 class KeyHistoryDialog(QDialog):
     """Dialog for viewing the history of key exchanges with true on-demand key decryption."""
     
+    PAGE_SIZE = 100
+    
     def __init__(self, key_storage: KeyStorage, secure_logger=None, parent=None):
         """Initialize the key history dialog."""
         super().__init__(parent)
@@ -31,6 +33,7 @@ class KeyHistoryDialog(QDialog):
         self.current_key_id = None      # Store key_id instead of decrypted key
         self.current_key = None         # Only set when explicitly decrypted
         self.decrypted_key_cache = {}   # Cache of decrypted keys (key_id -> decrypted_key)
+        self.page_offset = 0            # Offset of the page shown, newest entries first
 
         self.setWindowTitle("Key Exchange History")
         self.setMinimumSize(900, 600)
@@ -61,6 +64,25 @@ class KeyHistoryDialog(QDialog):
         table_widget = QWidget()
         table_layout = QVBoxLayout(table_widget)
         
+        # Peer filter and paging
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("Peer:"))
+        self.peer_filter = QComboBox()
+        self.peer_filter.setMinimumWidth(250)
+        self.peer_filter.currentIndexChanged.connect(self._on_peer_filter_changed)
+        filter_layout.addWidget(self.peer_filter)
+        filter_layout.addStretch()
+        
+        self.page_label = QLabel()
+        filter_layout.addWidget(self.page_label)
+        self.newer_button = QPushButton("< Newer")
+        self.newer_button.clicked.connect(lambda: self._change_page(-self.PAGE_SIZE))
+        filter_layout.addWidget(self.newer_button)
+        self.older_button = QPushButton("Older >")
+        self.older_button.clicked.connect(lambda: self._change_page(self.PAGE_SIZE))
+        filter_layout.addWidget(self.older_button)
+        table_layout.addLayout(filter_layout)
+        
         self.history_table = QTableWidget()
         self.history_table.setColumnCount(6)
         self.history_table.setHorizontalHeaderLabels([
@@ -154,6 +176,31 @@ class KeyHistoryDialog(QDialog):
         splitter.setSizes([400, 200])
         layout.addWidget(splitter)
         
+        # Retention policy, 0 means no limit
+        retention_group = QGroupBox("Retention (0 = unlimited)")
+        retention_layout = QHBoxLayout(retention_group)
+        
+        retention_layout.addWidget(QLabel("Keep per peer:"))
+        self.max_per_peer_spin = QSpinBox()
+        self.max_per_peer_spin.setRange(0, 1000000)
+        retention_layout.addWidget(self.max_per_peer_spin)
+        
+        retention_layout.addWidget(QLabel("Max age (days):"))
+        self.max_age_spin = QSpinBox()
+        self.max_age_spin.setRange(0, 100000)
+        retention_layout.addWidget(self.max_age_spin)
+        
+        retention_layout.addWidget(QLabel("Keep in total:"))
+        self.max_total_spin = QSpinBox()
+        self.max_total_spin.setRange(0, 10000000)
+        retention_layout.addWidget(self.max_total_spin)
+        
+        self.apply_retention_button = QPushButton("Apply")
+        self.apply_retention_button.clicked.connect(self._apply_retention)
+        retention_layout.addWidget(self.apply_retention_button)
+        retention_layout.addStretch()
+        layout.addWidget(retention_group)
+        
         # Buttons
         button_layout = QHBoxLayout()
         
@@ -183,16 +230,104 @@ class KeyHistoryDialog(QDialog):
         # Store key data for each row (without the decrypted keys)
         self.row_key_data = {}
         
-        # Load initial data
+        # Load initial data, dropping entries that have aged out since the last exchange
+        self._load_retention()
+        self.key_storage.prune_key_history()
         self._refresh_history()
     
+    def _load_retention(self):
+        """Show the current retention policy."""
+        retention = self.key_storage.get_history_retention()
+        self.max_per_peer_spin.setValue(retention.max_per_peer or 0)
+        self.max_age_spin.setValue(int(retention.max_age_days or 0))
+        self.max_total_spin.setValue(retention.max_total or 0)
+    
+    def _apply_retention(self):
+        """Save the retention policy shown and prune the history accordingly."""
+        retention = KeyHistoryRetention(
+            max_per_peer=self.max_per_peer_spin.value() or None,
+            max_age_days=self.max_age_spin.value() or None,
+            max_total=self.max_total_spin.value() or None
+        )
+        
+        count_before = self.key_storage.count_key_history()
+        if not self.key_storage.set_history_retention(retention):
+            QMessageBox.warning(self, "Error", "Failed to save the retention policy.")
+            return
+        deleted_count = count_before - self.key_storage.count_key_history()
+        
+        if self.secure_logger:
+            self.secure_logger.log_event(
+                event_type="key_history_changed",
+                message=f"Key history retention changed, {deleted_count} entries pruned",
+                action="retention",
+                **retention.to_dict()
+            )
+        
+        self._refresh_history()
+    
+    def _current_peer_filter(self):
+        """Get the peer selected in the filter, or None for all peers."""
+        return self.peer_filter.currentData()
+    
+    def _on_peer_filter_changed(self):
+        """Show the first page of the selected peer's history."""
+        self.page_offset = 0
+        self._refresh_history()
+    
+    def _change_page(self, delta: int):
+        """Move to a newer or older page of history.
+        
+        Args:
+            delta: Change of the page offset
+        """
+        self.page_offset = max(0, self.page_offset + delta)
+        self._refresh_history()
+    
+    def _update_peer_filter(self):
+        """Update the peers in the filter, keeping the selection."""
+        selected_peer = self._current_peer_filter()
+        
+        self.peer_filter.blockSignals(True)
+        self.peer_filter.clear()
+        self.peer_filter.addItem("All peers", None)
+        for peer_id in self.key_storage.get_key_history_peers():
+            self.peer_filter.addItem(f"{peer_id[:12]}...", peer_id)
+        
+        index = self.peer_filter.findData(selected_peer)
+        if index < 0:
+            # The peer's history is gone, show all peers from the start
+            index = 0
+            self.page_offset = 0
+        self.peer_filter.setCurrentIndex(index)
+        self.peer_filter.blockSignals(False)
+    
     def _refresh_history(self):
-        """Refresh the key history table."""
+        """Refresh the key history table with the current page."""
         self.history_table.setRowCount(0)  # Clear current rows
         self.row_key_data = {}  # Clear key data
         
-        # Get key history WITHOUT decrypting keys
-        key_history = self.key_storage.get_key_history(decrypt_keys=False)
+        self._update_peer_filter()
+        peer_id = self._current_peer_filter()
+        
+        # Stay on a page that still has entries after deletions
+        total = self.key_storage.count_key_history(peer_id)
+        if self.page_offset >= total:
+            self.page_offset = max(0, (total - 1) // self.PAGE_SIZE * self.PAGE_SIZE)
+        
+        # Get a page of key history WITHOUT decrypting keys
+        key_history = self.key_storage.get_key_history(
+            decrypt_keys=False, peer_id=peer_id, offset=self.page_offset, limit=self.PAGE_SIZE
+        )
+        
+        if total:
+            self.page_label.setText(
+                f"{self.page_offset + 1}-{self.page_offset + len(key_history)} of {total}"
+            )
+        else:
+            self.page_label.setText("No entries")
+        self.newer_button.setEnabled(self.page_offset > 0)
+        self.older_button.setEnabled(self.page_offset + len(key_history) < total)
         
         # Populate table
         for i, entry in enumerate(key_history):
@@ -601,10 +736,10 @@ class KeyHistoryDialog(QDialog):
     
     def _clear_all_history(self):
         """Clear all key history."""
-        # Get current key history
-        key_history = self.key_storage.get_key_history(decrypt_keys=False)
+        # Count the current key history
+        history_count = self.key_storage.count_key_history()
         
-        if not key_history:
+        if not history_count:
             QMessageBox.information(self, "No History", "There is no key history to clear.")
             return
         
@@ -612,7 +747,7 @@ class KeyHistoryDialog(QDialog):
         reply = QMessageBox.question(
             self, 
             "Confirm Clear All",
-            f"Are you sure you want to delete ALL key history?\n\nThis will remove {len(key_history)} entries and cannot be undone.",
+            f"Are you sure you want to delete ALL key history?\n\nThis will remove {history_count} entries and cannot be undone.",
             QMessageBox.Yes | QMessageBox.No,
             QMessageBox.No
         )
@@ -622,26 +757,19 @@ class KeyHistoryDialog(QDialog):
             if self.secure_logger:
                 self.secure_logger.log_event(
                     event_type="key_history_changed",
-                    message=f"Clearing all key history ({len(key_history)} entries)",
+                    message=f"Clearing all key history ({history_count} entries)",
                     action="clear_all_begin"
                 )
                 
             # Delete all key history entries
-            success = True
-            deleted_count = 0
-            for entry in key_history:
-                key_id = entry.get("key_id")
-                if key_id:
-                    if self.key_storage.delete_key(key_id):
-                        deleted_count += 1
-                    else:
-                        success = False
+            deleted_count = self.key_storage.clear_key_history()
+            success = deleted_count == history_count
             
             # Log result
             if self.secure_logger:
                 self.secure_logger.log_event(
                     event_type="key_history_changed",
-                    message=f"Cleared key history: {deleted_count} of {len(key_history)} entries deleted",
+                    message=f"Cleared key history: {deleted_count} of {history_count} entries deleted",
                     action="clear_all_complete",
                     success=success
                 )
@@ -650,7 +778,7 @@ class KeyHistoryDialog(QDialog):
                 QMessageBox.information(self, "Success", "All key history cleared successfully.")
                 self._refresh_history()
             else:
-                QMessageBox.warning(self, "Partial Success", f"{deleted_count} of {len(key_history)} key entries were deleted. Some entries could not be deleted.")
+                QMessageBox.warning(self, "Partial Success", f"{deleted_count} of {history_count} key entries were deleted. Some entries could not be deleted.")
                 self._refresh_history()
     
     def closeEvent(self, event):
@@ -8,12 +8,12 @@ from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
     QTableWidget, QTableWidgetItem, QHeaderView, QComboBox,
     QDateTimeEdit, QGroupBox, QFormLayout, QCheckBox, QSplitter,
-    QApplication
+    QApplication, QSpinBox, QMessageBox
 )
 from PyQt5.QtCore import Qt, QDateTime
 from PyQt5.QtGui import QColor, QFont, QPalette
 
-from ..app import SecureLogger
+from ..app import SecureLogger, LogRetention
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +21,9 @@ logger = logging.getLogger(__name__)
 class LogViewerDialog(QDialog):
     """Dialog for viewing secure logs."""
     
+    # Maximum number of events shown, the newest are shown first
+    MAX_EVENTS = 5000
+    
     def __init__(self, secure_logger, parent=None):
         """Initialize the log viewer dialog.
         
@@ -113,6 +116,31 @@ class LogViewerDialog(QDialog):
         
         layout.addWidget(self.logs_table, 1)  # Give it a stretch factor of 1
         
+        # Retention policy, 0 means no limit
+        retention_group = QGroupBox("Retention (0 = unlimited)")
+        retention_layout = QHBoxLayout(retention_group)
+        
+        retention_layout.addWidget(QLabel("Archive after (days):"))
+        self.archive_after_spin = QSpinBox()
+        self.archive_after_spin.setRange(0, 100000)
+        retention_layout.addWidget(self.archive_after_spin)
+        
+        retention_layout.addWidget(QLabel("Delete after (days):"))
+        self.max_age_spin = QSpinBox()
+        self.max_age_spin.setRange(0, 100000)
+        retention_layout.addWidget(self.max_age_spin)
+        
+        retention_layout.addWidget(QLabel("Max size (MB):"))
+        self.max_size_spin = QSpinBox()
+        self.max_size_spin.setRange(0, 1000000)
+        retention_layout.addWidget(self.max_size_spin)
+        
+        self.apply_retention_button = QPushButton("Apply")
+        self.apply_retention_button.clicked.connect(self._apply_retention)
+        retention_layout.addWidget(self.apply_retention_button)
+        retention_layout.addStretch()
+        layout.addWidget(retention_group)
+        
         # Close button
         button_layout = QHBoxLayout()
         
@@ -132,6 +160,7 @@ class LogViewerDialog(QDialog):
         self.setLayout(layout)
         
         # Initial load of logs
+        self._load_retention()
         self._refresh_logs()
     
     def _refresh_logs(self):
@@ -148,7 +177,8 @@ class LogViewerDialog(QDialog):
             end_time = self.end_time_edit.dateTime().toSecsSinceEpoch()
         
         # Get logs with the current filter
-        events = self.secure_logger.get_events(start_time, end_time, event_type)
+        events = self.secure_logger.get_events(start_time, end_time, event_type,
+                                               limit=self.MAX_EVENTS, newest_first=True)
         
         # Update the table
         self.logs_table.setRowCount(len(events))
@@ -290,6 +320,34 @@ class LogViewerDialog(QDialog):
         """Apply the current filter settings and refresh logs."""
         self._refresh_logs()
     
+    def _load_retention(self):
+        """Show the current retention policy."""
+        retention = self.secure_logger.get_retention()
+        self.archive_after_spin.setValue(int(retention.archive_after_days or 0))
+        self.max_age_spin.setValue(int(retention.max_age_days or 0))
+        self.max_size_spin.setValue((retention.max_total_bytes or 0) // (1024 * 1024))
+    
+    def _apply_retention(self):
+        """Save the retention policy shown and archive or delete logs accordingly."""
+        max_size_mb = self.max_size_spin.value()
+        retention = LogRetention(
+            archive_after_days=self.archive_after_spin.value() or None,
+            max_age_days=self.max_age_spin.value() or None,
+            max_total_bytes=max_size_mb * 1024 * 1024 if max_size_mb else None
+        )
+        
+        if not self.secure_logger.set_retention(retention):
+            QMessageBox.warning(self, "Error", "Failed to save the retention policy.")
+            return
+        
+        self.secure_logger.log_event(
+            event_type="log_retention_changed",
+            message="Log retention changed",
+            **retention.to_dict()
+        )
+        
+        self._refresh_logs()
+    
     def _confirm_clear_logs(self):
         """Show a confirmation dialog and clear logs if confirmed."""
         from PyQt5.QtWidgets import QMessageBox
@@ -5,7 +5,7 @@ Login dialog for unlocking key storage.
 import logging
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, 
-    QPushButton, QMessageBox
+    QPushButton, QMessageBox, QProgressBar
 )
 from PyQt5.QtCore import Qt, pyqtSignal
 
@@ -13,6 +13,7 @@ from ..crypto import KeyStorage
 
 from .change_password_dialog import ChangePasswordDialog
 from .reset_password_dialog import ResetPasswordDialog
+from .storage_worker import StorageWorker
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +34,7 @@ class LoginDialog(QDialog):
         super().__init__(parent)
         
         self.key_storage = key_storage
+        self.worker = None
         
         self.setWindowTitle("Unlock Key Storage")
         self.setMinimumWidth(350)
@@ -70,6 +72,18 @@ class LoginDialog(QDialog):
         confirm_layout.addWidget(self.confirm_input)
         layout.addLayout(confirm_layout)
         
+        # Progress while the password is being checked
+        self.progress_label = QLabel()
+        self.progress_label.setAlignment(Qt.AlignCenter)
+        self.progress_label.setVisible(False)
+        layout.addWidget(self.progress_label)
+        
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)  # Busy indicator, Argon2id doesn't report progress
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+        
         # Buttons
         button_layout = QHBoxLayout()
         self.login_button = QPushButton("Unlock")
@@ -103,8 +117,45 @@ class LoginDialog(QDialog):
             QMessageBox.warning(self, "Error", "Passwords do not match.")
             return
         
-        # Try to unlock the key storage
-        success = self.key_storage.unlock(password)
+        # Unlock in a worker thread, key derivation takes a while
+        self._set_busy(True)
+        self.worker = StorageWorker(
+            lambda progress: self.key_storage.unlock(password, progress=progress), self
+        )
+        self.worker.progress.connect(self.progress_label.setText)
+        self.worker.completed.connect(self._on_unlock_finished)
+        self.worker.failed.connect(lambda _: self._on_unlock_finished(False))
+        self.worker.start()
+    
+    def _set_busy(self, busy: bool):
+        """Show or hide the progress of an unlock and lock the inputs meanwhile.
+        
+        Args:
+            busy: Whether an unlock is running
+        """
+        self.password_input.setEnabled(not busy)
+        self.confirm_input.setEnabled(not busy)
+        self.login_button.setEnabled(not busy)
+        self.cancel_button.setEnabled(not busy)
+        self.progress_label.setText("Unlocking...")
+        self.progress_label.setVisible(busy)
+        self.progress_bar.setVisible(busy)
+    
+    def reject(self):
+        """Close the dialog, unless an unlock is still running."""
+        if self.worker is not None and self.worker.isRunning():
+            return
+        super().reject()
+    
+    def _on_unlock_finished(self, success: bool):
+        """Handle the result of an unlock.
+        
+        Args:
+            success: Whether the key storage was unlocked
+        """
+        self.worker.wait()
+        self.worker = None
+        self._set_busy(False)
         
         if success:
             logger.info("Key storage unlocked successfully")
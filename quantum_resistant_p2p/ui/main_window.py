@@ -22,10 +22,11 @@ from .settings_dialog import SettingsDialog
 from .security_metrics_dialog import SecurityMetricsDialog
 from .log_viewer_dialog import LogViewerDialog
 from .key_history_dialog import KeyHistoryDialog
+from .search_dialog import SearchDialog
 from .oqs_status_widget import OQSStatusWidget
 from .login_dialog import LoginDialog
 from .change_password_dialog import ChangePasswordDialog
-from ..app import SecureMessaging, SecureLogger, MessageStore
+from ..app import SecureMessaging, SecureLogger, MessageStore, BlobStore
 from ..crypto import KeyStorage
 from ..networking import P2PNode, NodeDiscovery
 
@@ -52,6 +53,10 @@ class MainWindow(QMainWindow):
         self.node_discovery = None
         self.secure_messaging = None
 
+        # Message and blob stores will be initialized after login, their keys are in the key storage
+        self.blob_store = None
+        self.message_store = None
+
         # Track if message handler has been registered to prevent duplicates
         self._message_handler_registered = False
 
@@ -90,7 +95,7 @@ class MainWindow(QMainWindow):
             self._init_network()
             
             # Create the message store and set the current node ID
-            self.message_store = MessageStore()
+            self._init_message_store()
             self.message_store.set_current_node_id(self.node.node_id)
             
             self._init_ui()
@@ -128,13 +133,30 @@ class MainWindow(QMainWindow):
             logger.error(f"Failed to initialize secure logger: {e}", exc_info=True)
             raise RuntimeError(f"Failed to initialize secure logging system: {e}") from e
     
+    def _init_message_store(self):
+        """Initialize the encrypted message and blob stores with persistent keys."""
+        try:
+            message_store_key = self.key_storage.get_or_create_persistent_key("message_store", key_size=32)
+            blob_store_key = self.key_storage.get_or_create_persistent_key("blob_store", key_size=32)
+
+            if message_store_key is None or blob_store_key is None:
+                raise RuntimeError("Failed to obtain message store keys from key storage")
+
+            self.blob_store = BlobStore(encryption_key=blob_store_key)
+            self.message_store = MessageStore(encryption_key=message_store_key, blob_store=self.blob_store)
+
+        except Exception as e:
+            logger.error(f"Failed to initialize message store: {e}", exc_info=True)
+            raise RuntimeError(f"Failed to initialize message store: {e}") from e
+    
     def _init_network(self):
         """Initialize network components."""
         # Create the P2P node
         self.node = P2PNode(key_storage=self.key_storage)
         
         # Create node discovery
-        self.node_discovery = NodeDiscovery(self.node.node_id, port=self.node.port)
+        self.node_discovery = NodeDiscovery(self.node.node_id, port=self.node.port,
+                                            registry=self.node.peer_registry)
         
         # Set the reference to node_discovery in the node
         self.node.node_discovery = self.node_discovery
@@ -219,6 +241,12 @@ class MainWindow(QMainWindow):
         send_file_action.triggered.connect(self._show_send_file_dialog)
         file_menu.addAction(send_file_action)
 
+        # Search messages action
+        search_action = QAction("Search Messages...", self)
+        search_action.setShortcut("Ctrl+F")
+        search_action.triggered.connect(self._show_search_dialog)
+        file_menu.addAction(search_action)
+
         # Change password action
         file_menu.addSeparator()
         change_password_action = QAction("Change Password...", self)
@@ -298,8 +326,9 @@ class MainWindow(QMainWindow):
             
             self.status_bar.showMessage("Network started", 3000)
             
-            # Start periodic update of peer list
-            asyncio.create_task(self._periodic_peer_update())
+            # Pick up peers found while the network was starting; later changes
+            # arrive as peer registry events
+            self.peer_list.sync_peers()
             
             logger.info("Network components started")
             
@@ -307,27 +336,6 @@ class MainWindow(QMainWindow):
             logger.error(f"Failed to start network: {e}")
             self.status_bar.showMessage(f"Error starting network: {e}", 5000)
     
-    async def _periodic_peer_update(self):
-        """Periodically update the peer list."""
-        while True:
-            try:
-                # Get discovered nodes
-                discovered = self.node_discovery.get_discovered_nodes()
-                # Get connected peers
-                connected = self.node.get_peers()
-
-                # Update the UI
-                self.peer_list.update_peers(discovered, connected)
-
-                # Wait before next update
-                await asyncio.sleep(10)
-
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                logger.error(f"Error updating peer list: {e}")
-                await asyncio.sleep(10)
-    
     def _on_secure_message_received(self, message):
         """Primary handler for all secure messages.
 
@@ -371,12 +379,9 @@ class MainWindow(QMainWindow):
             else:
                 self.status_bar.showMessage(f"New message from {sender_id}", 5000)
 
-        # Update the peer list to show unread indicators
+        # Update the sender's row to show unread indicators
         if hasattr(self, 'peer_list'):
-            self.peer_list.update_peers(
-                self.node_discovery.get_discovered_nodes(), 
-                self.node.get_peers()
-            )
+            self.peer_list.refresh_peer(message.sender_id)
     
     async def _connect_to_peer(self, host: str, port: int):
         """Connect to a peer.
@@ -474,6 +479,27 @@ class MainWindow(QMainWindow):
         dialog = KeyHistoryDialog(self.key_storage, self.secure_logger, self)
         dialog.exec_()
 
+    def _show_search_dialog(self):
+        """Show the message search dialog."""
+        if not self.message_store:
+            return
+        
+        current_peer = self.messaging.current_peer if hasattr(self, 'messaging') else None
+        dialog = SearchDialog(self.message_store, self.node.node_id, current_peer, self)
+        dialog.peer_selected.connect(self._open_conversation)
+        dialog.exec_()
+    
+    def _open_conversation(self, peer_id: str):
+        """Show the conversation with a peer.
+        
+        Args:
+            peer_id: The ID of the peer
+        """
+        # Go through the peer list when the peer is listed so it connects as on a click
+        if not self.peer_list.select_peer(peer_id):
+            self.message_store.mark_all_read(peer_id)
+            self.messaging.set_current_peer(peer_id)
+    
     def _show_about_dialog(self):
         """Show the about dialog."""
         QMessageBox.about(
@@ -503,6 +529,9 @@ class MainWindow(QMainWindow):
     async def _async_stop_network(self):
         """Asynchronously stop the network components."""
         try:
+            if self.node and hasattr(self, 'peer_list'):
+                self.node.peer_registry.unsubscribe(self.peer_list.handle_peer_event)
+            
             # Stop node discovery
             if self.node_discovery:
                 await self.node_discovery.stop()
@@ -511,6 +540,16 @@ class MainWindow(QMainWindow):
             if self.node:
                 await self.node.stop()
             
+            # Close the stores once nothing can add messages to them
+            if self.message_store:
+                self.message_store.close()
+            if self.blob_store:
+                self.blob_store.close()
+            
+            # Write the security events still queued in the logger
+            if self.secure_logger:
+                self.secure_logger.close()
+            
             logger.info("Network components stopped")
             
         except Exception as e:
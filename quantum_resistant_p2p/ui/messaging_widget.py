@@ -5,16 +5,17 @@ Widget for messaging functionality with file saving capabilities.
 import logging
 import asyncio
 import os
-from datetime import datetime
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QTextEdit, QLineEdit, 
+    QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QListView,
     QPushButton, QLabel, QFileDialog, QProgressBar, QSplitter,
-    QGroupBox, QFormLayout, QMessageBox, QAction, QMenu
+    QGroupBox, QFormLayout, QMessageBox, QAction, QMenu,
+    QAbstractItemView, QApplication
 )
 from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QTimer
-from PyQt5.QtGui import QFont, QColor, QTextCursor
+from PyQt5.QtGui import QFont, QColor
 
 from ..app import SecureMessaging, Message
+from .chat_history import ChatHistoryModel
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +23,9 @@ logger = logging.getLogger(__name__)
 class MessagingWidget(QWidget):
     """Widget for securely messaging with peers."""
     
+    # Number of stored messages loaded at a time when scrolling back through history
+    HISTORY_PAGE_SIZE = 100
+    
     # Signal for running async tasks
     async_task = pyqtSignal(object)
     # Signal for opening settings dialog
@@ -41,6 +45,9 @@ class MessagingWidget(QWidget):
         self.message_store = message_store
         self.current_peer = None
         self.is_connecting = False
+        
+        # Cursor for the next older page of the current peer's history
+        self._history_cursor = None
 
         self._init_ui()
 
@@ -161,19 +168,26 @@ class MessagingWidget(QWidget):
         self.crypto_panel.setLayout(crypto_layout)
         layout.addWidget(self.crypto_panel)
 
-        # Chat area with context menu for saving files
-        self.chat_area = QTextEdit()
-        self.chat_area.setReadOnly(True)
-        self.chat_area.setContextMenuPolicy(Qt.CustomContextMenu)
-        self.chat_area.customContextMenuRequested.connect(self._show_context_menu)
+        # Chat history with context menu for saving files. The list view only
+        # lays out and paints the visible rows; file messages are kept as item data.
+        self.chat_model = ChatHistoryModel(self)
+        self.chat_view = QListView()
+        self.chat_view.setModel(self.chat_model)
+        self.chat_view.setWordWrap(True)
+        self.chat_view.setLayoutMode(QListView.Batched)
+        self.chat_view.setBatchSize(self.HISTORY_PAGE_SIZE)
+        self.chat_view.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.chat_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.chat_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.chat_view.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.chat_view.customContextMenuRequested.connect(self._show_context_menu)
+        # Load older history when scrolled to the top
+        self.chat_view.verticalScrollBar().valueChanged.connect(self._on_chat_scrolled)
         # Set larger font size for better readability
-        font = self.chat_area.font()
+        font = self.chat_view.font()
         font.setPointSize(11)  # Increase from default (usually 9 or 10)
-        self.chat_area.setFont(font)
-        layout.addWidget(self.chat_area, 1)  # 1 = stretch factor
-        
-        # Store message info for context menu
-        self.file_messages = {}  # Maps positions to message data
+        self.chat_view.setFont(font)
+        layout.addWidget(self.chat_view, 1)  # 1 = stretch factor
 
         # Message input area
         input_layout = QHBoxLayout()
@@ -211,31 +225,27 @@ class MessagingWidget(QWidget):
         Args:
             position: The position where the context menu was requested
         """
-        # Get the cursor at the clicked position
-        cursor = self.chat_area.cursorForPosition(position)
-        cursor_pos = cursor.position()
+        index = self.chat_view.indexAt(position)
+        if not index.isValid():
+            return
         
-        # Check if this position corresponds to a file message
-        if cursor_pos in self.file_messages:
-            file_data = self.file_messages[cursor_pos]
-            
-            # Create a combined context menu with standard options and our save option
-            standard_menu = self.chat_area.createStandardContextMenu(position)
-            
-            # Add separator before our custom actions
-            standard_menu.addSeparator()
-            
-            # Add save action
+        menu = QMenu(self)
+        
+        # Copy the text of the clicked line
+        copy_action = QAction("Copy", self)
+        text = index.data(Qt.DisplayRole)
+        copy_action.triggered.connect(lambda: QApplication.clipboard().setText(text))
+        menu.addAction(copy_action)
+        
+        # Offer saving if this line is a received file
+        message = index.data(ChatHistoryModel.FileMessageRole)
+        if message is not None and message.sender_id != self.secure_messaging.node.node_id:
+            menu.addSeparator()
             save_action = QAction("Save File", self)
-            save_action.triggered.connect(lambda: self._save_file_from_menu(file_data))
-            standard_menu.addAction(save_action)
-            
-            # Show the menu
-            standard_menu.exec_(self.chat_area.mapToGlobal(position))
-        else:
-            # Use default context menu
-            standard_menu = self.chat_area.createStandardContextMenu(position)
-            standard_menu.exec_(self.chat_area.mapToGlobal(position))
+            save_action.triggered.connect(lambda: self._save_file_from_menu({"message": message}))
+            menu.addAction(save_action)
+        
+        menu.exec_(self.chat_view.viewport().mapToGlobal(position))
     
     def _save_file_from_menu(self, file_data):
         """Save a file from the context menu action.
@@ -259,9 +269,14 @@ class MessagingWidget(QWidget):
             return
         
         try:
-            # Save the file
-            with open(save_path, "wb") as f:
-                f.write(message.content)
+            # Stream the file out of the blob store, or write the contents we hold
+            blob_store = self.message_store.blob_store if self.message_store else None
+            if message.blob_id is not None and blob_store is not None:
+                if not blob_store.save_to(message.blob_id, save_path):
+                    raise IOError("Stored file could not be read")
+            else:
+                with open(save_path, "wb") as f:
+                    f.write(message.content)
             
             # Show success message
             QMessageBox.information(
@@ -481,9 +496,10 @@ class MessagingWidget(QWidget):
         self.settings_button.setEnabled(True)
         self.refresh_button.setEnabled(True)
 
-        # Clear the chat area and file message map
-        self.chat_area.clear()
-        self.file_messages.clear()
+        # Clear the chat history and load the newest page of stored messages
+        self.chat_model.clear()
+        self._history_cursor = None
+        self._load_history_page(initial=True)
 
         # Add a system message
         self._add_system_message(f"Started chat with {peer_id[:8]}...")
@@ -523,22 +539,55 @@ class MessagingWidget(QWidget):
             self._add_system_message("Not connected to peer. Attempting to autoconnect...", True)
             self._disable_messaging()
 
-        # Load previous messages if we have a message store
-        if self.message_store:
-            messages = self.message_store.get_messages(peer_id)
-            if messages:
-                self._add_system_message(f"Loading {len(messages)} previous messages...")
-
-                for message in messages:
-                    # Determine if this message is from us or the peer
-                    is_outgoing = message.sender_id == self.secure_messaging.node.node_id
-                    self._add_message(message, is_outgoing)
-
         # Update the crypto settings display
         self._update_crypto_display()
 
         logger.info(f"Set current peer to {peer_id}")
     
+    def _load_history_page(self, initial: bool = False) -> int:
+        """Load the next older page of the current peer's stored messages.
+        
+        Args:
+            initial: Load the newest page instead of continuing from the cursor
+            
+        Returns:
+            The number of messages loaded
+        """
+        if not self.message_store or not self.current_peer:
+            return 0
+        
+        # Without a cursor there is nothing older left to load
+        if not initial and self._history_cursor is None:
+            return 0
+        
+        messages, cursor = self.message_store.get_message_page(
+            self.current_peer, before=self._history_cursor, limit=self.HISTORY_PAGE_SIZE
+        )
+        self._history_cursor = cursor
+        
+        node_id = self.secure_messaging.node.node_id
+        return self.chat_model.prepend_messages(
+            [(message, message.sender_id == node_id) for message in messages]
+        )
+    
+    def _on_chat_scrolled(self, value: int):
+        """Load older history when the chat view is scrolled to the top.
+        
+        Args:
+            value: The new scroll bar value
+        """
+        if value != self.chat_view.verticalScrollBar().minimum() or self._history_cursor is None:
+            return
+        
+        # Remember the top row so it stays in place once older rows are inserted above it
+        top_index = self.chat_view.indexAt(self.chat_view.viewport().rect().topLeft())
+        loaded = self._load_history_page()
+        if loaded and top_index.isValid():
+            self.chat_view.scrollTo(self.chat_model.index(top_index.row() + loaded, 0),
+                                    QAbstractItemView.PositionAtTop)
+        
+        logger.debug(f"Loaded {loaded} older messages for {self.current_peer}")
+    
     def initiate_connection(self, peer_id: str, host: str, port: int):
         """Initiate connection to a peer.
 
@@ -673,65 +722,10 @@ class MessagingWidget(QWidget):
             message: The message to add
             is_outgoing: Whether the message is outgoing (sent by us)
         """
-        # Format the timestamp
-        timestamp = datetime.fromtimestamp(message.timestamp).strftime("%H:%M:%S")
-        
-        # Determine the prefix (no style differences)
-        prefix = "You" if is_outgoing else f"{message.sender_id[:8]}..."
-        style = ""
-        
-        # Get the cursor position before adding content
-        cursor = self.chat_area.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        start_pos = cursor.position()
-        
-        # Add the message to the chat area
-        if message.is_file:
-            filename = message.filename or "Unknown file"
-            file_size = len(message.content)
-            
-            # For file messages, include save instruction for received files
-            save_info = " (Right-click to save)" if not is_outgoing else ""
-            
-            # Store the cursor position before adding content
-            before_pos = self.chat_area.textCursor().position()
-            
-            # Add file message with a unique ID for easy location
-            message_id = f"file_{message.message_id}"
-            self.chat_area.append(
-                f'<div id="{message_id}" style="{style}"><b>[{timestamp}] {prefix}:</b> '
-                f'📄 <span style="text-decoration: underline;">File: {filename} ({file_size:,} bytes){save_info}</span></div>'
-            )
-            
-            # Get the end position after adding content
-            after_pos = self.chat_area.textCursor().position()
-            
-            # For received files, store positions for the entire message area
-            if not is_outgoing:
-                # Associate multiple positions in the range with this file
-                for pos in range(before_pos, after_pos + 1):
-                    self.file_messages[pos] = {
-                        "message": message,
-                        "position": (before_pos, after_pos)
-                    }
-        else:
-            try:
-                # Normal text message
-                content = message.content.decode("utf-8")
-                self.chat_area.append(
-                    f'<div style="{style}"><b>[{timestamp}] {prefix}:</b> {content}</div>'
-                )
-            except UnicodeDecodeError:
-                # Binary data, just show the size
-                self.chat_area.append(
-                    f'<div style="{style}"><b>[{timestamp}] {prefix}:</b> '
-                    f'Binary data ({len(message.content)} bytes)</div>'
-                )
+        self.chat_model.append_message(message, is_outgoing)
         
         # Scroll to the bottom
-        self.chat_area.verticalScrollBar().setValue(
-            self.chat_area.verticalScrollBar().maximum()
-        )
+        self.chat_view.scrollToBottom()
     
     def _add_system_message(self, message: str, is_warning: bool = False):
         """Add a system message to the chat area.
@@ -740,17 +734,10 @@ class MessagingWidget(QWidget):
             message: The message to add
             is_warning: Whether this is a warning message
         """
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        
-        # Set text color based on message type - use more subtle colors
-        color = "#C62828" if is_warning else "#555555"  # Dark red for warnings, dark gray for info
-        
-        self.chat_area.append(f'<div style="color:{color};"><b>[{timestamp}]</b> * {message} *</div>')
+        self.chat_model.append_system(message, is_warning)
         
         # Scroll to the bottom
-        self.chat_area.verticalScrollBar().setValue(
-            self.chat_area.verticalScrollBar().maximum()
-        )
+        self.chat_view.scrollToBottom()
     
     def _on_settings_clicked(self):
         """Handle clicking the settings button."""
@@ -861,10 +848,6 @@ class MessagingWidget(QWidget):
             file_name = os.path.basename(file_path)
             file_size = os.path.getsize(file_path)
 
-            # Read the file
-            with open(file_path, "rb") as f:
-                data = f.read()
-
             # Update progress bar
             self.progress_bar.setValue(50)
 
@@ -879,13 +862,22 @@ class MessagingWidget(QWidget):
             if success:
                 # Create a message object for the UI with recipient_id set
                 message = Message(
-                    content=data,
+                    content=b"",
                     sender_id=self.secure_messaging.node.node_id,
                     recipient_id=self.current_peer,  # Set recipient explicitly
                     is_file=True,
                     filename=file_name
                 )
 
+                # Keep a copy of the file in the blob store, streamed from disk
+                blob_store = self.message_store.blob_store if self.message_store else None
+                stored = blob_store.put_file(file_path) if blob_store is not None else None
+                if stored is not None:
+                    message.blob_id, message.file_size = stored
+                else:
+                    with open(file_path, "rb") as f:
+                        message.content = f.read()
+
                 # Store the message in our message store if available (mark as read)
                 if self.message_store:
                     self.message_store.add_message(message, mark_as_read=True)
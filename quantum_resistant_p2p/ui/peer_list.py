@@ -3,19 +3,265 @@ Widget for displaying and managing the list of peers.
 """
 
 import logging
+from typing import Dict, List, Optional, Tuple
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QListWidget, QListWidgetItem, QLabel, 
-    QPushButton, QHBoxLayout, QInputDialog, QMessageBox, QHeaderView,
-    QTableWidget, QTableWidgetItem
+    QWidget, QVBoxLayout, QLabel, QPushButton, QHBoxLayout, QMessageBox,
+    QHeaderView, QTableView, QAbstractItemView
 )
-from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QSize
-from PyQt5.QtGui import QColor, QFont, QIcon
+from PyQt5.QtCore import (
+    Qt, pyqtSignal, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+)
+from PyQt5.QtGui import QColor, QFont
 
-from ..networking import P2PNode, NodeDiscovery
+from ..networking import P2PNode, NodeDiscovery, PeerEvent
 
 logger = logging.getLogger(__name__)
 
 
+class PeerTableModel(QAbstractTableModel):
+    """Table model of discovered peers that is updated incrementally.
+    
+    Every row caches its rendered state (status text, tooltip, colors), which
+    is only recomputed when the peer is refreshed. Changes reach the view as
+    row inserts, row removals and dataChanged for the rows whose state actually
+    changed, so the table is never rebuilt as a whole.
+    """
+    
+    COLUMNS = ["Peer", "Status"]
+    
+    # Row background per connection state
+    BACKGROUNDS = {
+        "secure": QColor(230, 255, 230),  # Light green
+        "connected": QColor(240, 240, 255),  # Light blue
+    }
+    
+    def __init__(self, node: P2PNode, secure_messaging=None, message_store=None, parent=None):
+        """Initialize an empty peer table model.
+        
+        Args:
+            node: The P2P node
+            secure_messaging: The secure messaging service (optional)
+            message_store: The message store for unread counts (optional)
+            parent: The parent object
+        """
+        super().__init__(parent)
+        
+        self.node = node
+        self.secure_messaging = secure_messaging
+        self.message_store = message_store
+        
+        self._peers: List[str] = []  # Row order
+        self._rows: Dict[str, int] = {}  # node_id -> row
+        self._addresses: Dict[str, Tuple[str, int]] = {}  # node_id -> (host, port)
+        self._states: Dict[str, Tuple[str, str, Optional[str], bool]] = {}  # node_id -> rendered state
+    
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._peers)
+    
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.COLUMNS)
+    
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._peers):
+            return None
+        
+        node_id = self._peers[index.row()]
+        status_text, tooltip, style, bold = self._states[node_id]
+        
+        if role == Qt.DisplayRole:
+            return f"{node_id[:8]}..." if index.column() == 0 else status_text
+        if role == Qt.ToolTipRole:
+            return tooltip
+        if role == Qt.BackgroundRole:
+            return self.BACKGROUNDS.get(style, QColor(Qt.white))
+        if role == Qt.ForegroundRole:
+            return QColor(Qt.black)
+        if role == Qt.FontRole and bold:
+            font = QFont()
+            font.setBold(True)
+            return font
+        if role == Qt.UserRole:
+            return node_id
+        if role == Qt.UserRole + 1:
+            return self._addresses[node_id][0]
+        if role == Qt.UserRole + 2:
+            return self._addresses[node_id][1]
+        return None
+    
+    def peer_row(self, node_id: str) -> Optional[int]:
+        """Get the row of a peer in the model.
+        
+        Args:
+            node_id: The ID of the peer
+            
+        Returns:
+            The row index, or None if the peer isn't listed
+        """
+        return self._rows.get(node_id)
+    
+    def _compute_state(self, node_id: str) -> Tuple[str, str, Optional[str], bool]:
+        """Compute how a peer's row should look.
+        
+        Args:
+            node_id: The ID of the peer
+            
+        Returns:
+            Tuple of (status_text, tooltip, style, bold)
+        """
+        host, port = self._addresses[node_id]
+        is_connected = self.node.peer_registry.is_connected(node_id)
+        has_shared_key = False
+        is_secure = False
+        peer_settings = None
+        
+        if self.secure_messaging:
+            has_shared_key = node_id in self.secure_messaging.shared_keys
+            key_exchange_state = self.secure_messaging.key_exchange_states.get(node_id, 0)
+            is_secure = has_shared_key and key_exchange_state == 4  # ESTABLISHED
+            peer_settings = self.secure_messaging.peer_crypto_settings.get(node_id)
+        
+        # Tooltip with full information
+        tooltip = f"ID: {node_id}\nHost: {host}\nPort: {port}"
+        if peer_settings is not None:
+            key_exchange = peer_settings.get("key_exchange", "Unknown")
+            symmetric = peer_settings.get("symmetric", "Unknown")
+            signature = peer_settings.get("signature", "Unknown")
+            tooltip += f"\n\nCrypto Settings:\nKey Exchange: {key_exchange}\nSymmetric: {symmetric}\nSignature: {signature}"
+        
+        style = None
+        if is_connected:
+            if is_secure:
+                status_text = "Secure"
+                style = "secure"
+            else:
+                status_text = "Connected, Key Issue" if has_shared_key else "Connected"
+                style = "connected"
+            
+            # Add crypto compatibility indicator
+            if peer_settings is not None:
+                my_settings = {
+                    "key_exchange": self.secure_messaging.key_exchange.name,
+                    "symmetric": self.secure_messaging.symmetric.name,
+                    "signature": self.secure_messaging.signature.name
+                }
+                
+                # Check for mismatches
+                has_mismatches = any(
+                    peer_settings.get(key, "") != my_settings[key]
+                    for key in my_settings
+                    if key in peer_settings
+                )
+                
+                if has_mismatches:
+                    status_text += " ⚠️"
+        else:
+            status_text = "Discovered"
+        
+        # Unread messages make the row bold and show a count
+        bold = False
+        if self.message_store and self.message_store.has_unread_messages(node_id):
+            bold = True
+            status_text = f"{status_text} ({self.message_store.get_unread_count(node_id)} unread)"
+        
+        return (status_text, tooltip, style, bold)
+    
+    def upsert_peer(self, node_id: str, host: str, port: int) -> None:
+        """Add a peer, or update its address and state if it's already listed.
+        
+        Args:
+            node_id: The ID of the peer
+            host: The host IP address of the peer
+            port: The port number the peer is listening on
+        """
+        row = self._rows.get(node_id)
+        if row is None:
+            row = len(self._peers)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._peers.append(node_id)
+            self._rows[node_id] = row
+            self._addresses[node_id] = (host, port)
+            self._states[node_id] = self._compute_state(node_id)
+            self.endInsertRows()
+            return
+        
+        self._addresses[node_id] = (host, port)
+        self.refresh_peer(node_id, force=True)
+    
+    def remove_peer(self, node_id: str) -> None:
+        """Remove a peer from the model.
+        
+        Args:
+            node_id: The ID of the peer
+        """
+        row = self._rows.get(node_id)
+        if row is None:
+            return
+        
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._peers[row]
+        del self._rows[node_id]
+        del self._addresses[node_id]
+        del self._states[node_id]
+        for shifted_row in range(row, len(self._peers)):
+            self._rows[self._peers[shifted_row]] = shifted_row
+        self.endRemoveRows()
+    
+    def refresh_peer(self, node_id: str, force: bool = False) -> bool:
+        """Recompute a peer's row and notify the view if it changed.
+        
+        Args:
+            node_id: The ID of the peer
+            force: Notify the view even if the rendered state is unchanged
+            
+        Returns:
+            True if the view was notified, False otherwise
+        """
+        row = self._rows.get(node_id)
+        if row is None:
+            return False
+        
+        state = self._compute_state(node_id)
+        if not force and state == self._states[node_id]:
+            return False
+        
+        self._states[node_id] = state
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+        return True
+    
+    def refresh_all(self) -> int:
+        """Recompute every row, notifying the view only about changed ones.
+        
+        Returns:
+            The number of rows that changed
+        """
+        return sum(1 for node_id in list(self._peers) if self.refresh_peer(node_id))
+    
+    def set_peers(self, discovered: List[Tuple[str, str, int]]) -> None:
+        """Bring the model in line with a full list of peers.
+        
+        Only the difference is applied: missing peers are removed, new peers
+        inserted and changed rows updated.
+        
+        Args:
+            discovered: List of discovered peers (node_id, host, port)
+        """
+        wanted = {node_id: (host, port) for node_id, host, port in discovered}
+        
+        for node_id in [n for n in self._peers if n not in wanted]:
+            self.remove_peer(node_id)
+        
+        for node_id, (host, port) in wanted.items():
+            if node_id in self._rows and self._addresses[node_id] == (host, port):
+                self.refresh_peer(node_id)
+            else:
+                self.upsert_peer(node_id, host, port)
+
+
 class PeerListWidget(QWidget):
     """Widget for displaying and interacting with the list of peers."""
     
@@ -31,6 +277,9 @@ class PeerListWidget(QWidget):
     def __init__(self, node: P2PNode, discovery: NodeDiscovery, secure_messaging=None, message_store=None, parent=None):
         """Initialize the peer list widget.
         
+        The widget subscribes to the node's peer registry and applies each
+        added, updated or removed peer to its model as it happens.
+        
         Args:
             node: The P2P node
             discovery: The node discovery service
@@ -48,11 +297,17 @@ class PeerListWidget(QWidget):
         # Keep track of the currently selected peer
         self.current_peer_id = None
         
+        self.peer_model = PeerTableModel(node, secure_messaging, message_store, self)
+        
         self._init_ui()
         
         # If we have secure messaging, register for crypto changes
         if self.secure_messaging:
             self.secure_messaging.register_settings_change_listener(self._refresh_crypto_indicators)
+        
+        # Populate from the current peers, then follow changes
+        self.sync_peers()
+        self.node.peer_registry.subscribe(self.handle_peer_event)
     
     def _init_ui(self):
         """Initialize the user interface."""
@@ -63,16 +318,19 @@ class PeerListWidget(QWidget):
         header_label.setStyleSheet("font-weight: bold;")
         layout.addWidget(header_label)
         
-        # Use a table widget instead of list for better column control
-        self.peer_table = QTableWidget()
-        self.peer_table.setColumnCount(2)  # ID and Status columns
-        self.peer_table.setHorizontalHeaderLabels(["Peer", "Status"])
+        # Sorting goes through a proxy so the model itself can stay in insertion order
+        self.proxy_model = QSortFilterProxyModel(self)
+        self.proxy_model.setSourceModel(self.peer_model)
+        
+        self.peer_table = QTableView()
+        self.peer_table.setModel(self.proxy_model)
         self.peer_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)  # ID column stretches
         self.peer_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)  # Status fits content
-        self.peer_table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.peer_table.setSelectionMode(QTableWidget.SingleSelection)
-        self.peer_table.setEditTriggers(QTableWidget.NoEditTriggers)  # Make table read-only
-        self.peer_table.itemClicked.connect(self._on_peer_clicked)
+        self.peer_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.peer_table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.peer_table.setEditTriggers(QAbstractItemView.NoEditTriggers)  # Make table read-only
+        self.peer_table.setSortingEnabled(True)
+        self.peer_table.clicked.connect(self._on_peer_clicked)
         
         # Set row height to be a bit more compact
         self.peer_table.verticalHeader().setDefaultSectionSize(24)
@@ -107,160 +365,66 @@ class PeerListWidget(QWidget):
         
         logger.debug("Peer list widget initialized")
     
-    def update_peers(self, discovered: list, connected: list):
-        """Update the list of peers while preserving selection.
+    def handle_peer_event(self, event: str, peer_id: str):
+        """Apply a peer registry change to the table.
         
         Args:
-            discovered: List of discovered peers (node_id, host, port)
-            connected: List of connected peer IDs
+            event: The PeerEvent type
+            peer_id: The peer that changed
         """
-        # Remember the currently selected peer ID
-        selected_rows = self.peer_table.selectedItems()
-        if selected_rows and selected_rows[0].column() == 0:  # Make sure we get a peer ID column
-            selected_peer_id = selected_rows[0].data(Qt.UserRole)
-        else:
-            selected_peer_id = self.current_peer_id
-        
-        # Remember scroll position
-        scrollbar_pos = self.peer_table.verticalScrollBar().value()
+        if event == PeerEvent.REMOVED:
+            self.peer_model.remove_peer(peer_id)
+            return
         
-        # Clear and rebuild the table
-        self.peer_table.setRowCount(0)  # Clear all rows
-        self.peer_table.setSortingEnabled(False)  # Disable sorting while updating
+        info = self.node.peer_registry.get(peer_id)
+        if info is None:
+            # Connected but never discovered; not listed
+            return
         
-        # Rebuild the table
-        row = 0
-        for node_id, host, port in discovered:
-            self.peer_table.insertRow(row)
-            
-            # Determine state
-            is_connected = node_id in connected
-            has_shared_key = False
-            is_secure = False
-            
-            if self.secure_messaging:
-                has_shared_key = node_id in self.secure_messaging.shared_keys
-                key_exchange_state = self.secure_messaging.key_exchange_states.get(node_id, 0)
-                is_secure = has_shared_key and key_exchange_state == 4  # ESTABLISHED
-            
-            # ID column (short peer ID + address)
-            id_item = QTableWidgetItem(f"{node_id[:8]}...")
-            id_item.setData(Qt.UserRole, node_id)  # Store full ID
-            id_item.setData(Qt.UserRole + 1, host)  # Store host
-            id_item.setData(Qt.UserRole + 2, port)  # Store port
-            
-            # Set tooltip with full information
-            tooltip = f"ID: {node_id}\nHost: {host}\nPort: {port}"
-            if self.secure_messaging and node_id in self.secure_messaging.peer_crypto_settings:
-                peer_settings = self.secure_messaging.peer_crypto_settings[node_id]
-                key_exchange = peer_settings.get("key_exchange", "Unknown")
-                symmetric = peer_settings.get("symmetric", "Unknown")
-                signature = peer_settings.get("signature", "Unknown")
-                tooltip += f"\n\nCrypto Settings:\nKey Exchange: {key_exchange}\nSymmetric: {symmetric}\nSignature: {signature}"
-            id_item.setToolTip(tooltip)
-            
-            # Status column
-            status_item = QTableWidgetItem()
-            
-            # Set text based on state
-            if is_connected:
-                if is_secure:
-                    status_text = "Secure"
-                else:
-                    if has_shared_key:
-                        status_text = "Connected, Key Issue"
-                    else:
-                        status_text = "Connected"
-                
-                # Add crypto compatibility indicator
-                if self.secure_messaging and node_id in self.secure_messaging.peer_crypto_settings:
-                    peer_settings = self.secure_messaging.peer_crypto_settings[node_id]
-                    my_settings = {
-                        "key_exchange": self.secure_messaging.key_exchange.name,
-                        "symmetric": self.secure_messaging.symmetric.name,
-                        "signature": self.secure_messaging.signature.name
-                    }
-                    
-                    # Check for mismatches
-                    has_mismatches = any(
-                        peer_settings.get(key, "") != my_settings[key]
-                        for key in my_settings
-                        if key in peer_settings
-                    )
-                    
-                    if has_mismatches:
-                        status_text += " ⚠️"
-                        
-            else:
-                status_text = "Discovered"
-            
-            status_item.setText(status_text)
-            
-            # Add to table
-            self.peer_table.setItem(row, 0, id_item)
-            self.peer_table.setItem(row, 1, status_item)
-            
-            # Apply color based on state
-            background_color = Qt.white  # Default white
-            text_color = Qt.black  # Default black
-            
-            if is_connected:
-                if is_secure:
-                    background_color = QColor(230, 255, 230)  # Light green
-                else:
-                    background_color = QColor(240, 240, 255)  # Light blue
-            
-            # Apply colors to both columns
-            id_item.setBackground(background_color)
-            status_item.setBackground(background_color)
-            id_item.setForeground(text_color)
-            status_item.setForeground(text_color)
-            
-            # Separately handle unread messages
-            if self.message_store and self.message_store.has_unread_messages(node_id):
-                unread_count = self.message_store.get_unread_count(node_id)
-                
-                # Make text bold for unread messages
-                font = id_item.font()
-                font.setBold(True)
-                id_item.setFont(font)
-                status_item.setFont(font)
-                
-                # Update status text to include unread count
-                status_item.setText(f"{status_text} ({unread_count} unread)")
-            
-            row += 1
-        
-        # Restore selection if possible
-        if selected_peer_id:
-            for r in range(self.peer_table.rowCount()):
-                item = self.peer_table.item(r, 0)  # ID column
-                if item and item.data(Qt.UserRole) == selected_peer_id:
-                    self.peer_table.selectRow(r)
-                    break
-            
-        # Restore scroll position
-        self.peer_table.verticalScrollBar().setValue(scrollbar_pos)
+        host, port, _ = info
+        self.peer_model.upsert_peer(peer_id, host, port)
+    
+    def refresh_peer(self, peer_id: str):
+        """Update a single peer's row, e.g. after its unread count changed.
         
-        # Re-enable sorting
-        self.peer_table.setSortingEnabled(True)
+        Args:
+            peer_id: The ID of the peer
+        """
+        self.peer_model.refresh_peer(peer_id)
+    
+    def sync_peers(self):
+        """Bring the table in line with the currently discovered peers."""
+        discovered = self.discovery.get_discovered_nodes()
+        self.peer_model.set_peers(discovered)
+        logger.debug(f"Synchronized peer table with {len(discovered)} peers")
+    
+    def select_peer(self, peer_id: str) -> bool:
+        """Select a peer in the list as if it had been clicked.
         
-        logger.debug(f"Updated peer table with {len(discovered)} peers")
+        Args:
+            peer_id: The ID of the peer
+            
+        Returns:
+            True if the peer is listed and was selected, False otherwise
+        """
+        row = self.peer_model.peer_row(peer_id)
+        if row is None:
+            return False
+        
+        index = self.proxy_model.mapFromSource(self.peer_model.index(row, 0))
+        self.peer_table.setCurrentIndex(index)
+        self._on_peer_clicked(index)
+        return True
     
-    def _on_peer_clicked(self, item):
+    def _on_peer_clicked(self, index):
         """Handle clicking on a peer in the list.
         
         Args:
-            item: The clicked table item
+            index: The clicked model index
         """
-        # Get the row
-        row = item.row()
-        
-        # Get the peer ID from the ID column
-        id_item = self.peer_table.item(row, 0)
-        peer_id = id_item.data(Qt.UserRole)
-        host = id_item.data(Qt.UserRole + 1)
-        port = id_item.data(Qt.UserRole + 2)
+        peer_id = index.data(Qt.UserRole)
+        host = index.data(Qt.UserRole + 1)
+        port = index.data(Qt.UserRole + 2)
         
         # Store the current peer ID
         self.current_peer_id = peer_id
@@ -270,62 +434,33 @@ class PeerListWidget(QWidget):
             self.message_store.mark_all_read(peer_id)
             
             # Update display to reflect read state
-            self._refresh_peer_display(peer_id)
+            self.peer_model.refresh_peer(peer_id)
         
         # Emit the signal to select this peer
         self.peer_selected.emit(peer_id)
         
         # Automatically attempt to connect if not already connected
-        if peer_id not in self.node.get_peers():
+        if not self.node.peer_registry.is_connected(peer_id):
             logger.info(f"Auto-connecting to peer {peer_id} at {host}:{port}")
             self.connection_started.emit(peer_id, host, port)
         
         logger.debug(f"Selected peer {peer_id}")
     
-    def _refresh_peer_display(self, peer_id):
-        """Refresh the display for a specific peer.
-        
-        Args:
-            peer_id: The ID of the peer to refresh
-        """
-        # Find the row with this peer ID
-        for row in range(self.peer_table.rowCount()):
-            id_item = self.peer_table.item(row, 0)
-            if id_item and id_item.data(Qt.UserRole) == peer_id:
-                # Get status item
-                status_item = self.peer_table.item(row, 1)
-                
-                # Remove bold if this is the current peer (messages have been read)
-                font = id_item.font()
-                font.setBold(False)
-                id_item.setFont(font)
-                status_item.setFont(font)
-                
-                # Update status text to remove unread count
-                status_text = status_item.text()
-                if " (" in status_text:
-                    status_text = status_text.split(" (")[0]
-                    status_item.setText(status_text)
-                break
-    
     def _on_connect_clicked(self):
         """Handle clicking the connect button."""
         # Get the selected peer
-        selected_rows = self.peer_table.selectedItems()
+        selected_rows = self.peer_table.selectionModel().selectedRows()
         if not selected_rows:
             QMessageBox.warning(self, "No Peer Selected", "Please select a peer to connect to.")
             return
         
-        # Get the peer data from the first column
-        row = selected_rows[0].row()
-        id_item = self.peer_table.item(row, 0)
-        
-        peer_id = id_item.data(Qt.UserRole)
-        host = id_item.data(Qt.UserRole + 1)
-        port = id_item.data(Qt.UserRole + 2)
+        index = selected_rows[0]
+        peer_id = index.data(Qt.UserRole)
+        host = index.data(Qt.UserRole + 1)
+        port = index.data(Qt.UserRole + 2)
         
         # Only attempt connection if not already connected
-        if peer_id in self.node.get_peers():
+        if self.node.peer_registry.is_connected(peer_id):
             QMessageBox.information(self, "Already Connected", f"Already connected to {peer_id[:8]}...")
             return
         
@@ -336,12 +471,7 @@ class PeerListWidget(QWidget):
     
     def _on_refresh_clicked(self):
         """Handle clicking the refresh button."""
-        # Get discovered and connected peers
-        discovered = self.discovery.get_discovered_nodes()
-        connected = self.node.get_peers()
-        
-        # Update the list
-        self.update_peers(discovered, connected)
+        self.sync_peers()
         
         logger.debug("Manually refreshed peer list")
     
@@ -356,12 +486,8 @@ class PeerListWidget(QWidget):
         # Only proceed if we have secure_messaging
         if not self.secure_messaging:
             return
-            
-        # Get current connected peers
-        connected = self.node.get_peers()
-        
-        # Get currently discovered peers
-        discovered = self.discovery.get_discovered_nodes()
         
-        # Update the list with new indicators
-        self.update_peers(discovered, connected)
\ No newline at end of file
+        # Settings changes don't say which peer they concern, so recheck every
+        # row; only the rows whose indicators changed are redrawn
+        changed = self.peer_model.refresh_all()
+        logger.debug(f"Refreshed crypto indicators, {changed} peers changed")
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+Dialog for searching the stored message history.
+"""
+
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+from PyQt5.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QListWidget,
+    QListWidgetItem, QCheckBox, QPushButton
+)
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+
+from ..app import MessageStore
+
+logger = logging.getLogger(__name__)
+
+
+class SearchDialog(QDialog):
+    """Dialog for finding messages by the words they contain."""
+
+    # Signal emitted when the user opens a result, with the conversation's peer ID
+    peer_selected = pyqtSignal(str)
+
+    RESULT_LIMIT = 200
+    SEARCH_DELAY_MS = 200  # Wait for typing to pause before searching
+
+    def __init__(self, message_store: MessageStore, node_id: str,
+                 current_peer: Optional[str] = None, parent=None):
+        """Initialize the search dialog.
+
+        Args:
+            message_store: The message store to search
+            node_id: The ID of this node, to tell sent messages from received ones
+            current_peer: The peer of the open conversation (optional)
+            parent: The parent widget
+        """
+        super().__init__(parent)
+
+        self.message_store = message_store
+        self.node_id = node_id
+        self.current_peer = current_peer
+
+        self.setWindowTitle("Search Messages")
+        self.setMinimumSize(600, 400)
+
+        # Search once typing pauses instead of on every keystroke
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self._run_search)
+
+        self._init_ui()
+
+    def _init_ui(self):
+        """Initialize the user interface."""
+        layout = QVBoxLayout()
+
+        self.query_input = QLineEdit()
+        self.query_input.setPlaceholderText("Search messages and file names...")
+        self.query_input.textChanged.connect(lambda _: self.search_timer.start())
+        self.query_input.returnPressed.connect(self._run_search)
+        layout.addWidget(self.query_input)
+
+        self.current_only_checkbox = QCheckBox("Only the current conversation")
+        self.current_only_checkbox.setEnabled(self.current_peer is not None)
+        self.current_only_checkbox.toggled.connect(lambda _: self._run_search())
+        layout.addWidget(self.current_only_checkbox)
+
+        self.results_list = QListWidget()
+        self.results_list.setUniformItemSizes(True)
+        self.results_list.itemActivated.connect(self._on_result_activated)
+        layout.addWidget(self.results_list, 1)
+
+        bottom_layout = QHBoxLayout()
+        self.status_label = QLabel("Matches whole words in text messages and file names")
+        bottom_layout.addWidget(self.status_label, 1)
+
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(self.reject)
+        bottom_layout.addWidget(close_button)
+        layout.addLayout(bottom_layout)
+
+        self.setLayout(layout)
+
+    def _run_search(self):
+        """Search for the current query and show the results."""
+        self.search_timer.stop()
+        self.results_list.clear()
+
+        query = self.query_input.text().strip()
+        if not query:
+            self.status_label.setText("Matches whole words in text messages and file names")
+            return
+
+        peer_id = self.current_peer if self.current_only_checkbox.isChecked() else None
+
+        start = time.perf_counter()
+        messages = self.message_store.search(query, peer_id=peer_id, limit=self.RESULT_LIMIT)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        for message in messages:
+            conversation_peer = self.message_store.conversation_peer(message)
+            item = QListWidgetItem(self._format_result(message, conversation_peer))
+            item.setData(Qt.UserRole, conversation_peer)
+            self.results_list.addItem(item)
+
+        more = "+" if len(messages) == self.RESULT_LIMIT else ""
+        self.status_label.setText(f"{len(messages)}{more} results in {elapsed_ms:.0f} ms")
+
+    def _format_result(self, message, conversation_peer: Optional[str]) -> str:
+        """Render a search result as a line of text.
+
+        Args:
+            message: The matching message
+            conversation_peer: The peer of the conversation the message is in
+
+        Returns:
+            The text to show
+        """
+        timestamp = datetime.fromtimestamp(message.timestamp).strftime("%Y-%m-%d %H:%M")
+        peer = f"{conversation_peer[:8]}..." if conversation_peer else "Unknown"
+        sender = "You" if message.sender_id == self.node_id else "Peer"
+
+        if message.is_file:
+            text = f"📄 File: {message.filename or 'Unknown file'}"
+        else:
+            text = message.content.decode("utf-8", errors="replace")
+            # Keep results on one line
+            text = " ".join(text.split())
+            if len(text) > 120:
+                text = text[:117] + "..."
+
+        return f"[{timestamp}] {peer} {sender}: {text}"
+
+    def _on_result_activated(self, item: QListWidgetItem):
+        """Open the conversation of a result.
+
+        Args:
+            item: The activated result
+        """
+        peer_id = item.data(Qt.UserRole)
+        if peer_id:
+            self.peer_selected.emit(peer_id)
+            self.accept()
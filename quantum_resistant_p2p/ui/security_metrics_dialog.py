@@ -2,11 +2,13 @@
 Dialog for displaying security metrics.
 """
 
+import time
 import logging
+import datetime
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
     QTableWidget, QTableWidgetItem, QHeaderView, QGroupBox,
-    QFormLayout, QTextEdit, QTabWidget, QWidget
+    QFormLayout, QTextEdit, QTabWidget, QWidget, QComboBox
 )
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QColor, QFont
@@ -19,6 +21,14 @@ logger = logging.getLogger(__name__)
 class SecurityMetricsDialog(QDialog):
     """Dialog for displaying security metrics."""
     
+    # Periods the usage metrics can be shown for, as (label, seconds)
+    WINDOWS = [
+        ("All time", None),
+        ("Last 24 hours", 24 * 3600),
+        ("Last 7 days", 7 * 24 * 3600),
+        ("Last 30 days", 30 * 24 * 3600),
+    ]
+    
     def __init__(self, secure_messaging, secure_logger, parent=None):
         """Initialize the security metrics dialog.
         
@@ -116,82 +126,63 @@ class SecurityMetricsDialog(QDialog):
         metrics_tab = QWidget()
         metrics_layout = QVBoxLayout(metrics_tab)
         
-        # Get metrics from the secure logger
-        metrics = self.secure_logger.get_security_metrics()
+        # Time window of the metrics
+        window_layout = QHBoxLayout()
+        window_layout.addWidget(QLabel("Period:"))
+        self.window_combo = QComboBox()
+        for label, seconds in self.WINDOWS:
+            self.window_combo.addItem(label, seconds)
+        self.window_combo.currentIndexChanged.connect(self._refresh_metrics)
+        window_layout.addWidget(self.window_combo)
+        window_layout.addStretch()
+        metrics_layout.addLayout(window_layout)
         
         # Basic metrics
         metrics_group = QGroupBox("Usage Metrics")
         form_layout = QFormLayout()
         
-        # Display metrics
-        form_layout.addRow("Total Events:", QLabel(str(metrics.get('total_events', 0))))
-        form_layout.addRow("Key Exchanges:", QLabel(str(metrics.get('key_exchanges', 0))))
-        form_layout.addRow("Messages Sent:", QLabel(str(metrics.get('messages_sent', 0))))
-        form_layout.addRow("Messages Received:", QLabel(str(metrics.get('messages_received', 0))))
-        form_layout.addRow("Files Transferred:", QLabel(str(metrics.get('files_transferred', 0))))
-        form_layout.addRow("Total Bytes Transferred:", QLabel(f"{metrics.get('total_bytes_transferred', 0):,} bytes"))
-        
-        # Add timestamps if available
-        if metrics.get('first_event_time'):
-            import datetime
-            first_time = datetime.datetime.fromtimestamp(metrics['first_event_time']).strftime('%Y-%m-%d %H:%M:%S')
-            form_layout.addRow("First Activity:", QLabel(first_time))
-            
-        if metrics.get('last_event_time'):
-            import datetime
-            last_time = datetime.datetime.fromtimestamp(metrics['last_event_time']).strftime('%Y-%m-%d %H:%M:%S')
-            form_layout.addRow("Latest Activity:", QLabel(last_time))
+        self.metric_labels = {}
+        for key, title in (("total_events", "Total Events:"),
+                           ("key_exchanges", "Key Exchanges:"),
+                           ("messages_sent", "Messages Sent:"),
+                           ("messages_received", "Messages Received:"),
+                           ("files_transferred", "Files Transferred:"),
+                           ("total_bytes_transferred", "Total Bytes Transferred:"),
+                           ("first_event_time", "First Activity:"),
+                           ("last_event_time", "Latest Activity:")):
+            self.metric_labels[key] = QLabel()
+            form_layout.addRow(title, self.metric_labels[key])
         
         metrics_group.setLayout(form_layout)
         metrics_layout.addWidget(metrics_group)
         
         # Algorithms used
-        if metrics.get('algorithms_used'):
-            algos_group = QGroupBox("Algorithms Used")
-            algos_layout = QVBoxLayout()
-            
-            algos_table = QTableWidget()
-            algos_table.setColumnCount(2)
-            algos_table.setHorizontalHeaderLabels(["Algorithm", "Usage Count"])
-            algos_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
-            
-            # Add rows for each algorithm
-            algos_table.setRowCount(len(metrics['algorithms_used']))
-            row = 0
-            for algo, count in metrics['algorithms_used'].items():
-                algos_table.setItem(row, 0, QTableWidgetItem(algo))
-                algos_table.setItem(row, 1, QTableWidgetItem(str(count)))
-                row += 1
-            
-            algos_layout.addWidget(algos_table)
-            algos_group.setLayout(algos_layout)
-            metrics_layout.addWidget(algos_group)
+        algos_group = QGroupBox("Algorithms Used")
+        algos_layout = QVBoxLayout()
+        self.algos_table = self._create_count_table("Algorithm", "Usage Count")
+        algos_layout.addWidget(self.algos_table)
+        algos_group.setLayout(algos_layout)
+        metrics_layout.addWidget(algos_group)
+        
+        # Key exchanges by state
+        handshakes_group = QGroupBox("Key Exchanges by State")
+        handshakes_layout = QVBoxLayout()
+        self.handshakes_table = self._create_count_table("State", "Count")
+        handshakes_layout.addWidget(self.handshakes_table)
+        handshakes_group.setLayout(handshakes_layout)
+        metrics_layout.addWidget(handshakes_group)
         
         tabs.addTab(metrics_tab, "Usage Metrics")
         
-        # Event summary tab
+        # Event summary tab, for the same period
         summary_tab = QWidget()
         summary_layout = QVBoxLayout(summary_tab)
-        
-        # Get event summary
-        summary = self.secure_logger.get_event_summary()
-        
-        summary_table = QTableWidget()
-        summary_table.setColumnCount(2)
-        summary_table.setHorizontalHeaderLabels(["Event Type", "Count"])
-        summary_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
-        
-        # Add rows for each event type
-        summary_table.setRowCount(len(summary))
-        row = 0
-        for event_type, count in summary.items():
-            summary_table.setItem(row, 0, QTableWidgetItem(event_type))
-            summary_table.setItem(row, 1, QTableWidgetItem(str(count)))
-            row += 1
-        
-        summary_layout.addWidget(summary_table)
+        self.summary_table = self._create_count_table("Event Type", "Count")
+        summary_layout.addWidget(self.summary_table)
         tabs.addTab(summary_tab, "Event Summary")
         
+        self._refresh_metrics()
+        
         layout.addWidget(tabs)
         
         # Close button
@@ -203,3 +194,57 @@ class SecurityMetricsDialog(QDialog):
         layout.addLayout(button_layout)
         
         self.setLayout(layout)
+    
+    @staticmethod
+    def _create_count_table(name_header: str, count_header: str) -> QTableWidget:
+        """Create a two-column table of names and counts.
+        
+        Args:
+            name_header: Header of the name column
+            count_header: Header of the count column
+            
+        Returns:
+            The table
+        """
+        table = QTableWidget()
+        table.setColumnCount(2)
+        table.setHorizontalHeaderLabels([name_header, count_header])
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        return table
+    
+    @staticmethod
+    def _fill_count_table(table: QTableWidget, counts: dict) -> None:
+        """Show counts in a table, largest first.
+        
+        Args:
+            table: The table
+            counts: Counts by name
+        """
+        rows = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        table.setRowCount(len(rows))
+        for row, (name, count) in enumerate(rows):
+            table.setItem(row, 0, QTableWidgetItem(str(name)))
+            table.setItem(row, 1, QTableWidgetItem(str(count)))
+    
+    def _refresh_metrics(self):
+        """Show the metrics of the selected period."""
+        seconds = self.window_combo.currentData()
+        start_time = None if seconds is None else time.time() - seconds
+        
+        # The logger keeps running totals, so this doesn't read the logs
+        metrics = self.secure_logger.get_security_metrics(start_time)
+        
+        for key, label in self.metric_labels.items():
+            value = metrics.get(key)
+            if key.endswith("_time"):
+                text = (datetime.datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+                        if value else "-")
+            elif key == "total_bytes_transferred":
+                text = f"{value or 0:,} bytes"
+            else:
+                text = str(value or 0)
+            label.setText(text)
+        
+        self._fill_count_table(self.algos_table, metrics.get("algorithms_used", {}))
+        self._fill_count_table(self.handshakes_table, metrics.get("handshakes", {}))
+        self._fill_count_table(self.summary_table, metrics.get("events_by_type", {}))
@@ -0,0 +1,47 @@
+"""
+Worker thread for slow key storage operations.
+"""
+
+import logging
+from typing import Callable
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+logger = logging.getLogger(__name__)
+
+
+class StorageWorker(QThread):
+    """Runs a key storage operation, such as unlocking, off the UI thread.
+
+    Deriving the password key with Argon2id is deliberately slow, so running
+    it on the UI thread would freeze the window.
+    """
+
+    # Signal emitted with a description of each step of the operation
+    progress = pyqtSignal(str)
+
+    # Signal emitted with the operation's result
+    completed = pyqtSignal(bool)
+
+    # Signal emitted instead of completed if the operation raised, with the error
+    failed = pyqtSignal(str)
+
+    def __init__(self, operation: Callable[[Callable[[str], None]], bool], parent=None):
+        """Initialize the worker.
+
+        Args:
+            operation: The operation to run, called with a progress callback
+            parent: The parent object
+        """
+        super().__init__(parent)
+        self.operation = operation
+
+    def run(self):
+        """Run the operation in the worker thread."""
+        try:
+            result = bool(self.operation(self.progress.emit))
+        except Exception as e:
+            logger.error(f"Key storage operation failed: {e}", exc_info=True)
+            self.failed.emit(str(e))
+            return
+        self.completed.emit(result)
@@ -3,5 +3,7 @@ Utility functions for the post-quantum P2P application.
 """
 
 from .secure_file import SecureFile
+from .journal import Journal
+from .secure_buffer import SecureBuffer, secret_view
 
-__all__ = ['SecureFile']
\ No newline at end of file
+__all__ = ['SecureFile', 'Journal', 'SecureBuffer', 'secret_view']
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""
+Append-only record journal with group-committed fsync.
+
+This module provides an append-only file of length-prefixed records. Appends
+are cheap writes at the end of the file, and callers that need their records
+on disk share fsync calls, so concurrent writers don't each pay for one.
+"""
+
+import os
+import struct
+import logging
+import threading
+from pathlib import Path
+from typing import List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """An append-only file of records.
+
+    Each record is stored as a 4-byte big-endian length followed by the record
+    bytes. A crash can only leave the last record incomplete; such a torn tail
+    is dropped when the journal is read. The journal doesn't interpret or
+    protect the records themselves, callers encrypt and authenticate them.
+
+    Durability uses group commit: a caller that needs its record on disk
+    waits until an fsync covering it has completed. If another fsync is
+    already running, the caller waits for it and the next fsync covers every
+    record appended in the meantime, so N concurrent appends cost far fewer
+    than N fsyncs.
+    """
+
+    _LENGTH = struct.Struct(">I")
+
+    def __init__(self, file_path: Union[str, Path]):
+        """Initialize a journal.
+
+        The file is created on the first append.
+
+        Args:
+            file_path: The path to the journal file
+        """
+        self.file_path = Path(file_path)
+        self._fd: Optional[int] = None
+        self._cond = threading.Condition()
+
+        # Sequence numbers of the last appended and last synced records
+        self._appended = 0
+        self._synced = 0
+        self._syncing = False
+
+        self._size = self.file_path.stat().st_size if self.file_path.exists() else 0
+
+    @property
+    def size(self) -> int:
+        """Size of the journal file in bytes."""
+        return self._size
+
+    def _open(self) -> int:
+        """Open the journal file for appending if it isn't open yet."""
+        if self._fd is None:
+            self.file_path.parent.mkdir(parents=True, exist_ok=True)
+            flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0)
+            self._fd = os.open(self.file_path, flags, 0o600)
+        return self._fd
+
+    def read_records(self) -> List[bytes]:
+        """Read all complete records.
+
+        An incomplete record at the end of the file, left by a crash during
+        an append, is cut off so later appends follow the last good record.
+
+        Returns:
+            The records in the order they were appended
+        """
+        if not self.file_path.exists():
+            return []
+
+        with open(self.file_path, 'rb') as f:
+            data = f.read()
+
+        records = []
+        offset = 0
+        while offset + self._LENGTH.size <= len(data):
+            length = self._LENGTH.unpack_from(data, offset)[0]
+            end = offset + self._LENGTH.size + length
+            if end > len(data):
+                break
+            records.append(data[offset + self._LENGTH.size:end])
+            offset = end
+
+        if offset != len(data):
+            logger.warning(f"Dropping incomplete record at the end of {self.file_path}")
+            with self._cond:
+                with open(self.file_path, 'r+b') as f:
+                    f.truncate(offset)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._size = offset
+
+        return records
+
+    def append(self, record: bytes, sync: bool = True) -> bool:
+        """Append a record.
+
+        Args:
+            record: The record to append
+            sync: Whether to wait until the record is on disk
+
+        Returns:
+            True if the record was appended (and synced if requested), False otherwise
+        """
+        frame = self._LENGTH.pack(len(record)) + record
+
+        try:
+            with self._cond:
+                fd = self._open()
+                view = memoryview(frame)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+                self._size += len(frame)
+                self._appended += 1
+                sequence = self._appended
+        except Exception as e:
+            logger.error(f"Error appending to {self.file_path}: {e}")
+            return False
+
+        if sync:
+            return self._sync_to(sequence)
+        return True
+
+    def sync(self) -> bool:
+        """Wait until every record appended so far is on disk.
+
+        Returns:
+            True if the records are on disk, False otherwise
+        """
+        with self._cond:
+            sequence = self._appended
+        return self._sync_to(sequence)
+
+    def _sync_to(self, sequence: int) -> bool:
+        """Wait until the record with the given sequence number is on disk.
+
+        The first waiter runs the fsync for everyone; callers arriving while
+        it runs wait for it and are covered by the next one.
+
+        Args:
+            sequence: Sequence number of the record
+
+        Returns:
+            True if the record is on disk, False otherwise
+        """
+        with self._cond:
+            while self._synced < sequence:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+
+                # Become the leader and sync everything appended so far
+                self._syncing = True
+                target = self._appended
+                fd = self._fd
+                self._cond.release()
+                try:
+                    os.fsync(fd)
+                    synced = True
+                except Exception as e:
+                    logger.error(f"Error syncing {self.file_path}: {e}")
+                    synced = False
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    self._cond.notify_all()
+
+                if not synced:
+                    return False
+                self._synced = max(self._synced, target)
+        return True
+
+    def close(self) -> None:
+        """Sync and close the journal file."""
+        with self._cond:
+            while self._syncing:
+                self._cond.wait()
+            if self._fd is not None:
+                try:
+                    os.fsync(self._fd)
+                except Exception as e:
+                    logger.error(f"Error syncing {self.file_path}: {e}")
+                os.close(self._fd)
+                self._fd = None
+            self._synced = self._appended
+
+    def remove(self) -> None:
+        """Close the journal and delete its file."""
+        self.close()
+        try:
+            if self.file_path.exists():
+                os.remove(self.file_path)
+        except Exception as e:
+            logger.error(f"Error removing {self.file_path}: {e}")
+        self._size = 0
@@ -0,0 +1,165 @@
+"""
+Wipeable buffers for secret key material.
+
+Python's bytes objects are immutable and can be copied or swapped out by the
+operating system without notice, so secrets kept in them linger in memory
+until the interpreter happens to reuse it. SecureBuffer keeps a secret in
+memory allocated through ctypes, asks the OS to keep it out of swap and
+overwrites it with a single memset when it's no longer needed.
+"""
+
+import sys
+import hmac
+import ctypes
+import ctypes.util
+import logging
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+def _load_memory_lock():
+    """Find the platform functions for locking memory into RAM.
+
+    Returns:
+        The lock function, or None if locking memory isn't supported
+    """
+    try:
+        if sys.platform == "win32":
+            kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+            lock = kernel32.VirtualLock
+            lock.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+            lock.restype = ctypes.c_int
+            # VirtualLock returns nonzero on success, mlock returns 0
+            return lambda address, size: 0 if lock(address, size) else -1
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        lock = libc.mlock
+        lock.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        lock.restype = ctypes.c_int
+        return lock
+    except Exception as e:
+        logger.debug(f"Memory locking unavailable: {e}")
+        return None
+
+
+_memory_lock = _load_memory_lock()
+
+
+class SecureBuffer:
+    """Fixed-size secret held in locked memory that can be wiped.
+
+    The memory is allocated with ctypes and locked with mlock (VirtualLock on
+    Windows) so it isn't written to swap. Locking is best effort: when the
+    process is over its locked memory limit the buffer still works, it's
+    just swappable. wipe() zeroes the memory with one memset call, and the
+    buffer wipes itself when it's garbage collected.
+
+    Pass view() to APIs that accept bytes-like objects, such as the
+    cryptography package's ciphers and KDFs, to use the secret without
+    copying it. bytes(buffer) makes an immutable copy that can't be wiped,
+    for APIs that only accept bytes.
+
+    Pages are not unlocked when a buffer is wiped, as another buffer may
+    share them.
+    """
+
+    __slots__ = ('_buffer', '_size', '_locked', '__weakref__')
+
+    def __init__(self, data: Union[bytes, bytearray, memoryview, 'SecureBuffer']):
+        """Copy a secret into a new buffer.
+
+        Args:
+            data: The secret
+        """
+        if isinstance(data, SecureBuffer):
+            data = data.view()
+        source = memoryview(data).cast('B')
+
+        self._size = len(source)
+        self._buffer = (ctypes.c_ubyte * max(self._size, 1))()
+        self._locked = False
+
+        if _memory_lock is not None and self._size:
+            self._locked = _memory_lock(ctypes.addressof(self._buffer), self._size) == 0
+            if not self._locked:
+                logger.debug("Could not lock secret buffer into memory")
+
+        self.view()[:] = source
+
+    @property
+    def is_locked(self) -> bool:
+        """Whether the memory is locked against swapping."""
+        return self._locked
+
+    @property
+    def is_wiped(self) -> bool:
+        """Whether the buffer has been wiped."""
+        return self._buffer is None
+
+    def view(self) -> memoryview:
+        """Get a writable view of the secret without copying it.
+
+        Returns:
+            A memoryview of the secret bytes
+
+        Raises:
+            ValueError: If the buffer has been wiped
+        """
+        if self._buffer is None:
+            raise ValueError("Secure buffer has been wiped")
+        return memoryview(self._buffer).cast('B')[:self._size]
+
+    def wipe(self) -> None:
+        """Overwrite the secret with zeroes and release the buffer."""
+        if self._buffer is not None:
+            ctypes.memset(self._buffer, 0, self._size)
+            self._buffer = None
+
+    def __del__(self):
+        try:
+            self.wipe()
+        except Exception:
+            # ctypes may already be torn down at interpreter exit
+            pass
+
+    def __enter__(self) -> 'SecureBuffer':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.wipe()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bytes__(self) -> bytes:
+        return self.view().tobytes()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, SecureBuffer):
+            other = other.view()
+        elif not isinstance(other, (bytes, bytearray, memoryview)):
+            return NotImplemented
+        # Constant time, the contents are secret
+        return hmac.compare_digest(self.view(), other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        # Never show the contents
+        state = "wiped" if self._buffer is None else f"{self._size} bytes"
+        return f"SecureBuffer({state})"
+
+
+def secret_view(secret: Optional[Union[bytes, 'SecureBuffer']]):
+    """Get a bytes-like object for a secret that may be in a SecureBuffer.
+
+    Args:
+        secret: The secret, as bytes or a SecureBuffer
+
+    Returns:
+        The view of a SecureBuffer, or the value itself otherwise
+    """
+    if isinstance(secret, SecureBuffer):
+        return secret.view()
+    return secret
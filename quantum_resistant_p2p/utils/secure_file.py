@@ -10,10 +10,11 @@ import sys
 import time
 import json
 import tempfile
-import shutil
 import logging
 import platform
 import base64
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import Any, Dict, Optional, Union, BinaryIO, TextIO, TypeVar, Generic, Callable
 
@@ -115,9 +116,134 @@ else:
             return True
 
 
+def _fsync_directory(directory: Path) -> None:
+    """Flush the entries of a directory to disk, making renames in it durable.
+    
+    Windows doesn't support opening directories, and NTFS makes renames
+    durable by itself, so this does nothing there.
+    
+    Args:
+        directory: The directory
+    """
+    if WINDOWS:
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.debug(f"Could not sync directory {directory}: {e}")
+
+
+class _LockFile:
+    """A lock file kept open and reused for the life of the process.
+    
+    Locking holds an OS lock on the open descriptor, so no file is created
+    or deleted per lock and a crashed process's lock is released by the OS.
+    Threads of this process take turns through a thread lock first, as the
+    OS lock belongs to the descriptor they share. The lock is reentrant.
+    """
+    
+    __slots__ = ('path', 'file', 'thread_lock', 'depth', 'users')
+    
+    def __init__(self, path: Path):
+        """Open a lock file, creating it if it doesn't exist.
+        
+        Args:
+            path: The path of the lock file
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.file = open(path, 'a+b')
+        self.thread_lock = threading.RLock()
+        # Nesting depth of the holding thread's acquisitions
+        self.depth = 0
+        # Threads holding or waiting for the lock, guarded by _lock_files_guard
+        self.users = 0
+    
+    def acquire(self, timeout: float) -> bool:
+        """Acquire the lock.
+        
+        Args:
+            timeout: Maximum number of seconds to wait
+            
+        Returns:
+            True if the lock was acquired, False if the timeout expired
+        """
+        deadline = time.monotonic() + timeout
+        if not self.thread_lock.acquire(timeout=timeout):
+            return False
+        if self.depth == 0:
+            # Another process may hold the lock, poll until it's released
+            while not _lock_file(self.file, exclusive=True):
+                if time.monotonic() >= deadline:
+                    self.thread_lock.release()
+                    return False
+                time.sleep(0.01)
+        self.depth += 1
+        return True
+    
+    def release(self) -> None:
+        """Release the lock."""
+        self.depth -= 1
+        if self.depth == 0:
+            _unlock_file(self.file)
+        self.thread_lock.release()
+
+
+# Open lock files by path, least recently used first
+_lock_files: 'OrderedDict[Path, _LockFile]' = OrderedDict()
+_lock_files_guard = threading.Lock()
+
+# Lock files kept open when they're not in use
+MAX_OPEN_LOCK_FILES = 64
+
+
+def _open_lock_file(path: Path) -> _LockFile:
+    """Get the open lock file of a path, registering a user of it.
+    
+    Args:
+        path: The path of the lock file
+        
+    Returns:
+        The lock file; pass it to _close_lock_file when done with it
+    """
+    with _lock_files_guard:
+        lock_file = _lock_files.get(path)
+        if lock_file is None:
+            lock_file = _lock_files[path] = _LockFile(path)
+            # Close the least recently used lock files nobody is using
+            for idle_path in list(_lock_files):
+                if len(_lock_files) <= MAX_OPEN_LOCK_FILES:
+                    break
+                if _lock_files[idle_path].users == 0:
+                    _lock_files.pop(idle_path).file.close()
+        else:
+            _lock_files.move_to_end(path)
+        lock_file.users += 1
+        return lock_file
+
+
+def _close_lock_file(lock_file: _LockFile) -> None:
+    """Unregister a user of a lock file.
+    
+    The file stays open for the next user.
+    
+    Args:
+        lock_file: The lock file
+    """
+    with _lock_files_guard:
+        lock_file.users -= 1
+
+
 class SecureFile:
     """A secure file handler with protection against corruption and concurrent access."""
     
+    # Seconds to wait for another thread or process to finish writing
+    LOCK_TIMEOUT = 10.0
+    
     def __init__(self, file_path: Union[str, Path]):
         """Initialize a secure file handler.
         
@@ -128,87 +254,37 @@ class SecureFile:
         self.lock_path = self.file_path.with_suffix(self.file_path.suffix + '.lock')
         self.backup_path = self.file_path.with_suffix(self.file_path.suffix + '.bak')
     
-    def _acquire_process_lock(self) -> bool:
-        """Acquire a process-level lock using a lock file.
+    def _acquire_process_lock(self) -> Optional[_LockFile]:
+        """Acquire the lock that serializes writers across processes and threads.
         
-        This is a higher-level lock across processes, complementing
-        the file handle locking for individual operations.
+        The lock is held on a lock file next to the file that stays in place
+        and open between writes.
         
         Returns:
-            True if lock acquired, False otherwise
+            The held lock, to pass to _release_process_lock, or None if it
+            couldn't be acquired within LOCK_TIMEOUT seconds
         """
         try:
-            # Try to create the lock file - will fail if it already exists
-            with open(self.lock_path, 'x') as f:
-                # Write the current process ID to the lock file
-                f.write(str(os.getpid()))
-                f.write('\n')
-                f.write(str(time.time()))
-            return True
-        except FileExistsError:
-            # Lock file already exists
-            try:
-                # Check if the lock is stale (process no longer exists or too old)
-                lock_age = time.time() - self.lock_path.stat().st_mtime
-                
-                # If lock file is older than 1 hour, consider it stale
-                if lock_age > 3600:  # 1 hour in seconds
-                    logger.warning(f"Found stale lock file (age: {lock_age:.1f}s), removing")
-                    self._release_process_lock()
-                    # Try again
-                    return self._acquire_process_lock()
-                
-                # Otherwise, check the process
-                with open(self.lock_path, 'r') as f:
-                    pid_str = f.readline().strip()
-                    try:
-                        pid = int(pid_str)
-                        
-                        # Check if the process exists
-                        try:
-                            if WINDOWS:
-                                # On Windows, check using the tasklist command
-                                import subprocess
-                                output = subprocess.check_output(f'tasklist /FI "PID eq {pid}" /NH', shell=True)
-                                if str(pid) not in output.decode():
-                                    raise ProcessLookupError
-                            else:
-                                # On Unix, use os.kill with signal 0
-                                os.kill(pid, 0)
-                        except (ProcessLookupError, subprocess.CalledProcessError):
-                            # Process doesn't exist, lock is stale
-                            logger.warning(f"Found stale lock file for PID {pid}, removing")
-                            self._release_process_lock()
-                            # Try again
-                            return self._acquire_process_lock()
-                    except ValueError:
-                        # Invalid PID in lock file
-                        logger.warning("Found invalid lock file, removing")
-                        self._release_process_lock()
-                        # Try again
-                        return self._acquire_process_lock()
-            except Exception as e:
-                logger.error(f"Error checking lock file: {e}")
-            
-            # Lock is valid and in use
-            return False
+            lock_file = _open_lock_file(self.lock_path)
         except Exception as e:
-            logger.error(f"Error acquiring lock: {e}")
-            return False
+            logger.error(f"Error opening lock file {self.lock_path}: {e}")
+            return None
+        
+        if lock_file.acquire(self.LOCK_TIMEOUT):
+            return lock_file
+        _close_lock_file(lock_file)
+        return None
     
-    def _release_process_lock(self) -> bool:
-        """Release the process-level lock.
+    def _release_process_lock(self, lock_file: _LockFile) -> None:
+        """Release the lock acquired with _acquire_process_lock.
         
-        Returns:
-            True if lock released, False otherwise
+        Args:
+            lock_file: The held lock
         """
         try:
-            if self.lock_path.exists():
-                os.remove(self.lock_path)
-            return True
-        except Exception as e:
-            logger.error(f"Error releasing lock: {e}")
-            return False
+            lock_file.release()
+        finally:
+            _close_lock_file(lock_file)
     
     def read_json(self) -> Optional[Dict[str, Any]]:
         """Read and parse a JSON file safely.
@@ -226,10 +302,28 @@ class SecureFile:
             
             # If backup is valid, restore it to the main file
             if data is not None:
-                self.write_json(data)
+                self._restore_backup(data)
         
         return data
     
+    def _restore_backup(self, data: Dict[str, Any]) -> None:
+        """Write the backup's data to the file, unless a writer has replaced it meanwhile.
+        
+        Args:
+            data: The data read from the backup
+        """
+        lock_file = self._acquire_process_lock()
+        if lock_file is None:
+            return
+        try:
+            if self._read_json_file(self.file_path) is None:
+                # Keep the backup as it is, the file is missing or corrupted
+                self._write_json_locked(data, keep_backup=False)
+        except Exception as e:
+            logger.error(f"Error restoring {self.file_path} from backup: {e}")
+        finally:
+            self._release_process_lock(lock_file)
+    
     def _read_json_file(self, file_path: Path) -> Optional[Dict[str, Any]]:
         """Read and parse a single JSON file with locking.
         
@@ -277,41 +371,87 @@ class SecureFile:
             True if the write was successful, False otherwise
         """
         # Try to acquire the process lock
-        if not self._acquire_process_lock():
+        lock_file = self._acquire_process_lock()
+        if lock_file is None:
             logger.error(f"Could not acquire lock for {self.file_path}")
             return False
         
         try:
-            # Create parent directory if it doesn't exist
-            self.file_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            # Make a backup of the existing file if it exists
-            if self.file_path.exists():
-                try:
-                    shutil.copy2(self.file_path, self.backup_path)
-                except Exception as e:
-                    logger.warning(f"Failed to create backup: {e}")
-            
-            # Write to a temporary file first
-            with tempfile.NamedTemporaryFile(
-                mode='w', delete=False, dir=self.file_path.parent
-            ) as temp_file:
-                # Write the JSON data
-                json.dump(data, temp_file, indent=2)
-                temp_file.flush()
-                os.fsync(temp_file.fileno())  # Ensure data is written to disk
-                temp_path = temp_file.name
-            
-            # Now atomically move the temp file to the target
-            shutil.move(temp_path, self.file_path)
-            
+            self._write_json_locked(data)
             return True
         except Exception as e:
             logger.error(f"Error writing to {self.file_path}: {e}")
             return False
         finally:
             # Always release the process lock
-            self._release_process_lock()
+            self._release_process_lock(lock_file)
+    
+    def _write_json_locked(self, data: Dict[str, Any], keep_backup: bool = True) -> None:
+        """Replace the file with new JSON data.
+        
+        The data is written to a temporary file that is renamed over the file,
+        so the file always holds either the old or the new data. The old file
+        becomes the backup through a hard link or a rename, without copying it.
+        
+        Must be called with the process lock held.
+        
+        Args:
+            data: The data to write
+            keep_backup: Whether to make the current file the backup
+            
+        Raises:
+            Exception: If the data couldn't be written
+        """
+        directory = self.file_path.parent
+        directory.mkdir(parents=True, exist_ok=True)
+        
+        # Write to a temporary file first
+        fd, temp_name = tempfile.mkstemp(dir=directory, prefix=f".{self.file_path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+                temp_file.flush()
+                os.fsync(temp_file.fileno())  # Ensure data is written to disk
+            
+            if keep_backup and self.file_path.exists():
+                self._rotate_backup()
+            
+            # Now atomically move the temp file to the target
+            os.replace(temp_name, self.file_path)
+        except BaseException:
+            Path(temp_name).unlink(missing_ok=True)
+            raise
+        
+        # Make the renames survive a power loss
+        _fsync_directory(directory)
+    
+    def _rotate_backup(self) -> None:
+        """Make the current file the backup, replacing the old backup."""
+        link_path = self.backup_path.with_suffix(self.backup_path.suffix + '.tmp')
+        try:
+            # A second name for the current file, so the file stays in place
+            # until the new version is renamed over it
+            link_path.unlink(missing_ok=True)
+            os.link(self.file_path, link_path)
+            os.replace(link_path, self.backup_path)
+        except OSError:
+            # No hard links on this filesystem; readers fall back to the
+            # backup until the new version is in place
+            os.replace(self.file_path, self.backup_path)
+    
+    def remove(self) -> None:
+        """Delete the file with its backup and lock file."""
+        with _lock_files_guard:
+            lock_file = _lock_files.get(self.lock_path)
+            if lock_file is not None and lock_file.users == 0:
+                _lock_files.pop(self.lock_path).file.close()
+                lock_file = None
+        
+        self.file_path.unlink(missing_ok=True)
+        self.backup_path.unlink(missing_ok=True)
+        if lock_file is None:
+            # A lock file in use stays for the writer holding it
+            self.lock_path.unlink(missing_ok=True)
     
     def append_bytes(self, data: bytes) -> bool:
         """Append binary data to a file with locking.
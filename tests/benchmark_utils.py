@@ -0,0 +1,110 @@
+"""
+Helpers shared by the benchmark scripts.
+
+The benchmarks report in the same JSON layout: a "meta" section describing
+the run, tagged with the git commit, and a list of results whose latencies
+are summarized the same way, so reports of different benchmarks and commits
+can be compared.
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+REPO_DIR = Path(__file__).parent.parent
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Get the peak resident memory of this process in MiB, None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit() -> Optional[str]:
+    """Get the commit of the working tree, None if it isn't a git checkout."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def parse_sizes(value: str) -> List[int]:
+    """Parse a comma separated list of sizes."""
+    return [int(size) for size in value.split(",") if size.strip()]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """Summarize latencies in milliseconds.
+
+    Args:
+        latencies: The latency of each sample, in milliseconds
+
+    Returns:
+        Dict with mean_ms, p50_ms, p95_ms and max_ms
+    """
+    latencies = sorted(latencies)
+    return {
+        "mean_ms": statistics.fmean(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "max_ms": latencies[-1],
+    }
+
+
+def new_report(**meta: Any) -> Dict[str, Any]:
+    """Start a report, describing the run and the machine it runs on.
+
+    Args:
+        **meta: Parameters of the run to record
+
+    Returns:
+        The report, with an empty list of results
+    """
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            **meta,
+        },
+        "results": []
+    }
+
+
+def save_report(report: Dict[str, Any], output: Optional[str], name: str) -> None:
+    """Write a report as JSON.
+
+    Args:
+        report: The report
+        output: The output file, '-' for stdout, or None for
+                tests/results/<name>_<time>.json
+        name: The name of the benchmark
+    """
+    data = json.dumps(report, indent=2)
+    if output == "-":
+        print(data)
+        return
+
+    if output:
+        output_path = Path(output)
+    else:
+        output_path = RESULTS_DIR / f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(data, encoding="utf-8")
+    print(f"Results saved to: {output_path}")
@@ -96,8 +96,11 @@ class TestNode:
             logger=self.secure_logger
         )
         
-        # Create a message store for storing messages
-        self.message_store = MessageStore()
+        # Create an encrypted message store for storing messages
+        message_store_key = self.key_storage.get_or_create_persistent_key("message_store", key_size=32)
+        if message_store_key is None:
+            raise RuntimeError("Failed to obtain message store key from key storage")
+        self.message_store = MessageStore(str(self.base_dir / "messages.db"), encryption_key=message_store_key)
         self.message_store.set_current_node_id(self.node_id)
         
         # Track received messages for testing verification
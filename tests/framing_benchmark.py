@@ -0,0 +1,492 @@
+"""
+Loopback benchmark of the network message framing.
+
+This script sends payloads of 100 B to 1 GB between two endpoints on the
+loopback interface and measures the throughput, the one-way latency of each
+message and the CPU time per byte it takes to move them. Loopback takes the
+network out of the picture, so what is left is the cost of the framing and
+of the layers above it.
+
+It runs at three levels:
+    framing:   P2PNode._send_chunked_message and P2PNode._read_message on a
+               bare connection, in both framing versions, next to
+               alternative framings of the same data
+    node:      P2PNode.send_message between two connected nodes
+    messaging: SecureMessaging.send_message after a key exchange
+The chunked levels are repeated for each fixed chunk size given, and the
+node and messaging levels once more with the adaptive chunk size, up to the
+largest one. A "stages" level also times the CPU stages of a secure message
+(base64, JSON, AES-GCM) on their own.
+
+Results are written as JSON, tagged with the git commit, so runs on
+different commits can be compared.
+
+Usage:
+    python tests/framing_benchmark.py --quick
+    python tests/framing_benchmark.py --levels framing --sizes 1000000,1000000000 --output -
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Add the parent directory to the path so we can import the package
+parent_dir = str(Path(__file__).parent.parent)
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
+
+from quantum_resistant_p2p.networking import P2PNode, PeerLink
+from quantum_resistant_p2p.networking.peer_link import FRAMING_V1, FRAMING_V2
+from quantum_resistant_p2p.crypto import KeyStorage, AES256GCM
+from quantum_resistant_p2p.app import SecureMessaging, SecureLogger
+from tests.benchmark_utils import latency_summary, new_report, parse_sizes, peak_rss_mb, save_report
+
+logger = logging.getLogger("framing_benchmark")
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000, 10000000, 100000000]
+DEFAULT_CHUNK_SIZES = [16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+
+# Sizes used with --quick
+QUICK_SIZES = [100, 10000, 1000000, 10000000]
+QUICK_CHUNK_SIZES = [16 * 1024, 64 * 1024, 1024 * 1024]
+
+# Payload bytes sent per run; fewer, larger messages are sent for large sizes
+BYTES_PER_RUN = 64 * 1024 * 1024
+MIN_MESSAGES = 3
+MAX_MESSAGES = 1000
+
+# The levels above bare framing copy the payload several times
+DEFAULT_MAX_NODE_SIZE = 100000000
+DEFAULT_MAX_MESSAGING_SIZE = 10000000
+
+HOST = "127.0.0.1"
+PASSWORD = "benchmark-password"
+RECEIVE_TIMEOUT = 600.0
+
+
+@dataclass
+class FramingResult:
+    """Measurements of one way of sending messages of one size."""
+    level: str
+    variant: str
+    chunk_size: Optional[int]
+    size: int
+    messages: int
+    throughput_mb_s: float
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    max_ms: float
+    cpu_ns_per_byte: float
+    peak_rss_mb: Optional[float]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for reporting."""
+        return asdict(self)
+
+
+def message_count(size: int) -> int:
+    """Get the number of messages sent in a run of the given size."""
+    return max(MIN_MESSAGES, min(MAX_MESSAGES, BYTES_PER_RUN // max(size, 1)))
+
+
+async def measure(level: str, variant: str, chunk_size: Optional[int], size: int,
+                  send: Callable[[], Awaitable[Any]], received: asyncio.Queue,
+                  messages: int) -> FramingResult:
+    """Send messages one at a time and time their arrival.
+
+    Both ends run in this process, so the CPU time covers sending and
+    receiving.
+
+    Args:
+        level: The level benchmarked
+        variant: The way messages are sent
+        chunk_size: The chunk size used, None if the variant doesn't chunk
+        size: The payload size in bytes
+        send: Sends one message
+        received: Gets the arrival time of each message
+        messages: How many messages to send
+
+    Returns:
+        The measurements
+    """
+    latencies = []
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for _ in range(messages):
+        sent_at = time.perf_counter()
+        if await send() is False:
+            raise RuntimeError(f"{level}/{variant} failed to send a message of {size} bytes")
+        arrived_at = await asyncio.wait_for(received.get(), RECEIVE_TIMEOUT)
+        latencies.append((arrived_at - sent_at) * 1000)
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    total_bytes = size * messages
+    result = FramingResult(
+        level=level,
+        variant=variant,
+        chunk_size=chunk_size,
+        size=size,
+        messages=messages,
+        throughput_mb_s=total_bytes / wall_time / 1e6,
+        **latency_summary(latencies),
+        cpu_ns_per_byte=cpu_time * 1e9 / total_bytes,
+        peak_rss_mb=peak_rss_mb()
+    )
+    chunk = f" chunk {chunk_size}" if chunk_size else ""
+    logger.info(f"{level}/{variant}{chunk} @ {size}: {result.throughput_mb_s:.1f} MB/s, "
+                f"p50 {result.p50_ms:.3f} ms, {result.cpu_ns_per_byte:.2f} ns/B")
+    return result
+
+
+async def _send_writelines(node: P2PNode, writer: asyncio.StreamWriter, data: bytes) -> bool:
+    """Send a message in P2PNode's wire format with a single write and drain.
+
+    The chunks are views of the payload, so it isn't copied before the
+    transport gets it.
+    """
+    chunk_size = node.max_chunk_size
+    total_length = len(data)
+    if total_length <= chunk_size:
+        writer.writelines([b"\x00", struct.pack("!I", total_length), data])
+    else:
+        total_chunks = (total_length + chunk_size - 1) // chunk_size
+        view = memoryview(data)
+        parts = [b"\x01", uuid.uuid4().bytes, struct.pack("!II", total_chunks, total_length)]
+        for i in range(total_chunks):
+            chunk = view[i * chunk_size:(i + 1) * chunk_size]
+            parts.append(struct.pack("!II", i, len(chunk)))
+            parts.append(chunk)
+        writer.writelines(parts)
+    await writer.drain()
+    return True
+
+
+async def _send_length_prefixed(writer: asyncio.StreamWriter, data: bytes) -> bool:
+    """Send a message as a length and the payload, without chunks."""
+    writer.writelines([struct.pack("!Q", len(data)), data])
+    await writer.drain()
+    return True
+
+
+async def _read_length_prefixed(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """Read a message sent by _send_length_prefixed."""
+    length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    return await reader.readexactly(length)
+
+
+def _open_key_storage(base_dir: Path, name: str) -> KeyStorage:
+    """Create and unlock the key storage of a benchmark endpoint."""
+    key_storage = KeyStorage(str(base_dir / f"{name}_keys.json"))
+    key_storage.unlock(PASSWORD)
+    return key_storage
+
+
+def _make_node(key_storage: KeyStorage, name: str, chunk_size: int, adaptive: bool = False) -> P2PNode:
+    """Create a node that listens on a free loopback port once started.
+
+    The node ID is kept in the given key storage, so the benchmark doesn't
+    touch the persistent node ID of the user.
+    """
+    return P2PNode(host=HOST, port=0, node_id=f"benchmark-{name}", max_chunk_size=chunk_size,
+                   key_storage=key_storage, adaptive_chunk_size=adaptive)
+
+
+def _chunk_configurations(chunk_sizes: List[int]) -> List[tuple]:
+    """Get the (variant, chunk size, adaptive) runs of the node levels."""
+    return [("fixed", chunk_size, False) for chunk_size in chunk_sizes] + \
+        [("adaptive", max(chunk_sizes), True)]
+
+
+async def _start_node(node: P2PNode) -> asyncio.Task:
+    """Start a node and wait until it listens."""
+    task = asyncio.create_task(node.start())
+    while node.server is None or not node.running:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    node.port = node.server.sockets[0].getsockname()[1]
+    return task
+
+
+async def _stop_nodes(nodes: List[P2PNode], tasks: List[asyncio.Task]) -> None:
+    """Stop nodes started with _start_node."""
+    for node in nodes:
+        await node.stop()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def bench_framing(base_dir: Path, size: int, chunk_sizes: List[int]) -> List[FramingResult]:
+    """Benchmark the framing on a bare loopback connection."""
+    results = []
+    payload = os.urandom(size)
+    messages = message_count(size)
+    read_message: Callable[[asyncio.StreamReader], Awaitable[Optional[bytes]]] = None
+    received: asyncio.Queue = asyncio.Queue()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                data = await read_message(reader)
+                if data is None:
+                    break
+                received.put_nowait(time.perf_counter())
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, HOST, 0)
+    port = server.sockets[0].getsockname()[1]
+    # The node isn't started; only its framing methods are used
+    node = _make_node(_open_key_storage(base_dir, "framing"), "framing", max(chunk_sizes))
+    try:
+        variants = [
+            ("node", chunk_size,
+             lambda reader, link=PeerLink(FRAMING_V1, chunk_size, adaptive=False):
+                 node._read_message(reader, link),
+             lambda writer, link=PeerLink(FRAMING_V1, chunk_size, adaptive=False):
+                 node._send_chunked_message(writer, payload, link))
+            for chunk_size in chunk_sizes
+        ] + [
+            ("chunk_frames", chunk_size,
+             lambda reader, link=PeerLink(FRAMING_V2, chunk_size, adaptive=False):
+                 node._read_message(reader, link),
+             lambda writer, link=PeerLink(FRAMING_V2, chunk_size, adaptive=False):
+                 node._send_chunked_message(writer, payload, link))
+            for chunk_size in chunk_sizes
+        ] + [
+            ("writelines", chunk_size,
+             lambda reader, link=PeerLink(FRAMING_V1, chunk_size, adaptive=False):
+                 node._read_message(reader, link),
+             lambda writer: _send_writelines(node, writer, payload))
+            for chunk_size in chunk_sizes
+        ] + [
+            ("length_prefixed", None, _read_length_prefixed,
+             lambda writer: _send_length_prefixed(writer, payload))
+        ]
+        for variant, chunk_size, reader_func, sender in variants:
+            node.max_chunk_size = chunk_size or max(chunk_sizes)
+            read_message = reader_func
+            _, writer = await asyncio.open_connection(HOST, port)
+            try:
+                results.append(await measure(
+                    "framing", variant, chunk_size, size,
+                    lambda: sender(writer), received, messages
+                ))
+            finally:
+                writer.close()
+                await writer.wait_closed()
+    finally:
+        server.close()
+        await server.wait_closed()
+    return results
+
+
+async def bench_node(base_dir: Path, size: int, chunk_sizes: List[int]) -> List[FramingResult]:
+    """Benchmark P2PNode.send_message between two nodes."""
+    results = []
+    payload = base64.b64encode(os.urandom(size)).decode()
+    messages = message_count(size)
+    for variant, chunk_size, adaptive in _chunk_configurations(chunk_sizes):
+        sender = _make_node(_open_key_storage(base_dir, "sender"), "sender", chunk_size, adaptive)
+        receiver = _make_node(_open_key_storage(base_dir, "receiver"), "receiver", chunk_size, adaptive)
+        received: asyncio.Queue = asyncio.Queue()
+
+        async def handle(peer_id, message):
+            received.put_nowait(time.perf_counter())
+
+        receiver.register_message_handler("benchmark", handle)
+        tasks = [await _start_node(receiver), await _start_node(sender)]
+        try:
+            if not await sender.connect_to_peer(HOST, receiver.port):
+                raise RuntimeError("Failed to connect the nodes")
+            results.append(await measure(
+                "node", variant, chunk_size, size,
+                lambda: sender.send_message(receiver.node_id, "benchmark", payload=payload),
+                received, messages
+            ))
+        finally:
+            await _stop_nodes([sender, receiver], tasks)
+    return results
+
+
+async def bench_messaging(base_dir: Path, size: int, chunk_sizes: List[int]) -> List[FramingResult]:
+    """Benchmark SecureMessaging.send_message after a key exchange."""
+    results = []
+    payload = os.urandom(size)
+    messages = message_count(size)
+    for variant, chunk_size, adaptive in _chunk_configurations(chunk_sizes):
+        endpoints = {}
+        received: asyncio.Queue = asyncio.Queue()
+        for name in ("sender", "receiver"):
+            key_storage = _open_key_storage(base_dir, name)
+            node = _make_node(key_storage, name, chunk_size, adaptive)
+            log_key = key_storage.get_or_create_persistent_key("secure_logger", key_size=32)
+            secure_logger = SecureLogger(str(base_dir / f"{name}_logs"), encryption_key=log_key)
+            messaging = SecureMessaging(node=node, key_storage=key_storage, logger=secure_logger)
+            endpoints[name] = (node, messaging, secure_logger)
+        sender, sender_messaging, _ = endpoints["sender"]
+        receiver, receiver_messaging, _ = endpoints["receiver"]
+
+        def handle(message):
+            if not message.is_system:
+                received.put_nowait(time.perf_counter())
+
+        receiver_messaging.register_global_message_handler(handle)
+        tasks = [await _start_node(receiver), await _start_node(sender)]
+        try:
+            if not await sender.connect_to_peer(HOST, receiver.port):
+                raise RuntimeError("Failed to connect the nodes")
+            if not await sender_messaging.initiate_key_exchange(receiver.node_id):
+                raise RuntimeError("Key exchange failed")
+            for _ in range(100):
+                if sender_messaging.verify_key_exchange_state(receiver.node_id) and \
+                        sender.node_id in receiver_messaging.shared_keys:
+                    break
+                await asyncio.sleep(0.05)
+            results.append(await measure(
+                "messaging", variant, chunk_size, size,
+                lambda: sender_messaging.send_message(receiver.node_id, payload),
+                received, messages
+            ))
+        finally:
+            await _stop_nodes([sender, receiver], tasks)
+            for _, _, secure_logger in endpoints.values():
+                secure_logger.close()
+    return results
+
+
+async def bench_stages(base_dir: Path, size: int, chunk_sizes: List[int]) -> List[FramingResult]:
+    """Time the CPU stages of a secure message without the network."""
+    payload = os.urandom(size)
+    encoded = base64.b64encode(payload).decode()
+    cipher = AES256GCM()
+    key = os.urandom(32)
+    ciphertext = cipher.encrypt(key, payload)
+    stages = {
+        "base64_encode": lambda: base64.b64encode(payload),
+        "base64_decode": lambda: base64.b64decode(encoded),
+        "json_dumps": lambda: json.dumps({"payload": encoded}).encode(),
+        "json_loads": lambda: json.loads(json.dumps({"payload": encoded})),
+        "aes_gcm_encrypt": lambda: cipher.encrypt(key, payload),
+        "aes_gcm_decrypt": lambda: cipher.decrypt(key, ciphertext),
+    }
+    results = []
+    messages = message_count(size)
+    for stage, func in stages.items():
+        received: asyncio.Queue = asyncio.Queue()
+
+        async def run(func=func, received=received):
+            func()
+            received.put_nowait(time.perf_counter())
+
+        results.append(await measure("stages", stage, None, size, run, received, messages))
+    return results
+
+
+BENCHMARKS = {
+    "framing": bench_framing,
+    "node": bench_node,
+    "messaging": bench_messaging,
+    "stages": bench_stages,
+}
+
+
+def run_benchmark(level: str, size: int, chunk_sizes: List[int], base_dir: str) -> List[Dict[str, Any]]:
+    """Run one level's benchmark at one size, in a directory of its own.
+
+    Runs in a worker process, so it returns plain dictionaries. A level that
+    can't run, such as messaging without a working post-quantum library,
+    gives a single result with the error.
+    """
+    logging.getLogger("quantum_resistant_p2p").setLevel(logging.CRITICAL)
+
+    # Only the framing is of interest, not the KDF cost of the key storages
+    KeyStorage._calibrated_kdf_params = dict(KeyStorage.KDF_BASELINE_PARAMS)
+
+    run_dir = Path(tempfile.mkdtemp(prefix=f"{level}_{size}_", dir=base_dir))
+    try:
+        results = asyncio.run(BENCHMARKS[level](run_dir, size, chunk_sizes))
+        return [result.to_dict() for result in results]
+    except Exception as e:
+        logger.warning(f"{level} @ {size} failed: {e}")
+        return [{"level": level, "size": size, "error": str(e)}]
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def main():
+    """Run the framing benchmarks."""
+    parser = argparse.ArgumentParser(description="Network framing benchmarks for Quantum-Resistant P2P")
+    parser.add_argument("--levels", default="framing,node,messaging,stages",
+                        help="Levels to benchmark (comma separated)")
+    parser.add_argument("--sizes", type=parse_sizes, help="Payload sizes in bytes (comma separated)")
+    parser.add_argument("--chunk-sizes", type=parse_sizes, help="Chunk sizes in bytes (comma separated)")
+    parser.add_argument("--max-node-size", type=int, default=DEFAULT_MAX_NODE_SIZE,
+                        help="Largest payload sent at the node level")
+    parser.add_argument("--max-messaging-size", type=int, default=DEFAULT_MAX_MESSAGING_SIZE,
+                        help="Largest payload sent at the messaging level")
+    parser.add_argument("--quick", action="store_true", help="Use small default sizes")
+    parser.add_argument("--output", help="JSON output file, '-' for stdout "
+                                         "(default: tests/results/framing_<time>.json)")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        stream=sys.stderr
+    )
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    chunk_sizes = args.chunk_sizes or (QUICK_CHUNK_SIZES if args.quick else DEFAULT_CHUNK_SIZES)
+    max_sizes = {"node": args.max_node_size, "messaging": args.max_messaging_size}
+    levels = [level.strip() for level in args.levels.split(",") if level.strip()]
+    for level in levels:
+        if level not in BENCHMARKS:
+            parser.error(f"Unknown level {level}, choose from {', '.join(BENCHMARKS)}")
+    for size in sizes:
+        # The wire format has 32 bit lengths
+        if not 0 < size < 2 ** 32:
+            parser.error(f"Payload size {size} is out of range")
+
+    base_dir = Path(tempfile.mkdtemp(prefix="qr_p2p_framing_"))
+
+    report = new_report(chunk_sizes=chunk_sizes, bytes_per_run=BYTES_PER_RUN)
+
+    try:
+        for level in levels:
+            for size in sizes:
+                if size > max_sizes.get(level, size):
+                    logger.info(f"Skipping {level} @ {size}, above --max-{level}-size")
+                    continue
+                logger.info(f"Benchmarking {level} with {size} byte messages")
+                # A fresh process per run, so peak memory is the run's own
+                with multiprocessing.Pool(1) as pool:
+                    report["results"].extend(pool.apply(
+                        run_benchmark, (level, size, chunk_sizes, str(base_dir))
+                    ))
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    save_report(report, args.output, "framing")
+
+
+if __name__ == "__main__":
+    main()
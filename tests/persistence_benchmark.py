@@ -0,0 +1,403 @@
+"""
+Benchmark of the persistence layer as the stored data grows.
+
+This script builds synthetic key stores of 10 to 100k keys and security logs
+of 10 to 10M events in a temporary directory and measures KeyStorage,
+SecureLogger and SecureFile operations on them: latency, fsync calls and
+bytes written per operation, and the peak memory of the process. Each size
+runs in its own process so peak memory isn't carried over between sizes.
+
+Results are written as JSON, tagged with the git commit, so runs on
+different commits can be compared. Latency that grows faster than the data
+points at operations that rewrite or rescan everything.
+
+Usage:
+    python tests/persistence_benchmark.py --quick
+    python tests/persistence_benchmark.py --keys 1000,100000 --events 1000000 --output -
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# Add the parent directory to the path so we can import the package
+parent_dir = str(Path(__file__).parent.parent)
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
+
+from quantum_resistant_p2p.crypto import KeyStorage, KeyHistoryRetention
+from quantum_resistant_p2p.app import SecureLogger
+from quantum_resistant_p2p.utils.secure_file import SecureFile
+from tests.benchmark_utils import latency_summary, new_report, parse_sizes, peak_rss_mb, save_report
+
+logger = logging.getLogger("persistence_benchmark")
+
+DEFAULT_KEY_COUNTS = [10, 100, 1000, 10000, 100000]
+DEFAULT_EVENT_COUNTS = [10, 1000, 100000, 1000000, 10000000]
+DEFAULT_FILE_SIZES = [10, 100, 1000, 10000, 100000]
+
+# Sizes used with --quick
+QUICK_KEY_COUNTS = [10, 1000, 10000]
+QUICK_EVENT_COUNTS = [10, 1000, 100000]
+QUICK_FILE_SIZES = [10, 1000, 10000]
+
+# Logs larger than this aren't read back in full
+MAX_FULL_SCAN_EVENTS = 1000000
+
+PASSWORD = "benchmark-password"
+PEER_COUNT = 50
+
+
+class IOCounters:
+    """Counts fsync calls and bytes written by this process while active.
+
+    fsync calls are counted by wrapping os.fsync and os.fdatasync, which all
+    of the persistence layer goes through. Bytes written are read from
+    /proc/self/io and are None where that isn't available.
+    """
+
+    def __init__(self):
+        """Initialize the counters."""
+        self.fsyncs = 0
+        self.bytes_written: Optional[int] = None
+        self._originals: Dict[str, Callable] = {}
+        self._start_bytes: Optional[int] = None
+
+    @staticmethod
+    def _written_bytes() -> Optional[int]:
+        """Get the bytes this process has passed to write calls so far."""
+        try:
+            with open("/proc/self/io") as f:
+                for line in f:
+                    if line.startswith("wchar:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return None
+
+    def _wrap(self, name: str) -> None:
+        """Count the calls of an os function."""
+        original = getattr(os, name, None)
+        if original is None:
+            return
+
+        def counted(fd):
+            self.fsyncs += 1
+            return original(fd)
+
+        self._originals[name] = original
+        setattr(os, name, counted)
+
+    def __enter__(self) -> 'IOCounters':
+        self._wrap("fsync")
+        self._wrap("fdatasync")
+        self._start_bytes = self._written_bytes()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        end_bytes = self._written_bytes()
+        if self._start_bytes is not None and end_bytes is not None:
+            self.bytes_written = end_bytes - self._start_bytes
+        for name, original in self._originals.items():
+            setattr(os, name, original)
+        self._originals.clear()
+
+
+@dataclass
+class BenchmarkResult:
+    """Measurements of one operation at one data size."""
+    component: str
+    operation: str
+    size: int
+    samples: int
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    max_ms: float
+    fsyncs_per_op: float
+    bytes_written_per_op: Optional[float]
+    peak_rss_mb: Optional[float]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for reporting."""
+        return asdict(self)
+
+
+def measure(component: str, operation: str, size: int,
+            func: Callable[[int], Any], samples: int) -> BenchmarkResult:
+    """Time an operation.
+
+    Args:
+        component: The component benchmarked
+        operation: The operation benchmarked
+        size: The amount of data the component holds
+        func: Runs the operation once; gets the sample number and returns
+              False if the operation failed
+        samples: How many times to run the operation
+
+    Returns:
+        The measurements
+
+    Raises:
+        RuntimeError: If the operation failed, so a broken run isn't
+                      reported as a fast one
+    """
+    latencies = []
+    with IOCounters() as io:
+        for sample in range(samples):
+            start = time.perf_counter()
+            if func(sample) is False:
+                raise RuntimeError(f"{component}.{operation} failed at sample {sample} of size {size}")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    result = BenchmarkResult(
+        component=component,
+        operation=operation,
+        size=size,
+        samples=samples,
+        **latency_summary(latencies),
+        fsyncs_per_op=io.fsyncs / samples,
+        bytes_written_per_op=io.bytes_written / samples if io.bytes_written is not None else None,
+        peak_rss_mb=peak_rss_mb()
+    )
+    logger.info(f"{component}.{operation} @ {size}: mean {result.mean_ms:.3f} ms, "
+                f"p95 {result.p95_ms:.3f} ms, {result.fsyncs_per_op:.2f} fsyncs/op")
+    return result
+
+
+def _history_key_id(rng: random.Random, index: int) -> str:
+    """Get the key ID of a synthetic key history entry."""
+    return f"peer_shared_key_peer{rng.randrange(PEER_COUNT)}_{1700000000 + index}"
+
+
+def bench_key_storage(base_dir: Path, size: int, samples: int, seed: int) -> List[BenchmarkResult]:
+    """Benchmark KeyStorage with a store of the given number of keys."""
+    rng = random.Random(seed)
+    storage_path = base_dir / "keys.json"
+    results = []
+
+    key_storage = KeyStorage(str(storage_path))
+    if not key_storage.unlock(PASSWORD):
+        raise RuntimeError(f"Failed to create the key storage at {storage_path}")
+    # Keep every generated history entry
+    if not key_storage.set_history_retention(KeyHistoryRetention()):
+        raise RuntimeError("Failed to set the key history retention")
+
+    # Most keys are key exchange history, as on a long-running node
+    key_ids = []
+    for index in range(size):
+        if index % 10 == 0:
+            key_ids.append(f"benchmark_key_{index}")
+        else:
+            key_ids.append(_history_key_id(rng, index))
+
+    def store(sample):
+        return key_storage.store_key(key_ids[sample], {
+            "algorithm": "ML-KEM-768", "shared_key": os.urandom(32).hex()
+        })
+
+    results.append(measure("key_storage", "store_key (populate)", size, store, size))
+    key_storage.close()
+
+    storages = []
+
+    def unlock(sample):
+        storage = KeyStorage(str(storage_path))
+        storages.append(storage)
+        return storage.unlock(PASSWORD)
+
+    results.append(measure("key_storage", "unlock", size, unlock, min(samples, 5)))
+    for storage in storages[:-1]:
+        storage.close()
+    key_storage = storages[-1]
+
+    def store_more(sample):
+        return key_storage.store_key(f"benchmark_extra_{sample}", {"value": sample})
+
+    results.append(measure("key_storage", "store_key", size, store_more, samples))
+
+    results.append(measure("key_storage", "get_key", size,
+                           lambda sample: key_storage.get_key(rng.choice(key_ids)) is not None, samples))
+
+    results.append(measure("key_storage", "get_key_history (page of 50)", size,
+                           lambda sample: key_storage.get_key_history(limit=50), samples))
+
+    results.append(measure("key_storage", "get_key_history (peer)", size,
+                           lambda sample: key_storage.get_key_history(
+                               peer_id=f"peer{sample % PEER_COUNT}", limit=50), samples))
+
+    key_storage.close()
+    return results
+
+
+def bench_secure_logger(base_dir: Path, size: int, samples: int, seed: int) -> List[BenchmarkResult]:
+    """Benchmark SecureLogger with a log of the given number of events."""
+    rng = random.Random(seed)
+    log_dir = base_dir / "logs"
+    encryption_key = bytes(rng.randrange(256) for _ in range(32))
+    event_types = ["message_sent", "message_received", "key_exchange", "connection"]
+    results = []
+
+    secure_logger = SecureLogger(str(log_dir), encryption_key)
+
+    def log(sample):
+        secure_logger.log_event(
+            event_types[sample % len(event_types)],
+            peer_id=f"peer{sample % PEER_COUNT}",
+            size=sample % 65536,
+            algorithm="ML-KEM-768",
+            message_id=f"{sample:016x}"
+        )
+
+    results.append(measure("secure_logger", "log_event (populate)", size, log, size))
+    results.append(measure("secure_logger", "flush", size,
+                           lambda sample: secure_logger.flush(), 1))
+    secure_logger.close()
+
+    # A fresh logger, as after a restart, reads the indexes from disk
+    secure_logger = SecureLogger(str(log_dir), encryption_key)
+    results.append(measure("secure_logger", "get_events (cold, newest 100)", size,
+                           lambda sample: secure_logger.get_events(limit=100, newest_first=True), 1))
+
+    results.append(measure("secure_logger", "get_events (newest 100)", size,
+                           lambda sample: secure_logger.get_events(limit=100, newest_first=True),
+                           samples))
+
+    results.append(measure("secure_logger", "get_events (type, limit 100)", size,
+                           lambda sample: secure_logger.get_events(event_type="key_exchange", limit=100),
+                           samples))
+
+    results.append(measure("secure_logger", "get_security_metrics", size,
+                           lambda sample: secure_logger.get_security_metrics(), samples))
+
+    results.append(measure("secure_logger", "log_event + flush", size,
+                           lambda sample: log(sample) or secure_logger.flush(), samples))
+
+    if size <= MAX_FULL_SCAN_EVENTS:
+        results.append(measure("secure_logger", "iter_events (all)", size,
+                               lambda sample: sum(1 for _ in secure_logger.iter_events()), 1))
+
+    secure_logger.close()
+    return results
+
+
+def bench_secure_file(base_dir: Path, size: int, samples: int, seed: int) -> List[BenchmarkResult]:
+    """Benchmark SecureFile with documents and append logs of the given number of records."""
+    rng = random.Random(seed)
+    results = []
+
+    json_file = SecureFile(base_dir / "document.json")
+    document = {f"key_{index}": rng.getrandbits(128).to_bytes(16, "big").hex() for index in range(size)}
+
+    def write(sample):
+        document["revision"] = sample
+        return json_file.write_json(document)
+
+    results.append(measure("secure_file", "write_json", size, write, samples))
+    results.append(measure("secure_file", "read_json", size,
+                           lambda sample: json_file.read_json() is not None, samples))
+
+    append_file = SecureFile(base_dir / "records.bin")
+    record = os.urandom(100)
+    results.append(measure("secure_file", "append_bytes (populate)", size,
+                           lambda sample: append_file.append_bytes(record), size))
+    results.append(measure("secure_file", "append_bytes", size,
+                           lambda sample: append_file.append_bytes(record), samples))
+    return results
+
+
+BENCHMARKS: Dict[str, Callable[[Path, int, int, int], List[BenchmarkResult]]] = {
+    "key_storage": bench_key_storage,
+    "secure_logger": bench_secure_logger,
+    "secure_file": bench_secure_file,
+}
+
+
+def run_benchmark(component: str, size: int, samples: int, seed: int,
+                  base_dir: str, keep_data: bool) -> List[Dict[str, Any]]:
+    """Run one component's benchmark at one size, in a directory of its own.
+
+    Runs in a worker process, so it returns plain dictionaries.
+    """
+    logging.getLogger("quantum_resistant_p2p").setLevel(logging.WARNING)
+
+    # Only what scales with the store is of interest, not the KDF cost
+    KeyStorage._calibrated_kdf_params = dict(KeyStorage.KDF_BASELINE_PARAMS)
+
+    run_dir = Path(tempfile.mkdtemp(prefix=f"{component}_{size}_", dir=base_dir))
+    try:
+        results = BENCHMARKS[component](run_dir, size, samples, seed)
+        disk_usage = sum(path.stat().st_size for path in run_dir.rglob("*") if path.is_file())
+        logger.info(f"{component} @ {size}: {disk_usage} bytes on disk")
+        return [dict(result.to_dict(), disk_bytes=disk_usage) for result in results]
+    finally:
+        if not keep_data:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def main():
+    """Run the persistence benchmarks."""
+    parser = argparse.ArgumentParser(description="Persistence benchmarks for Quantum-Resistant P2P")
+    parser.add_argument("--keys", type=parse_sizes, help="Key store sizes (comma separated)")
+    parser.add_argument("--events", type=parse_sizes, help="Log sizes in events (comma separated)")
+    parser.add_argument("--records", type=parse_sizes, help="SecureFile sizes in records (comma separated)")
+    parser.add_argument("--components", default=",".join(BENCHMARKS),
+                        help="Components to benchmark (comma separated)")
+    parser.add_argument("--samples", type=int, default=20, help="Samples per operation")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--quick", action="store_true", help="Use small default sizes")
+    parser.add_argument("--data-dir", help="Directory for the synthetic data (default: a temp dir)")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the synthetic data")
+    parser.add_argument("--output", help="JSON output file, '-' for stdout "
+                                         "(default: tests/results/persistence_<time>.json)")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        stream=sys.stderr
+    )
+
+    sizes = {
+        "key_storage": args.keys or (QUICK_KEY_COUNTS if args.quick else DEFAULT_KEY_COUNTS),
+        "secure_logger": args.events or (QUICK_EVENT_COUNTS if args.quick else DEFAULT_EVENT_COUNTS),
+        "secure_file": args.records or (QUICK_FILE_SIZES if args.quick else DEFAULT_FILE_SIZES),
+    }
+    components = [component.strip() for component in args.components.split(",") if component.strip()]
+    for component in components:
+        if component not in BENCHMARKS:
+            parser.error(f"Unknown component {component}, choose from {', '.join(BENCHMARKS)}")
+
+    base_dir = Path(args.data_dir) if args.data_dir else Path(tempfile.mkdtemp(prefix="qr_p2p_bench_"))
+    base_dir.mkdir(parents=True, exist_ok=True)
+
+    report = new_report(samples=args.samples, seed=args.seed, data_dir=str(base_dir))
+
+    try:
+        for component in components:
+            for size in sizes[component]:
+                logger.info(f"Benchmarking {component} with {size} records")
+                # A fresh process per run, so peak memory is the run's own
+                with multiprocessing.Pool(1) as pool:
+                    report["results"].extend(pool.apply(
+                        run_benchmark,
+                        (component, size, args.samples, args.seed, str(base_dir), args.keep_data)
+                    ))
+    finally:
+        if not args.data_dir and not args.keep_data:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    save_report(report, args.output, "persistence")
+
+
+if __name__ == "__main__":
+    main()